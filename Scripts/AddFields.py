@@ -1,34 +1,62 @@
-import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
+# Where the tables are changed (arcpy, or a GeoPackage/SQLite database)
+from Backends import ArcpyBackend
+# Adds only the missing fields, all at once per table
+from SchemaMigration import migrate_schema
+# Optional tool parameters
+from DisasterImpact import optional_parameter
+# The timings of the run (and its optional trace and profile files)
+from Instrumentation import tracing
 
 # ********************************************************************
-# Helper Functions
+# Add Fields
 # ********************************************************************
 # --------------------------------------------------------------------
-# Prints a message in ArcGIS Pro
+# Adds the fields to every input table. Fields a table already has are skipped, and the missing ones are added with
+# one operation per table (see SchemaMigration.py); with several workers the tables are processed in parallel.
+# fieldsDict is a dictionary composed of a key, value pair where:
+# key: field name
+# value(s): (Field type, Field alias)
 # --------------------------------------------------------------------
-def message(message):
-    arcpy.AddMessage(message)
+def add_fields(backend, inputTables, fieldsDict, workers = 1):
+    added = migrate_schema(backend, inputTables, fieldsDict, workers)
+
+    # Print a success message for each field added in ArcGIS Pro
+    for tableName, fields in added.items():
+        for field in fields:
+            backend.message("Added '{}' field to {}!".format(field, tableName))
+        if len(fields) < len(fieldsDict):
+            backend.message("{} already had {} of the fields.".format(tableName, len(fieldsDict) - len(fields)))
+
+    # Print a success message in ArcGIS Pro
+    backend.message("Fields successfully added!")
 
 # ********************************************************************
 # Main Program
 # ********************************************************************
-# The first paramter is a list of the tables whose tables will add the new field(s)
-inputTables = arcpy.GetParameter(0)
-
-# The second parameter is a value table
-# How they work: https://pro.arcgis.com/en/pro-app/latest/arcpy/classes/valuetable.htm
-fields = arcpy.GetParameter(1)
-
-# Iterate through the input tables list and add the fields to each table
-for table in inputTables:
-    # Iterate 'row' number of times, 'row' being the number of rows in the value table
-    for row in range(fields.rowCount):
-        # Add the field to the table
-        # Using the AddField tool, we set the field name, its alias, and its type
-        arcpy.AddField_management(table, fields.getValue(row, 0), fields.getValue(row, 1) , field_alias=fields.getValue(row, 0))
-        
-        # Print a success message for each field added in ArcGIS Pro
-        message("Added '{}' field to {}!".format(fields.getValue(row, 0), table.name))
-
-# Print a success message in ArcGIS Pro
-message("Fields successfully added!")
\ No newline at end of file
+# --------------------------------------------------------------------
+# Runs the tool in ArcGIS Pro
+# --------------------------------------------------------------------
+def main():
+    import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
+
+    # The first paramter is a list of the tables whose tables will add the new field(s)
+    inputTables = arcpy.GetParameter(0)
+
+    # The second parameter is a value table
+    # How they work: https://pro.arcgis.com/en/pro-app/latest/arcpy/classes/valuetable.htm
+    fields = arcpy.GetParameter(1)
+
+    # Using the AddField tool, we set the field name, its alias, and its type
+    # 'row' being the number of rows in the value table
+    fieldsDict = {fields.getValue(row, 0): (fields.getValue(row, 1), fields.getValue(row, 0)) for row in range(fields.rowCount)}
+
+    # The third (optional) parameter is the number of worker processes (1 = no worker processes, 0 = one per CPU core)
+    workers = int(optional_parameter(2, 1))
+
+    add_fields(ArcpyBackend(), inputTables, fieldsDict, workers)
+
+# The tool only runs when the script is started (by ArcGIS Pro or Python), not when it's imported
+if __name__ == "__main__":
+    # The timings of the run are printed when it ends (see Instrumentation.py)
+    with tracing(ArcpyBackend().message):
+        main()
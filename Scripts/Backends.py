@@ -0,0 +1,711 @@
+import math
+import os           # Import os package to work with directories
+import contextlib   # Keeps the insert cursors of a partitioned copy open until the copy is done
+import sqlite3      # SQLite is part of Python, so the sidecar backend needs nothing extra
+import struct       # Reads the binary geometries of GeoPackage tables
+# NumPy holds the vertices of line geometries
+import numpy as np
+# The REST reader of the hosted fragility database (used when arcpy isn't available)
+from FragilityCache import query_service
+
+# ********************************************************************
+# Result Writers
+# ********************************************************************
+# The tools calculate their results for a whole layer in memory first, then hand them to a result writer
+# that applies them in one bulk pass. Results are given as a dictionary where:
+# key: object ID
+# value: tuple of new values, in the same order as the fields
+# Writers skip rows whose values haven't changed, so re-running a tool doesn't rewrite every row.
+#
+# Writers:
+#   ArcpyResultWriter  - writes to the attribute table of a feature class/layer (needs ArcGIS Pro)
+#   SQLiteResultWriter - writes to a sidecar SQLite database, one table per layer, keyed by OBJECTID
+#
+# write() returns a (written, unchanged) tuple with the number of rows written and skipped.
+
+# --------------------------------------------------------------------
+# Returns True if an old and a new value are the same.
+# Floats are compared with a small tolerance since they may have been stored with less precision.
+# --------------------------------------------------------------------
+def values_equal(old, new):
+    if old is None or new is None:
+        return old is None and new is None
+    if isinstance(old, float) or isinstance(new, float):
+        try:
+            return math.isclose(float(old), float(new), rel_tol = 1e-9, abs_tol = 1e-12)
+        except (TypeError, ValueError):
+            return False
+    return old == new
+
+# --------------------------------------------------------------------
+# Returns True if every old value is the same as its new value
+# --------------------------------------------------------------------
+def rows_equal(oldValues, newValues):
+    return all(values_equal(old, new) for old, new in zip(oldValues, newValues))
+
+# --------------------------------------------------------------------
+# Base class of the result writers
+# --------------------------------------------------------------------
+class ResultWriter:
+    def write(self, table, fields, results):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+# --------------------------------------------------------------------
+# Writes results to the attribute table of a feature class or layer with one UpdateCursor pass
+# --------------------------------------------------------------------
+class ArcpyResultWriter(ResultWriter):
+    def write(self, table, fields, results):
+        import arcpy
+        written = 0
+        unchanged = 0
+        with arcpy.da.UpdateCursor(table, ["OID@"] + list(fields)) as cursor:
+            for row in cursor:
+                newValues = results.get(row[0])
+                if newValues is None:
+                    continue
+                # Skip rows that already hold these values
+                if rows_equal(row[1:], newValues):
+                    unchanged += 1
+                    continue
+                cursor.updateRow([row[0]] + list(newValues))
+                written += 1
+        return written, unchanged
+
+# --------------------------------------------------------------------
+# Writes results to a sidecar SQLite database. Every layer gets a table (named after the layer) with an
+# OBJECTID primary key and one column per field.
+# --------------------------------------------------------------------
+class SQLiteResultWriter(ResultWriter):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+    def write(self, table, fields, results):
+        tableName = quote_identifier(table)
+        columns = ", ".join(quote_identifier(field) for field in fields)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS {} (OBJECTID INTEGER PRIMARY KEY, {})".format(tableName, columns))
+
+        # Add any field that the table doesn't have yet
+        existingColumns = {row[1] for row in self.connection.execute("PRAGMA table_info({})".format(tableName))}
+        for field in fields:
+            if field not in existingColumns:
+                self.connection.execute("ALTER TABLE {} ADD COLUMN {}".format(tableName, quote_identifier(field)))
+
+        # Read the current values so unchanged rows can be skipped
+        existing = {row[0]: row[1:] for row in self.connection.execute("SELECT OBJECTID, {} FROM {}".format(columns, tableName))}
+        changed = [
+            (objectID,) + tuple(newValues)
+            for objectID, newValues in results.items()
+            if objectID not in existing or not rows_equal(existing[objectID], newValues)
+        ]
+
+        placeholders = ", ".join("?" for _ in range(len(fields) + 1))
+        self.connection.executemany("INSERT OR REPLACE INTO {} (OBJECTID, {}) VALUES ({})".format(tableName, columns, placeholders), changed)
+        self.connection.commit()
+        return len(changed), len(results) - len(changed)
+
+    def close(self):
+        self.connection.close()
+
+# --------------------------------------------------------------------
+# Returns the fields of a fieldsDict that aren't in a list of existing field names (compared ignoring case,
+# like geodatabases and SQLite do)
+# --------------------------------------------------------------------
+def missing_fields(existingFields, fieldsDict):
+    existing = {str(field).upper() for field in existingFields}
+    return [field for field in fieldsDict if str(field).upper() not in existing]
+
+# --------------------------------------------------------------------
+# Wraps a table or column name in double quotes for SQLite
+# --------------------------------------------------------------------
+def quote_identifier(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+# ********************************************************************
+# Storage Backends
+# ********************************************************************
+# The tools read and write their data through a backend instead of calling arcpy directly, so the same logic
+# runs inside ArcGIS Pro and headless (e.g. on Linux compute nodes without ArcGIS).
+#
+# Backends:
+#   ArcpyBackend  - feature classes, layers and tables through arcpy (needs ArcGIS Pro)
+#   SQLiteBackend - tables of a GeoPackage or SQLite database, with plain Python
+#
+# Every backend has:
+#   message(text)                     - prints a status message
+#   warning(text)                     - prints a warning (a status message outside of ArcGIS Pro)
+#   table_name(table)                 - the name of a table/layer (e.g. "Bridges")
+#   table_path(table)                 - a reference to the table that other processes can open (e.g. a catalog path)
+#   table_location(table)             - where the table is stored (its workspace and name), so tables with the same name in
+#                                       two workspaces can be told apart
+#   object_id_field(table)            - the name of the table's object ID field
+#   workspace                         - the workspace the backend was opened on (see open_backend)
+#   list_fields(table)                - the field names of a table
+#   read_rows(table, fields, where, orderBy) - iterator of row tuples. "OID@" can be used as a field for the object ID.
+#                                       orderBy is an optional list of fields the rows are sorted by.
+#   result_writer()                   - a ResultWriter that writes to the backend's tables
+#   add_fields(table, fieldsDict)     - adds the fields given as {field name: (field type, field alias)} that the table
+#                                       doesn't have yet (field names are compared ignoring case) in one operation;
+#                                       returns the names of the fields that were added
+#   select(table, output, where)      - copies the rows matching the where clause to a new table
+#   output_table(output, folder, name) - where select() writes a table called name (see below)
+#   partition(table, field, output, folder) - copies every row to the table of its field value (see output_table)
+#                                       in one pass over the table; returns {value: number of rows}
+#   read_service(serviceUrl, fields)  - the rows of a hosted table (e.g. the fragility database)
+#   read_points(table, fields, where) - iterator of (longitude, latitude, *field values) tuples (WGS 84 decimal degrees;
+#                                       the centroid of non-point features)
+#   read_lines(table, fields, where)  - iterator of (parts, *field values) tuples, where parts is a list of
+#                                       (vertices x 2) arrays of longitudes and latitudes, one per part of the line
+
+# File extensions of the databases opened by the SQLiteBackend
+DATABASE_EXTENSIONS = (".gpkg", ".sqlite", ".db")
+
+# File extensions of the workspaces that hold tables themselves (anything else is a folder of shapefiles)
+DATABASE_WORKSPACE_EXTENSIONS = DATABASE_EXTENSIONS + (".gdb", ".sde", ".mdb")
+
+# Tables of a GeoPackage or SQLite database that a partition never replaces
+PROTECTED_TABLE_PREFIXES = ("gpkg_", "rtree_", "sqlite_")
+
+# WKID of WGS 84; geometries are always read in decimal degrees
+WGS84 = 4326
+
+# Number of rows a partitioned copy reads at a time
+PARTITION_BATCH_ROWS = 5000
+
+# Field types of the tools (ArcGIS field types) and the SQLite column types they become
+SQLITE_TYPES = {
+    "TEXT": "TEXT",
+    "DOUBLE": "REAL",
+    "FLOAT": "REAL",
+    "LONG": "INTEGER",
+    "SHORT": "INTEGER",
+    "DATE": "TEXT",
+}
+
+# --------------------------------------------------------------------
+# Base class of the storage backends
+# --------------------------------------------------------------------
+class Backend:
+    def message(self, text):
+        print(text)
+
+    def warning(self, text):
+        self.message("WARNING: " + text)
+
+    def table_name(self, table):
+        return str(table)
+
+    def table_path(self, table):
+        return str(table)
+
+    def table_location(self, table):
+        return self.table_path(table)
+
+    def read_service(self, serviceUrl, fields):
+        return query_service(serviceUrl, fields)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+# --------------------------------------------------------------------
+# arcpy backend
+# --------------------------------------------------------------------
+class ArcpyBackend(Backend):
+    def __init__(self):
+        import arcpy
+        self.arcpy = arcpy
+
+    def message(self, text):
+        self.arcpy.AddMessage(text)
+
+    def warning(self, text):
+        self.arcpy.AddWarning(text)
+
+    @property
+    def workspace(self):
+        return self.arcpy.env.workspace
+
+    def table_name(self, table):
+        return self.arcpy.Describe(table).baseName
+
+    # Layers become the path of their feature class (selections and definition queries of the layer are not kept)
+    def table_path(self, table):
+        return self.arcpy.Describe(table).catalogPath
+
+    def object_id_field(self, table):
+        return self.arcpy.Describe(table).OIDFieldName
+
+    def list_fields(self, table):
+        return [field.name for field in self.arcpy.ListFields(table)]
+
+    def read_rows(self, table, fields, where = None, orderBy = None):
+        sqlClause = (None, "ORDER BY " + ", ".join(orderBy)) if orderBy else (None, None)
+        with self.arcpy.da.SearchCursor(table, list(fields), where, sql_clause = sqlClause) as cursor:
+            for row in cursor:
+                yield row
+
+    def result_writer(self):
+        return ArcpyResultWriter()
+
+    # The missing fields are added with one AddFields call, which takes the schema lock once for all of them
+    def add_fields(self, table, fieldsDict):
+        missing = missing_fields(self.list_fields(table), fieldsDict)
+        if missing:
+            self.arcpy.management.AddFields(table, [[field, fieldsDict[field][0], fieldsDict[field][1]] for field in missing])
+        return missing
+
+    def select(self, table, output, where):
+        self.arcpy.Select_analysis(table, output, where)
+
+    # --------------------------------------------------------------------
+    # Reads the table once and copies every row (geometry and fields) to the feature class of its field value, which is
+    # created with the table as its template the first time the value shows up. All insert cursors stay open until the
+    # table has been read.
+    # Only editable fields are copied: Shape_Length and Shape_Area (and GlobalIDs) are read-only and maintained by the output.
+    # --------------------------------------------------------------------
+    def partition(self, table, field, output, folder):
+        arcpy = self.arcpy
+        describe = arcpy.Describe(table)
+        hasShape = hasattr(describe, "shapeType")
+        fields = [tableField.name for tableField in arcpy.ListFields(table)
+                  if tableField.editable and tableField.type not in ("OID", "Geometry", "GlobalID")]
+        # The partition field is read even if it isn't copied (e.g. a read-only field)
+        readFields = (["SHAPE@"] if hasShape else []) + fields + ([] if field in fields else [field])
+        valueIndex = readFields.index(field)
+
+        counts = {}
+        sinks = {}
+        with contextlib.ExitStack() as cursors, arcpy.da.SearchCursor(table, readFields) as rows:
+            for row in rows:
+                value = row[valueIndex]
+                sink = sinks.get(value)
+                if sink is None:
+                    sink = sinks[value] = self.partition_sink(cursors, table, describe, hasShape, fields, output, folder, value)
+                    self.message("{} feature layer created!".format(value))
+                cursor, positions = sink
+                cursor.insertRow([row[position] for position in positions])
+                counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    # --------------------------------------------------------------------
+    # Creates the output of a value of a partitioned copy.
+    # Returns (insert cursor, positions of the read fields the cursor takes).
+    # Shapefiles shorten field names to 10 characters, so fields are matched by their full name or its first 10 characters.
+    # --------------------------------------------------------------------
+    def partition_sink(self, cursors, table, describe, hasShape, fields, output, folder, value):
+        arcpy = self.arcpy
+        outputTable = self.output_table(output, folder, str(value))
+        # Tables without geometries are dBASE tables in a folder
+        if not hasShape and outputTable.lower().endswith(".shp"):
+            outputTable = outputTable[:-4] + ".dbf"
+        if arcpy.Exists(outputTable):
+            arcpy.Delete_management(outputTable)
+        outputPath, outputName = os.path.split(outputTable)
+        if hasShape:
+            arcpy.CreateFeatureclass_management(outputPath, outputName, describe.shapeType, table, "SAME_AS_TEMPLATE",
+                                                "SAME_AS_TEMPLATE", describe.spatialReference)
+        else:
+            arcpy.CreateTable_management(outputPath, outputName, table)
+
+        outputFields = {outputField.name.upper(): outputField.name for outputField in arcpy.ListFields(outputTable)
+                        if outputField.editable and outputField.type not in ("OID", "Geometry", "GlobalID")}
+        insertFields = ["SHAPE@"] if hasShape else []
+        positions = [0] if hasShape else []
+        for position, name in enumerate(fields, len(positions)):
+            outputField = outputFields.get(name.upper(), outputFields.get(name[:10].upper()))
+            if outputField is not None:
+                insertFields.append(outputField)
+                positions.append(position)
+        return cursors.enter_context(arcpy.da.InsertCursor(outputTable, insertFields)), positions
+
+    def read_service(self, serviceUrl, fields):
+        return self.read_rows(serviceUrl, fields)
+
+    # SHAPE@X and SHAPE@Y are the centroid of lines and polygons; the cursor projects them to WGS 84
+    def read_points(self, table, fields = (), where = None):
+        with self.arcpy.da.SearchCursor(table, ["SHAPE@X", "SHAPE@Y"] + list(fields), where,
+                                        self.arcpy.SpatialReference(WGS84)) as cursor:
+            for row in cursor:
+                yield row
+
+    def read_lines(self, table, fields = (), where = None):
+        with self.arcpy.da.SearchCursor(table, ["SHAPE@"] + list(fields), where, self.arcpy.SpatialReference(WGS84)) as cursor:
+            for row in cursor:
+                parts = [] if row[0] is None else [
+                    np.array([(point.X, point.Y) for point in part if point is not None], dtype = float).reshape(-1, 2)
+                    for part in row[0]
+                ]
+                yield (parts,) + tuple(row[1:])
+
+    # --------------------------------------------------------------------
+    # Tables are written to the {output}\{folder} directory, which is created if it doesn't exist.
+    # In a folder, the tables are shapefiles: the name gets the .shp extension that Select_analysis would add by itself,
+    # so the path can also be used with Exists, ListFields and the cursors.
+    # --------------------------------------------------------------------
+    def output_table(self, output, folder, name):
+        outputFolder = os.path.join(output, folder)
+        if not os.path.exists(outputFolder):
+            os.makedirs(outputFolder)
+            self.message("'{}' directory succesfully created!".format(outputFolder))
+        if folder_workspace(outputFolder):
+            name += ".shp"
+        return os.path.join(outputFolder, name)
+
+# --------------------------------------------------------------------
+# Returns True if a path is a plain folder, not in a geodatabase, GeoPackage or database connection
+# --------------------------------------------------------------------
+def folder_workspace(path):
+    return not any(os.path.splitext(part)[1].lower() in DATABASE_WORKSPACE_EXTENSIONS
+                   for part in os.path.normpath(str(path)).split(os.sep))
+
+# --------------------------------------------------------------------
+# GeoPackage / SQLite backend.
+# Tables are tables of the database; the object ID is the table's integer primary key (the "fid" of a
+# GeoPackage) or the SQLite rowid.
+# --------------------------------------------------------------------
+class SQLiteBackend(Backend):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+    @property
+    def workspace(self):
+        return self.path
+
+    # The table of this database, e.g. "C:\Data\Assets.gpkg\Bridges"
+    def table_location(self, table):
+        return os.path.join(os.path.abspath(self.path), str(table))
+
+    def close(self):
+        self.connection.close()
+
+    def list_fields(self, table):
+        return [row[1] for row in self.connection.execute("PRAGMA table_info({})".format(quote_identifier(table)))]
+
+    # --------------------------------------------------------------------
+    # Returns the integer primary key column of a table ("rowid" if it has none)
+    # --------------------------------------------------------------------
+    def object_id_field(self, table):
+        for row in self.connection.execute("PRAGMA table_info({})".format(quote_identifier(table))):
+            # row = (column id, name, type, not null, default value, primary key position)
+            if row[5] == 1 and row[2].upper() == "INTEGER":
+                return row[1]
+        return "rowid"
+
+    def read_rows(self, table, fields, where = None, orderBy = None):
+        objectIDField = self.object_id_field(table)
+        columns = ", ".join(quote_identifier(objectIDField) if field == "OID@" else quote_identifier(field) for field in fields)
+        query = "SELECT {} FROM {}".format(columns, quote_identifier(table))
+        if where:
+            query += " WHERE " + where
+        if orderBy:
+            query += " ORDER BY " + ", ".join(quote_identifier(field) for field in orderBy)
+        return self.connection.execute(query)
+
+    # --------------------------------------------------------------------
+    # Returns the geometry column of a GeoPackage table (None for tables without geometries)
+    # --------------------------------------------------------------------
+    def geometry_field(self, table):
+        if self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gpkg_geometry_columns'").fetchone() is None:
+            return None
+        row = self.connection.execute("SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?", (table,)).fetchone()
+        return None if row is None else row[0]
+
+    # --------------------------------------------------------------------
+    # Points are the mean of a feature's vertices (the feature itself for points).
+    # Tables without a geometry column (e.g. the prepared asset tables) use their LONG_CALC and LAT_CALC fields.
+    # --------------------------------------------------------------------
+    def read_points(self, table, fields = (), where = None):
+        geometryField = self.geometry_field(table)
+        if geometryField is None:
+            for row in self.read_rows(table, ["LONG_CALC", "LAT_CALC"] + list(fields), where):
+                yield row
+            return
+
+        for row in self.read_rows(table, [geometryField] + list(fields), where):
+            parts = [] if row[0] is None else geopackage_parts(row[0])
+            vertices = np.concatenate(parts) if parts else np.full((1, 2), np.nan)
+            long, lat = vertices.mean(axis = 0).tolist()
+            yield (long, lat) + tuple(row[1:])
+
+    def read_lines(self, table, fields = (), where = None):
+        geometryField = self.geometry_field(table)
+        if geometryField is None:
+            raise ValueError("Table '{}' has no geometry column".format(table))
+        for row in self.read_rows(table, [geometryField] + list(fields), where):
+            yield ([] if row[0] is None else geopackage_parts(row[0]),) + tuple(row[1:])
+
+    def result_writer(self):
+        return SQLiteTableWriter(self)
+
+    # The missing columns are added in one transaction
+    def add_fields(self, table, fieldsDict):
+        missing = missing_fields(self.list_fields(table), fieldsDict)
+        for field in missing:
+            self.connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+                quote_identifier(table), quote_identifier(field), SQLITE_TYPES.get(str(fieldsDict[field][0]).upper(), "")))
+        self.connection.commit()
+        return missing
+
+    # --------------------------------------------------------------------
+    # Copies the rows of a table matching the where clause to a new table.
+    # output is either a table name in the same database, or "{database path}|{table name}" for another database.
+    # GeoPackage tables are registered in the output's gpkg_contents (and gpkg_geometry_columns) so GIS software sees them.
+    # --------------------------------------------------------------------
+    def select(self, table, output, where):
+        database, outputTable = split_output(output)
+        # The copy gets its own connection, so it can run while the rows of the table are being read
+        connection = sqlite3.connect(self.path)
+        try:
+            schema = "main"
+            if database is not None and os.path.abspath(database) != os.path.abspath(self.path):
+                connection.execute("ATTACH DATABASE ? AS output", (database,))
+                schema = "output"
+            target = "{}.{}".format(schema, quote_identifier(outputTable))
+            connection.execute("DROP TABLE IF EXISTS {}".format(target))
+            query = "CREATE TABLE {} AS SELECT * FROM {}".format(target, quote_identifier(table))
+            if where:
+                query += " WHERE " + where
+            connection.execute(query)
+            register_geopackage_table(connection, schema, table, outputTable)
+            connection.commit()
+        finally:
+            connection.close()
+
+    # --------------------------------------------------------------------
+    # Reads the table once and copies every row to the table of its field value, which is created the first time the
+    # value shows up. The table is read PARTITION_BATCH_ROWS rows at a time in object ID order (a table can't be dropped
+    # while another one is being read, and an existing output table is replaced), and the rows of every chunk are
+    # inserted with one call per value.
+    # --------------------------------------------------------------------
+    def partition(self, table, field, output, folder):
+        columns = self.list_fields(table)
+        valueIndex = columns.index(field)
+        objectIDField = self.object_id_field(table)
+        query = "SELECT {}, * FROM {} WHERE {} > ? ORDER BY {} LIMIT {}".format(
+            quote_identifier(objectIDField), quote_identifier(table), quote_identifier(objectIDField),
+            quote_identifier(objectIDField), PARTITION_BATCH_ROWS)
+
+        # Every table goes to the same database: attach it before any rows are written
+        database, _ = split_output(self.output_table(output, folder, ""))
+        schema = "main"
+        if database is not None and os.path.abspath(database) != os.path.abspath(self.path):
+            self.connection.execute("ATTACH DATABASE ? AS output", (database,))
+            schema = "output"
+
+        # The table of a value replaces any table with its name, so no value may be named like the partitioned table
+        # (in the same database) or a GeoPackage/SQLite metadata table. This is checked before any table is replaced.
+        conditions = ["substr(lower(value), 1, {}) = ?".format(len(prefix)) for prefix in PROTECTED_TABLE_PREFIXES]
+        parameters = list(PROTECTED_TABLE_PREFIXES)
+        if schema == "main":
+            conditions.append("lower(value) = ?")
+            parameters.append(str(table).lower())
+        collision = self.connection.execute("SELECT value FROM (SELECT CAST({} AS TEXT) AS value FROM {}) WHERE {} LIMIT 1".format(
+            quote_identifier(field), quote_identifier(table), " OR ".join(conditions)), parameters).fetchone()
+        if collision is not None:
+            if schema == "output":
+                self.connection.execute("DETACH DATABASE output")
+            raise ValueError("The '{}' value '{}' can't be the name of a partition table: it would replace the partitioned table "
+                             "or a metadata table".format(field, collision[0]))
+
+        counts = {}
+        inserts = {}
+        try:
+            rows = self.connection.execute(query, (-2 ** 63,)).fetchall()
+            while rows:
+                chunk = {}
+                for row in rows:
+                    chunk.setdefault(row[valueIndex + 1], []).append(row[1:])
+
+                for value, valueRows in chunk.items():
+                    if value not in inserts:
+                        outputTable = split_output(self.output_table(output, folder, str(value)))[1]
+                        target = "{}.{}".format(schema, quote_identifier(outputTable))
+                        self.connection.execute("DROP TABLE IF EXISTS {}".format(target))
+                        self.connection.execute("CREATE TABLE {} AS SELECT * FROM {} WHERE 0".format(target, quote_identifier(table)))
+                        register_geopackage_table(self.connection, schema, table, outputTable)
+                        inserts[value] = "INSERT INTO {} VALUES ({})".format(target, ", ".join("?" for _ in columns))
+                        self.message("{} feature layer created!".format(value))
+                    self.connection.executemany(inserts[value], valueRows)
+                    counts[value] = counts.get(value, 0) + len(valueRows)
+                rows = self.connection.execute(query, (rows[-1][0],)).fetchall()
+            self.connection.commit()
+        finally:
+            self.connection.rollback()
+            if schema == "output":
+                self.connection.execute("DETACH DATABASE output")
+        return counts
+
+    # --------------------------------------------------------------------
+    # Tables are written to the output database if output is a .gpkg/.sqlite file,
+    # otherwise to {output}\{folder}.gpkg
+    # --------------------------------------------------------------------
+    def output_table(self, output, folder, name):
+        if os.path.splitext(str(output))[1].lower() not in DATABASE_EXTENSIONS:
+            os.makedirs(output, exist_ok = True)
+            output = os.path.join(output, folder + ".gpkg")
+        return "{}|{}".format(output, name)
+
+# --------------------------------------------------------------------
+# Writes results to the tables of a SQLiteBackend, keyed by the table's object ID
+# --------------------------------------------------------------------
+class SQLiteTableWriter(ResultWriter):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def write(self, table, fields, results):
+        connection = self.backend.connection
+        objectIDField = quote_identifier(self.backend.object_id_field(table))
+        tableName = quote_identifier(table)
+        columns = ", ".join(quote_identifier(field) for field in fields)
+
+        # Only the current values of the rows with results are kept
+        existing = {row[0]: row[1:] for row in connection.execute("SELECT {}, {} FROM {}".format(objectIDField, columns, tableName))
+                    if row[0] in results}
+        changed = [
+            tuple(newValues) + (objectID,)
+            for objectID, newValues in results.items()
+            if objectID in existing and not rows_equal(existing[objectID], newValues)
+        ]
+
+        assignments = ", ".join("{} = ?".format(quote_identifier(field)) for field in fields)
+        connection.executemany("UPDATE {} SET {} WHERE {} = ?".format(tableName, assignments, objectIDField), changed)
+        connection.commit()
+        return len(changed), sum(1 for objectID in results if objectID in existing) - len(changed)
+
+# ********************************************************************
+# GeoPackage Geometries
+# ********************************************************************
+# A GeoPackage geometry is a small header followed by the geometry in the WKB (well-known binary) format:
+#   "GP", version, flags, SRS ID (4 bytes), envelope (0, 32, 48 or 64 bytes, given by bits 1-3 of the flags)
+# Only the vertices are needed by the tools, so every geometry is read as a list of (vertices x 2) arrays:
+# one per point, line, or polygon ring. Z and M values are dropped.
+
+# Size of the envelope for each envelope code of the flags
+ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+# Geometries must be in decimal degrees: WGS 84, or the GeoPackage's "undefined geographic" SRS
+GEOGRAPHIC_SRS_IDS = (WGS84, 0)
+
+# --------------------------------------------------------------------
+# Returns the vertices of a GeoPackage geometry as a list of (vertices x 2) arrays of longitudes and latitudes
+# --------------------------------------------------------------------
+def geopackage_parts(blob):
+    blob = bytes(blob)
+    if blob[:2] != b"GP":
+        raise ValueError("Not a GeoPackage geometry")
+    flags = blob[3]
+    srsID = struct.unpack_from("<i" if flags & 1 else ">i", blob, 4)[0]
+    if srsID not in GEOGRAPHIC_SRS_IDS:
+        raise ValueError("Geometries must be in WGS 84 (EPSG:{}), not SRS {}".format(WGS84, srsID))
+
+    parts = []
+    wkb_parts(blob, 8 + ENVELOPE_SIZES[(flags >> 1) & 7], parts)
+    return parts
+
+# --------------------------------------------------------------------
+# Reads the WKB geometry starting at offset, appending its vertex arrays to parts.
+# Returns the offset right after the geometry (multi-geometries are read one geometry after another).
+# --------------------------------------------------------------------
+def wkb_parts(blob, offset, parts):
+    byteOrder = "<" if blob[offset] == 1 else ">"
+    geometryType = struct.unpack_from(byteOrder + "I", blob, offset + 1)[0]
+    offset += 5
+
+    # Extended WKB flags Z and M with the two highest bits; ISO WKB adds 1000 (Z), 2000 (M) or 3000 (ZM) to the type
+    dimensions = 2 + bool(geometryType & 0x80000000) + bool(geometryType & 0x40000000)
+    geometryType &= 0x0FFFFFFF
+    dimensions += (0, 1, 1, 2)[geometryType // 1000]
+    geometryType %= 1000
+    coordinate = np.dtype(byteOrder + "f8")
+
+    def vertices(count, start):
+        values = np.frombuffer(blob, dtype = coordinate, count = count * dimensions, offset = start)
+        return values.reshape(count, dimensions)[:, :2].astype(float)
+
+    if geometryType == 1:       # Point
+        parts.append(vertices(1, offset))
+        return offset + 8 * dimensions
+    count = struct.unpack_from(byteOrder + "I", blob, offset)[0]
+    offset += 4
+    if geometryType == 2:       # LineString
+        parts.append(vertices(count, offset))
+        return offset + 8 * dimensions * count
+    if geometryType == 3:       # Polygon: a list of rings
+        for _ in range(count):
+            ringCount = struct.unpack_from(byteOrder + "I", blob, offset)[0]
+            parts.append(vertices(ringCount, offset + 4))
+            offset += 4 + 8 * dimensions * ringCount
+        return offset
+    if geometryType in (4, 5, 6, 7):    # MultiPoint, MultiLineString, MultiPolygon, GeometryCollection
+        for _ in range(count):
+            offset = wkb_parts(blob, offset, parts)
+        return offset
+    raise ValueError("Unsupported WKB geometry type {}".format(geometryType))
+
+# --------------------------------------------------------------------
+# Splits "{database path}|{table name}" into (database path, table name).
+# A plain table name gives (None, table name).
+# --------------------------------------------------------------------
+def split_output(output):
+    if "|" in str(output):
+        database, table = str(output).rsplit("|", 1)
+        return database, table
+    return None, str(output)
+
+# --------------------------------------------------------------------
+# Registers a copied table in a GeoPackage's gpkg_contents and gpkg_geometry_columns tables,
+# using the registration of the table it was copied from. Does nothing for plain SQLite databases.
+# --------------------------------------------------------------------
+def register_geopackage_table(connection, schema, sourceTable, outputTable):
+    def has_table(tableSchema, name):
+        query = "SELECT 1 FROM {}.sqlite_master WHERE type = 'table' AND name = ?".format(tableSchema)
+        return connection.execute(query, (name,)).fetchone() is not None
+
+    if not has_table("main", "gpkg_contents") or not has_table(schema, "gpkg_contents"):
+        return
+
+    contents = connection.execute(
+        "SELECT data_type, srs_id, min_x, min_y, max_x, max_y FROM main.gpkg_contents WHERE table_name = ?", (sourceTable,)).fetchone()
+    if contents is None:
+        return
+    connection.execute("DELETE FROM {}.gpkg_contents WHERE table_name = ?".format(schema), (outputTable,))
+    connection.execute(
+        "INSERT INTO {}.gpkg_contents (table_name, data_type, identifier, srs_id, min_x, min_y, max_x, max_y) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)".format(schema), (outputTable, contents[0], outputTable) + tuple(contents[1:]))
+
+    if has_table("main", "gpkg_geometry_columns") and has_table(schema, "gpkg_geometry_columns"):
+        geometry = connection.execute(
+            "SELECT column_name, geometry_type_name, srs_id, z, m FROM main.gpkg_geometry_columns WHERE table_name = ?", (sourceTable,)).fetchone()
+        if geometry is not None:
+            connection.execute("DELETE FROM {}.gpkg_geometry_columns WHERE table_name = ?".format(schema), (outputTable,))
+            connection.execute(
+                "INSERT INTO {}.gpkg_geometry_columns (table_name, column_name, geometry_type_name, srs_id, z, m) "
+                "VALUES (?, ?, ?, ?, ?, ?)".format(schema), (outputTable,) + tuple(geometry))
+
+# --------------------------------------------------------------------
+# Returns the backend for a workspace: a GeoPackage/SQLite file gets a SQLiteBackend, anything else
+# (e.g. a file geodatabase) an ArcpyBackend
+# --------------------------------------------------------------------
+def open_backend(workspace = None):
+    if workspace is not None and os.path.splitext(str(workspace))[1].lower() in DATABASE_EXTENSIONS:
+        return SQLiteBackend(workspace)
+    backend = ArcpyBackend()
+    if workspace is not None:
+        backend.arcpy.env.workspace = workspace
+    return backend
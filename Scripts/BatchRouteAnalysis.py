@@ -0,0 +1,111 @@
+import os           # Import os package to be able to get the current directory
+# The batch routing (see BatchRouting.py) and the closure levels of the bridges
+from BatchRouting import scenario_routing
+from BridgeBarriers import DAMAGE_LEVELS
+# The native road network
+from RoadNetwork import open_network
+# The Disaster Impact tool, run once for every scenario
+from DisasterImpact import optional_parameter, run_disaster_impact
+from Scenarios import load_scenarios, select_scenarios
+# Where the bridges, incidents and facilities are read from
+from Backends import ArcpyBackend
+# The timings of the run (and its optional trace and profile files)
+from Instrumentation import tracing
+
+# ********************************************************************
+# Main Program
+# ********************************************************************
+# --------------------------------------------------------------------
+# Runs the tool in ArcGIS Pro.
+# Routes the incidents to their closest facility in several scenarios (or Monte Carlo realizations) at once,
+# avoiding the bridges damaged in each one, and writes the travel times to a routing matrix
+# (see BatchRouting.py) instead of one route layer per scenario.
+# --------------------------------------------------------------------
+def main():
+    import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
+
+    # --------------------------------------------------------------------
+    # Setting directories
+    # --------------------------------------------------------------------
+    # Get the current directory of the script; it should look something like the following:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Scripts
+    scriptsPath = os.getcwd()
+
+    # The main project path: {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Projects\GADEP
+    projectPath = os.path.join(os.path.dirname(scriptsPath), "Projects", "GADEP")
+
+    # Path to the "PGA Values" folder, which holds the scenario registry
+    pgasPath = os.path.join(os.path.dirname(scriptsPath), "PGA Values")
+
+    # Path to "Infrastructures.gdb"; the Disaster Impact tool refers to its layers by name
+    infrastructuresPath = os.path.join(projectPath, "Infrastructures.gdb")
+    arcpy.env.workspace = infrastructuresPath
+    bridges = os.path.join(infrastructuresPath, "Bridges")
+
+    # The analysis network, and the folder its export is kept in
+    network = os.path.join(projectPath, "TransportationNetwork.gdb", "OregonNetwork", "OregonNetworkDataset")
+    networkPath = os.path.join(projectPath, "OregonNetwork.network")
+
+    # --------------------------------------------------------------------
+    # Initializing variables
+    # --------------------------------------------------------------------
+    # The first parameter runs the Disaster Impact tool on the bridges first, once for every scenario
+    runDisasterImpact = arcpy.GetParameter(0)
+    # The scenarios, e.g. "8.1;8.4;8.7;9.0" or "ALL"
+    em = arcpy.GetParameterAsText(1)
+
+    # The incidents and facilities, and the SQL expressions that filter them
+    incidents = arcpy.GetParameter(2)
+    incidentsWhereClause = arcpy.GetParameterAsText(3)
+    facilities = arcpy.GetParameter(4)
+    facilitiesWhereClause = arcpy.GetParameterAsText(5)
+
+    # The seventh (optional) parameter is the number of Monte Carlo realizations per scenario
+    # (0 = one barrier set per scenario, from the damage states of the bridges), and the eighth the random seed
+    realizations = int(optional_parameter(6, 0))
+    seed = int(optional_parameter(7, 0))
+
+    # The ninth (optional) parameter is the lowest damage state that closes a bridge (default Slight)
+    closureState = str(optional_parameter(8, "Slight")) or "Slight"
+
+    # The tenth (optional) parameter is the number of worker processes (1 = no worker processes, 0 = one per CPU core)
+    workers = int(optional_parameter(9, 1))
+
+    # The eleventh (optional) parameter exports the network dataset again (needed after the network dataset was edited)
+    refreshNetwork = bool(optional_parameter(10, False))
+
+    # The twelfth (optional) parameter is a list of closure thresholds, e.g. "0.2;0.5;0.8": every scenario is solved once
+    # per threshold, closing the bridges whose probability of the closure state (or worse) is at least the threshold
+    # (see BridgeBarriers.py). Empty uses the damage states. Ignored with realizations.
+    thresholds = [float(value) for value in str(optional_parameter(11, "")).replace(",", ";").split(";") if value.strip() not in ("", "#")]
+
+    backend = ArcpyBackend()
+    scenarioNames = [scenario["name"] for scenario in select_scenarios(load_scenarios(pgasPath), em)]
+
+    # --------------------------------------------------------------------
+    # Disaster impact - bridges
+    # --------------------------------------------------------------------
+    # Every scenario is simulated in one run; with several scenarios the results go to the results side table
+    if runDisasterImpact:
+        arcpy.AddMessage("Running Disaster Impact tool...")
+        run_disaster_impact(backend, ["Bridges"], em, projectPath, pgasPath, realizations = realizations, seed = seed)
+
+    # --------------------------------------------------------------------
+    # Batch routing
+    # --------------------------------------------------------------------
+    edgeTables = [os.path.join(os.path.dirname(network), source.name) for source in arcpy.Describe(network).edgeSources]
+    roadNetwork = open_network(backend, networkPath, edgeTables, refreshNetwork)
+
+    arcpy.AddMessage("Routing {} scenario(s)...".format(len(scenarioNames)))
+    output = scenario_routing(backend, roadNetwork, networkPath, projectPath, bridges, incidents, facilities, scenarioNames,
+                              realizations, seed, DAMAGE_LEVELS[closureState], incidentsWhereClause or None,
+                              facilitiesWhereClause or None, workers, thresholds = thresholds)
+
+    # Print success message
+    arcpy.AddMessage("BATCH ROUTE ANALYSIS SUCCESSFUL! Routing matrix written to '{}'.".format(output))
+
+# The tool only runs when the script is started by ArcGIS Pro, not when it's imported (e.g. by worker processes)
+if __name__ == "__main__":
+    # The timings of the run are printed when it ends (see Instrumentation.py)
+    with tracing(ArcpyBackend().message):
+        main()
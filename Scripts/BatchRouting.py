@@ -0,0 +1,259 @@
+import os           # Import os package to work with directories
+# NumPy holds the travel times of every incident in every scenario as one matrix
+import numpy as np
+# scipy's Dijkstra runs in compiled code
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+# The road network and the reading of point tables
+from RoadNetwork import load_network, read_locations
+# The barrier sets of the scenarios
+from BridgeBarriers import CLOSURE_LEVEL, PENALTY_FACTORS, realization_factors, scenario_factors, state_probabilities, threshold_factors
+# Side tables
+from Scenarios import write_side_table
+# Process pools
+from Parallel import chunk_ranges, process_pool, worker_count
+# Stage timers of a traced run
+from Instrumentation import stage
+
+# ********************************************************************
+# Batch Routing
+# ********************************************************************
+# Comparing the routes of several scenarios used to mean one Disaster Route Analysis run per scenario. The batch mode
+# prepares everything once:
+#   - the exported network (memory-mapped) and its reversed adjacency,
+#   - the junctions of the incidents and facilities, and the edge of every bridge,
+# and then solves every barrier set (every scenario, every Monte Carlo realization or every closure threshold of a
+# scenario, see BridgeBarriers.py) with one reverse search from every facility (see RoadNetwork.reverse_closest_facilities).
+# Only the travel times of the arcs of the closed or penalized bridges change between sets; the sets are solved in chunks,
+# in parallel when there is more than one worker. Several thresholds are solved in one run instead of one run each.
+#
+# The results are a routing matrix ("Projects\GADEP\Scenarios\{incidents}_routing.npz" by default) with:
+#   incidentIDs     - int64 object IDs of the incidents
+#   facilityIDs     - int64 object IDs of the facilities
+#   sets            - names of the barrier sets (the scenario, "{scenario}#{realization}" or "{scenario}@{threshold}")
+#   scenarios       - scenario of every set
+#   realizations    - realization number of every set (-1 otherwise)
+#   thresholds      - closure threshold of every set (NaN otherwise)
+#   closedBridges   - number of closed bridges of every set
+#   minutes         - float32 (incidents x sets) travel time to the closest facility (inf = no facility can be reached)
+#   facilities      - int64 (incidents x sets) object ID of the closest facility (-1 = none)
+#   baselineMinutes - float32 travel time of every incident with every bridge open
+#   connected       - fraction of the (located) incidents that can reach a facility, for every set
+# and, with Monte Carlo realizations, the expected travel time over the realizations of every scenario:
+#   expectedMinutes - float32 (incidents x scenarios) mean travel time over the realizations in which the incident
+#                     reaches a facility (NaN = never)
+#   reachProbability - float32 (incidents x scenarios) fraction of the realizations in which the incident reaches a facility
+
+# Number of barrier sets solved by one task
+SETS_PER_TASK = 16
+
+# Network and routing problem of a worker process (set up once per worker by init_worker)
+workerNetwork = None
+workerProblem = None
+
+# --------------------------------------------------------------------
+# Worker process initializer. Every worker opens the exported network itself (memory-mapped).
+# --------------------------------------------------------------------
+def init_worker(networkPath, problem):
+    global workerNetwork, workerProblem
+    workerNetwork = load_network(networkPath)
+    workerProblem = problem
+
+# --------------------------------------------------------------------
+# Prepares a routing problem once for every barrier set. Returns a dictionary with:
+#   incidentNodes      - junction of every incident (-1 = not located)
+#   sourceNodes        - distinct junctions of the facilities, and sourceFacilities the first facility on each
+#   bridgeEdges        - edge of every bridge (-1 = not located)
+#   edgeArcPtr, edgeArcs - the arcs of edge e are edgeArcs[edgeArcPtr[e]:edgeArcPtr[e + 1]]
+#   reverseIndptr, reverseIndices, reverseMinutes - the reversed adjacency (arcs into every junction)
+#   reversePositions   - position of every arc in the reversed adjacency
+# --------------------------------------------------------------------
+def routing_problem(network, incidentNodes, facilityNodes, bridgeEdges):
+    facilityNodes = np.asarray(facilityNodes, dtype = np.int64)
+    facilities = np.flatnonzero(facilityNodes >= 0)
+    sourceNodes, first = np.unique(facilityNodes[facilities], return_index = True)
+
+    arcEdges = np.asarray(network.arcEdges)
+    edgeArcs = np.argsort(arcEdges, kind = "stable")
+    edgeArcPtr = np.concatenate([[0], np.cumsum(np.bincount(arcEdges, minlength = network.edgeIDs.shape[0]))]).astype(np.int64)
+
+    # Reversed adjacency: the arcs sorted by the junction they lead to
+    indptr = np.asarray(network.indptr)
+    arcStarts = np.repeat(np.arange(network.nodeCount), np.diff(indptr))
+    indices = np.asarray(network.indices)
+    reverseOrder = np.argsort(indices, kind = "stable")
+    reversePositions = np.empty(reverseOrder.shape[0], dtype = np.int64)
+    reversePositions[reverseOrder] = np.arange(reverseOrder.shape[0])
+
+    return {
+        "incidentNodes": np.asarray(incidentNodes, dtype = np.int64),
+        "sourceNodes": sourceNodes,
+        "sourceFacilities": facilities[first],
+        "bridgeEdges": np.asarray(bridgeEdges, dtype = np.int64),
+        "edgeArcPtr": edgeArcPtr,
+        "edgeArcs": edgeArcs,
+        "reverseIndptr": np.concatenate([[0], np.cumsum(np.bincount(indices, minlength = network.nodeCount))]).astype(np.int64),
+        "reverseIndices": arcStarts[reverseOrder].astype(np.int32),
+        "reverseMinutes": np.asarray(network.minutes, dtype = float)[reverseOrder],
+        "reversePositions": reversePositions,
+    }
+
+# --------------------------------------------------------------------
+# Solves barrier sets. factors is a (bridges x sets) matrix of travel time factors (inf = closed, see BridgeBarriers.py);
+# when several bridges are on one edge, the highest factor counts.
+# network and problem are None inside a worker process, which uses its own.
+# Returns (minutes, facilities): (incidents x sets) travel times and facility row positions (-1 = none)
+# --------------------------------------------------------------------
+def solve_sets(factors, network = None, problem = None):
+    network = workerNetwork if network is None else network
+    problem = workerProblem if problem is None else problem
+    incidentNodes = problem["incidentNodes"]
+    located = incidentNodes >= 0
+    nodeCount = problem["reverseIndptr"].shape[0] - 1
+
+    minutes = np.full((incidentNodes.shape[0], factors.shape[1]), np.inf, dtype = np.float32)
+    facilities = np.full((incidentNodes.shape[0], factors.shape[1]), -1, dtype = np.int64)
+    if problem["sourceNodes"].shape[0] == 0:
+        return minutes, facilities
+
+    for column in range(factors.shape[1]):
+        # The highest factor of every edge with a closed or penalized bridge
+        bridges = np.flatnonzero((factors[:, column] != 1) & (problem["bridgeEdges"] >= 0))
+        edges, bridgeEdges = np.unique(problem["bridgeEdges"][bridges], return_inverse = True)
+        edgeFactors = np.zeros(edges.shape[0])
+        np.maximum.at(edgeFactors, bridgeEdges, factors[bridges, column])
+
+        # The arcs of those edges, and their positions in the reversed adjacency
+        starts = problem["edgeArcPtr"][edges]
+        counts = problem["edgeArcPtr"][edges + 1] - starts
+        arcs = problem["edgeArcs"][np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts) + np.arange(counts.sum())]
+        positions = problem["reversePositions"][arcs]
+        arcFactors = np.repeat(edgeFactors, counts)
+
+        data = problem["reverseMinutes"].copy()
+        data[positions] = np.where(np.isinf(arcFactors), np.inf, data[positions] * arcFactors)
+        reverse = csr_matrix((data, problem["reverseIndices"], problem["reverseIndptr"]), shape = (nodeCount, nodeCount))
+        distances, _, sources = dijkstra(reverse, indices = problem["sourceNodes"], min_only = True, return_predecessors = True)
+
+        nodes = incidentNodes[located]
+        minutes[located, column] = distances[nodes]
+        reached = sources[nodes] >= 0
+        sourcePositions = np.searchsorted(problem["sourceNodes"], sources[nodes][reached])
+        columnFacilities = np.full(nodes.shape[0], -1, dtype = np.int64)
+        columnFacilities[reached] = problem["sourceFacilities"][sourcePositions]
+        facilities[located, column] = columnFacilities
+    return minutes, facilities
+
+# --------------------------------------------------------------------
+# Solves every barrier set of a (bridges x sets) matrix of travel time factors, in chunks of SETS_PER_TASK sets.
+# Returns (minutes, facilities) like solve_sets.
+# --------------------------------------------------------------------
+def batch_route(network, networkPath, problem, factors, workers = 1):
+    tasks = [factors[:, start:stop] for start, stop in chunk_ranges(factors.shape[1], SETS_PER_TASK)]
+    if worker_count(workers) > 1 and len(tasks) > 1:
+        with process_pool(workers, init_worker, (networkPath, problem)) as pool:
+            results = list(pool.map(solve_sets, tasks))
+    else:
+        results = [solve_sets(task, network, problem) for task in tasks]
+
+    incidentCount = problem["incidentNodes"].shape[0]
+    if not results:
+        return np.zeros((incidentCount, 0), dtype = np.float32), np.zeros((incidentCount, 0), dtype = np.int64)
+    return np.concatenate([result[0] for result in results], axis = 1), np.concatenate([result[1] for result in results], axis = 1)
+
+# --------------------------------------------------------------------
+# Routes the incidents to their closest facility in every scenario (or Monte Carlo realization, or closure threshold)
+# and writes the routing matrix (see above).
+# Parameters:
+#   backend       - storage backend (see Backends.py)
+#   network, networkPath - the exported road network and its folder
+#   projectPath   - project folder holding the Disaster Impact side tables of the bridges
+#   bridges, incidents, facilities - the bridges, incidents and facilities tables
+#   scenarioNames - the scenarios
+#   realizations  - Monte Carlo realizations per scenario (0 = one set per scenario, from its damage states)
+#   seed          - random seed of the realizations (the Disaster Impact run of the bridges must have used it)
+#   closureLevel  - lowest damage level that closes a bridge (see BridgeBarriers.py)
+#   thresholds    - optional closure thresholds (probabilities of closure), solved for every scenario instead of the
+#                   damage states (ignored with realizations)
+#   factors       - travel time factor of a bridge in every damage level that doesn't close it
+#   incidentsWhere, facilitiesWhere - optional where clauses filtering the incidents and facilities
+#   workers       - worker processes (1 = no worker processes, 0 = one per CPU core)
+#   output        - path of the routing matrix (default: "{project}\Scenarios\{incidents}_routing.npz")
+# Returns the path of the routing matrix
+# --------------------------------------------------------------------
+def scenario_routing(backend, network, networkPath, projectPath, bridges, incidents, facilities, scenarioNames,
+                     realizations = 0, seed = 0, closureLevel = CLOSURE_LEVEL, incidentsWhere = None, facilitiesWhere = None,
+                     workers = 1, output = None, thresholds = None, factors = PENALTY_FACTORS):
+    with stage("Read locations") as readStage:
+        incidentIDs, incidentLat, incidentLong = read_locations(backend, incidents, incidentsWhere)
+        facilityIDs, facilityLat, facilityLong = read_locations(backend, facilities, facilitiesWhere)
+        bridgeIDs, bridgeLat, bridgeLong = read_locations(backend, bridges)
+        readStage.rows = incidentIDs.shape[0] + facilityIDs.shape[0] + bridgeIDs.shape[0]
+
+    setThresholds = None
+    if realizations > 0:
+        sets, bridgeFactors = realization_factors(projectPath, backend.table_name(bridges), bridgeIDs, scenarioNames,
+                                                  realizations, seed, closureLevel, factors)
+        setScenarios = np.repeat(np.array(scenarioNames, dtype = str), realizations)
+        setRealizations = np.tile(np.arange(realizations), len(scenarioNames))
+    elif thresholds:
+        probabilities = state_probabilities(backend, projectPath, bridges, bridgeIDs, scenarioNames)
+        bridgeFactors = threshold_factors(probabilities, thresholds, closureLevel, factors)
+        sets = ["{}@{:g}".format(name, threshold) for name in scenarioNames for threshold in thresholds]
+        setScenarios = np.repeat(np.array(scenarioNames, dtype = str), len(thresholds))
+        setRealizations = np.full(len(sets), -1)
+        setThresholds = np.tile(np.asarray(thresholds, dtype = float), len(scenarioNames))
+    else:
+        sets, bridgeFactors = scenario_factors(backend, projectPath, bridges, bridgeIDs, scenarioNames, closureLevel, factors)
+        setScenarios = np.array(scenarioNames, dtype = str)
+        setRealizations = np.full(len(scenarioNames), -1)
+    if setThresholds is None:
+        setThresholds = np.full(len(sets), np.nan)
+
+    # The network is prepared once for every set; the first column is the baseline with every bridge open
+    with stage("Locate incidents, facilities and bridges"):
+        problem = routing_problem(network, network.snap(incidentLat, incidentLong), network.snap(facilityLat, facilityLong),
+                                  network.nearest_edges(bridgeLat, bridgeLong))
+    bridgeFactors = np.concatenate([np.ones((bridgeFactors.shape[0], 1), dtype = np.float32), bridgeFactors], axis = 1)
+    with stage("Solve barrier sets") as solveStage:
+        minutes, facilityPositions = batch_route(network, networkPath, problem, bridgeFactors, workers)
+        solveStage.rows = minutes.size
+
+    located = problem["incidentNodes"] >= 0
+    connected = np.isfinite(minutes[located]).mean(axis = 0) if located.any() else np.zeros(minutes.shape[1])
+    facilityObjectIDs = np.where(facilityPositions >= 0, facilityIDs[np.maximum(facilityPositions, 0)], -1)
+
+    # Expected travel time over the realizations of every scenario (realizations follow each other, see above)
+    expected = {}
+    if realizations > 0:
+        scenarioMinutes = minutes[:, 1:].reshape(minutes.shape[0], len(scenarioNames), realizations)
+        reached = np.isfinite(scenarioMinutes)
+        reachedCounts = reached.sum(axis = 2)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            expected["expectedMinutes"] = (np.where(reached, scenarioMinutes, 0).sum(axis = 2) / reachedCounts).astype(np.float32)
+        expected["reachProbability"] = (reachedCounts / realizations).astype(np.float32)
+
+    output = output or os.path.join(projectPath, "Scenarios", backend.table_name(incidents) + "_routing.npz")
+    write_side_table(output,
+                     incidentIDs = incidentIDs,
+                     facilityIDs = facilityIDs,
+                     sets = np.array(sets, dtype = str),
+                     scenarios = setScenarios,
+                     realizations = setRealizations,
+                     thresholds = setThresholds,
+                     closedBridges = np.isinf(bridgeFactors[:, 1:]).sum(axis = 0),
+                     minutes = minutes[:, 1:],
+                     facilities = facilityObjectIDs[:, 1:],
+                     baselineMinutes = minutes[:, 0],
+                     connected = connected[1:],
+                     **expected)
+
+    # Summary of every scenario (or threshold): the reachable incidents and their mean extra travel time
+    setGroups = np.array(sets if thresholds and realizations <= 0 else setScenarios, dtype = str)
+    for group in dict.fromkeys(setGroups.tolist()):
+        columns = np.flatnonzero(setGroups == group) + 1
+        reachable = np.isfinite(minutes[:, columns]) & np.isfinite(minutes[:, :1])
+        extra = (minutes[:, columns] - minutes[:, :1])[reachable]
+        backend.message("Scenario {}: {:.1%} of the incidents reach a facility, {:.2f} extra minutes on average.".format(
+            group, float(connected[columns].mean()), float(extra.mean()) if extra.shape[0] else 0.0))
+    return output
@@ -0,0 +1,493 @@
+import argparse     # Reads the command line arguments
+import gc
+import json         # Benchmark results and baselines are JSON files
+import os           # Import os package to work with directories
+import platform
+import shutil
+import sqlite3      # The synthetic tables are written to a GeoPackage
+import struct       # Packs the synthetic road geometries into GeoPackage geometries
+import sys
+import tempfile
+import time
+# NumPy generates the synthetic data
+import numpy as np
+# The parts of the tools that are benchmarked (all of them run without arcpy)
+from Backends import SQLiteBackend
+from DataExtractor import MEMORY, STREAM, extract_data
+from FragilityEngine import damage_states, load_fragility_curves, return_state, simulate_layer
+from GroundMotion import PGAGrid, StationIndex
+from PreparationForDisasterImpact import scenario_pgas
+from RoadNetwork import closest_facilities, export_network, load_network, reverse_closest_facilities
+
+# ********************************************************************
+# Benchmarks
+# ********************************************************************
+# Times the stages of the GADEP tools on synthetic data, so a change can be measured without the ArcGIS project.
+# The data is generated from a random seed, so every run (and every machine) benchmarks the same tables:
+#   Assets      - N prepared assets (LONG_CALC, LAT_CALC, Frag_no, IM, Diameter, AssetID and a Class field)
+#   AssetData   - the join table of the assets (one row per AssetID, in random order)
+#   Roads       - a grid road network of about N edges (GeoPackage lines with highway, maxspeed and oneway fields)
+#   the fragility catalog (every Fragility_distribution type), a PGA station grid of N stations, the bridges on
+#   the roads and the incidents and facilities of the routes are kept in memory
+#
+# Every stage is run REPEATS times at every scale, and its fastest run is kept. The results are written to a JSON file
+# and compared with a baseline (a results file of an earlier run): stages that got slower than the baseline by more than
+# the threshold are flagged as regressions.
+#
+# Examples:
+#   python Benchmark.py --update-baseline
+#   python Benchmark.py --scales 1000 10000 --stages pga_assignment extract_stream
+#   python Benchmark.py --threshold 0.1 --output Results.json
+
+# Number of assets (and PGA stations, and road edges) of every scale
+SCALES = (1000, 10000, 100000)
+
+# Number of times each stage is run; the fastest run is kept
+REPEATS = 3
+
+# A stage that takes more than (1 + REGRESSION_THRESHOLD) times its baseline time is a regression
+REGRESSION_THRESHOLD = 0.2
+
+# Version of the results file format
+RESULTS_VERSION = 1
+
+# The region the synthetic data is spread over (coastal Oregon, decimal degrees)
+LAT_RANGE = (44.0, 46.2)
+LONG_RANGE = (-124.1, -122.9)
+
+# Distance between the junctions of the synthetic road grid (decimal degrees, about 1 km)
+ROAD_SPACING = 0.01
+
+# Scenarios of the synthetic PGA grid
+SCENARIO_NAMES = ("M81_PGA", "M84_PGA", "M87_PGA", "M90_PGA")
+
+# Values of the Class field of the assets and the highway field of the roads (the partitioned fields)
+ASSET_CLASSES = tuple("Class{}".format(number) for number in range(20))
+ROAD_CLASSES = ("motorway", "trunk", "primary", "secondary", "tertiary", "residential", "service", "unclassified", "footway")
+
+# Routes of every scale
+INCIDENT_COUNT = 100
+FACILITY_COUNT = 10
+
+# The GADEP folder (the parent of this Scripts folder)
+gadepPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ********************************************************************
+# Synthetic Data
+# ********************************************************************
+# --------------------------------------------------------------------
+# Returns a fragility database dictionary (see the fdDict structure in DisasterImpact.py) with curves of every
+# Fragility_distribution type, and the share of the assets that get each fragility number.
+# "MISSING" isn't in the database, like the fragility numbers of real layers that have no curve.
+# --------------------------------------------------------------------
+def synthetic_fragility_database():
+    stateNames = ("Slight", "Moderate", "Extensive", "Complete")
+
+    def record(distribution, medians, stds, polynomial = None):
+        states = []
+        for stateName, median, std in zip(stateNames, medians, stds):
+            states += [stateName, str(median), str(std)]
+        return ("Earthquake", "PGA", "g", distribution, str(len(stateNames))) + tuple(states) + (polynomial, None, None, None)
+
+    fdDict = {
+        "LN1": record("Lognormal", (0.25, 0.45, 0.75, 1.1), (0.6, 0.6, 0.6, 0.6)),
+        "LN2": record("Lognormal", (0.4, 0.7, 1.0, 1.5), (0.5, 0.5, 0.55, 0.6)),
+        "LN3": record("Lognormal", (0.15, 0.3, 0.5, 0.9), (0.7, 0.7, 0.7, 0.7)),
+        "NO1": record("Normal", (0.3, 0.5, 0.8, 1.2), (0.1, 0.15, 0.2, 0.25)),
+        "NO2": record("Normal", (0.2, 0.4, 0.6, 0.9), (0.08, 0.1, 0.12, 0.15)),
+        "DI1": record("Discrete", ("0.1 0.3 0.6 1.0 1.5",) * 4,
+                      ("0.05 0.4 0.8 0.95 1.0", "0.02 0.25 0.6 0.85 0.97", "0.0 0.1 0.35 0.6 0.85", "0.0 0.05 0.15 0.4 0.7")),
+        "PO1": record("Polynomial", (None,) * 4, (None,) * 4, "0.6 * PGA ^ 1.2 * D ^ 0.1"),
+    }
+    mix = {"LN1": 0.3, "LN2": 0.2, "LN3": 0.1, "NO1": 0.1, "NO2": 0.1, "DI1": 0.1, "PO1": 0.08, "MISSING": 0.02}
+    return fdDict, mix
+
+# --------------------------------------------------------------------
+# Returns the synthetic assets as a dictionary of arrays, one entry per asset
+# --------------------------------------------------------------------
+def synthetic_assets(random, rowCount, mix):
+    fragNos = np.array(list(mix.keys()), dtype = object)
+    return {
+        "lat": random.uniform(LAT_RANGE[0], LAT_RANGE[1], rowCount),
+        "long": random.uniform(LONG_RANGE[0], LONG_RANGE[1], rowCount),
+        "fragNos": fragNos[random.choice(len(fragNos), rowCount, p = list(mix.values()))].tolist(),
+        "IM": random.lognormal(np.log(0.4), 0.6, rowCount),
+        "D": np.where(random.random(rowCount) < 0.5, random.choice([4.0, 6.0, 8.0, 12.0, 24.0], rowCount), np.nan),
+        "classes": [ASSET_CLASSES[position] for position in random.integers(0, len(ASSET_CLASSES), rowCount).tolist()],
+    }
+
+# --------------------------------------------------------------------
+# Returns a PGAGrid (see GroundMotion.py) of stationCount randomly placed stations
+# --------------------------------------------------------------------
+def synthetic_pga_grid(random, stationCount):
+    lat = random.uniform(LAT_RANGE[0], LAT_RANGE[1], stationCount)
+    long = random.uniform(LONG_RANGE[0], LONG_RANGE[1], stationCount)
+    values = {}
+    for position, scenario in enumerate(SCENARIO_NAMES):
+        values[scenario] = (random.lognormal(np.log(0.2 + 0.1 * position), 0.5, stationCount)).astype(np.float32)
+    return PGAGrid(lat, long, values)
+
+# --------------------------------------------------------------------
+# Returns a GeoPackage geometry (little-endian, no envelope, WGS 84) of a line through the given (long, lat) vertices
+# --------------------------------------------------------------------
+def geopackage_line(vertices):
+    vertices = np.asarray(vertices, dtype = "<f8")
+    return b"GP" + struct.pack("<BBi", 0, 1, 4326) + struct.pack("<BII", 1, 2, vertices.shape[0]) + vertices.tobytes()
+
+# --------------------------------------------------------------------
+# Creates the GeoPackage tables of the backend (only the columns the tools use)
+# --------------------------------------------------------------------
+def create_geopackage(connection):
+    connection.execute("CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT, srs_id INTEGER PRIMARY KEY, organization TEXT, "
+                       "organization_coordsys_id INTEGER, definition TEXT, description TEXT)")
+    connection.execute("INSERT INTO gpkg_spatial_ref_sys VALUES ('WGS 84', 4326, 'EPSG', 4326, 'undefined', NULL)")
+    connection.execute("CREATE TABLE gpkg_contents (table_name TEXT PRIMARY KEY, data_type TEXT, identifier TEXT, "
+                       "description TEXT DEFAULT '', last_change TEXT, min_x REAL, min_y REAL, max_x REAL, max_y REAL, srs_id INTEGER)")
+    connection.execute("CREATE TABLE gpkg_geometry_columns (table_name TEXT, column_name TEXT, geometry_type_name TEXT, "
+                       "srs_id INTEGER, z INTEGER, m INTEGER)")
+
+# --------------------------------------------------------------------
+# Writes the synthetic tables to a new GeoPackage:
+#   Assets    - the assets (see synthetic_assets) with an AssetID and empty Owner and Year fields
+#   AssetData - the Owner and Year of every AssetID, in random order
+#   Roads     - a grid of road lines with about edgeCount edges
+# Returns the bridges (lat, long) on the roads: one on every hundredth road, at its middle.
+# --------------------------------------------------------------------
+def write_tables(path, random, assets, edgeCount):
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        create_geopackage(connection)
+        rowCount = len(assets["fragNos"])
+
+        connection.execute("CREATE TABLE Assets (OBJECTID INTEGER PRIMARY KEY, AssetID INTEGER, Frag_no TEXT, Class TEXT, "
+                           "LONG_CALC REAL, LAT_CALC REAL, IM REAL, Diameter REAL, Owner TEXT, Year INTEGER)")
+        connection.executemany("INSERT INTO Assets VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, NULL, NULL)", zip(
+            range(1, rowCount + 1), assets["fragNos"], assets["classes"], assets["long"].tolist(), assets["lat"].tolist(),
+            assets["IM"].tolist(), [None if np.isnan(diameter) else diameter for diameter in assets["D"].tolist()]))
+
+        connection.execute("CREATE TABLE AssetData (OBJECTID INTEGER PRIMARY KEY, AssetID INTEGER, Owner TEXT, Year INTEGER)")
+        assetIDs = random.permutation(rowCount) + 1
+        connection.executemany("INSERT INTO AssetData VALUES (NULL, ?, ?, ?)", zip(
+            assetIDs.tolist(), ["Owner{}".format(owner) for owner in random.integers(0, 500, rowCount).tolist()],
+            random.integers(1900, 2020, rowCount).tolist()))
+
+        # Grid of side x side junctions: every junction is joined to its east and north neighbors
+        side = max(3, int(np.sqrt(edgeCount / 2)) + 1)
+        rows, columns = np.meshgrid(np.arange(side), np.arange(side), indexing = "ij")
+        starts = np.column_stack([rows.ravel(), columns.ravel()])
+        east = starts[starts[:, 1] < side - 1]
+        north = starts[starts[:, 0] < side - 1]
+        ends = np.concatenate([east + [0, 1], north + [1, 0]])
+        starts = np.concatenate([east, north])
+        origin = np.array([LONG_RANGE[0], LAT_RANGE[0]])
+        startPoints = origin + starts[:, ::-1] * ROAD_SPACING
+        endPoints = origin + ends[:, ::-1] * ROAD_SPACING
+
+        roadCount = starts.shape[0]
+        classes = [ROAD_CLASSES[position] for position in random.integers(0, len(ROAD_CLASSES), roadCount).tolist()]
+        speeds = random.choice(["25", "35 mph", "45 mph", "55 mph", "", "90 km/h"], roadCount).tolist()
+        oneway = np.where(random.random(roadCount) < 0.05, "yes", "no").tolist()
+
+        connection.execute("CREATE TABLE Roads (fid INTEGER PRIMARY KEY, geom BLOB, highway TEXT, maxspeed TEXT, oneway TEXT)")
+        connection.executemany("INSERT INTO Roads VALUES (NULL, ?, ?, ?, ?)", (
+            (geopackage_line([start, (start + end) / 2, end]), roadClass, speed or None, direction)
+            for start, end, roadClass, speed, direction in zip(startPoints, endPoints, classes, speeds, oneway)))
+        maxPoint = origin + (side - 1) * ROAD_SPACING
+        connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) "
+                           "VALUES ('Roads', 'features', 'Roads', ?, ?, ?, ?, 4326)", tuple(origin) + tuple(maxPoint))
+        connection.execute("INSERT INTO gpkg_geometry_columns VALUES ('Roads', 'geom', 'LINESTRING', 4326, 0, 0)")
+        connection.commit()
+    finally:
+        connection.close()
+
+    bridges = np.arange(0, roadCount, 100)
+    middles = (startPoints[bridges] + endPoints[bridges]) / 2
+    return middles[:, 1], middles[:, 0], maxPoint
+
+# --------------------------------------------------------------------
+# Generates every synthetic data set of a scale in folder. Returns a dictionary of the data.
+# --------------------------------------------------------------------
+def generate_data(folder, rowCount, seed = 0):
+    random = np.random.default_rng(seed)
+    fdDict, mix = synthetic_fragility_database()
+    assets = synthetic_assets(random, rowCount, mix)
+    pgaGrid = synthetic_pga_grid(random, rowCount)
+
+    databasePath = os.path.join(folder, "Synthetic{}.gpkg".format(rowCount))
+    bridgeLat, bridgeLong, maxPoint = write_tables(databasePath, random, assets, rowCount)
+
+    # Incidents and facilities anywhere on the road grid
+    def locations(count):
+        return (random.uniform(LAT_RANGE[0], maxPoint[1], count), random.uniform(LONG_RANGE[0], maxPoint[0], count))
+
+    return {
+        "folder": folder,
+        "rowCount": rowCount,
+        "databasePath": databasePath,
+        "networkPath": os.path.join(folder, "Synthetic{}.network".format(rowCount)),
+        "partitionPath": os.path.join(folder, "Partitions{}.gpkg".format(rowCount)),
+        "curves": load_fragility_curves(fdDict),
+        "assets": assets,
+        "pgaGrid": pgaGrid,
+        "bridges": (bridgeLat, bridgeLong),
+        "incidents": locations(INCIDENT_COUNT),
+        "facilities": locations(FACILITY_COUNT),
+    }
+
+# ********************************************************************
+# Stages
+# ********************************************************************
+# Every stage takes the data of a scale (see generate_data) and its backend, gets ready, and returns a function that
+# runs the stage once and returns the number of rows it processed. Only that function is timed.
+
+# --------------------------------------------------------------------
+# SQLite backend that keeps the messages of the tools out of the benchmark output
+# --------------------------------------------------------------------
+class QuietBackend(SQLiteBackend):
+    def message(self, text):
+        pass
+
+# The single asset helpers, once per asset
+def damage_states_stage(data, backend):
+    curves = data["curves"]
+    assets = data["assets"]
+
+    def run():
+        for fragNo, IM in zip(assets["fragNos"], assets["IM"].tolist()):
+            curve = curves.get(fragNo)
+            if curve is not None:
+                return_state(damage_states(curves, fragNo, len(curve.stateNames), IM))
+        return len(assets["fragNos"])
+    return run
+
+# The whole layer at once, grouped by fragility number
+def simulate_layer_stage(data, backend):
+    assets = data["assets"]
+
+    def run():
+        simulate_layer(data["curves"], assets["fragNos"], assets["IM"], assets["D"])
+        return len(assets["fragNos"])
+    return run
+
+# The nearest PGA station of every asset, including building the station index
+def pga_assignment_stage(data, backend):
+    pgaGrid = data["pgaGrid"]
+    assets = data["assets"]
+
+    def run():
+        sources = [(list(range(len(SCENARIO_NAMES))), list(SCENARIO_NAMES), pgaGrid, StationIndex(pgaGrid.lat, pgaGrid.long))]
+        scenario_pgas(sources, len(SCENARIO_NAMES), assets["lat"], assets["long"])
+        return assets["lat"].shape[0]
+    return run
+
+# The Data Extractor joins; the joined fields are emptied before every run so every row is written
+def extract_stage(mode):
+    def stage(data, backend):
+        def run():
+            backend.connection.execute("UPDATE Assets SET Owner = NULL, Year = NULL")
+            backend.connection.commit()
+            extract_data(backend, "Assets", "AssetID", "AssetData", "AssetID", ["Owner", "Year"], mode)
+            return data["rowCount"]
+        return run
+    return stage
+
+# The OSM Data Separator's partitioned copy of the roads by their highway field
+def partition_stage(data, backend):
+    def run():
+        return sum(backend.partition("Roads", "highway", data["partitionPath"], "Roads").values())
+    return run
+
+# Exporting the road network
+def network_export_stage(data, backend):
+    def run():
+        export_network(backend, ["Roads"], data["networkPath"])
+        return len(load_network(data["networkPath"]).edgeIDs)
+    return run
+
+# The closest facility of every incident, around the bridges that close their roads (one search per incident, or one
+# reverse search from every facility)
+def routing_stage(search):
+    def stage(data, backend):
+        if not os.path.exists(data["networkPath"]):
+            export_network(backend, ["Roads"], data["networkPath"])
+
+        def run():
+            network = load_network(data["networkPath"])
+            closedArcs = network.barrier_arcs(*data["bridges"])
+            incidentNodes = network.snap(*data["incidents"])
+            facilityNodes = network.snap(*data["facilities"])
+            routes = search(network, incidentNodes, facilityNodes, 1, closedArcs)
+            return routes["incidents"].shape[0]
+        return run
+    return stage
+
+# Stages by name, in the order they run
+STAGES = {
+    "damage_states": damage_states_stage,
+    "simulate_layer": simulate_layer_stage,
+    "pga_assignment": pga_assignment_stage,
+    "extract_memory": extract_stage(MEMORY),
+    "extract_stream": extract_stage(STREAM),
+    "partition": partition_stage,
+    "network_export": network_export_stage,
+    "routing_incident": routing_stage(closest_facilities),
+    "routing_facility": routing_stage(reverse_closest_facilities),
+}
+
+# ********************************************************************
+# Timing
+# ********************************************************************
+# --------------------------------------------------------------------
+# Runs a stage repeats times. Returns the fastest run as {"seconds", "cpuSeconds", "rows", "rowsPerSecond"}.
+# --------------------------------------------------------------------
+def time_stage(run, repeats = REPEATS):
+    best = None
+    for _ in range(max(1, repeats)):
+        gc.collect()
+        wallStart = time.perf_counter()
+        cpuStart = time.process_time()
+        rows = run()
+        seconds = time.perf_counter() - wallStart
+        cpuSeconds = time.process_time() - cpuStart
+        if best is None or seconds < best["seconds"]:
+            best = {"seconds": seconds, "cpuSeconds": cpuSeconds, "rows": int(rows),
+                    "rowsPerSecond": rows / seconds if seconds > 0 else None}
+    return best
+
+# --------------------------------------------------------------------
+# Runs the stages at every scale. Returns the results dictionary:
+#   version, created, machine - the results file format, when and where it was run
+#   seed, repeats, scales     - how it was run
+#   stages                    - {"{stage}@{scale}": timing (see time_stage)}
+# --------------------------------------------------------------------
+def run_benchmarks(folder, scales = SCALES, stages = None, repeats = REPEATS, seed = 0, message = print):
+    stages = list(STAGES) if not stages else list(stages)
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                    "processor": platform.processor(), "cpus": os.cpu_count()},
+        "seed": seed,
+        "repeats": repeats,
+        "scales": list(scales),
+        "stages": {},
+    }
+    for scale in scales:
+        message("Generating the synthetic data of {} rows...".format(scale))
+        data = generate_data(folder, scale, seed)
+        backend = QuietBackend(data["databasePath"])
+        try:
+            for stage in stages:
+                timing = time_stage(STAGES[stage](data, backend), repeats)
+                results["stages"]["{}@{}".format(stage, scale)] = timing
+                message("{:<18} {:>8} rows {:>10.4f} s {:>14}".format(stage, scale, timing["seconds"], rows_per_second(timing)))
+        finally:
+            backend.close()
+    return results
+
+# --------------------------------------------------------------------
+# Returns the rows per second of a timing as text
+# --------------------------------------------------------------------
+def rows_per_second(timing):
+    if not timing.get("rowsPerSecond"):
+        return ""
+    return "{:,.0f} rows/s".format(timing["rowsPerSecond"])
+
+# ********************************************************************
+# Baselines
+# ********************************************************************
+# --------------------------------------------------------------------
+# Compares results with a baseline. Returns a list of (stage, baseline seconds, seconds, ratio) tuples, one per stage
+# (of both runs) whose time grew by more than threshold (0.2 = 20% slower).
+# --------------------------------------------------------------------
+def find_regressions(results, baseline, threshold = REGRESSION_THRESHOLD):
+    regressions = []
+    for stage, timing in results["stages"].items():
+        baselineTiming = baseline.get("stages", {}).get(stage)
+        if baselineTiming is None or not baselineTiming.get("seconds"):
+            continue
+        ratio = timing["seconds"] / baselineTiming["seconds"]
+        if ratio > 1 + threshold:
+            regressions.append((stage, baselineTiming["seconds"], timing["seconds"], ratio))
+    return regressions
+
+# --------------------------------------------------------------------
+# Reads a results file. Returns None if it doesn't exist or was written by a different RESULTS_VERSION.
+# --------------------------------------------------------------------
+def read_results(path):
+    try:
+        with open(path) as resultsFile:
+            results = json.load(resultsFile)
+    except (OSError, ValueError):
+        return None
+    return results if results.get("version") == RESULTS_VERSION else None
+
+# --------------------------------------------------------------------
+# Writes a results file
+# --------------------------------------------------------------------
+def write_results(path, results):
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok = True)
+    with open(path, "w") as resultsFile:
+        json.dump(results, resultsFile, indent = 2)
+
+# ********************************************************************
+# Main Program
+# ********************************************************************
+# --------------------------------------------------------------------
+# Builds the command line parser
+# --------------------------------------------------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(description = "Times the GADEP stages on synthetic data.")
+    parser.add_argument("--scales", type = int, nargs = "+", default = list(SCALES), help = "number of rows of every scale")
+    parser.add_argument("--stages", nargs = "+", choices = list(STAGES), help = "stages to run (default: every stage)")
+    parser.add_argument("--repeats", type = int, default = REPEATS, help = "runs of every stage; the fastest one is kept")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed of the synthetic data")
+    parser.add_argument("--folder", help = "folder the synthetic data is written to (default: a temporary folder)")
+    parser.add_argument("--output", help = "results file (JSON) of this run")
+    parser.add_argument("--baseline", default = os.path.join(gadepPath, "Projects", "GADEP", "Benchmarks", "Baseline.json"),
+                        help = "results file the run is compared with")
+    parser.add_argument("--update-baseline", action = "store_true", help = "write the results of this run to the baseline")
+    parser.add_argument("--threshold", type = float, default = REGRESSION_THRESHOLD,
+                        help = "slowdown (0.2 = 20%%) past which a stage is flagged as a regression")
+    return parser
+
+# --------------------------------------------------------------------
+# Runs the benchmarks. Returns the number of regressions.
+# --------------------------------------------------------------------
+def main(arguments = None):
+    arguments = build_parser().parse_args(arguments)
+    folder = arguments.folder or tempfile.mkdtemp(prefix = "GADEPBenchmark")
+    os.makedirs(folder, exist_ok = True)
+    try:
+        results = run_benchmarks(folder, arguments.scales, arguments.stages, arguments.repeats, arguments.seed)
+    finally:
+        if not arguments.folder:
+            shutil.rmtree(folder, ignore_errors = True)
+
+    if arguments.output:
+        write_results(arguments.output, results)
+        print("Results written to '{}'.".format(arguments.output))
+
+    regressions = []
+    baseline = read_results(arguments.baseline)
+    if baseline is None:
+        print("No baseline at '{}'.".format(arguments.baseline))
+    else:
+        if baseline.get("seed") != results["seed"]:
+            print("The baseline was run with a different seed; the synthetic data isn't the same.")
+        regressions = find_regressions(results, baseline, arguments.threshold)
+        for stage, baselineSeconds, seconds, ratio in regressions:
+            print("REGRESSION {}: {:.4f} s -> {:.4f} s ({:+.0%})".format(stage, baselineSeconds, seconds, ratio - 1))
+        if not regressions:
+            print("No regressions past {:.0%} compared with '{}'.".format(arguments.threshold, arguments.baseline))
+
+    if arguments.update_baseline:
+        write_results(arguments.baseline, results)
+        print("Baseline written to '{}'.".format(arguments.baseline))
+    return len(regressions)
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,241 @@
+import os           # Import os package to work with directories
+# NumPy holds the barrier sets of every scenario as one boolean matrix
+import numpy as np
+# The side tables written by the Disaster Impact tool
+from Scenarios import scenario_table_path
+# Number of damage levels (None and every damage state)
+from DamageSimulation import LEVELS
+
+# ********************************************************************
+# Bridge Barriers
+# ********************************************************************
+# Turns the Disaster Impact results of the bridges into barrier sets for the route analyses: a (bridges x sets)
+# matrix of travel time factors, applied to the edge every bridge is on. A factor of inf closes the edge, 1 leaves it
+# as it is, and anything in between is a penalty (e.g. a damaged bridge crossed at a lower speed). A set is either
+#   - a scenario: the damage state of every bridge (in "Projects\GADEP\Scenarios\Bridges_results.npz", or the Damage
+#     field for a single scenario run). Bridges at the closure level or worse are closed, the others get the
+#     penalty of their damage level,
+#   - a Monte Carlo realization of a scenario: the damage level of every bridge in that realization of the Disaster
+#     Impact run (from "Projects\GADEP\Scenarios\Bridges_montecarlo.npz"). The realizations are reused, not sampled
+#     again, so bridges that fail together in a realization (the correlated IM values, see DamageSimulation.py) close
+#     their roads together, or
+#   - a closure threshold of a scenario: bridges whose probability of ending at the closure level or worse is at
+#     least the threshold are closed; the others get their expected penalty, weighted by their state probabilities.
+#     The state probabilities come from the Monte Carlo side table; after a run without realizations they're
+#     estimated from the damage state and its EP (see state_probabilities).
+#
+# Damage levels are numbered like in DamageSimulation.py (0 = None, 1 = Slight, ...). The default closure level of 1
+# closes every bridge rated Slight or worse, like the Disaster Route Analysis tool, and the default threshold of 0.5
+# closes the same bridges: the damage state of a bridge is the highest state with an EP of at least 0.5.
+
+# Damage level of the damage state names of the bridge fragility curves.
+# Other (non-empty) state names count as level 1; assets without results ("") are never closed.
+DAMAGE_LEVELS = {"None": 0, "Slight": 1, "Moderate": 2, "Extensive": 3, "Complete": 4}
+CLOSURE_LEVEL = 1
+
+# Default probability of closure at which a bridge is closed
+CLOSURE_PROBABILITY = 0.5
+
+# Default travel time factor of a bridge in every damage level that doesn't close it (one per level, see LEVELS):
+# slight damage slows the traffic down, moderate damage or worse leaves a single lane open
+PENALTY_FACTORS = (1.0, 1.5, 3.0, 6.0, 12.0, 12.0)
+
+# --------------------------------------------------------------------
+# Returns the damage level of an array of damage state names (-1 for no result)
+# --------------------------------------------------------------------
+def damage_levels(damage):
+    damage = np.asarray(damage, dtype = str)
+    levels = np.ones(damage.shape, dtype = np.int64)
+    levels[damage == ""] = -1
+    for name, level in DAMAGE_LEVELS.items():
+        levels[damage == name] = level
+    return levels
+
+# --------------------------------------------------------------------
+# Returns the rows of a side table holding the given object IDs (and whether each object ID was found)
+# --------------------------------------------------------------------
+def table_rows(tableObjectIDs, objectIDs):
+    objectIDs = np.asarray(objectIDs, dtype = np.int64)
+    if tableObjectIDs.shape[0] == 0:
+        return np.zeros(objectIDs.shape[0], dtype = np.int64), np.zeros(objectIDs.shape[0], dtype = bool)
+    order = np.argsort(tableObjectIDs, kind = "stable")
+    found = np.minimum(np.searchsorted(tableObjectIDs[order], objectIDs), order.shape[0] - 1)
+    return order[found], tableObjectIDs[order][found] == objectIDs
+
+# --------------------------------------------------------------------
+# Returns the penalty factors of every damage level from a shorter list (e.g. from the command line):
+# the last factor is repeated for the remaining levels
+# --------------------------------------------------------------------
+def penalty_factors(values):
+    values = [float(value) for value in values] or [1.0]
+    return tuple(values[:LEVELS] + values[-1:] * (LEVELS - len(values)))
+
+# --------------------------------------------------------------------
+# Returns the travel time factors of a matrix of damage levels: inf at the closure level or worse,
+# the penalty factor of the level below it, and 1 for no result (-1)
+# --------------------------------------------------------------------
+def level_factors(levels, closureLevel = CLOSURE_LEVEL, factors = PENALTY_FACTORS):
+    levels = np.asarray(levels, dtype = np.int64)
+    factors = np.asarray(factors, dtype = np.float32)
+    return np.where(levels >= closureLevel, np.float32(np.inf), np.where(levels >= 0, factors[np.maximum(levels, 0)], np.float32(1)))
+
+# --------------------------------------------------------------------
+# Returns the damage levels of the bridges in every scenario: a (bridges x scenarios) matrix (-1 for no result).
+# Parameters:
+#   backend       - storage backend; single scenario results are read from the Damage field of the bridges
+#   projectPath   - project folder holding the results side table
+#   bridges       - the bridges table, and objectIDs its object IDs (in the order of the rows of the matrix)
+#   scenarioNames - the scenarios (must all be in the results side table, unless there is only one)
+# With withEP, the EP of every damage state is returned as well: (levels, eps)
+# --------------------------------------------------------------------
+def scenario_levels(backend, projectPath, bridges, objectIDs, scenarioNames, withEP = False):
+    objectIDs = np.asarray(objectIDs, dtype = np.int64)
+    levels = np.full((objectIDs.shape[0], len(scenarioNames)), -1, dtype = np.int64)
+    eps = np.full(levels.shape, np.nan)
+
+    path = scenario_table_path(projectPath, backend.table_name(bridges), results = True)
+    tableScenarios = []
+    if os.path.exists(path):
+        with np.load(path, allow_pickle = False) as table:
+            tableObjectIDs, tableScenarios = table["objectIDs"], table["scenarios"].tolist()
+            tableDamage, tableEP = table["damage"], table["ep"]
+        rows, matched = table_rows(tableObjectIDs, objectIDs)
+
+    for column, scenarioName in enumerate(scenarioNames):
+        if scenarioName in tableScenarios:
+            tableColumn = tableScenarios.index(scenarioName)
+            levels[matched, column] = damage_levels(tableDamage[rows[matched], tableColumn])
+            eps[matched, column] = tableEP[rows[matched], tableColumn]
+        elif len(scenarioNames) == 1:
+            # A single scenario run writes its results to the attribute table
+            results = {row[0]: row[1:] for row in backend.read_rows(bridges, ["OID@", "Damage", "EP"])}
+            results = [results.get(objectID, (None, None)) for objectID in objectIDs.tolist()]
+            levels[:, column] = damage_levels(["" if state is None else state for state, _ in results])
+            eps[:, column] = [np.nan if ep is None else ep for _, ep in results]
+        else:
+            raise ValueError("No Disaster Impact results of scenario '{}' for '{}'; run the Disaster Impact tool with "
+                             "every scenario first".format(scenarioName, backend.table_name(bridges)))
+    return (levels, eps) if withEP else levels
+
+# --------------------------------------------------------------------
+# Returns the barrier sets of scenarios: (set names, (bridges x scenarios) travel time factors).
+# The parameters are the same as scenario_levels, plus the closure level and penalty factors (see level_factors).
+# --------------------------------------------------------------------
+def scenario_factors(backend, projectPath, bridges, objectIDs, scenarioNames, closureLevel = CLOSURE_LEVEL, factors = PENALTY_FACTORS):
+    levels = scenario_levels(backend, projectPath, bridges, objectIDs, scenarioNames)
+    return [str(name) for name in scenarioNames], level_factors(levels, closureLevel, factors)
+
+# --------------------------------------------------------------------
+# Reads the state probabilities of the Monte Carlo side table: a (bridges x scenarios x LEVELS) matrix
+# (NaN for bridges that aren't in it), or None if the side table doesn't hold every scenario (or doesn't exist)
+# --------------------------------------------------------------------
+def monte_carlo_probabilities(projectPath, layerName, objectIDs, scenarioNames):
+    path = os.path.join(projectPath, "Scenarios", layerName + "_montecarlo.npz")
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle = False) as table:
+        tableObjectIDs, tableScenarios, stateProbabilities = table["objectIDs"], table["scenarios"].tolist(), table["stateProbabilities"]
+    if any(name not in tableScenarios for name in scenarioNames):
+        return None
+
+    rows, matched = table_rows(tableObjectIDs, objectIDs)
+    columns = [tableScenarios.index(name) for name in scenarioNames]
+    probabilities = np.full((rows.shape[0], len(columns), stateProbabilities.shape[2]), np.nan)
+    probabilities[matched] = stateProbabilities[rows[matched]][:, columns]
+    return probabilities
+
+# --------------------------------------------------------------------
+# Returns the probability of every bridge to end at the closure level or worse: a (bridges x scenarios) matrix
+# taken from the Monte Carlo side table (NaN for bridges that aren't in it)
+# --------------------------------------------------------------------
+def closure_probabilities(projectPath, layerName, objectIDs, scenarioNames, closureLevel = CLOSURE_LEVEL):
+    probabilities = monte_carlo_probabilities(projectPath, layerName, objectIDs, scenarioNames)
+    if probabilities is None:
+        raise ValueError("No Monte Carlo results of scenario(s) {} for '{}'; run the Disaster Impact tool with realizations "
+                         "first".format(", ".join(str(name) for name in scenarioNames), layerName))
+    return probabilities[:, :, closureLevel:].sum(axis = 2)
+
+# --------------------------------------------------------------------
+# Returns the probability of every bridge to end in every damage level: a (bridges x scenarios x LEVELS) matrix.
+# The Monte Carlo side table is used when it holds every scenario. Otherwise the probabilities are estimated from
+# the damage state of every bridge and its EP (the probability of reaching that state): the bridge ends in its damage
+# state with probability EP, and one level lower with probability 1 - EP. Bridges without results are undamaged.
+# The parameters are the same as scenario_levels.
+# --------------------------------------------------------------------
+def state_probabilities(backend, projectPath, bridges, objectIDs, scenarioNames):
+    probabilities = monte_carlo_probabilities(projectPath, backend.table_name(bridges), objectIDs, scenarioNames)
+    if probabilities is None:
+        levels, eps = scenario_levels(backend, projectPath, bridges, objectIDs, scenarioNames, withEP = True)
+        eps = np.where((levels > 0) & np.isfinite(eps), np.clip(eps, 0, 1), 1.0)
+        levels = np.minimum(levels, LEVELS - 1)
+        probabilities = np.zeros(levels.shape + (LEVELS,))
+        rows, columns = np.indices(levels.shape)
+        probabilities[rows, columns, np.maximum(levels, 0)] = eps
+        np.add.at(probabilities, (rows, columns, np.maximum(levels - 1, 0)), 1 - eps)
+    return np.where(np.isnan(probabilities).any(axis = 2, keepdims = True), np.eye(LEVELS)[0], probabilities)
+
+# --------------------------------------------------------------------
+# Returns the travel time factors of closure thresholds: a (bridges x sets) matrix for the (bridges x scenarios x LEVELS)
+# state probabilities of the bridges, with one set per scenario and threshold (scenario after scenario).
+# A bridge is closed (inf) if its probability of ending at the closure level or worse is at least the threshold;
+# otherwise it gets its expected penalty, every penalty factor weighted by the probability of its damage level.
+# --------------------------------------------------------------------
+def threshold_factors(probabilities, thresholds, closureLevel = CLOSURE_LEVEL, factors = PENALTY_FACTORS):
+    closure = probabilities[:, :, closureLevel:].sum(axis = 2)
+    expected = (probabilities * np.asarray(factors, dtype = float)[:probabilities.shape[2]]).sum(axis = 2)
+    thresholds = np.asarray(thresholds, dtype = float)
+    closed = closure[:, :, None] >= thresholds[None, None, :] - 1e-9
+    return np.where(closed, np.inf, expected[:, :, None]).reshape(probabilities.shape[0], -1).astype(np.float32)
+
+# --------------------------------------------------------------------
+# Returns the damage levels of Monte Carlo realizations: (set names, (bridges x (scenarios * realizations)) levels).
+# The sets of a scenario are named "{scenario}#{realization}" and follow each other. They are the first realizations
+# of the Disaster Impact run, which must have used the same seed and at least as many realizations.
+# Bridges that aren't in the Monte Carlo side table (or have no results) get -1 and are never closed.
+# --------------------------------------------------------------------
+def realization_levels(projectPath, layerName, objectIDs, scenarioNames, realizations, seed = 0):
+    path = os.path.join(projectPath, "Scenarios", layerName + "_montecarlo.npz")
+    missing = ValueError("No Monte Carlo results of scenario(s) {} for '{}'; run the Disaster Impact tool with {} realizations "
+                         "and seed {} first".format(", ".join(str(name) for name in scenarioNames), layerName, realizations, seed))
+    if not os.path.exists(path):
+        raise missing
+    with np.load(path, allow_pickle = False) as table:
+        if "realizationLevels" not in table.files:
+            raise missing
+        tableObjectIDs, tableScenarios = table["objectIDs"], table["scenarios"].tolist()
+        tableSeed, tableLevels = int(table["seed"]), table["realizationLevels"]
+    if any(name not in tableScenarios for name in scenarioNames) or tableSeed != seed or tableLevels.shape[2] < realizations:
+        raise missing
+
+    rows, matched = table_rows(tableObjectIDs, objectIDs)
+    names = []
+    levels = np.full((rows.shape[0], len(scenarioNames) * realizations), -1, dtype = np.int8)
+    for column, scenarioName in enumerate(scenarioNames):
+        tableColumn = tableScenarios.index(scenarioName)
+        levels[matched, column * realizations:(column + 1) * realizations] = tableLevels[rows[matched], tableColumn, :realizations]
+        names.extend("{}#{}".format(scenarioName, realization) for realization in range(realizations))
+    return names, levels
+
+# --------------------------------------------------------------------
+# Returns the barrier sets of Monte Carlo realizations: (set names, (bridges x (scenarios * realizations)) travel time
+# factors). The parameters are the same as realization_levels, plus the closure level and penalty factors.
+# --------------------------------------------------------------------
+def realization_factors(projectPath, layerName, objectIDs, scenarioNames, realizations, seed = 0,
+                        closureLevel = CLOSURE_LEVEL, factors = PENALTY_FACTORS):
+    names, levels = realization_levels(projectPath, layerName, objectIDs, scenarioNames, realizations, seed)
+    return names, level_factors(levels, closureLevel, factors)
+
+# --------------------------------------------------------------------
+# Returns the travel time factor of every bridge in one scenario: a dictionary {object ID: factor} for a route analysis
+# (see RoadNetwork.solve_routes). Without a threshold the damage states decide (see scenario_factors), with a threshold
+# the state probabilities (see threshold_factors).
+# --------------------------------------------------------------------
+def barrier_factors(backend, projectPath, bridges, scenarioName, threshold = None, closureLevel = CLOSURE_LEVEL,
+                    factors = PENALTY_FACTORS, where = None):
+    objectIDs = np.array([row[0] for row in backend.read_rows(bridges, ["OID@"], where)], dtype = np.int64)
+    if threshold is None:
+        bridgeFactors = scenario_factors(backend, projectPath, bridges, objectIDs, [scenarioName], closureLevel, factors)[1]
+    else:
+        probabilities = state_probabilities(backend, projectPath, bridges, objectIDs, [scenarioName])
+        bridgeFactors = threshold_factors(probabilities, [threshold], closureLevel, factors)
+    return dict(zip(objectIDs.tolist(), bridgeFactors[:, 0].tolist()))
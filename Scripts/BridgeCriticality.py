@@ -0,0 +1,270 @@
+# NumPy holds the shortest path forest of the whole network
+import numpy as np
+# scipy's Dijkstra runs in compiled code
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+# The road network and the reading of point tables
+from RoadNetwork import load_network, read_locations
+# Process pools
+from Parallel import chunk_ranges, process_pool, worker_count
+# Stage timers of a traced run
+from Instrumentation import stage
+
+# ********************************************************************
+# Bridge Criticality
+# ********************************************************************
+# Ranks the bridges by how much the incidents (e.g. schools) suffer when that bridge alone fails:
+#   Extra_Minutes    - total increase of the travel time from the incidents to their closest facility (e.g. hospital),
+#                      over the incidents that can still reach a facility
+#   Lost_Incidents   - number of incidents that can't reach any facility anymore
+#   Criticality_Rank - 1 for the most critical bridge: the most lost incidents, then the most extra minutes
+# Bridges that are already closed (the barriers, e.g. the damaged bridges of a Disaster Impact run) stay closed
+# in every evaluation, so the ranking is of the bridges still standing after the earthquake.
+#
+# Removing a bridge only closes the edge it is on (see RoadNetwork.barrier_arcs), so no full solve is needed per bridge:
+#   1. One reverse search from every facility (see RoadNetwork.reverse_closest_facilities) gives the travel time of
+#      every junction to its closest facility and the shortest path forest: every junction's next junction on the way.
+#   2. A bridge whose edge is on no incident's path changes nothing: those bridges are done without any search.
+#   3. Otherwise, only the junctions whose path uses the edge (the subtree of the forest below it) can change.
+#      Every other junction keeps its travel time, so the subtree is solved alone: each of its junctions starts with
+#      its best travel time through a neighbor outside the subtree, and a Dijkstra search over the subtree finishes it.
+# The bridges are evaluated in chunks, in parallel when there is more than one worker.
+
+# Fields the results are written to, in the Bridges layer
+CRITICALITY_FIELDS = {
+    "Extra_Minutes": ("DOUBLE", "Extra Minutes"),
+    "Lost_Incidents": ("LONG", "Lost Incidents"),
+    "Criticality_Rank": ("LONG", "Criticality Rank"),
+}
+
+# Number of distinct bridge edges evaluated by one task
+EDGES_PER_TASK = 200
+
+# Network and baseline of a worker process (set up once per worker by init_worker)
+workerNetwork = None
+workerBaseline = None
+
+# --------------------------------------------------------------------
+# Worker process initializer. Every worker opens the exported network itself (memory-mapped).
+# --------------------------------------------------------------------
+def init_worker(networkPath, baseline):
+    global workerNetwork, workerBaseline
+    workerNetwork = load_network(networkPath)
+    workerBaseline = baseline
+
+# --------------------------------------------------------------------
+# Returns the junctions (and their arrays) reached from a list of junctions through the CSR arrays (pointers, targets)
+# --------------------------------------------------------------------
+def gather(pointers, nodes):
+    starts = np.asarray(pointers[nodes], dtype = np.int64)
+    counts = np.asarray(pointers[nodes + 1], dtype = np.int64) - starts
+    positions = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts) + np.arange(counts.sum())
+    return positions, np.repeat(nodes, counts)
+
+# --------------------------------------------------------------------
+# Solves the network once with the baseline barriers. Returns a dictionary with:
+#   minutes      - float64 array of the arc travel times (infinite for closed arcs)
+#   distances    - travel time of every junction to its closest facility
+#   treeEdges    - edge of the arc every junction takes towards its closest facility (-1 for none)
+#   childPtr, children - the junctions whose next junction is junction n are children[childPtr[n]:childPtr[n + 1]]
+#   incidentNodes - junction of every located incident
+#   usedEdges    - sorted edges on the path of at least one incident
+# --------------------------------------------------------------------
+def baseline_forest(network, incidentNodes, facilityNodes, closedArcs = None):
+    minutes = np.array(network.minutes, dtype = float)
+    if closedArcs is not None:
+        minutes[closedArcs] = np.inf
+    nodeCount = network.nodeCount
+    indptr = np.asarray(network.indptr)
+    indices = np.asarray(network.indices)
+
+    reverse = network.matrix(closedArcs).T.tocsr()
+    distances, predecessors, _ = dijkstra(reverse, indices = np.unique(facilityNodes[facilityNodes >= 0]), min_only = True,
+                                          return_predecessors = True)
+
+    # The arc of every junction towards its closest facility: the cheapest open arc to its predecessor
+    arcStarts = np.repeat(np.arange(nodeCount), np.diff(indptr))
+    candidates = np.flatnonzero((predecessors[arcStarts] == indices) & np.isfinite(minutes))
+    candidates = candidates[np.lexsort((minutes[candidates], arcStarts[candidates]))]
+    nodes, first = np.unique(arcStarts[candidates], return_index = True)
+    treeEdges = np.full(nodeCount, -1, dtype = np.int64)
+    treeEdges[nodes] = np.asarray(network.arcEdges)[candidates[first]]
+
+    # Children of every junction in the forest
+    hasParent = predecessors >= 0
+    children = np.flatnonzero(hasParent)
+    children = children[np.argsort(predecessors[children], kind = "stable")]
+    childPtr = np.concatenate([[0], np.cumsum(np.bincount(predecessors[hasParent], minlength = nodeCount))]).astype(np.int64)
+
+    # Edges on the path of an incident: follow the forest from every incident junction
+    incidentNodes = incidentNodes[incidentNodes >= 0]
+    used = np.zeros(nodeCount, dtype = bool)
+    frontier = np.unique(incidentNodes[np.isfinite(distances[incidentNodes])])
+    while frontier.shape[0]:
+        used[frontier] = True
+        frontier = predecessors[frontier]
+        frontier = np.unique(frontier[frontier >= 0])
+        frontier = frontier[~used[frontier]]
+    usedEdges = np.unique(treeEdges[used & (treeEdges >= 0)])
+
+    return {"minutes": minutes, "distances": distances, "treeEdges": treeEdges, "childPtr": childPtr,
+            "children": children, "incidentNodes": incidentNodes, "usedEdges": usedEdges}
+
+# --------------------------------------------------------------------
+# Returns the new travel times of the junctions of a subtree (sorted array) when its edges are closed.
+# Junctions outside the subtree keep their baseline travel time.
+# --------------------------------------------------------------------
+def solve_subtree(network, baseline, subtree, closedEdges):
+    minutes = baseline["minutes"]
+    distances = baseline["distances"]
+    indices = np.asarray(network.indices)
+
+    # Open arcs leaving the subtree's junctions
+    arcs, starts = gather(network.indptr, subtree)
+    ends = indices[arcs]
+    usable = np.isfinite(minutes[arcs]) & ~np.isin(np.asarray(network.arcEdges)[arcs], closedEdges)
+    arcs, starts, ends = arcs[usable], starts[usable], ends[usable]
+
+    local = np.searchsorted(subtree, ends)
+    inside = (local < subtree.shape[0]) & (subtree[np.minimum(local, subtree.shape[0] - 1)] == ends)
+    startLocal = np.searchsorted(subtree, starts)
+
+    # Arcs to junctions outside the subtree: the junction can start with that neighbor's travel time
+    seeds = np.full(subtree.shape[0], np.inf)
+    np.minimum.at(seeds, startLocal[~inside], distances[ends[~inside]] + minutes[arcs[~inside]])
+
+    # Reverse search over the subtree from an extra junction (number len(subtree)) linked to every seeded junction
+    size = subtree.shape[0] + 1
+    seeded = np.flatnonzero(np.isfinite(seeds))
+    rows = np.concatenate([local[inside], np.full(seeded.shape[0], size - 1)])
+    columns = np.concatenate([startLocal[inside], seeded])
+    weights = np.concatenate([minutes[arcs[inside]], seeds[seeded]])
+    graph = csr_matrix((weights, (rows, columns)), shape = (size, size))
+    # Parallel arcs are summed by the matrix constructor; keep only the cheapest instead
+    if graph.nnz != weights.shape[0]:
+        order = np.lexsort((weights, columns, rows))
+        keep = np.concatenate([[True], (np.diff(rows[order]) != 0) | (np.diff(columns[order]) != 0)])
+        order = order[keep]
+        graph = csr_matrix((weights[order], (rows[order], columns[order])), shape = (size, size))
+    return dijkstra(graph, indices = size - 1)[:-1]
+
+# --------------------------------------------------------------------
+# Evaluates the failure of every edge of a list of edges. Returns (extraMinutes, lostIncidents) arrays, one per edge.
+# network and baseline are None inside a worker process, which uses its own.
+# --------------------------------------------------------------------
+def edge_impacts(edges, network = None, baseline = None):
+    network = workerNetwork if network is None else network
+    baseline = workerBaseline if baseline is None else baseline
+    edges = np.asarray(edges, dtype = np.int64)
+    extraMinutes = np.zeros(edges.shape[0])
+    lostIncidents = np.zeros(edges.shape[0], dtype = np.int64)
+
+    distances = baseline["distances"]
+    incidentNodes = baseline["incidentNodes"]
+    for position, edge in enumerate(edges.tolist()):
+        # Edges on no incident's path change nothing
+        found = np.searchsorted(baseline["usedEdges"], edge)
+        if found >= baseline["usedEdges"].shape[0] or baseline["usedEdges"][found] != edge:
+            continue
+
+        # The junctions whose path takes the edge, and everything below them in the forest
+        roots = np.flatnonzero(baseline["treeEdges"] == edge)
+        subtree = [roots]
+        frontier = roots
+        while frontier.shape[0]:
+            childPositions, _ = gather(baseline["childPtr"], frontier)
+            frontier = baseline["children"][childPositions]
+            subtree.append(frontier)
+        subtree = np.unique(np.concatenate(subtree))
+
+        affected = np.isin(incidentNodes, subtree) & np.isfinite(distances[incidentNodes])
+        if not affected.any():
+            continue
+        newDistances = solve_subtree(network, baseline, subtree, [edge])[np.searchsorted(subtree, incidentNodes[affected])]
+        reachable = np.isfinite(newDistances)
+        extraMinutes[position] = float((newDistances[reachable] - distances[incidentNodes[affected]][reachable]).sum())
+        lostIncidents[position] = int((~reachable).sum())
+    return extraMinutes, lostIncidents
+
+# --------------------------------------------------------------------
+# Evaluates the failure of every bridge.
+# Parameters:
+#   network       - RoadNetwork
+#   networkPath   - the network's folder (opened by the worker processes)
+#   incidentNodes, facilityNodes - junctions of the incidents and facilities (see RoadNetwork.snap)
+#   bridgeLat, bridgeLong - coordinates of the bridges
+#   closedArcs    - optional arcs closed in every evaluation (see RoadNetwork.barrier_arcs)
+#   workers       - worker processes (1 = no worker processes, 0 = one per CPU core)
+# Returns (extraMinutes, lostIncidents, ranks) arrays, one per bridge (NaN, -1 and -1 for bridges not on the network)
+# --------------------------------------------------------------------
+def rank_bridges(network, networkPath, incidentNodes, facilityNodes, bridgeLat, bridgeLong, closedArcs = None, workers = 1):
+    incidentNodes = np.asarray(incidentNodes, dtype = np.int64)
+    facilityNodes = np.asarray(facilityNodes, dtype = np.int64)
+    baseline = baseline_forest(network, incidentNodes, facilityNodes, closedArcs)
+
+    # Bridges on the same edge fail the same way, so every edge is evaluated once
+    bridgeEdges = network.nearest_edges(bridgeLat, bridgeLong)
+    edges, bridgePositions = np.unique(bridgeEdges[bridgeEdges >= 0], return_inverse = True)
+    tasks = [edges[start:stop] for start, stop in chunk_ranges(edges.shape[0], EDGES_PER_TASK)]
+
+    if worker_count(workers) > 1 and len(tasks) > 1:
+        with process_pool(workers, init_worker, (networkPath, baseline)) as pool:
+            results = list(pool.map(edge_impacts, tasks))
+    else:
+        results = [edge_impacts(task, network, baseline) for task in tasks]
+    edgeExtraMinutes = np.concatenate([result[0] for result in results]) if results else np.zeros(0)
+    edgeLostIncidents = np.concatenate([result[1] for result in results]) if results else np.zeros(0, dtype = np.int64)
+
+    located = bridgeEdges >= 0
+    extraMinutes = np.full(bridgeEdges.shape[0], np.nan)
+    lostIncidents = np.full(bridgeEdges.shape[0], -1, dtype = np.int64)
+    extraMinutes[located] = edgeExtraMinutes[bridgePositions.ravel()]
+    lostIncidents[located] = edgeLostIncidents[bridgePositions.ravel()]
+
+    # Rank: most lost incidents first, then most extra minutes
+    ranks = np.full(bridgeEdges.shape[0], -1, dtype = np.int64)
+    order = np.flatnonzero(located)
+    order = order[np.lexsort((-extraMinutes[order], -lostIncidents[order]))]
+    ranks[order] = np.arange(1, order.shape[0] + 1)
+    return extraMinutes, lostIncidents, ranks
+
+# --------------------------------------------------------------------
+# Ranks the bridges of a table and writes the results to its criticality fields (which are added if needed).
+# Parameters:
+#   backend    - storage backend (see Backends.py)
+#   network, networkPath - the exported road network and its folder
+#   bridges    - the bridges table (e.g. Bridges)
+#   incidents, facilities - point tables
+#   bridgesWhere  - optional where clause choosing the bridges to rank
+#   barriersWhere - optional where clause choosing the bridges that are closed in every evaluation
+#                   (e.g. the damaged bridges)
+#   incidentsWhere, facilitiesWhere - optional where clauses filtering the incidents and facilities
+#   workers    - worker processes
+# Returns the (written, unchanged) number of rows
+# --------------------------------------------------------------------
+def bridge_criticality(backend, network, networkPath, bridges, incidents, facilities, bridgesWhere = None, barriersWhere = None,
+                       incidentsWhere = None, facilitiesWhere = None, workers = 1):
+    _, incidentLat, incidentLong = read_locations(backend, incidents, incidentsWhere)
+    _, facilityLat, facilityLong = read_locations(backend, facilities, facilitiesWhere)
+    bridgeIDs, bridgeLat, bridgeLong = read_locations(backend, bridges, bridgesWhere)
+
+    closedArcs = None
+    if barriersWhere:
+        _, barrierLat, barrierLong = read_locations(backend, bridges, barriersWhere)
+        closedArcs = network.barrier_arcs(barrierLat, barrierLong)
+        backend.message("{} closed bridges close {} arcs of the network.".format(barrierLat.shape[0], int(closedArcs.sum())))
+
+    with stage("Rank bridges") as rankStage:
+        extraMinutes, lostIncidents, ranks = rank_bridges(network, networkPath, network.snap(incidentLat, incidentLong),
+                                                          network.snap(facilityLat, facilityLong), bridgeLat, bridgeLong,
+                                                          closedArcs, workers)
+        rankStage.rows = bridgeIDs.shape[0]
+
+    results = {
+        int(objectID): (None, None, None) if rank < 0 else (round(float(minutes), 4), int(lost), int(rank))
+        for objectID, minutes, lost, rank in zip(bridgeIDs.tolist(), extraMinutes, lostIncidents.tolist(), ranks.tolist())
+    }
+    # Only the fields the bridges don't have yet are added
+    backend.add_fields(bridges, CRITICALITY_FIELDS)
+    with stage("Write results"), backend.result_writer() as resultWriter:
+        return resultWriter.write(bridges, list(CRITICALITY_FIELDS.keys()), results)
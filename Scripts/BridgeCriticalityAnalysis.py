@@ -0,0 +1,84 @@
+import os           # Import os package to be able to get the current directory
+# The bridge ranking (see BridgeCriticality.py)
+from BridgeCriticality import bridge_criticality
+# The native road network
+from RoadNetwork import open_network
+# Where the bridges, incidents and facilities are read from
+from Backends import ArcpyBackend
+# Optional tool parameters
+from DisasterImpact import optional_parameter
+# The timings of the run (and its optional trace and profile files)
+from Instrumentation import tracing
+
+# ********************************************************************
+# Main Program
+# ********************************************************************
+# --------------------------------------------------------------------
+# Runs the tool in ArcGIS Pro.
+# Ranks the bridges of "Infrastructures.gdb\Bridges" by the extra travel time (and lost connectivity) of the
+# incidents to their closest facility when that bridge alone fails, and writes the results to the Extra_Minutes,
+# Lost_Incidents and Criticality_Rank fields of the bridges.
+# --------------------------------------------------------------------
+def main():
+    import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
+
+    # --------------------------------------------------------------------
+    # Setting directories
+    # --------------------------------------------------------------------
+    # Get the current directory of the script; it should look something like the following:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Scripts
+    scriptsPath = os.getcwd()
+
+    # The main project path: {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Projects\GADEP
+    projectPath = os.path.join(os.path.dirname(scriptsPath), "Projects", "GADEP")
+
+    # Path to "Infrastructures.gdb" and its bridges
+    bridges = os.path.join(projectPath, "Infrastructures.gdb", "Bridges")
+
+    # The analysis network, and the folder its export is kept in
+    network = os.path.join(projectPath, "TransportationNetwork.gdb", "OregonNetwork", "OregonNetworkDataset")
+    networkPath = os.path.join(projectPath, "OregonNetwork.network")
+
+    # --------------------------------------------------------------------
+    # Initializing variables
+    # --------------------------------------------------------------------
+    # The incidents and facilities, and the SQL expressions that filter them (e.g. schools and hospitals)
+    incidents = arcpy.GetParameter(0)
+    incidentsWhereClause = arcpy.GetParameterAsText(1)
+    facilities = arcpy.GetParameter(2)
+    facilitiesWhereClause = arcpy.GetParameterAsText(3)
+
+    # The fifth (optional) parameter is the SQL expression of the bridges that are already closed
+    # (e.g. "Damage = 'Extensive' Or Damage = 'Complete'" after a Disaster Impact run); empty = every bridge is open
+    barriersWhereClause = str(optional_parameter(4, "")).strip()
+
+    # The sixth (optional) parameter is the number of worker processes the bridges are evaluated with
+    # (1 = no worker processes, 0 = one per CPU core)
+    workers = int(optional_parameter(5, 1))
+
+    # The seventh (optional) parameter exports the network dataset again (needed after the network dataset was edited)
+    refreshNetwork = bool(optional_parameter(6, False))
+
+    # --------------------------------------------------------------------
+    # Rank the bridges
+    # --------------------------------------------------------------------
+    backend = ArcpyBackend()
+    edgeTables = [os.path.join(os.path.dirname(network), source.name) for source in arcpy.Describe(network).edgeSources]
+    roadNetwork = open_network(backend, networkPath, edgeTables, refreshNetwork)
+
+    # Status message
+    arcpy.AddMessage("Ranking the bridges...")
+
+    written, unchanged = bridge_criticality(backend, roadNetwork, networkPath, bridges, incidents, facilities,
+                                            barriersWhere = barriersWhereClause or None,
+                                            incidentsWhere = incidentsWhereClause or None,
+                                            facilitiesWhere = facilitiesWhereClause or None, workers = workers)
+
+    # Print success message
+    arcpy.AddMessage("BRIDGE CRITICALITY SUCCESSFUL! {} bridges updated, {} unchanged.".format(written, unchanged))
+
+# The tool only runs when the script is started by ArcGIS Pro, not when it's imported (e.g. by worker processes)
+if __name__ == "__main__":
+    # The timings of the run are printed when it ends (see Instrumentation.py)
+    with tracing(ArcpyBackend().message):
+        main()
@@ -0,0 +1,233 @@
+import argparse     # Reads the command line arguments
+import os           # Import os package to work with directories
+# Every tool's logic, as importable functions
+from AddFields import add_fields
+from BatchRouting import scenario_routing
+from BridgeBarriers import DAMAGE_LEVELS, PENALTY_FACTORS, barrier_factors, penalty_factors
+from BridgeCriticality import bridge_criticality
+from DataExtractor import JOIN_MODES, MEMORY, extract_data
+from DisasterImpact import run_disaster_impact
+from OSMDataSeparator import separate_layer
+from PreparationForDisasterImpact import assign_pga, preparation_fields
+from SchemaMigration import migrate_schema
+from Scenarios import load_scenarios, select_scenarios
+from RoadNetwork import AUTO, SEARCHES, open_network, solve_routes, write_route_table
+# The storage backends
+from Backends import open_backend
+# The evaluation modes of the fragility curves
+from FragilityTables import EXACT, MODES
+# Stage timings, trace and profile files of a run
+from Instrumentation import tracing
+
+# ********************************************************************
+# Command Line Interface
+# ********************************************************************
+# Runs the GADEP tools outside ArcGIS Pro. With a GeoPackage/SQLite workspace (--workspace Infrastructures.gpkg)
+# no arcpy is needed, so scenario batches can run on Linux compute nodes. Any other workspace (e.g. a file geodatabase)
+# is opened with arcpy.
+#
+# Examples:
+#   python CommandLine.py --workspace Infrastructures.gpkg impact Bridges Substations --scenarios "8.1;9.0"
+#   python CommandLine.py --workspace Infrastructures.gpkg prepare Bridges
+#   python CommandLine.py --workspace Infrastructures.gpkg extract Bridges OBJECTID BridgeData OBJECTID Frag_no
+#   python CommandLine.py --workspace Infrastructures.gpkg separate Roads highway Roads.gpkg
+#   python CommandLine.py --workspace Infrastructures.gpkg add-fields Bridges --field Frag_no TEXT
+#   python CommandLine.py --workspace Infrastructures.gpkg route Schools Hospitals Routes.csv --edges Roads --barriers Bridges
+#   python CommandLine.py --workspace Infrastructures.gpkg route Schools Hospitals Routes.csv --barriers Bridges --scenario 9.0 --closure-probability 0.8
+#   python CommandLine.py --workspace Infrastructures.gpkg criticality Bridges Schools Hospitals --workers 0
+#   python CommandLine.py --workspace Infrastructures.gpkg batch-route Bridges Schools Hospitals --scenarios ALL --realizations 100
+#   python CommandLine.py --workspace Infrastructures.gpkg batch-route Bridges Schools Hospitals --thresholds 0.2 0.5 0.8
+#   python CommandLine.py --workspace Infrastructures.gpkg --trace Impact.json --profile Impact.prof impact Bridges
+#
+# The timings of every stage are printed when a tool ends; --trace and --profile also write them to a file (see
+# Instrumentation.py).
+
+# Bridges with any damage close the road they are on (the filter of the Disaster Route Analysis tool)
+DAMAGED_BRIDGES = "Damage IN ('Slight', 'Moderate', 'Extensive', 'Complete')"
+
+# The GADEP folder (the parent of this Scripts folder)
+gadepPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# --------------------------------------------------------------------
+# Builds the command line parser
+# --------------------------------------------------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(description = "Runs the GADEP tools without ArcGIS Pro.")
+    parser.add_argument("--workspace", help = "GeoPackage/SQLite database (or, with arcpy, geodatabase) holding the tables")
+    parser.add_argument("--project", default = os.path.join(gadepPath, "Projects", "GADEP"),
+                        help = "project folder (fragility database cache, scenario side tables)")
+    parser.add_argument("--pga-values", default = os.path.join(gadepPath, "PGA Values"),
+                        help = "folder holding the PGA source files and the scenario registry")
+    parser.add_argument("--trace", help = "file the stage timings are written to (*.json: Chrome trace format, other: JSON lines)")
+    parser.add_argument("--profile", help = "file the cProfile statistics of the run are written to")
+    tools = parser.add_subparsers(dest = "tool", required = True)
+
+    # Disaster Impact
+    impact = tools.add_parser("impact", help = "calculate the damage states of the assets")
+    impact.add_argument("assets", nargs = "+", help = "asset tables (e.g. Bridges)")
+    impact.add_argument("--scenarios", default = "9.0", help = "scenario name(s) separated by semicolons, or ALL")
+    impact.add_argument("--refresh-cache", action = "store_true", help = "download the fragility database again")
+    impact.add_argument("--offline", action = "store_true", help = "only use the local copy of the fragility database")
+    impact.add_argument("--realizations", type = int, default = 0, help = "Monte Carlo realizations per scenario")
+    impact.add_argument("--seed", type = int, default = 0, help = "Monte Carlo random seed")
+    impact.add_argument("--im-sigma", type = float, default = 0.0, help = "lognormal standard deviation of the IM values")
+    impact.add_argument("--im-correlation", type = float, default = 0.0, help = "correlation of the sampled IM values")
+    impact.add_argument("--output", choices = ["TABLE", "SQLITE"], default = "TABLE", help = "where single scenario results are written")
+    impact.add_argument("--workers", type = int, default = 1, help = "worker processes (0 = one per CPU core)")
+    impact.add_argument("--evaluation", choices = MODES, default = EXACT,
+                        help = "exact curves, lookup tables (max error 1e-5) or memoized exact values")
+    impact.add_argument("--recalculate-all", action = "store_true", help = "calculate every row, not only the changed ones")
+
+    # Preparation For Disaster Impact (the fields and PGA values; the tables need LONG_CALC and LAT_CALC coordinates)
+    prepare = tools.add_parser("prepare", help = "add the fields and PGA values to tables with LONG_CALC/LAT_CALC coordinates")
+    prepare.add_argument("tables", nargs = "+", help = "tables to prepare")
+    prepare.add_argument("--workers", type = int, default = 1, help = "worker processes adding the fields (0 = one per CPU core)")
+
+    # Data Extractor
+    extract = tools.add_parser("extract", help = "copy fields from a join table")
+    extract.add_argument("input_table")
+    extract.add_argument("input_join_field", help = "join field(s), several separated by semicolons (e.g. \"Name;County\")")
+    extract.add_argument("join_table")
+    extract.add_argument("join_field")
+    extract.add_argument("fields", nargs = "+", help = "fields to copy")
+    extract.add_argument("--mode", choices = JOIN_MODES, default = MEMORY,
+                         help = "join table in memory, or a sort-merge join streaming both tables (for very large join tables)")
+
+    # OSM Data Separator
+    separate = tools.add_parser("separate", help = "create one table per unique value of a field")
+    separate.add_argument("table")
+    separate.add_argument("field")
+    separate.add_argument("output", help = "output folder or GeoPackage")
+
+    # Add Fields
+    addFields = tools.add_parser("add-fields", help = "add fields to tables")
+    addFields.add_argument("tables", nargs = "+")
+    addFields.add_argument("--field", nargs = 2, action = "append", required = True, metavar = ("NAME", "TYPE"),
+                           help = "field name and type (TEXT, DOUBLE, LONG, ...); can be given several times")
+    addFields.add_argument("--workers", type = int, default = 1, help = "worker processes (0 = one per CPU core)")
+
+    # Disaster Route Analysis with the native solver (see RoadNetwork.py)
+    route = tools.add_parser("route", help = "find the closest facilities of the incidents, avoiding the damaged bridges")
+    route.add_argument("incidents")
+    route.add_argument("facilities")
+    route.add_argument("output", help = "CSV file the routes are written to")
+    route.add_argument("--network", help = "exported network folder (default: {project}/OregonNetwork.network)")
+    route.add_argument("--edges", nargs = "+", default = [], help = "edge tables the network is exported from if it isn't yet")
+    route.add_argument("--refresh-network", action = "store_true", help = "export the network again")
+    route.add_argument("--facility-count", type = int, default = 1, help = "facilities to find for every incident")
+    route.add_argument("--incidents-where", help = "where clause filtering the incidents")
+    route.add_argument("--facilities-where", help = "where clause filtering the facilities")
+    route.add_argument("--barriers", help = "point table of barriers (e.g. Bridges)")
+    route.add_argument("--barriers-where", help = "where clause selecting the barriers (default: the damaged bridges, "
+                                                  "or every bridge with --scenario)")
+    route.add_argument("--scenario", help = "scenario whose Disaster Impact results of the barriers close or slow down their "
+                                            "edges, instead of closing the edge of every barrier")
+    route.add_argument("--closure-state", choices = list(DAMAGE_LEVELS)[1:], default = "Slight",
+                       help = "lowest damage state that closes a bridge (with --scenario)")
+    route.add_argument("--closure-probability", type = float,
+                       help = "close the bridges whose probability of the closure state (or worse) is at least this; "
+                              "the others get their expected penalty (with --scenario; default: the damage states)")
+    route.add_argument("--penalties", type = float, nargs = "+", default = list(PENALTY_FACTORS),
+                       help = "travel time factor of a bridge in every damage level (None, Slight, ...) that doesn't close it")
+    route.add_argument("--search", choices = SEARCHES, default = AUTO,
+                       help = "one search per incident, or one reverse search from every facility at once")
+
+    # Bridge Criticality
+    criticality = tools.add_parser("criticality", help = "rank the bridges by the travel time lost when each one fails")
+    criticality.add_argument("bridges")
+    criticality.add_argument("incidents")
+    criticality.add_argument("facilities")
+    criticality.add_argument("--network", help = "exported network folder (default: {project}/OregonNetwork.network)")
+    criticality.add_argument("--edges", nargs = "+", default = [], help = "edge tables the network is exported from if it isn't yet")
+    criticality.add_argument("--refresh-network", action = "store_true", help = "export the network again")
+    criticality.add_argument("--bridges-where", help = "where clause choosing the bridges to rank")
+    criticality.add_argument("--barriers-where", help = "where clause of the bridges that are already closed (e.g. damaged)")
+    criticality.add_argument("--incidents-where", help = "where clause filtering the incidents")
+    criticality.add_argument("--facilities-where", help = "where clause filtering the facilities")
+    criticality.add_argument("--workers", type = int, default = 1, help = "worker processes (0 = one per CPU core)")
+
+    # Batch routing of several scenarios (run the impact tool on the bridges with the same scenarios first)
+    batchRoute = tools.add_parser("batch-route", help = "route the incidents in every scenario at once into a routing matrix")
+    batchRoute.add_argument("bridges")
+    batchRoute.add_argument("incidents")
+    batchRoute.add_argument("facilities")
+    batchRoute.add_argument("--scenarios", default = "ALL", help = "scenario name(s) separated by semicolons, or ALL")
+    batchRoute.add_argument("--realizations", type = int, default = 0,
+                            help = "Monte Carlo realizations per scenario (0 = the damage states of every scenario)")
+    batchRoute.add_argument("--seed", type = int, default = 0,
+                            help = "random seed of the realizations (the seed of the impact run of the bridges)")
+    batchRoute.add_argument("--closure-state", choices = list(DAMAGE_LEVELS)[1:], default = "Slight",
+                            help = "lowest damage state that closes a bridge")
+    batchRoute.add_argument("--thresholds", type = float, nargs = "+",
+                            help = "closure probabilities, each solved for every scenario (instead of the damage states)")
+    batchRoute.add_argument("--penalties", type = float, nargs = "+", default = list(PENALTY_FACTORS),
+                            help = "travel time factor of a bridge in every damage level (None, Slight, ...) that doesn't close it")
+    batchRoute.add_argument("--network", help = "exported network folder (default: {project}/OregonNetwork.network)")
+    batchRoute.add_argument("--edges", nargs = "+", default = [], help = "edge tables the network is exported from if it isn't yet")
+    batchRoute.add_argument("--refresh-network", action = "store_true", help = "export the network again")
+    batchRoute.add_argument("--incidents-where", help = "where clause filtering the incidents")
+    batchRoute.add_argument("--facilities-where", help = "where clause filtering the facilities")
+    batchRoute.add_argument("--workers", type = int, default = 1, help = "worker processes (0 = one per CPU core)")
+    batchRoute.add_argument("--output", help = "routing matrix file (default: {project}/Scenarios/{incidents}_routing.npz)")
+    return parser
+
+# --------------------------------------------------------------------
+# Runs the tool chosen on the command line
+# --------------------------------------------------------------------
+def main(arguments = None):
+    arguments = build_parser().parse_args(arguments)
+
+    with open_backend(arguments.workspace) as backend, tracing(backend.message, arguments.trace, arguments.profile):
+        if arguments.tool == "impact":
+            run_disaster_impact(backend, arguments.assets, arguments.scenarios, arguments.project, arguments.pga_values,
+                                arguments.refresh_cache, arguments.offline, arguments.realizations, arguments.seed,
+                                arguments.im_sigma, arguments.im_correlation, arguments.output, arguments.workers,
+                                not arguments.recalculate_all, arguments.evaluation)
+        elif arguments.tool == "prepare":
+            scenarios = load_scenarios(arguments.pga_values)
+            # The fields of every table are added first, in one step (see SchemaMigration.py)
+            migrate_schema(backend, arguments.tables, preparation_fields(scenarios), arguments.workers)
+            for table in arguments.tables:
+                assign_pga(backend, table, backend.table_name(table), arguments.project, arguments.pga_values, scenarios)
+        elif arguments.tool == "extract":
+            written, unchanged = extract_data(backend, arguments.input_table, arguments.input_join_field,
+                                              arguments.join_table, arguments.join_field, arguments.fields, arguments.mode)
+            backend.message("{} DATA EXTRACTION SUCCESSFUL! {} rows updated, {} unchanged.".format(arguments.input_table, written, unchanged))
+        elif arguments.tool == "separate":
+            separate_layer(backend, arguments.table, arguments.field, arguments.output, backend.table_name(arguments.table))
+        elif arguments.tool == "add-fields":
+            add_fields(backend, arguments.tables, {name: (fieldType, name) for name, fieldType in arguments.field}, arguments.workers)
+        elif arguments.tool == "route":
+            networkPath = arguments.network or os.path.join(arguments.project, "OregonNetwork.network")
+            network = open_network(backend, networkPath, arguments.edges, arguments.refresh_network)
+            factors = None
+            barriersWhere = arguments.barriers_where or (None if arguments.scenario else DAMAGED_BRIDGES)
+            if arguments.barriers and arguments.scenario:
+                factors = barrier_factors(backend, arguments.project, arguments.barriers, arguments.scenario,
+                                          arguments.closure_probability, DAMAGE_LEVELS[arguments.closure_state],
+                                          penalty_factors(arguments.penalties), barriersWhere)
+            rows = solve_routes(backend, network, arguments.incidents, arguments.facilities, arguments.barriers,
+                                arguments.facility_count, arguments.incidents_where, arguments.facilities_where,
+                                barriersWhere, arguments.search, factors)
+            write_route_table(arguments.output, rows)
+            backend.message("ROUTE ANALYSIS SUCCESSFUL! {} routes written to '{}'.".format(len(rows), arguments.output))
+        elif arguments.tool == "criticality":
+            networkPath = arguments.network or os.path.join(arguments.project, "OregonNetwork.network")
+            network = open_network(backend, networkPath, arguments.edges, arguments.refresh_network)
+            written, unchanged = bridge_criticality(backend, network, networkPath, arguments.bridges, arguments.incidents,
+                                                    arguments.facilities, arguments.bridges_where, arguments.barriers_where,
+                                                    arguments.incidents_where, arguments.facilities_where, arguments.workers)
+            backend.message("BRIDGE CRITICALITY SUCCESSFUL! {} bridges updated, {} unchanged.".format(written, unchanged))
+        elif arguments.tool == "batch-route":
+            networkPath = arguments.network or os.path.join(arguments.project, "OregonNetwork.network")
+            network = open_network(backend, networkPath, arguments.edges, arguments.refresh_network)
+            scenarioNames = [scenario["name"] for scenario in select_scenarios(load_scenarios(arguments.pga_values), arguments.scenarios)]
+            output = scenario_routing(backend, network, networkPath, arguments.project, arguments.bridges, arguments.incidents,
+                                      arguments.facilities, scenarioNames, arguments.realizations, arguments.seed,
+                                      DAMAGE_LEVELS[arguments.closure_state], arguments.incidents_where,
+                                      arguments.facilities_where, arguments.workers, arguments.output,
+                                      arguments.thresholds, penalty_factors(arguments.penalties))
+            backend.message("BATCH ROUTE ANALYSIS SUCCESSFUL! Routing matrix written to '{}'.".format(output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# NumPy does the sampling for every asset and realization at once
+import numpy as np
+# The fragility curves are evaluated again when the ground motion itself is sampled
+from FragilityEngine import MAX_STATES, load_fragility_curves, simulate_scenarios
+# Helpers to split the work across a pool of worker processes
+from Parallel import chunk_ranges, process_pool, worker_count
+
+# ********************************************************************
+# Monte Carlo Damage Simulation
+# ********************************************************************
+# The Disaster Impact tool normally gives every asset a single damage state: the highest state with an EP >= 0.5.
+# The Monte Carlo mode instead samples many possible outcomes (realizations) of the earthquake:
+#   1. (optional) The IM value of every asset is sampled around its median value with a lognormal variability.
+#      Part of that variability is shared by every asset in the same realization (correlation), the rest is
+#      independent per asset:
+#          ln(IM) = ln(median IM) + sigma * (sqrt(rho) * common + sqrt(1 - rho) * independent)
+#   2. For every asset, a random number u between 0 and 1 is drawn. The asset's damage level is the number of
+#      damage states whose EP is greater than u (0 = no damage, 1 = first damage state, ...).
+# The realizations are split into chunks. Each chunk gets its own random seed derived from the main seed, so the
+# results are the same no matter how many worker processes are used.
+#
+# Damage levels are numbered instead of named because different fragility curves use different state names:
+#   level 0 = None, level 1 = damage state 1, ..., level 5 = damage state 5
+#
+# The damage states of a fragility curve are expected in order, from the least to the most severe (the order of the
+# Damage_state_1 ... Damage_state_5 columns of the fragility database). The EP of a state is the probability of reaching
+# that state or a worse one, so it should be between 0 and 1 and never higher than the EP of the state before it.
+# EP values that aren't (see exceedance_probabilities) are made so before sampling:
+#   - values below 0 or above 1 are clipped to [0, 1]. Polynomial curves (e.g. buried pipelines) give a repair rate
+#     (repairs per unit length) instead of a probability: its clipped value is used as the probability of the first
+#     damage state,
+#   - an EP higher than the EP of the state before it (e.g. lognormal curves that cross at high IM values) is lowered
+#     to that EP.
+# monte_carlo returns the number of assets whose EP values were changed this way, which the Disaster Impact tool reports.
+#
+# The samples are kept as NumPy arrays: the (assets x realizations) damage levels of a chunk are only counted
+# (np.bincount), never turned into damage state names or Python lists.
+
+# Number of damage levels (None + the max number of damage states)
+LEVELS = MAX_STATES + 1
+
+# Max number of (asset x realization) samples held in memory by one chunk
+CHUNK_SAMPLES = 2000000
+
+# Max number of (asset x scenario x realization) damage levels kept in the Monte Carlo side table (one byte each), so the
+# route analyses can reuse the realizations (see BridgeBarriers.py); larger runs only keep the counts
+MAX_KEPT_LEVELS = 500000000
+
+# Fragility curves of a worker process (built once per worker by init_worker)
+workerCurves = None
+
+# --------------------------------------------------------------------
+# Worker process initializer. The fragility database is sent once per worker and parsed there,
+# instead of being sent with every chunk.
+# --------------------------------------------------------------------
+def init_worker(fdDict):
+    global workerCurves
+    workerCurves = load_fragility_curves(fdDict)
+
+# --------------------------------------------------------------------
+# Makes the EP values of every row usable as exceedance probabilities (see above):
+# NaN becomes 0, values are kept between 0 and 1, and the EP of a damage state can't be higher than
+# the EP of the state before it.
+# --------------------------------------------------------------------
+def exceedance_probabilities(epMatrix):
+    epMatrix = np.clip(np.nan_to_num(epMatrix, nan = 0.0), 0.0, 1.0)
+    return np.minimum.accumulate(epMatrix, axis = -1)
+
+# --------------------------------------------------------------------
+# Returns a boolean array, True for the rows of a (rows x MAX_STATES) EP matrix that exceedance_probabilities changes:
+# a value outside [0, 1], or higher than the value of the state before it (NaN padding is ignored)
+# --------------------------------------------------------------------
+def adjusted_rows(epMatrix):
+    with np.errstate(invalid = "ignore"):
+        outside = ((epMatrix < 0) | (epMatrix > 1)).any(axis = -1)
+        increasing = (np.diff(epMatrix, axis = -1) > 0).any(axis = -1)
+    return outside | increasing
+
+# --------------------------------------------------------------------
+# Simulates one chunk of realizations.
+# Parameters:
+#   epMatrix    - (rows x MAX_STATES) EP values; used when the IM values aren't sampled
+#   fragNos, IM, D - fragility numbers, median IM values and pipe diameters; used when sigma > 0
+#   sigma, rho  - lognormal standard deviation of the IM values and the correlation between assets
+#   realizations - number of realizations in this chunk
+#   seed        - numpy SeedSequence of this chunk
+#   known       - boolean array, True for the rows that are counted (a known fragility number and an IM value)
+#   keepLevels  - also return the damage level of every asset in every realization
+#   curves      - fragility curves (None inside a worker process, which uses its own copy)
+# Returns:
+#   assetCounts       - (rows x LEVELS) number of realizations in which each asset ended in each damage level
+#   realizationCounts - (realizations x LEVELS) number of assets in each damage level in each realization
+#   levels            - (rows x realizations) int8 damage levels (-1 for assets that aren't counted), or None
+# --------------------------------------------------------------------
+def simulate_chunk(epMatrix, fragNos, IM, D, sigma, rho, realizations, seed, known, keepLevels = False, curves = None):
+    rng = np.random.default_rng(seed)
+    rowCount = known.shape[0]
+
+    if sigma > 0:
+        # Sample the IM values: one common value per realization, one independent value per asset and realization
+        common = rng.standard_normal(realizations)
+        independent = rng.standard_normal((rowCount, realizations))
+        sampledIM = IM[:, None] * np.exp(sigma * (np.sqrt(rho) * common + np.sqrt(1 - rho) * independent))
+        _, _, sampledEPs = simulate_scenarios(workerCurves if curves is None else curves, fragNos, sampledIM, D, names = False)
+        ep = exceedance_probabilities(sampledEPs)
+    else:
+        ep = exceedance_probabilities(epMatrix)[:, None, :]
+
+    # Damage level = number of damage states whose EP is greater than u
+    u = rng.random((rowCount, realizations))
+    levels = (ep > u[:, :, None]).sum(axis = 2, dtype = np.int64)
+
+    # Every (asset, level) and (realization, level) pair is counted in one np.bincount call.
+    # Assets with an unknown fragility number or no IM value aren't counted.
+    knownLevels = levels[known]
+    assetCounts = np.bincount((np.flatnonzero(known)[:, None] * LEVELS + knownLevels).ravel(),
+                              minlength = rowCount * LEVELS).reshape(rowCount, LEVELS)
+    realizationCounts = np.bincount((np.arange(realizations)[None, :] * LEVELS + knownLevels).ravel(),
+                                    minlength = realizations * LEVELS).reshape(realizations, LEVELS)
+
+    keptLevels = None
+    if keepLevels:
+        keptLevels = levels.astype(np.int8)
+        keptLevels[~known] = -1
+    return assetCounts.astype(np.int32), realizationCounts.astype(np.int32), keptLevels
+
+# --------------------------------------------------------------------
+# Runs the Monte Carlo simulation for one layer and one scenario.
+# Parameters:
+#   fdDict      - the fragility database dictionary (sent to the worker processes)
+#   curves      - the fragility curves built from fdDict
+#   fragNos     - list of fragility numbers, one per row
+#   IM          - array of (median) IM values, one per row
+#   D           - optional array of pipe diameters, one per row
+#   realizations - number of realizations (K)
+#   seed        - main random seed; the same seed always gives the same results
+#   sigma       - lognormal standard deviation of the IM values (0 = IM values aren't sampled)
+#   rho         - correlation of the sampled IM values between assets (0 to 1)
+#   workers     - number of worker processes (0 = one per CPU core, 1 = no worker processes)
+#   keepLevels  - also return the damage level of every asset in every realization
+# Returns a dictionary with:
+#   stateProbabilities - (rows x LEVELS) probability of every asset ending in every damage level
+#   realizationCounts  - (realizations x LEVELS) number of assets in every damage level in every realization
+#   expectedCounts     - (LEVELS) expected number of assets in every damage level
+#   adjustedAssets     - number of assets whose median EP values were clipped or lowered (see exceedance_probabilities)
+#   realizationLevels  - (rows x realizations) int8 damage level of every asset in every realization (-1 for assets
+#                        that aren't counted), or None without keepLevels
+# --------------------------------------------------------------------
+def monte_carlo(fdDict, curves, fragNos, IM, D = None, realizations = 1000, seed = 0, sigma = 0.0, rho = 0.0, workers = 0,
+                keepLevels = False):
+    IM = np.asarray(IM, dtype = float)
+    rowCount = IM.shape[0]
+    if not 0 <= rho <= 1:
+        raise ValueError("The IM correlation must be between 0 and 1.")
+
+    # The median EP values are calculated once; they're all that's needed when the IM values aren't sampled
+    _, _, epMatrix = simulate_scenarios(curves, fragNos, IM.reshape(-1, 1), D, names = False)
+    epMatrix = epMatrix[:, 0, :]
+    known = ~np.isnan(epMatrix[:, 0])
+
+    # The chunk size only depends on the number of rows, so the chunks (and their seeds) are always the same
+    chunks = chunk_ranges(realizations, CHUNK_SAMPLES // max(rowCount, 1))
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    assetCounts = np.zeros((rowCount, LEVELS), dtype = np.int64)
+    realizationCounts = np.zeros((realizations, LEVELS), dtype = np.int32)
+    realizationLevels = np.full((rowCount, realizations), -1, dtype = np.int8) if keepLevels else None
+    chunkArguments = [
+        (epMatrix, fragNos, IM, D, sigma, rho, stop - start, chunkSeed, known, keepLevels)
+        for (start, stop), chunkSeed in zip(chunks, seeds)
+    ]
+
+    if worker_count(workers) == 1 or len(chunks) == 1:
+        results = [simulate_chunk(*arguments, curves = curves) for arguments in chunkArguments]
+    else:
+        with process_pool(workers, init_worker, (fdDict,)) as pool:
+            results = list(pool.map(simulate_chunk, *zip(*chunkArguments)))
+
+    for (start, stop), (chunkAssetCounts, chunkRealizationCounts, chunkLevels) in zip(chunks, results):
+        assetCounts += chunkAssetCounts
+        realizationCounts[start:stop] = chunkRealizationCounts
+        if keepLevels:
+            realizationLevels[:, start:stop] = chunkLevels
+
+    return {
+        "stateProbabilities": assetCounts / max(realizations, 1),
+        "realizationCounts": realizationCounts,
+        "expectedCounts": realizationCounts.mean(axis = 0) if realizations else np.zeros(LEVELS),
+        "adjustedAssets": int(adjusted_rows(epMatrix[known]).sum()),
+        "realizationLevels": realizationLevels,
+    }
@@ -1,55 +1,211 @@
-import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
+import itertools    # Reads the rows of the streaming join a chunk at a time
+# Where the tables are read from and written to (arcpy, or a GeoPackage/SQLite database)
+from Backends import ArcpyBackend, rows_equal
+# Optional tool parameters
+from DisasterImpact import optional_parameter
+# Stage timers of a traced run
+from Instrumentation import stage, tracing
+
+# ********************************************************************
+# Join Modes
+# ********************************************************************
+# MEMORY - the join table is read into a dictionary (key: join field values), and every input table row looks up
+#          its join field values in it. Fast for join tables that fit in memory.
+# STREAM - sort-merge join: both tables are read sorted by their join fields, a chunk of rows at a time, and merged
+#          like two sorted lists. Only the current chunks and the rows whose values change are held in memory, so join
+#          tables with millions of rows (e.g. OSM or census tables) can be joined. Both tables must be sorted the way
+#          Python compares the join field values (true for numbers and, in GeoPackage/SQLite workspaces, text).
+# In both modes, empty (None) join field values are values like any other: an input row whose join fields are empty
+# gets the values of the join table row with the same empty join fields (this is what the tool has always done). The
+# streaming join can't sort empty values, so it keeps the rows with an empty join field apart, in memory, and joins
+# them at the end.
+MEMORY = "MEMORY"
+STREAM = "STREAM"
+JOIN_MODES = (MEMORY, STREAM)
+
+# Number of rows the streaming join reads from a table at a time
+JOIN_CHUNK_ROWS = 50000
 
 # ********************************************************************
 # Helper Functions
 # ********************************************************************
 # --------------------------------------------------------------------
-# Prints a message in ArcGIS Pro
+# Returns a list of join fields given as a list or as a string of fields separated by semicolons (e.g. "Name;County")
+# --------------------------------------------------------------------
+def join_fields(fields):
+    if isinstance(fields, str):
+        fields = fields.split(";")
+    return [str(field).strip() for field in fields if str(field).strip()]
+
+# --------------------------------------------------------------------
+# Reads the rows of a table sorted by its first keyCount fields, JOIN_CHUNK_ROWS rows at a time.
+# Yields (key, other values) tuples. Rows with an empty (None) join field value can't be sorted; they are appended to
+# the emptyKeys list as (key, other values) tuples instead of being yielded.
+# Raises a ValueError if the rows don't come back sorted the way Python compares them.
+# --------------------------------------------------------------------
+def sorted_rows(backend, table, fields, keyCount, emptyKeys):
+    rows = iter(backend.read_rows(table, fields, orderBy = fields[:keyCount]))
+    previousKey = None
+    for chunk in iter(lambda: list(itertools.islice(rows, JOIN_CHUNK_ROWS)), []):
+        for row in chunk:
+            key = tuple(row[:keyCount])
+            if None in key:
+                emptyKeys.append((key, row[keyCount:]))
+                continue
+            try:
+                ordered = previousKey is None or not key < previousKey
+            except TypeError:
+                ordered = False
+            if not ordered:
+                raise ValueError("The rows of '{}' aren't sorted by {} the way they are compared; "
+                                 "use the {} join mode".format(backend.table_name(table), ", ".join(fields[:keyCount]), MEMORY))
+            previousKey = key
+            yield key, row[keyCount:]
+
+# --------------------------------------------------------------------
+# Returns the last row of every join field value of a sorted join table (like the dictionary of the MEMORY mode,
+# where a later row replaces an earlier one with the same key)
+# --------------------------------------------------------------------
+def last_rows(rows):
+    for _, group in itertools.groupby(rows, lambda row: row[0]):
+        *_, row = group
+        yield row
+
+# ********************************************************************
+# Data Extraction
+# ********************************************************************
+# --------------------------------------------------------------------
+# Copies the dataToExtract fields of the join table into the rows of the input table with the same join field value.
+# Parameters:
+#   backend             - storage backend (see Backends.py)
+#   inputTable          - the table that will be updated
+#   inputTableJoinField - its join field(s): one field, a list of fields, or fields separated by semicolons
+#   joinTable           - the table holding the data
+#   joinTableField      - its join field(s), in the same order as the input table's
+#   dataToExtract       - the fields that will be copied
+#   mode                - MEMORY or STREAM (see JOIN_MODES)
+# Returns the (written, unchanged) number of rows.
 # --------------------------------------------------------------------
-def message(message):
-    arcpy.AddMessage(message)
+def extract_data(backend, inputTable, inputTableJoinField, joinTable, joinTableField, dataToExtract, mode = MEMORY):
+    dataToExtract = list(dataToExtract)
+    inputKeys = join_fields(inputTableJoinField)
+    joinKeys = join_fields(joinTableField)
+    if len(inputKeys) != len(joinKeys):
+        raise ValueError("The input table and the join table need the same number of join fields")
+    keyCount = len(joinKeys)
+
+    # The rows to update are collected first and written in one pass by the backend's result writer.
+    # This dictionary is composed of a key, value pair where:
+    # key: Object ID of the input table row
+    # value(s): the join table values of the row's join field values
+    results = {}
+    matched = 0
+    unmatched = 0
+    unchanged = 0
+
+    if mode == STREAM:
+        # --------------------------------------------------------------------
+        # Sort-merge join
+        # --------------------------------------------------------------------
+        # The input table rows are read with the current values of the dataToExtract fields, so rows that already
+        # hold the join table's values are never handed to the result writer.
+        with stage("Sort-merge join") as mergeStage:
+            # The rows with an empty join field value of both tables (see sorted_rows)
+            emptyJoinKeys = []
+            emptyInputKeys = []
+            joinRows = last_rows(sorted_rows(backend, joinTable, joinKeys + dataToExtract, keyCount, emptyJoinKeys))
+            joinKey, joinValues = next(joinRows, (None, None))
+            for key, row in sorted_rows(backend, inputTable, inputKeys + ["OID@"] + dataToExtract, keyCount, emptyInputKeys):
+                # Skip the join table rows whose key is smaller than the input row's: no input row has it
+                try:
+                    while joinKey is not None and joinKey < key:
+                        joinKey, joinValues = next(joinRows, (None, None))
+                except TypeError:
+                    raise ValueError("The join fields of '{}' and '{}' hold different types of values".format(
+                        backend.table_name(inputTable), backend.table_name(joinTable)))
+                if joinKey != key:
+                    unmatched += 1
+                    continue
+                matched += 1
+                if rows_equal(row[1:], joinValues):
+                    unchanged += 1
+                else:
+                    results[row[0]] = tuple(joinValues)
+
+            # The input rows with an empty join field value are joined like in the MEMORY mode. The rest of the join table
+            # is read first, since its rows with an empty join field value can come anywhere in it.
+            if emptyInputKeys:
+                for _ in joinRows:
+                    pass
+                # A later row replaces an earlier one with the same key, like in the MEMORY mode
+                emptyJoinDict = dict(emptyJoinKeys)
+                for key, row in emptyInputKeys:
+                    if key not in emptyJoinDict:
+                        unmatched += 1
+                        continue
+                    matched += 1
+                    if rows_equal(row[1:], emptyJoinDict[key]):
+                        unchanged += 1
+                    else:
+                        results[row[0]] = tuple(emptyJoinDict[key])
+            mergeStage.rows = matched + unmatched
+    else:
+        # Use list comprehension to build a dictionary from the join table's rows
+        # Join table dictionary - composed of a key, value pair where:
+        # key: Join table field values
+        # value(s): (array containing the values for each of the fields in the dataToExtract list)
+        # Empty (None) join field values are part of the key, so they match too (see Join Modes)
+        with stage("Read join table") as readStage:
+            jtDict = {tuple(row[:keyCount]): row[keyCount:] for row in backend.read_rows(joinTable, joinKeys + dataToExtract)}
+            readStage.rows = len(jtDict)
+
+        with stage("Join") as joinStage:
+            for row in backend.read_rows(inputTable, ["OID@"] + inputKeys):
+                # check if the current object exists in the jtDict
+                key = tuple(row[1:])
+                if key in jtDict:
+                    results[row[0]] = tuple(jtDict[key])
+                    matched += 1
+                else:
+                    unmatched += 1
+            joinStage.rows = matched + unmatched
+
+    with stage("Write results") as writeStage:
+        with backend.result_writer() as resultWriter:
+            written, writerUnchanged = resultWriter.write(inputTable, dataToExtract, results)
+        writeStage.rows = len(results)
+
+    backend.message("{} rows matched, {} unmatched, {} unchanged.".format(matched, unmatched, unchanged + writerUnchanged))
+    return written, unchanged + writerUnchanged
 
 # ********************************************************************
 # Main Program
 # ********************************************************************
 # --------------------------------------------------------------------
-# Initializing variables
-# --------------------------------------------------------------------
-inputTable = arcpy.GetParameter(0)                  # This is the table from the feature layer that will be updated
-inputTableJoinField = arcpy.GetParameterAsText(1)   # This is the join field 
-joinTable = arcpy.GetParameter(2)                   # This is the join table containing the data that will be added to the input table
-joinTableField = arcpy.GetParameter(3)              # This is the join field. It must be the same as the join field in the previous parameter
-dataToExtract = arcpy.GetParameter(4)               # This is a list composed of the fields containing the data that will be "extracted"
-
-# Input table fields - composed of the input table join field concatendated with the dataToExtract fields
-itFields = [inputTableJoinField] + dataToExtract
-
-# Join table fields - composed of the input table join field concatendated with the dataToExtract fields
-jtFields = [joinTableField] + dataToExtract
-
-# Use list comprehension to build a dictionary from a da.SearchCursor
-# Join table dictionary - composed of a key, value pair where:
-# key: Join table field 
-# value(s): (array containing the values for each of the fields in the dataToExtract list)
-jtDict = {row[0]:(row[1:]) for row in arcpy.da.SearchCursor(joinTable, jtFields)}
-
-# Use the UpdateCursor function to iterate and update through every row in the given feature class table
-with arcpy.da.UpdateCursor(inputTable, itFields) as cursor:
-    # row is the nth row in the table
-    # cursor is the iterator
-    for row in cursor:
-        # row[0] = Join field value (this is generally the object ID)
-        objectID = row[0]
-        
-        # check if the current object exists in the jtDict
-        if objectID in jtDict:
-            
-            # Update the current row given the fields chosen by the user
-            for data in range(len(dataToExtract)):
-                row[data + 1] = jtDict[objectID][data]
-        
-            # Update the row
-            cursor.updateRow(row)
-
-# Print a message in ArcGIS Pro
-message("{} DATA EXTRACTION SUCCESSFUL!".format(inputTable))
\ No newline at end of file
+# Runs the tool in ArcGIS Pro
+# --------------------------------------------------------------------
+def main():
+    import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
+
+    # --------------------------------------------------------------------
+    # Initializing variables
+    # --------------------------------------------------------------------
+    inputTable = arcpy.GetParameter(0)                  # This is the table from the feature layer that will be updated
+    inputTableJoinField = arcpy.GetParameterAsText(1)   # This is the join field (several fields are separated by semicolons)
+    joinTable = arcpy.GetParameter(2)                   # This is the join table containing the data that will be added to the input table
+    joinTableField = arcpy.GetParameterAsText(3)        # This is the join field. It must be the same as the join field in the previous parameter
+    dataToExtract = arcpy.GetParameter(4)               # This is a list composed of the fields containing the data that will be "extracted"
+    # The sixth (optional) parameter is the join mode: MEMORY (default) or STREAM for join tables too big for memory
+    mode = str(optional_parameter(5, MEMORY)).upper() or MEMORY
+
+    backend = ArcpyBackend()
+    extract_data(backend, inputTable, inputTableJoinField, joinTable, joinTableField, dataToExtract, mode)
+
+    # Print a message in ArcGIS Pro
+    backend.message("{} DATA EXTRACTION SUCCESSFUL!".format(inputTable))
+
+# The tool only runs when the script is started (by ArcGIS Pro or Python), not when it's imported
+if __name__ == "__main__":
+    # The timings of the run are printed when it ends (see Instrumentation.py)
+    with tracing(ArcpyBackend().message):
+        main()
@@ -1,256 +1,49 @@
-import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
-# Import math package to use in our distribution formulas
-import math
-from math import exp, log
-# Import scipy package and tools to make our calculations accurate
-from scipy.stats import norm, lognorm    
-from scipy import interpolate
 import os           # Import os package to be able to get the current directory
+# NumPy lets us hold a whole column of IM values in one array
+import numpy as np
+# The fragility functions and damage state calculations live in the FragilityEngine module (in this same folder)
+from FragilityEngine import load_fragility_curves
+# The local copy of the hosted fragility database
+from FragilityCache import cache_path, load_fragility_database
+# The scenario registry and the scenario side tables
+from Scenarios import (load_scenarios, scenario_fields, select_scenarios, scenario_table_path,
+                       read_scenario_table, write_results_table, write_side_table)
+# The Monte Carlo damage simulation
+from DamageSimulation import LEVELS, MAX_KEPT_LEVELS, monte_carlo
+# Where the data is read from and the results are written to (arcpy, or a GeoPackage/SQLite database)
+from Backends import ArcpyBackend, SQLiteResultWriter
+# Reading and simulating the layers, in this process or in a pool of worker processes
+from LayerSimulation import CHUNK_ROWS, combine_results, evaluation_tables, init_worker, layer_tasks, simulate_task
+from Parallel import process_pool, worker_count
+# The asset fingerprints of incremental runs
+from Fingerprints import fingerprint_path, fragility_versions, run_key, write_fingerprints
+# Stage timers and counters of a traced run
+from Instrumentation import count_event, stage, tracing
 
 # ********************************************************************
-# Helper Functions
-# ********************************************************************
-# --------------------------------------------------------------------
-# Prints a message in ArcGIS Pro
-# --------------------------------------------------------------------
-def message(message):
-    arcpy.AddMessage(message)
-
-# --------------------------------------------------------------------
-# Takes in the dictionary of damage states and their EP values and
-# returns the state that is >= 0.5
-# --------------------------------------------------------------------
-def return_state(dict):
-    # Sort dictionary into an array of tuples
-    # Tuple array structure:
-    # ((first state, first EP), (second state, second EP), (n state, n EP), etc.)
-    sorted_dict = sorted(dict.items(), key=lambda x: x[1])
-    
-    # iterate through tuple array 
-    # if b in (a, b) (which is the EP value) >= 0.50, return a (the damage state)
-    for i, (a, b) in enumerate(sorted_dict):
-        if float(b) >= 0.5:
-            return (a, b)
-    
-    # if no value is >= 0.5, then the damage state will be none
-    lowState = list(dict.keys())[0]     # the lowState will be the first key (state) in the dict
-    lowEP = dict.get(lowState)          # using the lowState key, get the corresponding EP value
-
-    # return none as the damage state and the EP value
-    return ("None", lowEP)
-    
-# --------------------------------------------------------------------
-# Function to return a dictionary containing the right number of damage states
-# --------------------------------------------------------------------
-def damage_states(fdDict, fragNo, numberOfStates, IM):
-    # Explanation:
-    # There is a max number of 5 different damage states an infrastructure can have. However, some infrastructures only
-    # have 1 or a few more. Instead of creating one big dictionary that might have more states than it needs
-    # (these values would appear as nulls in the dictionary), we can create the correct dictionary size depending on the
-    # number of states stated in the fragility database under the 'No_of_damage_state' column.
-    # Furthermore, once the number of states is known, we'll go ahead and calculate the EP values and store them in the dictionary that will be returned.
-
-    # The fragility distribution respective to the fragility number (i.e. Discrete, Lognormal, Normal, Polynomial)
-    fragDist = fdDict[fragNo][3] 
-    # Store the formula in the 'Fragility_polynomial' column. If there is none, it's okay since it wouldn't be used anyway. 
-    poly = fdDict[fragNo][17]
-    # Short for IM Description, this is the string value in the 'IM' column in the fragility database (e.g. PGA, PGV, etc.). 
-    IMDesc = fdDict[fragNo][1]
-
-    # This dictionary will be the dictionary returned from this function.
-    # This dictionary is composed of a key, value pair where:
-    # key: Damage state (string)
-    # value: EP value (string)
-    # Dictionary structure/index:
-    # [Key]            [0]     
-    # [Damage state] = EP 
-    damageStates = {}
-
-    # Some infrastructures will require different fragility distribution functions to calculate their EP.
-    # Therefore, the 'fragility_function' function returns the EP value using the correct fragility distribution function.
-    if numberOfStates == 1:
-        damageStates[fdDict[fragNo][5]] = fragility_function(fragDist, IM, fdDict[fragNo][6], fdDict[fragNo][7], poly, IMDesc)
-    elif numberOfStates == 2:
-        damageStates[fdDict[fragNo][5]] = fragility_function(fragDist, IM, fdDict[fragNo][6], fdDict[fragNo][7], poly, IMDesc)
-        damageStates[fdDict[fragNo][8]] = fragility_function(fragDist, IM, fdDict[fragNo][9], fdDict[fragNo][10], poly, IMDesc)
-    elif numberOfStates == 3:
-        damageStates[fdDict[fragNo][5]] = fragility_function(fragDist, IM, fdDict[fragNo][6], fdDict[fragNo][7], poly, IMDesc)
-        damageStates[fdDict[fragNo][8]] = fragility_function(fragDist, IM, fdDict[fragNo][9], fdDict[fragNo][10], poly, IMDesc)
-        damageStates[fdDict[fragNo][11]] = fragility_function(fragDist, IM, fdDict[fragNo][12], fdDict[fragNo][13], poly, IMDesc)
-    elif numberOfStates == 4:
-        damageStates[fdDict[fragNo][5]] = fragility_function(fragDist, IM, fdDict[fragNo][6], fdDict[fragNo][7], poly, IMDesc)
-        damageStates[fdDict[fragNo][8]] = fragility_function(fragDist, IM, fdDict[fragNo][9], fdDict[fragNo][10], poly, IMDesc)
-        damageStates[fdDict[fragNo][11]] = fragility_function(fragDist, IM, fdDict[fragNo][12], fdDict[fragNo][13], poly, IMDesc)
-        damageStates[fdDict[fragNo][14]] = fragility_function(fragDist, IM, fdDict[fragNo][15], fdDict[fragNo][16], poly, IMDesc)
-    elif numberOfStates == 5:
-        damageStates[fdDict[fragNo][5]] = fragility_function(fragDist, IM, fdDict[fragNo][6], fdDict[fragNo][7], poly, IMDesc)
-        damageStates[fdDict[fragNo][8]] = fragility_function(fragDist, IM, fdDict[fragNo][9], fdDict[fragNo][10], poly, IMDesc)
-        damageStates[fdDict[fragNo][11]] = fragility_function(fragDist, IM, fdDict[fragNo][12], fdDict[fragNo][13], poly, IMDesc)
-        damageStates[fdDict[fragNo][14]] = fragility_function(fragDist, IM, fdDict[fragNo][15], fdDict[fragNo][16], poly, IMDesc)
-        damageStates[fdDict[fragNo][18]] = fragility_function(fragDist, IM, fdDict[fragNo][19], fdDict[fragNo][20], poly, IMDesc)
-    
-    return damageStates     # Return dictionary
-
-# ********************************************************************
-# Fragility Functions
-# ********************************************************************
-# --------------------------------------------------------------------
-# Lognormal Distribution Function 
-# Reference: https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.lognorm.html
-# --------------------------------------------------------------------
-def lognormal_cdf(IM, med, std) -> float:
-    return lognorm.cdf(IM, float(std), scale = exp(log(float(med))))
-
-# --------------------------------------------------------------------
-# Normal Distribution 
-# Reference: https://python.plainenglish.io/probability-distributions-with-python-discrete-continuous-1a11d7c8d717
-# --------------------------------------------------------------------
-def normal_cdf(IM, med, std) -> float:
-    return (1 + math.erf((IM - float(med)) / math.sqrt(2) / float(std))) / 2
-
-# --------------------------------------------------------------------
-# Discrete Distribution Function  
-# --------------------------------------------------------------------
-def discrete(IM, med, std) -> float:
-    # For discrete distributions, med and std are strings of values concatenated together where
-    # the median acts as the IM values (e.g. PGA), and the std acts as the EP values (the values we want).
-    # However, since these are fixed values and we want to be able to use any value we want as the IM, we'll
-    # use linear interpolation to calculate the EP values that we don't know.
-    # More on linear interpolation: https://www.statology.org/linear-interpolation-python/
-
-    # First, convert med and std to individual arrays containing floats
-    x = [float(num) for num in med.split()]
-    y = [float(num) for num in std.split()]
-
-    # If the IM value we choose is less than the first element in the x array (which should be the smallest one by default),
-    # then linear interpolation will fail. 
-    # We can get around this by defaulting the IM value to that first element. 
-    if IM < x[0]:
-        IM = x[0]
-
-    # Use interpolate function to take in float arrays and develop a function.
-    # The fill_value is set to “extrapolate”, which means we can calculate points outside the data range.
-    linearInterpolation = interpolate.interp1d(x, y, fill_value='extrapolate')
-
-    # Utilize this interpolation function with the IM as an argument to calculate and return the EP value 
-    return linearInterpolation(IM)
-
-# --------------------------------------------------------------------
-# Polynomial Distribution Function 
-# --------------------------------------------------------------------
-def polynomial(IM, polynomial, IMDesc, D = 1) -> float:
-    # For polynomial distributions, there are formulas already written for us in the database under the
-    # 'Fragility_polynomial' column. We take this formula (which is a string), and replace the IM description (e.g., PGA, PGV, etc.)
-    # in this formula with the IM value given by the user.
-    # The D parameter applies to buried pipelines and is the pipe diameter. This value will show up in the formula as
-    # a 'D' and will be replaced by the D parameter. 
-    # NOTE: as of the year 2022, when this script was created, we didn't have access to any data regarding buried pipelines.
-    # Therefore, while this function works, this script does not take in a D parameter anywhere else. This is a 
-    # feature that will need to be added. In the meantime, D is defaulted to 1 so the program doesn't return an error if it's called. 
-    # Lastly, we use the eval function to evaluate this string as a python arithmetic and voila, we get our EP value.
-
-    # Cast D parameter to string and wrap it in parantheses.
-    # Some formulas use log, therefore, we want to make sure the D parameter is wrapped in parentheses.
-    D = "(" + str(D) + ")"
-
-    # Store the new string with the updated IM value in a temporary variable
-    temp = str(polynomial).replace(IMDesc, str(IM)).replace("D", D).replace("^", "**")
-    # Evaluate and return the calculated value.
-    return eval(temp)                                   
-
-# --------------------------------------------------------------------
-# Fragility function evaluator 
-# --------------------------------------------------------------------
-def fragility_function(fragDist, IM, med, std, poly, IMDesc):
-    # There are four different types of fragility distributions:
-    #   1. Discrete
-    #   2. Lognormal
-    #   3. Normal
-    #   4. Polynomial
-    # These functions are defined above. 
-    # This function computes which function will be used based on the fragDist (Fragility Distribution).
-    # Once the correct funciton is chosen, it's called using the remaining paramters and returns the calculated value (the EP).
-    if fragDist == "Discrete":
-        return str(discrete(IM, med, std))
-    elif fragDist == 'Lognormal':
-        return str(lognormal_cdf(IM, med, std))
-    elif fragDist == 'Normal':
-        return str(normal_cdf(IM, med, std))
-    elif fragDist == 'Polynomial':
-        return str(polynomial(IM, poly, IMDesc))
-
-# ********************************************************************
-# Main Program
-# ********************************************************************
-# --------------------------------------------------------------------
-# Setting directory
-# --------------------------------------------------------------------
-# First, we'll calculate the exceedance probability values of the bridges.
-# Get the current directory of the script; it should look something like the following:
-# {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Scripts
-scriptsPath = os.getcwd()
-
-# However, we want to get the parent directory of the script. We'll get something like this:
-# {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP
-# Then, in the same line, we compose a new directory.
-# The resulting directory will look something like this:
-# {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Projects\GADEP
-projectPath = os.path.join(os.path.dirname(scriptsPath), "Projects", "GADEP")
-
-# Now that we have the main project path stored as a variable, we can use it to 
-# compose a path for other directories we need to traverse to
-# Path to "Infrastructures.gdb"
-infrastructuresPath = os.path.join(projectPath, "Infrastructures.gdb")
-
-# To avoid typing out the entire directory everytime, we set the workspace to our composed directory.
-# This lets us refer to the contents in the directory directly.
-arcpy.env.workspace = infrastructuresPath
-
-# --------------------------------------------------------------------
-# Initializing variables
-# --------------------------------------------------------------------
 # Fragility Database
+# ********************************************************************
 # This link takes you to where the Fragility Database is hosted on ArcGIS Online
-fd = r"https://services1.arcgis.com/CD5mKowwN6nIaqd8/arcgis/rest/services/Fragility_Database_USA/FeatureServer/0"
-
-# asset (infrastructure/map layer) is the first parameter
-# This parameter is a list of values and its length will depend on how many map layers the user chooses
-asset = arcpy.GetParameter(0)
-
-# em is the earthquake magnitude
-# The user has 4 choices:
-# 1) 8.1 
-# 2) 8.4
-# 3) 8.7
-# 4) 9.0
-# These values come from the CSZ tool in OHELP: https://ohelp.oregonstate.edu/
-em = arcpy.GetParameterAsText(1)
-
-# This dictionary contains the earthquake magnitudes as its keys, and the corresponding column name as its values.
-# These column names will (should) already be present in the map layer's attribute table, and should contain the
-# PGA (Peak Ground Acceleration) values before running this script. 
-# The em parameter will dictate what PGA column will be used in the rest of the program, i.e. what PGA values will be used
-# in the calculations.
-magDict = {
-    '8.1': 'M81_PGA',
-    '8.4': 'M84_PGA',
-    '8.7': 'M87_PGA',
-    '9.0': 'M90_PGA',
-}
+FRAGILITY_DATABASE_URL = r"https://services1.arcgis.com/CD5mKowwN6nIaqd8/arcgis/rest/services/Fragility_Database_USA/FeatureServer/0"
 
 # Asset attribute table columns
 # Index:
 # [0]        Fragility no
 # [1, 2]     Damage state, EP
 # [3, 4, 5]  Hazard type, IM, IM unit
-# [6, 7]     PGA column, Earthquake magnitude
+# [6]        Earthquake magnitude
 assetFields = [ 
     'Frag_no', \
     'Damage', 'EP', \
     'Hazard', 'IM', 'IM_unit', \
-    magDict.get(em), 'EQ_MAG'
+    'EQ_MAG'
 ]
 
+# Optional pipe diameter column.
+# Buried pipeline fragility functions use a polynomial formula with a 'D' (pipe diameter) in it.
+# If a map layer has this column, each asset's own diameter is used; otherwise D defaults to 1.
+diameterField = 'Diameter'
+
 # Fragility Database column name fields
 # The order of these elements is the order they're in respective to the database
 # Index:
@@ -273,7 +66,10 @@ fdFields = [ \
     'Damage_state_5', 'Damage_state_med_5', 'Damage_state_std_5'
 ]
 
-# Use list comprehension to build a dictionary from a da.SearchCursor
+# --------------------------------------------------------------------
+# Builds the fragility database dictionary.
+# The hosted table is only read (through the backend) when the local copy (Projects\GADEP\FragilityDatabase.npz)
+# is missing or out of date, or when a refresh is requested. Otherwise the dictionary is read from the local copy.
 # This dictionary is composed of a key, value pair where:
 # key: fragility number (string)
 # value(s): (array containing the values for each of the columns stated) (strings)
@@ -294,52 +90,397 @@ fdFields = [ \
 #                   Fragility_polynomial, 
 #                   [18]            [19]                [20]
 #                   Damage_state_5, Damage_state_med_5, Damage_state_std_5)
-fdDict = {row[0]:(row[1:]) for row in arcpy.da.SearchCursor(fd, fdFields)}
-
-# Loop through the asset list (the different map layers chosen by the user).
-# Basically, we're updating each attribute table for each map layer that is chosen by the user.
-for assetIndex in asset:
-    # Use the UpdateCursor function to iterate and update through every row in the given feature class table
-    with arcpy.da.UpdateCursor(assetIndex, assetFields) as cursor:
-        # row is the nth row in the table
-        # cursor is the iterator
-        for row in cursor:
-            # row[0] = Fragility_no column
-            fragNo = str(row[0])
-            
-            # check if the current fragility number exists in the fdDict
-            if fragNo in fdDict:
-                IM = (row[6])
-
-                # The damage_states function is called which returns a dictionary
-                # composed of a key, value pair where:
-                # key: Damage state (string)
-                # value: Exeedence probability (EP) (string)
-                # Dictionary structure/index:
-                # [Key]            [0]         
-                # [Damage state] = EP
-                damageStates = damage_states(fdDict, fragNo, fdDict[fragNo][4], IM)
-
-                # Use return_state function to return the "optimal" state, i.e. the state that is most likely to occur and be relevant
-                optimalState = return_state(damageStates)
-
-                # row[1] = Damage_State column
-                row[1] = optimalState[0]        # Update what the value is going to be in the Damage_State column
-                # row[2] = EP column
-                row[2] = optimalState[1]        # Update what the value is going to be in the EP column
-                # row[3] = Hazard_type column
-                row[3] = fdDict[fragNo][0]      # Update the Hazard_type column to contain the type of hazard as stated in the fragility database
-                # row[4] = IM column
-                row[4] = fdDict[fragNo][1]      # Update the IM column to contain the IM as stated in the fragility database
-                # row[5] = IM_unit column
-                row[5] = fdDict[fragNo][2]      # Update the IM_unit column to contain the unit of measure as stated in the fragility database
-                # row[7] = Earthquake magnitude
-                row[7] = str(em)                # Update the EQ_MAG column to contain the earthquake magnitude chosen 
-
-                # Update the row
-                cursor.updateRow(row)
-    # Print a message in ArcGIS Pro
-    message("{} SIMULATION SUCCESSFUL!".format(assetIndex))
-
-# Delete dictionary
-del fdDict
+# --------------------------------------------------------------------
+def fragility_database(backend, projectPath, refreshCache = False, offline = False):
+    return load_fragility_database(FRAGILITY_DATABASE_URL, fdFields, cache_path(projectPath),
+                                   lambda: backend.read_service(FRAGILITY_DATABASE_URL, fdFields),
+                                   refresh = refreshCache, offline = offline, message = backend.message)
+
+# ********************************************************************
+# Disaster Impact
+# ********************************************************************
+# --------------------------------------------------------------------
+# Calculates the damage states of the assets of every given layer.
+# Parameters:
+#   backend       - storage backend the layers are read from and written to (see Backends.py)
+#   asset         - list of map layers / tables (e.g. bridges, substations, schools)
+#   em            - the chosen scenario(s), e.g. "9.0", "8.1;9.0" or "ALL"
+#   projectPath   - the "Projects\GADEP" folder (fragility database cache, side tables)
+#   pgasPath      - the "PGA Values" folder (scenario registry)
+#   refreshCache  - always download the fragility database again and rewrite the local copy
+#   offline       - never contact ArcGIS Online; only the local copy is used
+#   realizations, seed, imSigma, imCorrelation - the Monte Carlo mode (see DamageSimulation.py)
+#   output        - where the results of a single scenario are written:
+#                   TABLE  - the attribute table of each map layer
+#                   SQLITE - a sidecar SQLite database ("Projects\GADEP\Results.sqlite") with one table per layer, keyed by OBJECTID
+#   workers       - number of worker processes (0 = one per CPU core, 1 = no worker processes)
+#   incremental   - only calculate the rows whose inputs changed since the last run (see Fingerprints.py)
+#   evaluation    - how the fragility curves are evaluated (see FragilityTables.py):
+#                   EXACT - every curve is evaluated exactly for every asset
+#                   TABLE - lookup tables on a fine IM grid (max error 1e-5 on every EP value)
+#                   MEMO  - exact values, calculated once per (Frag_no, IM)
+# --------------------------------------------------------------------
+def run_disaster_impact(backend, asset, em, projectPath, pgasPath, refreshCache = False, offline = False,
+                        realizations = 0, seed = 0, imSigma = 0.0, imCorrelation = 0.0, output = "TABLE", workers = 1,
+                        incremental = True, evaluation = "EXACT"):
+    message = backend.message
+
+    # The scenarios chosen by the user, in the order they were given
+    scenarios = load_scenarios(pgasPath)
+    selectedScenarios = select_scenarios(scenarios, em)
+    scenarioNames = [scenario["name"] for scenario in selectedScenarios]
+
+    # This dictionary contains the scenario names (earthquake magnitudes) as its keys, and the corresponding column name as its values.
+    # These column names will (should) already be present in the map layer's attribute table, and should contain the
+    # PGA (Peak Ground Acceleration) values before running this script. 
+    # By default this is:
+    # '8.1': 'M81_PGA'
+    # '8.4': 'M84_PGA'
+    # '8.7': 'M87_PGA'
+    # '9.0': 'M90_PGA'
+    # Scenarios without a column are read from the layer's scenario side table ("Projects\GADEP\Scenarios\{layer name}.npz")
+    # written by the Preparation For Disaster Impact tool.
+    magDict = scenario_fields(scenarios)
+
+    with stage("Fragility database") as databaseStage:
+        # Build the fragility database dictionary (from the local copy when it's up to date, see fragility_database)
+        fdDict = fragility_database(backend, projectPath, refreshCache, offline)
+
+        # Parse the fragility database once. Every fragility number gets a FragilityCurve object holding its
+        # damage states, parsed medians and standard deviations (or discrete breakpoints) and a prepared evaluator,
+        # so the rows below only need a lookup and an evaluation.
+        # Dictionary structure:
+        # [Fragility_no] = FragilityCurve
+        # Records that can't be parsed (e.g. a polynomial with something other than arithmetic, log and exp) are reported,
+        # along with the rows that use them below, instead of being left out silently.
+        rejectedCurves = {}
+        curves = load_fragility_curves(fdDict, rejectedCurves)
+        databaseStage.rows = len(fdDict)
+    for fragNo, error in sorted(rejectedCurves.items()):
+        backend.warning("Fragility number {} can't be used: {}".format(fragNo, error))
+
+    # The result writer for single scenario runs
+    if output == "SQLITE":
+        resultWriter = SQLiteResultWriter(os.path.join(projectPath, "Results.sqlite"))
+    else:
+        resultWriter = backend.result_writer()
+
+    # Every row gets a fingerprint of its inputs. In an incremental run, rows whose fingerprint is the same as in the
+    # last run with the same settings (layer table, scenarios, output, evaluation mode and Monte Carlo settings) keep
+    # their last results and aren't written again. When the results are written to the attribute table, a row also has
+    # to still hold the results of the last run (see LayerSimulation.py), e.g. not a copy of the layer with empty fields.
+    checkResults = incremental and output == "TABLE" and len(scenarioNames) == 1
+
+    # When the work is shared by worker processes, the layers are read through their catalog paths and large
+    # layers are split into object ID ranges (see LayerSimulation.py). The object IDs are read from the layer itself,
+    # so only the rows of its selection and definition query are calculated, written and fingerprinted.
+    parallel = worker_count(workers) > 1
+
+    # --------------------------------------------------------------------
+    # Plan the work
+    # --------------------------------------------------------------------
+    # Loop through the asset list (the different map layers chosen by the user) and list the tasks of every layer.
+    # layers is a list of (asset, layer name, run key, number of tasks) tuples
+    layers = []
+    tasks = []
+    for assetIndex in asset:
+        # Name of the feature class (e.g. "Bridges"), used to find its scenario side table
+        layerName = backend.table_name(assetIndex)
+
+        # --------------------------------------------------------------------
+        # Choose where the IM values come from
+        # --------------------------------------------------------------------
+        # If every chosen scenario has a PGA column in the attribute table, the attribute table is used.
+        # Otherwise, the IM values come from the layer's scenario side table.
+        layerFields = backend.list_fields(assetIndex)
+        pgaColumns = [magDict.get(name) for name in scenarioNames]
+        scenarioTablePath = None
+        if not all(column in layerFields for column in pgaColumns):
+            scenarioTablePath = scenario_table_path(projectPath, layerName)
+            scenarioTable = read_scenario_table(scenarioTablePath)
+            if scenarioTable is None:
+                raise ValueError("{} has no PGA column or scenario side table for scenario(s) {}. "
+                                 "Run the Preparation For Disaster Impact tool first.".format(layerName, em))
+            if any(name not in scenarioTable[1] for name in scenarioNames):
+                raise ValueError("The scenario side table of {} doesn't have scenario(s) {}. "
+                                 "Run the Preparation For Disaster Impact tool again.".format(layerName, em))
+            pgaColumns = []
+
+        # Instead of calculating the EP values one row at a time, the object ID, fragility number
+        # and IM values of every row are read into memory so a whole layer (or chunk) can be calculated at once.
+        # Only read the pipe diameter column if the map layer has one
+        hasDiameter = diameterField in layerFields
+        readFields = ["OID@", assetFields[0]] + ([diameterField] if hasDiameter else []) + pgaColumns
+        # The Damage and EP fields are read too when the rows' results are checked
+        resultFields = assetFields[1:3] if checkResults and all(field in layerFields for field in assetFields[1:3]) else []
+
+        key = run_key(scenarioNames, output, evaluation, realizations, seed, imSigma, imCorrelation, backend.table_location(assetIndex))
+        layerTasks = layer_tasks(backend, backend.table_path(assetIndex) if parallel else assetIndex, readFields + resultFields,
+                                 hasDiameter, scenarioTablePath, scenarioNames, CHUNK_ROWS if parallel else None,
+                                 key, fingerprint_path(projectPath, layerName) if incremental else None, assetIndex,
+                                 len(resultFields))
+        layers.append((assetIndex, layerName, key, len(layerTasks)))
+        tasks.extend(layerTasks)
+
+    # --------------------------------------------------------------------
+    # Calculate the damage states
+    # --------------------------------------------------------------------
+    # Every task reads its rows and calls simulate_scenarios, which groups the rows by fragility number and calculates
+    # the EP values of all damage states of all chosen scenarios of a group in one vectorized call.
+    # The tasks of every layer run at the same time in the worker processes; each worker gets the fragility
+    # database once. The results come back to this process, which does all the writing.
+    # The stage covers reading the rows too, since every task reads its own rows
+    with stage("Read and simulate") as simulateStage:
+        if parallel:
+            message("Simulating {} layer(s) in {} task(s) with {} worker processes...".format(len(layers), len(tasks), worker_count(workers)))
+            with process_pool(workers, init_worker, (backend.workspace, fdDict, evaluation)) as pool:
+                taskResults = list(pool.map(simulate_task, tasks))
+        else:
+            versions = fragility_versions(fdDict)
+            tables = evaluation_tables(evaluation)
+            taskResults = [simulate_task(task, backend, curves, versions, tables) for task in tasks]
+        simulateStage.rows = sum(len(taskResult["objectIDs"]) for taskResult in taskResults)
+
+    # Loop through the layers and write their results.
+    # Basically, we're updating each attribute table for each map layer that is chosen by the user.
+    firstTask = 0
+    for assetIndex, layerName, key, taskCount in layers:
+        layerResult = combine_results(taskResults[firstTask:firstTask + taskCount])
+        firstTask += taskCount
+
+        # objectIDs, fragNos, D: object ID, fragility number and pipe diameter (None without a Diameter field) of every row
+        # IM: (rows x scenarios) matrix of IM values
+        # damage: list (one per row) of lists (one per scenario) of damage states (None if the fragility number is not in the fragility database)
+        # ep: (rows x scenarios) array of the EP values that go with the damage states (floats)
+        objectIDs = layerResult["objectIDs"]
+        fragNos = layerResult["fragNos"]
+        D = layerResult["D"]
+        IM = layerResult["IM"]
+        damage = layerResult["damage"]
+        ep = layerResult["ep"]
+
+        # Rows whose fragility record was rejected get no results and keep the ones they had
+        rejectedRows = sum(1 for fragNo in fragNos if fragNo in rejectedCurves)
+        if rejectedRows:
+            backend.warning("{}: {} rows have a fragility number that can't be used; their results were not updated.".format(
+                layerName, rejectedRows))
+
+        # The fingerprints and results of this run are kept for the next one once the results are written (see below)
+        recomputed = layerResult["recomputed"]
+        fingerprintTable = fingerprint_path(projectPath, layerName)
+        if incremental:
+            message("{}: {} rows calculated, {} rows skipped (inputs unchanged).".format(
+                layerName, int(recomputed.sum()), int((~recomputed).sum())))
+            count_event("Incremental rows calculated", int(recomputed.sum()))
+            count_event("Incremental rows skipped", int((~recomputed).sum()))
+
+        # --------------------------------------------------------------------
+        # Monte Carlo mode
+        # --------------------------------------------------------------------
+        # Sample the damage state of every asset in every realization, for every chosen scenario.
+        # The results are stored in "Projects\GADEP\Scenarios\{layer name}_montecarlo.npz" with:
+        # objectIDs          - object IDs of the assets
+        # scenarios          - scenario names
+        # stateProbabilities - (assets x scenarios x damage levels) probability of every asset ending in every damage level
+        # expectedCounts     - (scenarios x damage levels) expected number of assets in every damage level
+        # realizationCounts  - (scenarios x realizations x damage levels) number of assets in every damage level in every realization
+        # realizationLevels  - (assets x scenarios x realizations) int8 damage level of every asset in every realization
+        #                      (-1 without results), so the route analyses reuse the same (correlated) realizations.
+        #                      Only kept when it holds at most MAX_KEPT_LEVELS values.
+        # seed               - the random seed of the realizations
+        # Damage level 0 is None and damage level n is damage state n.
+        if realizations > 0:
+            message("Running {} Monte Carlo realizations per scenario...".format(realizations))
+            stateProbabilities = np.zeros((len(objectIDs), len(scenarioNames), LEVELS))
+            expectedCounts = np.zeros((len(scenarioNames), LEVELS))
+            realizationCounts = np.zeros((len(scenarioNames), realizations, LEVELS), dtype = np.int32)
+            keepLevels = len(objectIDs) * len(scenarioNames) * realizations <= MAX_KEPT_LEVELS
+            realizationLevels = np.zeros((len(objectIDs), len(scenarioNames), realizations), dtype = np.int8) if keepLevels else None
+            if not keepLevels:
+                message("{}: too many assets x realizations to keep the damage level of every realization; only the counts "
+                        "are kept.".format(layerName))
+
+            for scenarioIndex, scenarioName in enumerate(scenarioNames):
+                with stage("Monte Carlo {} {}".format(layerName, scenarioName)) as monteCarloStage:
+                    result = monte_carlo(fdDict, curves, fragNos, IM[:, scenarioIndex], D, realizations = realizations,
+                                         seed = seed, sigma = imSigma, rho = imCorrelation, workers = workers,
+                                         keepLevels = keepLevels)
+                    monteCarloStage.rows = len(objectIDs)
+                stateProbabilities[:, scenarioIndex] = result["stateProbabilities"]
+                expectedCounts[scenarioIndex] = result["expectedCounts"]
+                realizationCounts[scenarioIndex] = result["realizationCounts"]
+                if keepLevels:
+                    realizationLevels[:, scenarioIndex] = result["realizationLevels"]
+
+                message("Scenario {}: expected number of assets per damage level (None, 1-{}): {}".format(
+                    scenarioName, LEVELS - 1, ", ".join("{:.1f}".format(count) for count in result["expectedCounts"])))
+                if result["adjustedAssets"]:
+                    message("Scenario {}: {} assets have EP values outside [0, 1] (e.g. polynomial repair rates) or rising "
+                            "with the damage state; they were clipped and capped before sampling (see DamageSimulation.py).".format(
+                                scenarioName, result["adjustedAssets"]))
+
+            write_side_table(os.path.join(projectPath, "Scenarios", layerName + "_montecarlo.npz"),
+                             objectIDs = np.array(objectIDs, dtype = np.int64),
+                             scenarios = np.array(scenarioNames, dtype = str),
+                             stateProbabilities = stateProbabilities.astype(np.float32),
+                             expectedCounts = expectedCounts,
+                             realizationCounts = realizationCounts,
+                             seed = np.array(seed, dtype = np.int64),
+                             **({} if realizationLevels is None else {"realizationLevels": realizationLevels}))
+
+        # --------------------------------------------------------------------
+        # Several scenarios: write the results to the results side table
+        # --------------------------------------------------------------------
+        # Instead of rewriting the attribute table once per scenario, the damage states and EP values of every
+        # scenario are stored in "Projects\GADEP\Scenarios\{layer name}_results.npz".
+        if len(scenarioNames) > 1:
+            with stage("Write results {}".format(layerName)) as writeStage:
+                write_results_table(scenario_table_path(projectPath, layerName, results = True), objectIDs, scenarioNames, damage, ep)
+                writeStage.rows = len(objectIDs)
+            write_fingerprints(fingerprintTable, key, objectIDs, layerResult["fingerprints"], damage, ep)
+            message("{} SIMULATION SUCCESSFUL! Results of {} scenarios stored in the results side table.".format(assetIndex, len(scenarioNames)))
+            continue
+
+        # --------------------------------------------------------------------
+        # One scenario: write the results
+        # --------------------------------------------------------------------
+        # The results of the whole layer are collected first. This dictionary is composed of a key, value pair where:
+        # key: Object ID
+        # value: (Damage state, EP, Hazard type, IM, IM unit, Earthquake magnitude), in the order of assetFields[1:]
+        # Rows without an IM value, or whose fragility number doesn't exist in the fragility database, are left out,
+        # and so are the rows skipped by an incremental run (they already hold their results).
+        results = {}
+        for position, objectID in enumerate(objectIDs):
+            if not recomputed[position] or np.isnan(IM[position, 0]) or damage[position][0] is None:
+                continue
+            curve = curves[fragNos[position]]
+            results[objectID] = (
+                damage[position][0],                                                # Damage state
+                None if np.isnan(ep[position, 0]) else float(ep[position, 0]),      # EP is a DOUBLE field
+                curve.hazard,                                                       # Type of hazard as stated in the fragility database
+                curve.IMDesc,                                                       # IM as stated in the fragility database
+                curve.IMUnit,                                                       # Unit of measure as stated in the fragility database
+                scenarioNames[0],                                                   # Earthquake magnitude chosen
+            )
+
+        # The writer applies all results in one pass and skips the rows whose values haven't changed
+        with stage("Write results {}".format(layerName)) as writeStage:
+            written, unchanged = resultWriter.write(assetIndex if output == "TABLE" else layerName, assetFields[1:], results)
+            writeStage.rows = len(results)
+
+        # Only now are the results safely written: if the write fails (e.g. a schema lock, or the tool is cancelled),
+        # the last fingerprints stay as they were and the next incremental run calculates these rows again
+        write_fingerprints(fingerprintTable, key, objectIDs, layerResult["fingerprints"], damage, ep)
+
+        # Print a message in ArcGIS Pro
+        message("{} SIMULATION SUCCESSFUL! {} rows updated, {} unchanged.".format(assetIndex, written, unchanged))
+
+    resultWriter.close()
+
+# ********************************************************************
+# Main Program
+# ********************************************************************
+# --------------------------------------------------------------------
+# Returns the value of an optional parameter, or the default value if the tool
+# was called without it (e.g. the Disaster Route Analysis tool only passes the first two)
+# --------------------------------------------------------------------
+def optional_parameter(index, default):
+    import arcpy
+    if arcpy.GetArgumentCount() <= index:
+        return default
+    value = arcpy.GetParameter(index)
+    return default if value is None else value
+
+# --------------------------------------------------------------------
+# Runs the tool in ArcGIS Pro
+# --------------------------------------------------------------------
+def main():
+    import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
+
+    # --------------------------------------------------------------------
+    # Setting directory
+    # --------------------------------------------------------------------
+    # First, we'll calculate the exceedance probability values of the bridges.
+    # Get the current directory of the script; it should look something like the following:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Scripts
+    scriptsPath = os.getcwd()
+
+    # However, we want to get the parent directory of the script. We'll get something like this:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP
+    # Then, in the same line, we compose a new directory.
+    # The resulting directory will look something like this:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Projects\GADEP
+    projectPath = os.path.join(os.path.dirname(scriptsPath), "Projects", "GADEP")
+
+    # Now that we have the main project path stored as a variable, we can use it to 
+    # compose a path for other directories we need to traverse to
+    # Path to "Infrastructures.gdb"
+    infrastructuresPath = os.path.join(projectPath, "Infrastructures.gdb")
+
+    # Path to the "PGA Values" folder, which holds the scenario registry
+    pgasPath = os.path.join(os.path.dirname(scriptsPath), "PGA Values")
+
+    # To avoid typing out the entire directory everytime, we set the workspace to our composed directory.
+    # This lets us refer to the contents in the directory directly.
+    arcpy.env.workspace = infrastructuresPath
+
+    # --------------------------------------------------------------------
+    # Initializing variables
+    # --------------------------------------------------------------------
+    # asset (infrastructure/map layer) is the first parameter
+    # This parameter is a list of values and its length will depend on how many map layers the user chooses
+    asset = arcpy.GetParameter(0)
+
+    # em is the earthquake magnitude (scenario)
+    # By default, the user has 4 choices:
+    # 1) 8.1 
+    # 2) 8.4
+    # 3) 8.7
+    # 4) 9.0
+    # These values come from the CSZ tool in OHELP: https://ohelp.oregonstate.edu/
+    # More scenarios can be added to the scenario registry ("PGA Values\Scenarios.json").
+    # Several scenarios can be chosen at once by separating them with semicolons (e.g. "8.1;9.0"), or "ALL" for every scenario.
+    em = arcpy.GetParameterAsText(1)
+
+    # The third and fourth (optional) parameters control the local copy of the fragility database:
+    # refreshCache - always download the fragility database again and rewrite the local copy
+    # offline      - never contact ArcGIS Online; only the local copy is used
+    refreshCache = bool(optional_parameter(2, False))
+    offline = bool(optional_parameter(3, False))
+
+    # The fifth to eighth (optional) parameters control the Monte Carlo mode (see DamageSimulation.py):
+    # realizations - number of sampled outcomes per scenario (0 turns the Monte Carlo mode off)
+    # seed         - random seed; the same seed always gives the same results
+    # imSigma      - lognormal standard deviation used to sample the IM values (0 = IM values aren't sampled)
+    # imCorrelation - correlation of the sampled IM values between assets (0 to 1)
+    realizations = int(optional_parameter(4, 0))
+    seed = int(optional_parameter(5, 0))
+    imSigma = float(optional_parameter(6, 0.0))
+    imCorrelation = float(optional_parameter(7, 0.0))
+
+    # The ninth (optional) parameter is where the results of a single scenario are written:
+    # TABLE  - the attribute table of each map layer (default)
+    # SQLITE - a sidecar SQLite database ("Projects\GADEP\Results.sqlite") with one table per layer, keyed by OBJECTID
+    output = str(optional_parameter(8, "TABLE")).upper() or "TABLE"
+
+    # The tenth (optional) parameter is the number of worker processes the layers are simulated with
+    # (1 = no worker processes, 0 = one per CPU core). Large layers are split into object ID ranges.
+    workers = int(optional_parameter(9, 1))
+
+    # The eleventh (optional) parameter calculates every row again instead of only the rows whose
+    # fragility number, IM values, diameter or fragility record changed since the last run
+    recalculateAll = bool(optional_parameter(10, False))
+
+    # The twelfth (optional) parameter is how the fragility curves are evaluated:
+    # EXACT (default), TABLE (lookup tables, max error 1e-5) or MEMO (exact, once per fragility number and IM value)
+    evaluation = str(optional_parameter(11, "EXACT")).upper() or "EXACT"
+
+    run_disaster_impact(ArcpyBackend(), asset, em, projectPath, pgasPath, refreshCache, offline,
+                        realizations, seed, imSigma, imCorrelation, output, workers, not recalculateAll, evaluation)
+
+# The tool only runs when the script is started (by ArcGIS Pro or Python), not when it's imported
+# (e.g. by the command line interface or by worker processes)
+if __name__ == "__main__":
+    # The timings of the run are printed when it ends (see Instrumentation.py)
+    with tracing(ArcpyBackend().message):
+        main()
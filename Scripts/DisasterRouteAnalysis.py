@@ -2,6 +2,16 @@ import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Pyth
 import os           # Import os package to be able to get the current directory
 # Import random package
 import random
+# The native road network and closest facility solver (no Network Analyst license needed)
+from RoadNetwork import AUTO, open_network, solve_routes
+# Probability-weighted bridge barriers
+from BridgeBarriers import DAMAGE_LEVELS, barrier_factors
+# Where the incidents, facilities and barriers are read from
+from Backends import ArcpyBackend, WGS84
+# Optional tool parameters
+from DisasterImpact import optional_parameter
+# Stage timers of a traced run
+from Instrumentation import stage, tracing
 
 # ********************************************************************
 # Helper Functions
@@ -59,241 +69,328 @@ def feature_to_point(inFeature, outFeature):
         return outFeature
 
 # ********************************************************************
-# Main Program
+# Native Route Analysis
 # ********************************************************************
-# ////////////////////////////////////////////////////////////////////
-# Earthquake Simulation
-# ////////////////////////////////////////////////////////////////////
 # --------------------------------------------------------------------
-# Setting directories
+# Writes route rows (see RoadNetwork.route_rows) to a new polyline feature class with the same
+# fields as the routes exported by the Network Analyst solver
 # --------------------------------------------------------------------
-# First, we'll calculate the exceedance probability values of the bridges.
-# Get the current directory of the script; it should look something like the following:
-# {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Scripts
-scriptsPath = os.getcwd()
-
-# However, we want to get the parent directory of the script. We'll get something like this:
-# {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP
-# Then, in the same line, we compose a new directory.
-# The resulting directory will look something like this:
-# {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Projects\GADEP
-projectPath = os.path.join(os.path.dirname(scriptsPath), "Projects", "GADEP")
-
-# Now that we have the main project path stored as a variable, we can use it to 
-# compose a path for other directories we need to traverse to
-# Path to "Infrastructures.gdb"
-infrastructuresPath = os.path.join(projectPath, "Infrastructures.gdb")
-
-# Path to "NetworkAnaysis.gdb"
-networkAnalysisPath = os.path.join(projectPath, "NetworkAnalysis.gdb")
-
-# Path to "TransportationNetwork.gdb"
-transportationNetworkPath = os.path.join(projectPath, "TransportationNetwork.gdb")
-
-# Path to the "GADEP.gdb"
-gadepPath = os.path.join(projectPath, "GADEP.gdb")
-
-# ////////////////////////////////////////////////////////////////////
-# Disaster impact - bridges
-# ////////////////////////////////////////////////////////////////////
-
-# Get the boolean value of the first parameter.
-runDisasterImpact = arcpy.GetParameter(0)
-
-# Filtered bridges layer to be used in the Select_analysis function
-bridgesFiltered = os.path.join(gadepPath, "BridgesFiltered")   
-
-# If the boolean is true, then the Disaster Impact tool will be ran using only the bridges as
-# its parameter.
-if runDisasterImpact:
-    # Status messsage
-    message("Running Disaster Impact tool...")
-    # Bridges directory
-    bridges = os.path.join(infrastructuresPath, "Bridges")
-    # The earthquake magnitude chosen
-    em = arcpy.GetParameterAsText(1)
-
-    # The Disaster Impact toolbox directory
-    gadepToolBox = os.path.join(projectPath, "GADEP.tbx")
-
-    # Import the Disaster Impact toolbox
-    arcpy.ImportToolbox(gadepToolBox, "tool")
-    # Run the Disaster Impact tool.
-    # Here we use the string "Bridges" because the Disaster Impact tool checks the 
-    # names of the feature layers contained in the "Infrastructures.gdb", and not
-    # the full path of them.
-    arcpy.DisasterImpact_tool("Bridges", em)
-
-    # Success message
-    message("Disaster Impact simulation successful!")
+def write_routes(rows, outputLayerFile):
+    spatialReference = arcpy.SpatialReference(WGS84)
+    arcpy.CreateFeatureclass_management(os.path.dirname(outputLayerFile), os.path.basename(outputLayerFile),
+                                        "POLYLINE", spatial_reference = spatialReference)
+    for field, fieldType in (("IncidentOID", "LONG"), ("FacilityOID", "LONG"), ("FacilityRank", "SHORT"), ("Total_Minutes", "DOUBLE")):
+        arcpy.AddField_management(outputLayerFile, field, fieldType)
+
+    with arcpy.da.InsertCursor(outputLayerFile, ["SHAPE@", "IncidentOID", "FacilityOID", "FacilityRank", "Total_Minutes"]) as cursor:
+        for incidentID, facilityID, rank, minutes, coordinates in rows:
+            line = arcpy.Polyline(arcpy.Array([arcpy.Point(long, lat) for long, lat in coordinates.tolist()]), spatialReference)
+            cursor.insertRow([line, incidentID, facilityID, rank, minutes])
 
+# ********************************************************************
+# Main Program
+# ********************************************************************
+# --------------------------------------------------------------------
+# Runs the tool in ArcGIS Pro
+# --------------------------------------------------------------------
+def main():
+    # ////////////////////////////////////////////////////////////////////
+    # Earthquake Simulation
+    # ////////////////////////////////////////////////////////////////////
+    # --------------------------------------------------------------------
+    # Setting directories
+    # --------------------------------------------------------------------
+    # First, we'll calculate the exceedance probability values of the bridges.
+    # Get the current directory of the script; it should look something like the following:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Scripts
+    scriptsPath = os.getcwd()
+
+    # However, we want to get the parent directory of the script. We'll get something like this:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP
+    # Then, in the same line, we compose a new directory.
+    # The resulting directory will look something like this:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Projects\GADEP
+    projectPath = os.path.join(os.path.dirname(scriptsPath), "Projects", "GADEP")
+
+    # Now that we have the main project path stored as a variable, we can use it to 
+    # compose a path for other directories we need to traverse to
+    # Path to "Infrastructures.gdb"
+    infrastructuresPath = os.path.join(projectPath, "Infrastructures.gdb")
+
+    # Path to "NetworkAnaysis.gdb"
+    networkAnalysisPath = os.path.join(projectPath, "NetworkAnalysis.gdb")
+
+    # Path to "TransportationNetwork.gdb"
+    transportationNetworkPath = os.path.join(projectPath, "TransportationNetwork.gdb")
+
+    # Path to the "GADEP.gdb"
+    gadepPath = os.path.join(projectPath, "GADEP.gdb")
+
+    # ////////////////////////////////////////////////////////////////////
+    # Disaster impact - bridges
+    # ////////////////////////////////////////////////////////////////////
+
+    # Get the boolean value of the first parameter.
+    runDisasterImpact = arcpy.GetParameter(0)
+
+    # Filtered bridges layer to be used in the Select_analysis function
+    bridgesFiltered = os.path.join(gadepPath, "BridgesFiltered")   
+
+    # If the boolean is true, then the Disaster Impact tool will be ran using only the bridges as
+    # its parameter.
+    if runDisasterImpact:
+        # Status messsage
+        message("Running Disaster Impact tool...")
+        # Bridges directory
+        bridges = os.path.join(infrastructuresPath, "Bridges")
+        # The earthquake magnitude chosen
+        em = arcpy.GetParameterAsText(1)
+
+        # The Disaster Impact toolbox directory
+        gadepToolBox = os.path.join(projectPath, "GADEP.tbx")
+
+        # Import the Disaster Impact toolbox
+        arcpy.ImportToolbox(gadepToolBox, "tool")
+        # Run the Disaster Impact tool.
+        # Here we use the string "Bridges" because the Disaster Impact tool checks the 
+        # names of the feature layers contained in the "Infrastructures.gdb", and not
+        # the full path of them.
+        with stage("Disaster Impact"):
+            arcpy.DisasterImpact_tool("Bridges", em)
+
+        # Success message
+        message("Disaster Impact simulation successful!")
+
+        # --------------------------------------------------------------------
+        # BridgesFiltered layer for routing
+        # --------------------------------------------------------------------
+        # After the simulation is complete, we'll create a new map layer called "BridgesFiltered".
+        # Using an SQL expression, this layer will consist of specific bridges given the expression.
+        # This layer will serve as the PointBarriers feature for the routing.
+
+        # The SQL expression that dictates what features will be selected
+        whereClause = 'Damage = \'Slight\' Or Damage = \'Moderate\' Or Damage = \'Extensive\' Or Damage = \'Complete\''     
+
+        # In the case that the bridge layer does not exist in the "Infrastructures.gdb", it will throw an error.
+        # Wrap the next function in a try-except statement to handle this case.
+        try: 
+            # The Select_analysis will take in the latest data in the "Bridges" feature layer and create/replace the values of the 
+            # 'BridgesFiltered' feature layer leaving only the values resulting from the SQL expression
+            arcpy.Select_analysis(bridges, bridgesFiltered, whereClause)
+        except:
+            message("A possible error occurred but it was caught. \n\
+                After this script completes the simulation, it filters the 'Bridges' layer. \n\
+                It's possible that this layer does not exist yet.")
+
+    message("Preparing for route analysis...")
+
+    # ////////////////////////////////////////////////////////////////////
+    # Routing Analysis
+    # ////////////////////////////////////////////////////////////////////
     # --------------------------------------------------------------------
-    # BridgesFiltered layer for routing
+    # Initializing variables for routing
     # --------------------------------------------------------------------
-    # After the simulation is complete, we'll create a new map layer called "BridgesFiltered".
-    # Using an SQL expression, this layer will consist of specific bridges given the expression.
-    # This layer will serve as the PointBarriers feature for the routing.
-
-    # The SQL expression that dictates what features will be selected
-    whereClause = 'Damage = \'Slight\' Or Damage = \'Moderate\' Or Damage = \'Extensive\' Or Damage = \'Complete\''     
-
-    # In the case that the bridge layer does not exist in the "Infrastructures.gdb", it will throw an error.
-    # Wrap the next function in a try-except statement to handle this case.
-    try: 
-        # The Select_analysis will take in the latest data in the "Bridges" feature layer and create/replace the values of the 
-        # 'BridgesFiltered' feature layer leaving only the values resulting from the SQL expression
-        arcpy.Select_analysis(bridges, bridgesFiltered, whereClause)
+    network = os.path.join(transportationNetworkPath, "OregonNetwork", "OregonNetworkDataset")  # Analysis network
+    travelMode = "Vehicle"                                                                      # Currently the only mode of transportation
+    # The name of the output layer.
+    # We concatenate a string of random integers at the end in order to create a unique layer each time.
+    defaultLayerName = "ClosestFacilities" + str(random.randint(100000,999999))  
+
+    # The incidents, facilities, and barriers that will be used in the analysis
+    incidents = arcpy.GetParameter(2)
+    incidentsWhereClause = arcpy.GetParameter(3)        # The SQL expression that will filter the incidents feature layer
+    facilities = arcpy.GetParameter(4)
+    facilitiesWhereClause = arcpy.GetParameter(5)       # The SQL expression that will filter the incidents feature layer
+    numberOfFacilities = arcpy.GetParameter(6)          # The number of facilities parameter value
+    analysisName = arcpy.GetParameter(7)                # The analysis name 
+    existingAnalysisName = arcpy.GetParameter(8)        # The existing analysis name
+
+    # The tenth (optional) parameter is the route solver:
+    # NETWORK_ANALYST - the ClosestFacility solver of the Network Analyst extension (default)
+    # NATIVE          - the built-in solver of RoadNetwork.py, on an export of the network dataset (no license needed)
+    solver = str(optional_parameter(9, "NETWORK_ANALYST")).upper() or "NETWORK_ANALYST"
+    # The eleventh (optional) parameter exports the network dataset again for the native solver
+    # (needed after the network dataset was edited)
+    refreshNetwork = bool(optional_parameter(10, False))
+    # The twelfth (optional) parameter is how the native solver searches (see RoadNetwork.SEARCHES):
+    # INCIDENT - one search from every incident
+    # FACILITY - a single reverse search from every facility at once, for many incidents and few facilities
+    #            (e.g. evacuation to shelters)
+    # AUTO     - FACILITY if there are fewer facilities than incidents (default)
+    search = str(optional_parameter(11, AUTO)).upper() or AUTO
+    # The thirteenth (optional) parameter is the closure threshold of the native solver: the bridges whose probability
+    # of the closure state (or worse) is at least this are closed, and the others are slowed down by their expected
+    # penalty (see BridgeBarriers.py). Empty closes every damaged bridge, like the Network Analyst solver.
+    closureProbability = optional_parameter(12, "")
+    closureProbability = None if closureProbability in ("", "#", None) else float(closureProbability)
+    # The fourteenth (optional) parameter is the closure state: the lowest damage state that closes a bridge (default Slight)
+    closureState = str(optional_parameter(13, "Slight")) or "Slight"
+
+    # Try to onvert the number of facilities parameter to an integer
+    try:
+        numberOfFacilities = int(numberOfFacilities)
+    # If we can't, then it's not a valid value. Default the value to 1.
     except:
-        message("A possible error occurred but it was caught. \n\
-            After this script completes the simulation, it filters the 'Bridges' layer. \n\
-            It's possible that this layer does not exist yet.")
+        numberOfFacilities = 1
 
-message("Preparing for route analysis...")
+    # Set the current workspace to the "NetworkAnalysis.gdb"
+    arcpy.env.workspace = networkAnalysisPath
+    # Store the names of the existing route analyses in a list
+    existingAnalyses = arcpy.ListFeatureClasses()
 
-# ////////////////////////////////////////////////////////////////////
-# Routing Analysis
-# ////////////////////////////////////////////////////////////////////
-# --------------------------------------------------------------------
-# Initializing variables for routing
-# --------------------------------------------------------------------
-network = os.path.join(transportationNetworkPath, "OregonNetwork", "OregonNetworkDataset")  # Analysis network
-travelMode = "Vehicle"                                                                      # Currently the only mode of transportation
-# The name of the output layer.
-# We concatenate a string of random integers at the end in order to create a unique layer each time.
-defaultLayerName = "ClosestFacilities" + str(random.randint(100000,999999))  
-
-# The incidents, facilities, and barriers that will be used in the analysis
-incidents = arcpy.GetParameter(2)
-incidentsWhereClause = arcpy.GetParameter(3)        # The SQL expression that will filter the incidents feature layer
-facilities = arcpy.GetParameter(4)
-facilitiesWhereClause = arcpy.GetParameter(5)       # The SQL expression that will filter the incidents feature layer
-numberOfFacilities = arcpy.GetParameter(6)          # The number of facilities parameter value
-analysisName = arcpy.GetParameter(7)                # The analysis name 
-existingAnalysisName = arcpy.GetParameter(8)        # The existing analysis name
-
-# Try to onvert the number of facilities parameter to an integer
-try:
-    numberOfFacilities = int(numberOfFacilities)
-# If we can't, then it's not a valid value. Default the value to 1.
-except:
-    numberOfFacilities = 1
-
-# Set the current workspace to the "NetworkAnalysis.gdb"
-arcpy.env.workspace = networkAnalysisPath
-# Store the names of the existing route analyses in a list
-existingAnalyses = arcpy.ListFeatureClasses()
-
-# If the existing analysis name parameter value exists in the list of existing analyses, then it will be overwritten.
-# Else, a new layer will be created.
-if existingAnalysisName in existingAnalyses:
-    layerName = existingAnalysisName
-    outputLayerFile = os.path.join(networkAnalysisPath, layerName)
-    arcpy.Delete_management(outputLayerFile)
-
-    message("Exisiting route layer will be overwritten.")
-else:
-    layerName = analysis_name(analysisName, defaultLayerName)
-    outputLayerFile = os.path.join(networkAnalysisPath, layerName)
-    message("New route layer will be created.")
+    # If the existing analysis name parameter value exists in the list of existing analyses, then it will be overwritten.
+    # Else, a new layer will be created.
+    if existingAnalysisName in existingAnalyses:
+        layerName = existingAnalysisName
+        outputLayerFile = os.path.join(networkAnalysisPath, layerName)
+        arcpy.Delete_management(outputLayerFile)
 
-# --------------------------------------------------------------------
-# Filter incidents and facilities
-# --------------------------------------------------------------------
-# Status message
-message("Applying your filters (if you selected any)...")
-
-# If the incidents feature layer is not a point feature, e.g., a polygon shape, it will be converted
-# into a point feature. Else, it will not change.
-incidents = feature_to_point(incidents, os.path.join(gadepPath, "IncidentsPoints"))
+        message("Exisiting route layer will be overwritten.")
+    else:
+        layerName = analysis_name(analysisName, defaultLayerName)
+        outputLayerFile = os.path.join(networkAnalysisPath, layerName)
+        message("New route layer will be created.")
 
-# The path for a new feature layer called "IncidentsFiltered"
-incidentsFiltered = os.path.join(gadepPath,"IncidentsFiltered")
+    # --------------------------------------------------------------------
+    # Filter incidents and facilities
+    # --------------------------------------------------------------------
+    # Status message
+    message("Applying your filters (if you selected any)...")
 
-# The Select_analysis will take in the latest data in the "incidents" feature layer and create (or replace, if it exists) the values of the 
-# 'IncidentsFiltered' feature layer per the SQL expression
-arcpy.Select_analysis(incidents, incidentsFiltered, incidentsWhereClause)
+    # If the incidents feature layer is not a point feature, e.g., a polygon shape, it will be converted
+    # into a point feature. Else, it will not change.
+    incidents = feature_to_point(incidents, os.path.join(gadepPath, "IncidentsPoints"))
 
-# If the facilities feature layer is not a point feature, e.g., a polygon shape, it will be converted
-# into a point feature. Else, it will not change.
-facilities = feature_to_point(facilities, os.path.join(gadepPath, "FacilitiesPoints"))
+    # The path for a new feature layer called "IncidentsFiltered"
+    incidentsFiltered = os.path.join(gadepPath,"IncidentsFiltered")
 
-# The path for a new feature layer called "IncidentsFiltered"
-facilitiesFiltered = os.path.join(gadepPath,"FacilitiesFiltered")
+    # The Select_analysis will take in the latest data in the "incidents" feature layer and create (or replace, if it exists) the values of the 
+    # 'IncidentsFiltered' feature layer per the SQL expression
+    arcpy.Select_analysis(incidents, incidentsFiltered, incidentsWhereClause)
 
-# The Select_analysis will take in the latest data in the "incidents" feature layer and create (or replace, if it exists) the values of the 
-# 'IncidentsFiltered' feature layer per the SQL expression
-arcpy.Select_analysis(facilities, facilitiesFiltered, facilitiesWhereClause)
+    # If the facilities feature layer is not a point feature, e.g., a polygon shape, it will be converted
+    # into a point feature. Else, it will not change.
+    facilities = feature_to_point(facilities, os.path.join(gadepPath, "FacilitiesPoints"))
 
-# --------------------------------------------------------------------
-# Start analysis
-# Reference: https://pro.arcgis.com/en/pro-app/latest/arcpy/network-analyst/closestfacility.htm
-# --------------------------------------------------------------------
-# Status message
-message("Preparing route analysis...")
+    # The path for a new feature layer called "IncidentsFiltered"
+    facilitiesFiltered = os.path.join(gadepPath,"FacilitiesFiltered")
 
-# Network name
-ndLayerName = "OregonNetworkDataset"
+    # The Select_analysis will take in the latest data in the "incidents" feature layer and create (or replace, if it exists) the values of the 
+    # 'IncidentsFiltered' feature layer per the SQL expression
+    arcpy.Select_analysis(facilities, facilitiesFiltered, facilitiesWhereClause)
 
-# Create a network dataset layer and get the desired travel mode for analysis
-arcpy.nax.MakeNetworkDatasetLayer(network, ndLayerName)
+    # --------------------------------------------------------------------
+    # Start analysis
+    # Reference: https://pro.arcgis.com/en/pro-app/latest/arcpy/network-analyst/closestfacility.htm
+    # --------------------------------------------------------------------
+    # Status message
+    message("Preparing route analysis...")
+
+    if solver == "NATIVE":
+        # --------------------------------------------------------------------
+        # Native solver (see RoadNetwork.py)
+        # --------------------------------------------------------------------
+        # The edge sources of the network dataset are exported once to "Projects\GADEP\OregonNetwork.network";
+        # later runs only load that folder (memory-mapped).
+        networkPath = os.path.join(projectPath, "OregonNetwork.network")
+        networkDatasetPath = os.path.dirname(network)
+        edgeTables = [os.path.join(networkDatasetPath, source.name) for source in arcpy.Describe(network).edgeSources]
+        backend = ArcpyBackend()
+        roadNetwork = open_network(backend, networkPath, edgeTables, refreshNetwork)
 
-# Instantiate a ClosestFacility solver object
-closestFacility = arcpy.nax.ClosestFacility(network)
-# Set properties
-closestFacility.travelMode = travelMode     # The mode of travel
-# The number of facilities the analysis will find for each incident
-closestFacility.defaultTargetFacilityCount = 1 if numberOfFacilities == "" or numberOfFacilities == "#" else int(numberOfFacilities)
-# Load inputs
-closestFacility.load(arcpy.nax.ClosestFacilityInputDataType.Facilities, facilitiesFiltered)
-closestFacility.load(arcpy.nax.ClosestFacilityInputDataType.Incidents, incidentsFiltered)
-closestFacility.load(arcpy.nax.ClosestFacilityInputDataType.PointBarriers, bridgesFiltered)
+        # Status message
+        message("Running analysis... Finding the nearest facilities.")
+
+        # The damaged bridges close the edges they are on; with a closure threshold every bridge closes or slows down
+        # its edge according to the probabilities of its damage states in the chosen scenario
+        barriers = bridgesFiltered if arcpy.Exists(bridgesFiltered) else None
+        factors = None
+        if closureProbability is not None:
+            barriers = os.path.join(infrastructuresPath, "Bridges")
+            factors = barrier_factors(backend, projectPath, barriers, arcpy.GetParameterAsText(1), closureProbability,
+                                      DAMAGE_LEVELS[closureState])
+        rows = solve_routes(backend, roadNetwork, incidentsFiltered, facilitiesFiltered, barriers, numberOfFacilities,
+                            search = search, barrierFactors = factors)
+
+        # Export the routes as a route layer
+        with stage("Export routes") as exportStage:
+            write_routes(rows, outputLayerFile)
+            exportStage.rows = len(rows)
+    else:
+        # Network name
+        ndLayerName = "OregonNetworkDataset"
+
+        with stage("Network dataset layer"):
+            # Create a network dataset layer and get the desired travel mode for analysis
+            arcpy.nax.MakeNetworkDatasetLayer(network, ndLayerName)
+
+            # Instantiate a ClosestFacility solver object
+            closestFacility = arcpy.nax.ClosestFacility(network)
+            # Set properties
+            closestFacility.travelMode = travelMode     # The mode of travel
+            # The number of facilities the analysis will find for each incident
+            closestFacility.defaultTargetFacilityCount = 1 if numberOfFacilities == "" or numberOfFacilities == "#" else int(numberOfFacilities)
+        with stage("Load inputs"):
+            # Load inputs
+            closestFacility.load(arcpy.nax.ClosestFacilityInputDataType.Facilities, facilitiesFiltered)
+            closestFacility.load(arcpy.nax.ClosestFacilityInputDataType.Incidents, incidentsFiltered)
+            closestFacility.load(arcpy.nax.ClosestFacilityInputDataType.PointBarriers, bridgesFiltered)
 
-# Status message
-message("Running analysis... Finding the nearest facilities.".format(numberOfFacilities))
+        # Status message
+        message("Running analysis... Finding the nearest facilities.".format(numberOfFacilities))
 
-# --------------------------------------------------------------------
-# Solve and export analysis
-# --------------------------------------------------------------------
-result = closestFacility.solve()
+        # --------------------------------------------------------------------
+        # Solve and export analysis
+        # --------------------------------------------------------------------
+        with stage("Solve routes (Network Analyst)") as solveStage:
+            result = closestFacility.solve()
+            solveStage.rows = result.count(arcpy.nax.ClosestFacilityOutputDataType.Routes)
 
-# Export the analysis as a route layer
-result.export(arcpy.nax.ClosestFacilityOutputDataType.Routes, outputLayerFile)
+        # Export the analysis as a route layer
+        with stage("Export routes"):
+            result.export(arcpy.nax.ClosestFacilityOutputDataType.Routes, outputLayerFile)
 
-# Status message
-message("Route analysis successful! Exporting the route layer...")
+    # Status message
+    message("Route analysis successful! Exporting the route layer...")
 
-# Add the route layer to the map
-aprx = arcpy.mp.ArcGISProject("CURRENT")
-aprxMap = aprx.listMaps("Map")[0] 
-aprxMap.addDataFromPath(outputLayerFile)
+    # Add the route layer to the map
+    aprx = arcpy.mp.ArcGISProject("CURRENT")
+    aprxMap = aprx.listMaps("Map")[0] 
+    aprxMap.addDataFromPath(outputLayerFile)
 
-# --------------------------------------------------------------------
-# Adjust route layer properties
-# References:
-# https://pro.arcgis.com/en/pro-app/latest/arcpy/mapping/uniquevaluerenderer-class.htm
-# --------------------------------------------------------------------
-# Once the layer is added to the map, adjust its physical properties.
-# Get the layer first.
-lyr = aprxMap.listLayers(layerName)[0]
-# Symbology object with adjustable properties
-sym = lyr.symbology
-
-# Update the symbology to render a unique color for every unique IncidentOID value
-sym.updateRenderer('UniqueValueRenderer')
-sym.renderer.fields = ['IncidentOID']
-
-# Loop through the groups in the current unique value render.
-for grp in sym.renderer.groups:
-    # Loop through the values in the group items (the group items are the values in the chosen renderer fields)
-    for itm in grp.items:
-        # For each layer:
-        # 1. Change the symbol style
-        itm.symbol.applySymbolFromGallery("Marker Arrow Line 3 (Bold)")
-        # 2. Set a random color to it
-        itm.symbol.outlineColor = {'RGB': random_rgb()}   
-
-# Apply new properties
-lyr.symbology = sym
-
-# Print success message
-message("Script completed successfully!")
\ No newline at end of file
+    # --------------------------------------------------------------------
+    # Adjust route layer properties
+    # References:
+    # https://pro.arcgis.com/en/pro-app/latest/arcpy/mapping/uniquevaluerenderer-class.htm
+    # --------------------------------------------------------------------
+    # Once the layer is added to the map, adjust its physical properties.
+    # Get the layer first.
+    lyr = aprxMap.listLayers(layerName)[0]
+    # Symbology object with adjustable properties
+    sym = lyr.symbology
+
+    # Update the symbology to render a unique color for every unique IncidentOID value
+    sym.updateRenderer('UniqueValueRenderer')
+    sym.renderer.fields = ['IncidentOID']
+
+    # Loop through the groups in the current unique value render.
+    for grp in sym.renderer.groups:
+        # Loop through the values in the group items (the group items are the values in the chosen renderer fields)
+        for itm in grp.items:
+            # For each layer:
+            # 1. Change the symbol style
+            itm.symbol.applySymbolFromGallery("Marker Arrow Line 3 (Bold)")
+            # 2. Set a random color to it
+            itm.symbol.outlineColor = {'RGB': random_rgb()}   
+
+    # Apply new properties
+    lyr.symbology = sym
+
+    # Print success message
+    message("Script completed successfully!")
+
+# The tool only runs when the script is started by ArcGIS Pro, not when it's imported
+if __name__ == "__main__":
+    # The timings of the run are printed when it ends (see Instrumentation.py)
+    with tracing(message):
+        main()
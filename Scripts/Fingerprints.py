@@ -0,0 +1,160 @@
+import hashlib      # Hashes the fragility records and the run settings
+import os           # Import os package to work with directories
+# NumPy lets us fingerprint a whole layer at once
+import numpy as np
+# Fingerprint tables are side tables, like the scenario tables
+from Scenarios import write_side_table
+
+# ********************************************************************
+# Asset Fingerprints
+# ********************************************************************
+# To re-run the Disaster Impact tool without recalculating every row, every asset gets a fingerprint: a 64 bit hash of
+#   - the run settings (the table the layer is stored in, the chosen scenarios, where the results are written, how the
+#     fragility curves are evaluated and the Monte Carlo settings),
+#   - its fragility number and the version of that fragility number's record in the fragility database,
+#   - its IM value in every chosen scenario, and
+#   - its pipe diameter.
+# The fingerprints and results of the last run are kept in "Projects\GADEP\Scenarios\{layer name}_fingerprints.npz":
+#   runKey       - hash of the run settings
+#   objectIDs    - int64 object IDs of the assets
+#   fingerprints - uint64 fingerprints
+#   damage       - (assets x scenarios) damage states ("" if the asset's fragility number is unknown)
+#   ep           - (assets x scenarios) EP values
+# Rows whose fingerprint hasn't changed keep their last results; only the other rows are calculated again.
+# A fragility record that changes upstream changes its version, and so the fingerprint of every asset using it.
+
+# Constants of the SplitMix64 mixing function
+MIX_INCREMENT = np.uint64(0x9E3779B97F4A7C15)
+MIX_MULTIPLIER_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_MULTIPLIER_2 = np.uint64(0x94D049BB133111EB)
+
+# --------------------------------------------------------------------
+# Returns the 64 bit hash of a text
+# --------------------------------------------------------------------
+def text_hash(text):
+    return np.uint64(int.from_bytes(hashlib.blake2b(str(text).encode("utf-8"), digest_size = 8).digest(), "little"))
+
+# --------------------------------------------------------------------
+# Mixes an array of 64 bit values into an array of hashes (SplitMix64)
+# --------------------------------------------------------------------
+def mix(hashes, values):
+    with np.errstate(over = "ignore"):
+        hashes = (hashes ^ values) + MIX_INCREMENT
+        hashes = (hashes ^ (hashes >> np.uint64(30))) * MIX_MULTIPLIER_1
+        hashes = (hashes ^ (hashes >> np.uint64(27))) * MIX_MULTIPLIER_2
+        return hashes ^ (hashes >> np.uint64(31))
+
+# --------------------------------------------------------------------
+# Returns the hash of the run settings.
+# A run with another evaluation mode (e.g. EXACT after TABLE) or other Monte Carlo settings calculates every row again,
+# so no row keeps results that were calculated another way. location is where the layer's table is stored (see
+# table_location in Backends.py): a layer with the same name in another workspace (e.g. a fresh copy of the database)
+# has its own results, so every row of it is calculated again.
+# --------------------------------------------------------------------
+def run_key(scenarioNames, output, evaluation = "EXACT", realizations = 0, seed = 0, imSigma = 0.0, imCorrelation = 0.0,
+            location = ""):
+    return text_hash("{}|{}|{}|{}|{}|{!r}|{!r}|{}".format(";".join(scenarioNames), output, evaluation, realizations, seed,
+                                                        float(imSigma), float(imCorrelation), os.path.normcase(str(location))))
+
+# --------------------------------------------------------------------
+# Returns the dictionary of fragility number -> version (hash of its fragility number and record)
+# --------------------------------------------------------------------
+def fragility_versions(fdDict):
+    return {fragNo: text_hash("{}|{}".format(fragNo, repr(tuple(record)))) for fragNo, record in fdDict.items()}
+
+# --------------------------------------------------------------------
+# Returns the fingerprints of the rows of a layer.
+# Parameters:
+#   key      - hash of the run settings (see run_key)
+#   versions - dictionary of fragility number -> version (see fragility_versions)
+#   fragNos  - list of fragility numbers, one per row
+#   IM       - (rows x scenarios) IM values
+#   D        - optional array of pipe diameters, one per row
+# --------------------------------------------------------------------
+def asset_fingerprints(key, versions, fragNos, IM, D = None):
+    IM = np.ascontiguousarray(IM, dtype = np.float64)
+    rowCount = IM.shape[0]
+
+    # Every distinct fragility number is hashed once; unknown fragility numbers get the hash of their name
+    unknown = {}
+    fragNoHashes = np.array([versions[fragNo] if fragNo in versions else unknown.setdefault(fragNo, text_hash(fragNo))
+                             for fragNo in fragNos], dtype = np.uint64).reshape(rowCount)
+
+    hashes = mix(np.full(rowCount, key, dtype = np.uint64), fragNoHashes)
+    # The bits of the float values are hashed, so NaN (no IM value) has a fingerprint too
+    for column in range(IM.shape[1]):
+        hashes = mix(hashes, IM[:, column].view(np.uint64))
+    if D is not None:
+        hashes = mix(hashes, np.ascontiguousarray(D, dtype = np.float64).view(np.uint64))
+    return hashes
+
+# --------------------------------------------------------------------
+# Returns the path of a layer's fingerprint table
+# --------------------------------------------------------------------
+def fingerprint_path(projectPath, layerName):
+    return os.path.join(projectPath, "Scenarios", layerName + "_fingerprints.npz")
+
+# --------------------------------------------------------------------
+# Reads a fingerprint table.
+# Returns (objectIDs, fingerprints, damage, ep), or None if the table doesn't exist or was written with other run settings.
+# --------------------------------------------------------------------
+def read_fingerprints(path, key):
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle = False) as table:
+            if np.uint64(table["runKey"]) != key:
+                return None
+            return table["objectIDs"], table["fingerprints"], table["damage"], table["ep"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+# --------------------------------------------------------------------
+# Writes a fingerprint table
+# --------------------------------------------------------------------
+def write_fingerprints(path, key, objectIDs, fingerprints, damage, ep):
+    write_side_table(path,
+                     runKey = np.array(key, dtype = np.uint64),
+                     objectIDs = np.asarray(objectIDs, dtype = np.int64),
+                     fingerprints = np.asarray(fingerprints, dtype = np.uint64),
+                     damage = np.array([["" if state is None else state for state in row] for row in damage], dtype = str),
+                     ep = np.asarray(ep, dtype = np.float64))
+
+# --------------------------------------------------------------------
+# Deletes a layer's fingerprint table, so the next run calculates every row again
+# (e.g. when the layer is created again and its result fields are empty)
+# --------------------------------------------------------------------
+def remove_fingerprints(projectPath, layerName):
+    path = fingerprint_path(projectPath, layerName)
+    if os.path.exists(path):
+        os.remove(path)
+
+# --------------------------------------------------------------------
+# Finds the rows whose fingerprint is the same as in the last run.
+# Returns (unchanged, damage, ep) where:
+#   unchanged - boolean array, True for the rows that can keep their last results
+#   damage    - (rows x scenarios) last damage states of the rows (None if unknown)
+#   ep        - (rows x scenarios) last EP values of the rows
+# --------------------------------------------------------------------
+def previous_results(table, objectIDs, fingerprints, scenarioCount):
+    objectIDs = np.asarray(objectIDs, dtype = np.int64)
+    rowCount = objectIDs.shape[0]
+    unchanged = np.zeros(rowCount, dtype = bool)
+    damage = [[None] * scenarioCount for _ in range(rowCount)]
+    ep = np.full((rowCount, scenarioCount), np.nan)
+    if table is None or table[0].shape[0] == 0:
+        return unchanged, damage, ep
+
+    tableObjectIDs, tableFingerprints, tableDamage, tableEP = table
+
+    # Find the table row of every object ID with a binary search over the sorted object IDs
+    order = np.argsort(tableObjectIDs, kind = "stable")
+    sortedObjectIDs = tableObjectIDs[order]
+    found = np.minimum(np.searchsorted(sortedObjectIDs, objectIDs), sortedObjectIDs.shape[0] - 1)
+    tableRows = order[found]
+    unchanged = (sortedObjectIDs[found] == objectIDs) & (tableFingerprints[tableRows] == fingerprints)
+
+    for position in np.flatnonzero(unchanged):
+        damage[position] = [state or None for state in tableDamage[tableRows[position]].tolist()]
+    ep[unchanged] = tableEP[tableRows[unchanged]]
+    return unchanged, damage, ep
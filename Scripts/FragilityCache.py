@@ -0,0 +1,197 @@
+import json         # Used to read the feature service's metadata
+import os           # Import os package to work with directories
+import time
+import urllib.parse
+import urllib.request
+# NumPy lets us store the fragility database as a compact columnar file (.npz)
+import numpy as np
+# The cache hit and miss counters of a traced run
+from Instrumentation import count_event
+
+# ********************************************************************
+# Fragility Database Cache
+# ********************************************************************
+# The fragility database is hosted on ArcGIS Online. Instead of streaming the whole table over the internet every
+# time the Disaster Impact tool runs, we keep a local copy next to the project (Projects\GADEP\FragilityDatabase.npz).
+# The copy stores one array per database column and is only downloaded again when:
+#   1. it doesn't exist yet (or was written by a different version of this module),
+#   2. the hosted table was edited after the copy was made, or
+#   3. a refresh is requested.
+# In offline mode the hosted table is never contacted, which lets the tools run on computers without internet access.
+
+# Bump this number whenever the layout of the cache file changes so old files get rebuilt
+CACHE_VERSION = 1
+
+# File name of the cache inside the project folder
+CACHE_FILE_NAME = "FragilityDatabase.npz"
+
+# --------------------------------------------------------------------
+# Returns the path of the cache file inside the project folder
+# --------------------------------------------------------------------
+def cache_path(projectPath):
+    return os.path.join(projectPath, CACHE_FILE_NAME)
+
+# --------------------------------------------------------------------
+# Asks the feature service when it was last edited.
+# Returns the edit date in milliseconds since 1970, or None if the service can't be reached
+# or doesn't report an edit date.
+# --------------------------------------------------------------------
+def service_last_edit_date(serviceUrl, timeout = 10):
+    try:
+        with urllib.request.urlopen(serviceUrl + "?f=json", timeout = timeout) as response:
+            metadata = json.load(response)
+    except (OSError, ValueError):
+        return None
+    return metadata.get("editingInfo", {}).get("lastEditDate")
+
+# --------------------------------------------------------------------
+# Reads the rows of the hosted table through the feature service's REST query endpoint, without arcpy.
+# The service only returns a limited number of records per request, so the rows are read page by page.
+# Returns a list of rows (tuples) in the order of fdFields.
+# --------------------------------------------------------------------
+def query_service(serviceUrl, fdFields, pageSize = 2000, timeout = 30):
+    rows = []
+    while True:
+        parameters = urllib.parse.urlencode({
+            "where": "1=1",
+            "outFields": ",".join(fdFields),
+            "returnGeometry": "false",
+            "orderByFields": fdFields[0],
+            "resultOffset": len(rows),
+            "resultRecordCount": pageSize,
+            "f": "json",
+        })
+        with urllib.request.urlopen(serviceUrl + "/query?" + parameters, timeout = timeout) as response:
+            page = json.load(response)
+        if "error" in page:
+            raise RuntimeError("The fragility database service returned an error: {}".format(page["error"].get("message")))
+
+        features = page.get("features", [])
+        rows.extend(tuple(feature["attributes"].get(field) for field in fdFields) for feature in features)
+        # The service sets exceededTransferLimit while there are more pages to read
+        if not features or not page.get("exceededTransferLimit"):
+            return rows
+
+# --------------------------------------------------------------------
+# Writes the fragility database to the cache file.
+# fdFields is the list of column names and rows is a list of rows (tuples) in that column order.
+# Each column is stored as an integer, float or string array plus a mask of the null values.
+# --------------------------------------------------------------------
+def write_cache(path, fdFields, rows, lastEditDate):
+    arrays = {
+        "version": np.array(CACHE_VERSION),
+        "fields": np.array(fdFields, dtype = str),
+        "lastEditDate": np.array(-1 if lastEditDate is None else lastEditDate, dtype = np.int64),
+        "cachedAt": np.array(time.time()),
+    }
+
+    for column, field in enumerate(fdFields):
+        values = [row[column] for row in rows]
+        nulls = np.array([value is None for value in values], dtype = bool)
+        present = [value for value in values if value is not None]
+
+        # Pick the most compact array type that holds every value in the column
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+            data = np.array([0 if value is None else value for value in values], dtype = np.int64)
+        elif all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+            data = np.array([np.nan if value is None else value for value in values], dtype = np.float64)
+        else:
+            data = np.array(["" if value is None else str(value) for value in values], dtype = str)
+
+        arrays["column_{}".format(column)] = data
+        arrays["null_{}".format(column)] = nulls
+
+    # Write to a temporary file first so a failed write never leaves a broken cache behind
+    temporaryPath = path + ".tmp.npz"
+    np.savez_compressed(temporaryPath, **arrays)
+    os.replace(temporaryPath, path)
+
+# --------------------------------------------------------------------
+# Reads the cache file.
+# Returns a (rows, lastEditDate) tuple, or None if the file doesn't exist, was written by a
+# different CACHE_VERSION, or holds different columns than fdFields.
+# lastEditDate is None if the edit date of the service wasn't known when the cache was written.
+# --------------------------------------------------------------------
+def read_cache(path, fdFields):
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle = False) as cache:
+            if int(cache["version"]) != CACHE_VERSION or list(cache["fields"]) != list(fdFields):
+                return None
+
+            columns = []
+            for column in range(len(fdFields)):
+                data = cache["column_{}".format(column)]
+                nulls = cache["null_{}".format(column)]
+                # .tolist() turns the NumPy values back into plain Python ints, floats and strings
+                columns.append([None if isNull else value for value, isNull in zip(data.tolist(), nulls.tolist())])
+
+            lastEditDate = int(cache["lastEditDate"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+    rows = list(zip(*columns))
+    return rows, (None if lastEditDate < 0 else lastEditDate)
+
+# --------------------------------------------------------------------
+# Returns the fragility database as a dictionary in the same structure the tools have always used:
+# [Fragility_no] = (the remaining columns of fdFields)
+#
+# Parameters:
+#   serviceUrl  - URL of the hosted fragility database
+#   fdFields    - list of columns to read (Fragility_no first)
+#   path        - path of the cache file
+#   readService - function that takes no arguments and returns the rows of the hosted table
+#                 (e.g. lambda: arcpy.da.SearchCursor(serviceUrl, fdFields) or lambda: query_service(serviceUrl, fdFields))
+#   refresh     - always download the hosted table and rewrite the cache
+#   offline     - never contact the hosted table; only the cache is used
+#   message     - function used to print status messages
+# --------------------------------------------------------------------
+def load_fragility_database(serviceUrl, fdFields, path, readService, refresh = False, offline = False, message = print):
+    cached = None if refresh else read_cache(path, fdFields)
+
+    if offline:
+        if refresh:
+            raise RuntimeError("The fragility database can't be refreshed in offline mode.")
+        if cached is None:
+            raise RuntimeError("Offline mode was chosen but there is no usable fragility database cache at '{}'.".format(path))
+        message("Offline mode: using the local fragility database cache.")
+        count_event("Fragility database cache hit")
+        return rows_to_dictionary(cached[0])
+
+    lastEditDate = service_last_edit_date(serviceUrl)
+
+    if cached is not None:
+        cachedRows, cachedEditDate = cached
+        # The service couldn't be reached; the cache is the best we have
+        if lastEditDate is None:
+            message("The fragility database service couldn't be checked for edits; using the local cache.")
+            count_event("Fragility database cache hit")
+            return rows_to_dictionary(cachedRows)
+        # The service hasn't been edited since the cache was made
+        if cachedEditDate is not None and lastEditDate <= cachedEditDate:
+            message("Using the local fragility database cache (up to date).")
+            count_event("Fragility database cache hit")
+            return rows_to_dictionary(cachedRows)
+        message("The fragility database has been edited since it was cached; downloading it again...")
+    else:
+        message("Downloading the fragility database...")
+
+    count_event("Fragility database cache miss")
+    rows = [tuple(row) for row in readService()]
+    try:
+        write_cache(path, fdFields, rows, lastEditDate)
+        message("Fragility database cached to '{}'.".format(path))
+    except OSError as error:
+        # A read-only project folder shouldn't stop the simulation
+        message("The fragility database couldn't be cached: {}".format(error))
+
+    return rows_to_dictionary(rows)
+
+# --------------------------------------------------------------------
+# Builds the fragility database dictionary from its rows
+# --------------------------------------------------------------------
+def rows_to_dictionary(rows):
+    return {row[0]:(row[1:]) for row in rows}
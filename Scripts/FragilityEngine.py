@@ -0,0 +1,386 @@
+# ast lets us parse the polynomial formulas once without handing them to eval()
+import ast
+# NumPy lets us evaluate the fragility functions for a whole column of IM values at once
+import numpy as np
+# Import scipy package and tools to make our calculations accurate
+from scipy.stats import norm
+
+# ********************************************************************
+# Constants
+# ********************************************************************
+# The max number of damage states an infrastructure can have
+MAX_STATES = 5
+
+# Index positions of the (Damage state, median, standard deviation) columns for each damage state
+# in the fdDict value tuples (see the fdDict structure in DisasterImpact.py).
+# Damage state 5 comes after the 'Fragility_polynomial' column, which is why it skips index 17.
+STATE_INDEXES = ((5, 6, 7), (8, 9, 10), (11, 12, 13), (14, 15, 16), (18, 19, 20))
+
+# ********************************************************************
+# Polynomial Compiler
+# ********************************************************************
+# The formulas in the 'Fragility_polynomial' column (e.g. "0.00187 * PGV ^ 2 * log(D)") are parsed once into
+# a Python syntax tree. Only arithmetic, log, exp, ^ (power), numbers, the IM description and D (the pipe diameter)
+# are allowed; anything else is rejected. The tree is then turned into a function that takes whole arrays of
+# IM and D values, so every asset in a group is evaluated with a handful of NumPy calls.
+
+# Arithmetic operators allowed in a formula
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+}
+UNARY_OPERATORS = {
+    ast.USub: np.negative,
+    ast.UAdd: np.positive,
+}
+
+# --------------------------------------------------------------------
+# log(x) is the natural log like math.log; log(x, base) is also accepted
+# --------------------------------------------------------------------
+def polynomial_log(value, base = None):
+    if base is None:
+        return np.log(value)
+    return np.log(value) / np.log(base)
+
+# Functions allowed in a formula and the number of arguments they accept
+FUNCTIONS = {
+    "log": (polynomial_log, (1, 2)),
+    "exp": (np.exp, (1,)),
+}
+
+# --------------------------------------------------------------------
+# Turns one node of the syntax tree into a function of (IM, D).
+# Raises a ValueError for anything that isn't on the whitelist.
+# --------------------------------------------------------------------
+def compile_node(node, IMDesc):
+    if isinstance(node, ast.Expression):
+        return compile_node(node.body, IMDesc)
+
+    # Numbers
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        value = float(node.value)
+        return lambda IM, D: value
+
+    # The IM description (e.g. PGA) and the pipe diameter D
+    if isinstance(node, ast.Name):
+        if node.id == IMDesc:
+            return lambda IM, D: IM
+        if node.id == "D":
+            return lambda IM, D: D
+        raise ValueError("Unknown name '{}' in fragility polynomial".format(node.id))
+
+    # a + b, a - b, a * b, a / b, a ** b
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        operator = BINARY_OPERATORS[type(node.op)]
+        left = compile_node(node.left, IMDesc)
+        right = compile_node(node.right, IMDesc)
+        return lambda IM, D: operator(left(IM, D), right(IM, D))
+
+    # -a, +a
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        operator = UNARY_OPERATORS[type(node.op)]
+        operand = compile_node(node.operand, IMDesc)
+        return lambda IM, D: operator(operand(IM, D))
+
+    # log(...), exp(...)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and not node.keywords:
+        function, argumentCounts = FUNCTIONS[node.func.id]
+        if len(node.args) not in argumentCounts:
+            raise ValueError("Wrong number of arguments to '{}' in fragility polynomial".format(node.func.id))
+        arguments = [compile_node(argument, IMDesc) for argument in node.args]
+        return lambda IM, D: function(*[argument(IM, D) for argument in arguments])
+
+    raise ValueError("'{}' is not allowed in a fragility polynomial".format(type(node).__name__))
+
+# --------------------------------------------------------------------
+# Compiles a 'Fragility_polynomial' formula into a function that takes an array of IM values and an
+# array of pipe diameters (D) and returns an array of EP values.
+# In the database, ^ means "to the power of" (** in Python).
+# --------------------------------------------------------------------
+def compile_polynomial(polynomial, IMDesc):
+    try:
+        tree = ast.parse(str(polynomial).strip().replace("^", "**"), mode = "eval")
+    except SyntaxError as error:
+        raise ValueError("Invalid fragility polynomial '{}'".format(polynomial)) from error
+    evaluator = compile_node(tree, IMDesc)
+
+    def polynomial_function(IM, D):
+        # Invalid math (e.g. the log of a negative number) results in NaN instead of an error
+        with np.errstate(divide = "ignore", invalid = "ignore", over = "ignore"):
+            return np.broadcast_to(np.asarray(evaluator(IM, D), dtype = float), np.shape(IM))
+
+    return polynomial_function
+
+# ********************************************************************
+# Fragility Curve
+# ********************************************************************
+# --------------------------------------------------------------------
+# A fragility curve is built once per fragility number when the fragility database is loaded.
+# The raw strings of the fragility database record are parsed here so that evaluating the curve
+# for a group of rows is only array math.
+#
+# Attributes:
+#   fragNo        - Fragility_no (string)
+#   hazard        - Hazard_type
+#   IMDesc        - IM description (e.g. PGA, PGV, etc.)
+#   IMUnit        - IM unit
+#   distribution  - Fragility_distribution (Discrete, Lognormal, Normal or Polynomial)
+#   stateNames    - tuple of damage state names
+#   medians       - array of medians, one per damage state (Lognormal and Normal only)
+#   betas         - array of standard deviations, one per damage state (Lognormal and Normal only)
+#   logMedians    - array of log(median), one per damage state (Lognormal only)
+#   breakpoints   - tuple of (IM array, EP array, end slope) per damage state (Discrete only)
+#   polynomial    - Fragility_polynomial formula (Polynomial only)
+#   polynomialFunction - compiled Fragility_polynomial formula (Polynomial only)
+#   evaluator     - the method that calculates the EP matrix for this distribution
+# --------------------------------------------------------------------
+class FragilityCurve:
+    __slots__ = (
+        "fragNo", "hazard", "IMDesc", "IMUnit", "distribution", "stateNames",
+        "medians", "betas", "logMedians", "breakpoints", "polynomial", "polynomialFunction", "evaluator"
+    )
+
+    def __init__(self, fragNo, fdRecord):
+        self.fragNo = fragNo
+        self.hazard = fdRecord[0]
+        self.IMDesc = fdRecord[1]
+        self.IMUnit = fdRecord[2]
+        self.distribution = fdRecord[3]
+        self.polynomial = fdRecord[17]
+
+        # Only keep the damage states stated in the 'No_of_damage_state' column
+        states = STATE_INDEXES[:int(fdRecord[4])]
+        self.stateNames = tuple(fdRecord[stateIndex] for stateIndex, _, _ in states)
+
+        self.medians = None
+        self.betas = None
+        self.logMedians = None
+        self.breakpoints = None
+        self.polynomialFunction = None
+
+        if self.distribution == "Lognormal" or self.distribution == "Normal":
+            self.medians = np.array([float(fdRecord[medIndex]) for _, medIndex, _ in states])
+            self.betas = np.array([float(fdRecord[stdIndex]) for _, _, stdIndex in states])
+            if self.distribution == "Lognormal":
+                self.logMedians = np.log(self.medians)
+                self.evaluator = self._lognormal
+            else:
+                self.evaluator = self._normal
+        elif self.distribution == "Discrete":
+            self.breakpoints = tuple(discrete_breakpoints(fdRecord[medIndex], fdRecord[stdIndex]) for _, medIndex, stdIndex in states)
+            self.evaluator = self._discrete
+        elif self.distribution == "Polynomial":
+            self.polynomialFunction = compile_polynomial(self.polynomial, self.IMDesc)
+            self.evaluator = self._polynomial
+        else:
+            raise ValueError("Unknown fragility distribution '{}'".format(self.distribution))
+
+    # --------------------------------------------------------------------
+    # Returns a float matrix with one row per IM value and one column per damage state.
+    # D is an optional array of pipe diameters (one per IM value); it's only used by polynomial curves
+    # and defaults to 1 for rows that don't have one.
+    # --------------------------------------------------------------------
+    def evaluate(self, IM, D = None):
+        IM = np.asarray(IM, dtype = float)
+        if self.distribution == "Polynomial":
+            return self.evaluator(IM, pipe_diameters(D, IM.shape[0]))
+        return self.evaluator(IM)
+
+    # --------------------------------------------------------------------
+    # Lognormal Distribution Function
+    # Same as lognorm.cdf(IM, std, scale = median), calculated for every damage state in one call.
+    # Reference: https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.lognorm.html
+    # --------------------------------------------------------------------
+    def _lognormal(self, IM):
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            logIM = np.log(IM)
+        # An IM value of 0 or less can't exceed any damage state
+        logIM = np.where(IM > 0, logIM, np.where(np.isnan(IM), np.nan, -np.inf))
+        return norm.cdf((logIM[:, None] - self.logMedians) / self.betas)
+
+    # --------------------------------------------------------------------
+    # Normal Distribution
+    # Same as (1 + erf((IM - med) / sqrt(2) / std)) / 2, calculated for every damage state in one call.
+    # --------------------------------------------------------------------
+    def _normal(self, IM):
+        return norm.cdf((IM[:, None] - self.medians) / self.betas)
+
+    # --------------------------------------------------------------------
+    # Discrete Distribution Function
+    # Linear interpolation between the breakpoints. IM values below the first breakpoint default to the
+    # first breakpoint, and IM values past the last breakpoint are extrapolated with the last segment's slope.
+    # --------------------------------------------------------------------
+    def _discrete(self, IM):
+        matrix = np.empty((IM.shape[0], len(self.breakpoints)))
+        for column, (x, y, endSlope) in enumerate(self.breakpoints):
+            matrix[:, column] = np.interp(IM, x, y) + np.maximum(IM - x[-1], 0) * endSlope
+        return matrix
+
+    # --------------------------------------------------------------------
+    # Polynomial Distribution Function
+    # Every damage state shares the same formula.
+    # --------------------------------------------------------------------
+    def _polynomial(self, IM, D):
+        values = self.polynomialFunction(IM, D)
+        return np.repeat(values.reshape(-1, 1), len(self.stateNames), axis = 1)
+
+# --------------------------------------------------------------------
+# Returns an array of pipe diameters for rowCount rows.
+# Missing diameters (no array at all, or NaN values) default to 1.
+# --------------------------------------------------------------------
+def pipe_diameters(D, rowCount):
+    if D is None:
+        return np.ones(rowCount)
+    D = np.asarray(D, dtype = float)
+    return np.where(np.isnan(D), 1.0, D)
+
+# --------------------------------------------------------------------
+# Parses the discrete 'med' and 'std' strings of a damage state.
+# For discrete distributions, med and std are strings of values concatenated together where
+# the median acts as the IM values (e.g. PGA), and the std acts as the EP values.
+# Returns the sorted IM breakpoints, their EP values and the slope used to extrapolate past the last breakpoint.
+# --------------------------------------------------------------------
+def discrete_breakpoints(med, std):
+    x = np.array([float(num) for num in med.split()])
+    y = np.array([float(num) for num in std.split()])
+    order = np.argsort(x, kind = "stable")
+    x = x[order]
+    y = y[order]
+    endSlope = (y[-1] - y[-2]) / (x[-1] - x[-2]) if x.shape[0] > 1 else 0.0
+    return x, y, endSlope
+
+# --------------------------------------------------------------------
+# Builds a FragilityCurve for every record in the fragility database.
+# Returns a dictionary where:
+# key: fragility number (string)
+# value: FragilityCurve
+# Records that can't be parsed (e.g. missing medians, or a polynomial that isn't on the whitelist) are left out, just
+# like fragility numbers that don't exist in the database. When a rejected dictionary is given, the reason each record
+# was left out is added to it (key: fragility number, value: error message), so the tools can report them.
+# --------------------------------------------------------------------
+def load_fragility_curves(fdDict, rejected = None):
+    curves = {}
+    for fragNo, fdRecord in fdDict.items():
+        try:
+            curves[fragNo] = FragilityCurve(fragNo, fdRecord)
+        except (TypeError, ValueError, IndexError, AttributeError) as error:
+            if rejected is not None:
+                rejected[fragNo] = str(error) or type(error).__name__
+    return curves
+
+# ********************************************************************
+# Damage States
+# ********************************************************************
+# --------------------------------------------------------------------
+# Takes in a matrix of EP values (rows x damage states) and returns, for every row, the column of the
+# state whose EP is the lowest one that is still >= 0.5, along with that EP.
+# Rows where no EP is >= 0.5 get a column of -1 and the EP of the first state.
+# --------------------------------------------------------------------
+def return_states(matrix):
+    matrix = np.asarray(matrix, dtype = float)
+    # Replace every EP below 0.5 (and any NaN) with infinity so argmin skips them
+    candidates = np.where(matrix >= 0.5, matrix, np.inf)
+    columns = np.argmin(candidates, axis = 1)
+    rows = np.arange(matrix.shape[0])
+    found = np.isfinite(candidates[rows, columns])
+
+    eps = np.where(found, matrix[rows, columns], matrix[:, 0])
+    columns = np.where(found, columns, -1)
+    return columns, eps
+
+# --------------------------------------------------------------------
+# Groups the row positions of a layer by their fragility number.
+# Returns a dictionary where:
+# key: fragility number (string)
+# value: array of row positions with that fragility number
+# --------------------------------------------------------------------
+def group_by_frag_no(fragNos):
+    groups = {}
+    for position, fragNo in enumerate(fragNos):
+        groups.setdefault(fragNo, []).append(position)
+    return {fragNo: np.array(positions, dtype = np.intp) for fragNo, positions in groups.items()}
+
+# --------------------------------------------------------------------
+# Runs the damage simulation for a whole layer at once.
+# curves is the dictionary returned by load_fragility_curves, fragNos is a list of fragility numbers (strings)
+# and IM is an array of IM values, one per row. D is an optional array of pipe diameters, one per row.
+# tables is an optional FragilityTables object (see FragilityTables.py) that evaluates the curves with lookup tables
+# or a memo instead of exactly.
+# Returns:
+#   damage - list of damage states, one per row ("None" if no EP is >= 0.5, None if the fragility number is unknown)
+#   ep     - array of the EP values that go with the damage states (NaN if the fragility number is unknown)
+#   epMatrix - (rows x MAX_STATES) float matrix of every damage state's EP, padded with NaN
+# --------------------------------------------------------------------
+def simulate_layer(curves, fragNos, IM, D = None, tables = None):
+    IM = np.asarray(IM, dtype = float)
+    damage, ep, epMatrix = simulate_scenarios(curves, fragNos, IM.reshape(-1, 1), D, tables)
+    return [row[0] for row in damage], ep[:, 0], epMatrix[:, 0, :]
+
+# --------------------------------------------------------------------
+# Runs the damage simulation of a whole layer for several scenarios at once.
+# IM is a (rows x scenarios) matrix of IM values; every scenario of a fragility group is evaluated in the same call.
+# tables is an optional FragilityTables object, like in simulate_layer.
+# names=False skips the damage state names (damage is then None), e.g. for the (rows x realizations) sampled IM values of
+# the Monte Carlo mode, which only need the EP values.
+# Returns:
+#   damage - list (one per row) of lists (one per scenario) of damage states
+#   ep     - (rows x scenarios) array of the EP values that go with the damage states
+#   epMatrix - (rows x scenarios x MAX_STATES) float array of every damage state's EP, padded with NaN
+# --------------------------------------------------------------------
+def simulate_scenarios(curves, fragNos, IM, D = None, tables = None, names = True):
+    IM = np.asarray(IM, dtype = float)
+    rowCount, scenarioCount = IM.shape
+    D = pipe_diameters(D, rowCount)
+    # The damage states are gathered in an object array and turned into lists once at the end
+    damage = np.full((rowCount, scenarioCount), None, dtype = object) if names else None
+    ep = np.full((rowCount, scenarioCount), np.nan)
+    epMatrix = np.full((rowCount, scenarioCount, MAX_STATES), np.nan)
+
+    for fragNo, positions in group_by_frag_no(fragNos).items():
+        # Skip fragility numbers that don't exist in the fragility database
+        curve = curves.get(fragNo)
+        if curve is None:
+            continue
+
+        # Flatten the group's (rows x scenarios) IM values so every row and scenario is evaluated in one call
+        groupIM = IM[positions].ravel()
+        groupD = np.repeat(D[positions], scenarioCount)
+        matrix = curve.evaluate(groupIM, groupD) if tables is None else tables.evaluate(curve, groupIM, groupD)
+        columns, groupEPs = return_states(matrix)
+
+        stateCount = matrix.shape[1]
+        epMatrix[positions, :, :stateCount] = matrix.reshape(positions.shape[0], scenarioCount, stateCount)
+        ep[positions] = groupEPs.reshape(positions.shape[0], scenarioCount)
+
+        # Damage state names of the group; the last entry (column -1) is "None"
+        if names:
+            stateNames = np.array(list(curve.stateNames) + ["None"], dtype = object)
+            damage[positions] = stateNames[columns.reshape(positions.shape[0], scenarioCount)]
+
+    return damage.tolist() if names else None, ep, epMatrix
+
+# ********************************************************************
+# Single asset helpers
+# ********************************************************************
+# --------------------------------------------------------------------
+# Returns a dictionary containing the right number of damage states for a single IM value where:
+# key: Damage state (string)
+# value: EP value (float)
+# --------------------------------------------------------------------
+def damage_states(curves, fragNo, numberOfStates, IM):
+    curve = curves[fragNo]
+    matrix = curve.evaluate([IM])
+    return {stateName: float(value) for stateName, value in zip(curve.stateNames[:numberOfStates], matrix[0])}
+
+# --------------------------------------------------------------------
+# Takes in the dictionary of damage states and their EP values and
+# returns the state that is >= 0.5 as a (state, EP) tuple
+# --------------------------------------------------------------------
+def return_state(dict):
+    columns, eps = return_states([list(dict.values())])
+    if columns[0] < 0:
+        return ("None", float(eps[0]))
+    return (list(dict.keys())[columns[0]], float(eps[0]))
@@ -0,0 +1,189 @@
+# NumPy lets us look up a whole column of IM values at once
+import numpy as np
+# The exact fragility curves the tables are built from
+from FragilityEngine import pipe_diameters
+# The cache hit and miss counters of a traced run
+from Instrumentation import count_event
+
+# ********************************************************************
+# Fragility Lookup Tables
+# ********************************************************************
+# PGA values only carry a few significant digits and many assets share the same fragility number, so evaluating
+# every fragility curve exactly for every asset repeats a lot of work. Two optional evaluation modes avoid that:
+#
+# TABLE - The EP values of every damage state of a curve are calculated once on a fine IM grid (evenly spaced in
+#         log(IM) between IM_RANGE[0] and IM_RANGE[1]) and assets are then evaluated by linear interpolation in the
+#         table, without scipy. The grid starts at POINTS_PER_DECADE points per power of 10 and is made finer until
+#         the interpolation error, measured at the midpoint of every grid interval (where the error of a smooth curve
+#         is largest), is at most TABLE_MAX_ERROR. Curves that can't reach that within MAX_POINTS_PER_DECADE, or that
+#         have invalid values (e.g. NaN) on the grid, and IM values outside IM_RANGE are evaluated exactly.
+#         Discrete curves usually end up being evaluated exactly: their breakpoints are kinks that a log(IM) grid can't
+#         follow closely enough, and their exact evaluation is already a table interpolation (np.interp).
+#         Maximum error: TABLE_MAX_ERROR (1e-5) on every EP value, or 1e-5 times the value for values above 1
+#         (e.g. polynomial repair rates).
+# MEMO  - Every curve is evaluated exactly, but only once per distinct IM value. The results are remembered by
+#         (Frag_no, IM), so the same IM value is never evaluated twice, across layers, chunks and scenarios.
+#         Maximum error: 0 (the results are the exact values).
+#
+# Polynomial curves also depend on the pipe diameter (D); they get one table (or memo) per distinct diameter.
+
+# Evaluation modes
+EXACT = "EXACT"
+TABLE = "TABLE"
+MEMO = "MEMO"
+MODES = (EXACT, TABLE, MEMO)
+
+# Max interpolation error of a table
+TABLE_MAX_ERROR = 1e-5
+
+# IM values covered by the tables
+IM_RANGE = (1e-3, 1e3)
+
+# Grid resolution of the tables: the first try, and the finest allowed
+POINTS_PER_DECADE = 500
+MAX_POINTS_PER_DECADE = 8000
+
+# --------------------------------------------------------------------
+# The lookup table of one fragility curve (and one pipe diameter for polynomial curves)
+#
+# Attributes:
+#   start    - log of the first IM value of the grid
+#   step     - distance between two grid points (in log(IM))
+#   values   - (grid points x damage states) EP values
+#   maxError - largest interpolation error measured when the table was built (relative for values above 1)
+# --------------------------------------------------------------------
+class FragilityTable:
+    __slots__ = ("start", "step", "values", "maxError")
+
+    def __init__(self, start, step, values, maxError):
+        self.start = start
+        self.step = step
+        self.values = values
+        self.maxError = maxError
+
+    # --------------------------------------------------------------------
+    # Returns the (rows x damage states) EP values of IM values inside IM_RANGE, by linear interpolation
+    # --------------------------------------------------------------------
+    def lookup(self, IM):
+        position = (np.log(IM) - self.start) / self.step
+        lower = np.clip(np.floor(position).astype(np.intp), 0, self.values.shape[0] - 2)
+        fraction = (position - lower)[:, None]
+        return self.values[lower] * (1 - fraction) + self.values[lower + 1] * fraction
+
+# --------------------------------------------------------------------
+# Builds the lookup table of a curve for one pipe diameter.
+# Returns None if no grid within MAX_POINTS_PER_DECADE reaches TABLE_MAX_ERROR.
+# --------------------------------------------------------------------
+def build_table(curve, diameter = 1.0):
+    low, high = np.log(IM_RANGE[0]), np.log(IM_RANGE[1])
+    decades = np.log10(IM_RANGE[1]) - np.log10(IM_RANGE[0])
+
+    pointsPerDecade = POINTS_PER_DECADE
+    while pointsPerDecade <= MAX_POINTS_PER_DECADE:
+        grid = np.linspace(low, high, int(decades * pointsPerDecade) + 1)
+        step = grid[1] - grid[0]
+        values = curve.evaluate(np.exp(grid), np.full(grid.shape[0], diameter))
+
+        # Compare the interpolated and the exact values halfway between the grid points
+        midpoints = grid[:-1] + step / 2
+        exact = curve.evaluate(np.exp(midpoints), np.full(midpoints.shape[0], diameter))
+        if not (np.isfinite(values).all() and np.isfinite(exact).all()):
+            return None
+        maxError = float((np.abs((values[:-1] + values[1:]) / 2 - exact) / np.maximum(np.abs(exact), 1)).max())
+        if maxError <= TABLE_MAX_ERROR:
+            return FragilityTable(low, step, values, maxError)
+        pointsPerDecade *= 2
+    return None
+
+# --------------------------------------------------------------------
+# Evaluates fragility curves with lookup tables or a memo (see above).
+# The tables and the memo are built the first time a curve is used and kept for the next calls, so one
+# FragilityTables object should be used for a whole run (every worker process has its own).
+# --------------------------------------------------------------------
+class FragilityTables:
+    def __init__(self, mode = TABLE):
+        if mode not in (TABLE, MEMO):
+            raise ValueError("Unknown evaluation mode '{}'".format(mode))
+        self.mode = mode
+        # Dictionary of (Frag_no, diameter) -> FragilityTable (None if the curve can't be tabulated)
+        self.tables = {}
+        # Dictionary of (Frag_no, diameter) -> (sorted IM values, (IM values x damage states) EP values)
+        self.memo = {}
+
+    # --------------------------------------------------------------------
+    # Same as curve.evaluate(IM, D): returns a float matrix with one row per IM value and one column per damage state
+    # --------------------------------------------------------------------
+    def evaluate(self, curve, IM, D = None):
+        IM = np.asarray(IM, dtype = float)
+        D = pipe_diameters(D, IM.shape[0])
+
+        # Only polynomial curves depend on the pipe diameter
+        if curve.distribution != "Polynomial":
+            return self.evaluate_diameter(curve, IM, 1.0)
+
+        matrix = np.empty((IM.shape[0], len(curve.stateNames)))
+        diameters, groups = np.unique(D, return_inverse = True)
+        for group, diameter in enumerate(diameters.tolist()):
+            rows = groups.ravel() == group
+            matrix[rows] = self.evaluate_diameter(curve, IM[rows], diameter)
+        return matrix
+
+    # --------------------------------------------------------------------
+    # Evaluates a curve for IM values that all have the same pipe diameter
+    # --------------------------------------------------------------------
+    def evaluate_diameter(self, curve, IM, diameter):
+        key = (curve.fragNo, diameter)
+        if self.mode == MEMO:
+            return self.remembered(curve, key, IM, diameter)
+
+        if key not in self.tables:
+            count_event("Fragility table miss")
+            self.tables[key] = build_table(curve, diameter)
+        else:
+            count_event("Fragility table hit")
+        table = self.tables[key]
+        if table is None:
+            return curve.evaluate(IM, np.full(IM.shape[0], diameter))
+
+        # IM values outside the table (and NaN) are evaluated exactly
+        inside = (IM >= IM_RANGE[0]) & (IM <= IM_RANGE[1])
+        matrix = np.empty((IM.shape[0], table.values.shape[1]))
+        matrix[inside] = table.lookup(IM[inside])
+        if not inside.all():
+            matrix[~inside] = curve.evaluate(IM[~inside], np.full(int((~inside).sum()), diameter))
+        return matrix
+
+    # --------------------------------------------------------------------
+    # Evaluates a curve exactly, once per IM value that isn't in the memo yet
+    # --------------------------------------------------------------------
+    def remembered(self, curve, key, IM, diameter):
+        matrix = np.empty((IM.shape[0], len(curve.stateNames)))
+        # NaN IM values can't be looked up, they're evaluated directly
+        valid = ~np.isnan(IM)
+        if not valid.all():
+            matrix[~valid] = curve.evaluate(IM[~valid], np.full(int((~valid).sum()), diameter))
+
+        uniqueIMs, inverse = np.unique(IM[valid], return_inverse = True)
+        memoIMs, memoValues = self.memo.get(key, (np.empty(0), np.empty((0, matrix.shape[1]))))
+
+        # Find the memo row of every distinct IM value with a binary search
+        found = np.minimum(np.searchsorted(memoIMs, uniqueIMs), max(memoIMs.shape[0] - 1, 0))
+        known = (memoIMs[found] == uniqueIMs) if memoIMs.shape[0] else np.zeros(uniqueIMs.shape[0], dtype = bool)
+
+        count_event("Fragility memo hit", int(known.sum()))
+        count_event("Fragility memo miss", int((~known).sum()))
+
+        uniqueValues = np.empty((uniqueIMs.shape[0], matrix.shape[1]))
+        uniqueValues[known] = memoValues[found[known]]
+        if not known.all():
+            newIMs = uniqueIMs[~known]
+            newValues = curve.evaluate(newIMs, np.full(newIMs.shape[0], diameter))
+            uniqueValues[~known] = newValues
+
+            # Add the new IM values to the memo, keeping it sorted
+            allIMs = np.concatenate([memoIMs, newIMs])
+            order = np.argsort(allIMs, kind = "stable")
+            self.memo[key] = (allIMs[order], np.concatenate([memoValues, newValues])[order])
+
+        matrix[valid] = uniqueValues[inverse.ravel()]
+        return matrix
@@ -0,0 +1,251 @@
+import json         # The grid's metadata file is JSON
+import os           # Import os package to work with directories
+import shutil
+# NumPy lets us work with whole columns of coordinates at once
+import numpy as np
+# A KD-tree finds the nearest PGA station for every feature without comparing every feature to every station
+from scipy.spatial import cKDTree
+# The cache hit and miss counters of a traced run
+from Instrumentation import count_event
+
+# ********************************************************************
+# Constants
+# ********************************************************************
+# Radius of the earth in kilometers, and the number of kilometers in a mile
+EARTH_RADIUS_KM = 6371
+KM_PER_MILE = 1.609
+
+# Bump this number whenever the layout of the converted PGA grid changes so old grids get rebuilt
+GRID_VERSION = 1
+
+# Columns of a PGA source file that hold the station coordinates and IDs instead of scenario values
+COORDINATE_COLUMNS = ("OBJECTID", "LATITUDE", "LONGITUDE")
+
+# ********************************************************************
+# Nearest PGA Station
+# ********************************************************************
+# --------------------------------------------------------------------
+# Converts latitudes and longitudes (decimal degrees) to points on a sphere with a radius of 1.
+# The straight-line distance between two of these points always grows with the great-circle distance
+# between the coordinates, so the nearest point in 3D is also the nearest point on the earth.
+# --------------------------------------------------------------------
+def unit_sphere_coordinates(lat, long):
+    lat = np.radians(np.asarray(lat, dtype = float))
+    long = np.radians(np.asarray(long, dtype = float))
+    return np.column_stack((np.cos(lat) * np.cos(long), np.cos(lat) * np.sin(long), np.sin(lat)))
+
+# --------------------------------------------------------------------
+# Holds the coordinates of the PGA stations (e.g. the rows of BridgePGAs.xlsx) in a KD-tree.
+# The tree is built once; nearest() then finds the nearest station of any number of features in bulk.
+# --------------------------------------------------------------------
+class StationIndex:
+    __slots__ = ("tree", "stationCount")
+
+    def __init__(self, stationLat, stationLong):
+        points = unit_sphere_coordinates(stationLat, stationLong)
+        self.stationCount = points.shape[0]
+        self.tree = cKDTree(points)
+
+    # --------------------------------------------------------------------
+    # Returns, for every feature coordinate:
+    #   positions - the row position of the nearest station (-1 if the feature has no coordinates)
+    #   distances - the great-circle distance to that station in miles (NaN if the feature has no coordinates)
+    # --------------------------------------------------------------------
+    def nearest(self, lat, long):
+        points = unit_sphere_coordinates(lat, long)
+        valid = np.all(np.isfinite(points), axis = 1)
+
+        positions = np.full(points.shape[0], -1, dtype = np.intp)
+        distances = np.full(points.shape[0], np.nan)
+        if valid.any():
+            chords, found = self.tree.query(points[valid])
+            positions[valid] = found
+            distances[valid] = chord_to_miles(chords)
+        return positions, distances
+
+# --------------------------------------------------------------------
+# Converts straight-line distances between points on the unit sphere to great-circle distances in miles
+# --------------------------------------------------------------------
+def chord_to_miles(chords):
+    return 2 * np.arcsin(np.clip(np.asarray(chords) / 2, 0, 1)) * EARTH_RADIUS_KM / KM_PER_MILE
+
+# ********************************************************************
+# Converted PGA Grids
+# ********************************************************************
+# Reading BridgePGAs.xlsx (or any other PGA source file) with pandas on every run is slow. Instead, the source file
+# is converted once into a folder next to it (e.g. "PGA Values\BridgePGAs.pgagrid") holding one .npy file per column:
+#   LATITUDE.npy, LONGITUDE.npy    - float64 station coordinates (decimal degrees)
+#   {scenario}.npy                 - float32 PGA values of a scenario (e.g. M81_PGA.npy)
+#   grid.json                      - the grid version, the scenario names and the source file's size and modified time
+# The .npy files are opened memory-mapped, so loading a grid doesn't read the values until they're used.
+# The grid is converted again whenever the source file changes.
+#
+# Supported source files:
+#   .xlsx/.xls   - first sheet, with LATITUDE and LONGITUDE columns and one column per scenario
+#   .csv         - same columns as the Excel file
+#   .tif/.tiff   - a geographic (lat/long) raster; every band is a scenario and every cell center a station
+
+# --------------------------------------------------------------------
+# A converted PGA grid.
+# Attributes:
+#   lat, long  - arrays of station coordinates
+#   scenarios  - tuple of scenario names
+#   values     - dictionary of scenario name -> array of PGA values (one per station)
+# --------------------------------------------------------------------
+class PGAGrid:
+    __slots__ = ("lat", "long", "scenarios", "values")
+
+    def __init__(self, lat, long, values):
+        self.lat = lat
+        self.long = long
+        self.scenarios = tuple(values.keys())
+        self.values = values
+
+    # --------------------------------------------------------------------
+    # Returns a (positions x scenarios) float matrix of the PGA values at the given station row positions.
+    # Only the requested rows are read from the memory-mapped files.
+    # --------------------------------------------------------------------
+    def gather(self, positions, scenarios = None):
+        scenarios = self.scenarios if scenarios is None else scenarios
+        positions = np.asarray(positions, dtype = np.intp)
+        matrix = np.empty((positions.shape[0], len(scenarios)))
+        for column, scenario in enumerate(scenarios):
+            matrix[:, column] = self.values[scenario][positions]
+        return matrix
+
+# --------------------------------------------------------------------
+# Returns the path of the converted grid folder of a source file
+# --------------------------------------------------------------------
+def grid_path(sourcePath):
+    return os.path.splitext(sourcePath)[0] + ".pgagrid"
+
+# --------------------------------------------------------------------
+# Reads the station coordinates and scenario values of a table (pandas DataFrame).
+# Every numeric column that isn't a coordinate/ID column is a scenario.
+# --------------------------------------------------------------------
+def table_columns(table):
+    values = {
+        str(column): table[column].to_numpy(dtype = np.float32)
+        for column in table.columns
+        if column not in COORDINATE_COLUMNS and np.issubdtype(table[column].dtype, np.number)
+    }
+    return table["LATITUDE"].to_numpy(dtype = np.float64), table["LONGITUDE"].to_numpy(dtype = np.float64), values
+
+# --------------------------------------------------------------------
+# Reads a geographic raster. Every cell center becomes a station and every band a scenario
+# (named by the band's description, or "{file name}_{band number}").
+# rasterio is used if it's installed; inside ArcGIS Pro, arcpy is used instead.
+# --------------------------------------------------------------------
+def raster_columns(sourcePath):
+    name = os.path.splitext(os.path.basename(sourcePath))[0]
+    try:
+        import rasterio
+    except ImportError:
+        rasterio = None
+
+    if rasterio is not None:
+        with rasterio.open(sourcePath) as raster:
+            bands = raster.read(masked = True).astype(np.float32).filled(np.nan)
+            rows, columns = np.meshgrid(np.arange(raster.height), np.arange(raster.width), indexing = "ij")
+            long, lat = rasterio.transform.xy(raster.transform, rows.ravel(), columns.ravel())
+            names = [description or "{}_{}".format(name, band + 1) for band, description in enumerate(raster.descriptions)]
+    else:
+        import arcpy
+        raster = arcpy.Raster(sourcePath)
+        bands = arcpy.RasterToNumPyArray(raster, nodata_to_value = np.nan).astype(np.float32)
+        if bands.ndim == 2:
+            bands = bands[np.newaxis]
+        rows, columns = np.meshgrid(np.arange(raster.height), np.arange(raster.width), indexing = "ij")
+        long = raster.extent.XMin + (columns.ravel() + 0.5) * raster.meanCellWidth
+        lat = raster.extent.YMax - (rows.ravel() + 0.5) * raster.meanCellHeight
+        names = ["{}_{}".format(name, band + 1) for band in range(bands.shape[0])]
+
+    # Cells without a value in any band (no data) are not stations
+    bands = bands.reshape(bands.shape[0], -1)
+    keep = ~np.all(np.isnan(bands), axis = 0)
+    values = {bandName: band[keep] for bandName, band in zip(names, bands)}
+    return np.asarray(lat, dtype = np.float64)[keep], np.asarray(long, dtype = np.float64)[keep], values
+
+# --------------------------------------------------------------------
+# Reads the station coordinates and scenario values of any supported source file
+# --------------------------------------------------------------------
+def read_pga_source(sourcePath):
+    extension = os.path.splitext(sourcePath)[1].lower()
+    if extension in (".xlsx", ".xls"):
+        import pandas
+        return table_columns(pandas.read_excel(sourcePath, sheet_name = 0))
+    if extension == ".csv":
+        import pandas
+        return table_columns(pandas.read_csv(sourcePath))
+    if extension in (".tif", ".tiff"):
+        return raster_columns(sourcePath)
+    raise ValueError("Unsupported PGA source file '{}'".format(sourcePath))
+
+# --------------------------------------------------------------------
+# Size and modified time of the source file; the grid is rebuilt when either changes
+# --------------------------------------------------------------------
+def source_signature(sourcePath):
+    stat = os.stat(sourcePath)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+# --------------------------------------------------------------------
+# Converts a PGA source file to a grid folder. Returns the path of the grid folder.
+# --------------------------------------------------------------------
+def convert_pga_grid(sourcePath, gridPath = None):
+    gridPath = grid_path(sourcePath) if gridPath is None else gridPath
+    lat, long, values = read_pga_source(sourcePath)
+
+    # Write to a temporary folder first so a failed conversion never leaves a broken grid behind
+    temporaryPath = gridPath + ".tmp"
+    shutil.rmtree(temporaryPath, ignore_errors = True)
+    os.makedirs(temporaryPath)
+    np.save(os.path.join(temporaryPath, "LATITUDE.npy"), lat)
+    np.save(os.path.join(temporaryPath, "LONGITUDE.npy"), long)
+    for scenario, scenarioValues in values.items():
+        np.save(os.path.join(temporaryPath, scenario + ".npy"), scenarioValues.astype(np.float32))
+
+    metadata = {
+        "version": GRID_VERSION,
+        "scenarios": list(values.keys()),
+        "source": os.path.basename(sourcePath),
+        "sourceSignature": source_signature(sourcePath),
+    }
+    with open(os.path.join(temporaryPath, "grid.json"), "w") as metadataFile:
+        json.dump(metadata, metadataFile, indent = 2)
+
+    shutil.rmtree(gridPath, ignore_errors = True)
+    os.replace(temporaryPath, gridPath)
+    return gridPath
+
+# --------------------------------------------------------------------
+# Reads a grid folder's metadata. Returns None if the folder doesn't exist or can't be read.
+# --------------------------------------------------------------------
+def read_grid_metadata(gridPath):
+    try:
+        with open(os.path.join(gridPath, "grid.json")) as metadataFile:
+            return json.load(metadataFile)
+    except (OSError, ValueError):
+        return None
+
+# --------------------------------------------------------------------
+# Returns the PGAGrid of a source file. The source file is converted first if it has no grid yet,
+# if the grid was made by a different GRID_VERSION, or if the source file changed since it was converted.
+# --------------------------------------------------------------------
+def load_pga_grid(sourcePath, gridPath = None, message = print):
+    gridPath = grid_path(sourcePath) if gridPath is None else gridPath
+    metadata = read_grid_metadata(gridPath)
+
+    if (metadata is None or metadata.get("version") != GRID_VERSION
+            or metadata.get("sourceSignature") != source_signature(sourcePath)):
+        message("Converting '{}' to a PGA grid...".format(os.path.basename(sourcePath)))
+        count_event("PGA grid cache miss")
+        convert_pga_grid(sourcePath, gridPath)
+        metadata = read_grid_metadata(gridPath)
+    else:
+        count_event("PGA grid cache hit")
+
+    # Memory-map every column: nothing is read from the disk until it's used
+    def column(name):
+        return np.load(os.path.join(gridPath, name + ".npy"), mmap_mode = "r")
+
+    return PGAGrid(column("LATITUDE"), column("LONGITUDE"), {scenario: column(scenario) for scenario in metadata["scenarios"]})
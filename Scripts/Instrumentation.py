@@ -0,0 +1,239 @@
+import contextlib
+import cProfile     # The optional profile of a whole tool run
+import json         # Trace files are JSON
+import os           # Import os package to work with directories
+import sys
+import time
+
+# ********************************************************************
+# Instrumentation
+# ********************************************************************
+# The tools time their stages (reading the rows, simulating, writing the results, ...) and count their cache hits and
+# misses through this module, so every tool reports where its time goes the same way.
+#
+# A tool run is traced inside tracing(); outside of it (e.g. in the worker processes, or when a module is used on its
+# own) stage() and count_event() do nothing. When the run ends:
+#   - the time (wall and CPU), rows, rows per second and peak memory of every stage, the counters and the peak memory of
+#     the process are printed with the tool's message function (the ArcGIS Pro message pane)
+#   - if a trace file is given, every stage is written to it:
+#       *.json  - Chrome trace format (open it in chrome://tracing or https://ui.perfetto.dev)
+#       other   - JSON lines, one object per stage (written as soon as the stage ends) and per counter
+#   - if a profile file is given, the whole run is profiled with cProfile and its statistics are written to it
+#     (read them with python -m pstats, or snakeviz)
+# The trace and profile files are opt-in: the command line interface takes them as --trace and --profile, and the
+# script tools read them from the GADEP_TRACE and GADEP_PROFILE environment variables.
+#
+# Usage:
+#   with tracing(backend.message):
+#       with stage("Read rows") as readStage:
+#           rows = list(...)
+#           readStage.rows = len(rows)
+#       count_event("PGA grid cache hit")
+
+# Environment variables of the trace and profile files of the script tools
+TRACE_VARIABLE = "GADEP_TRACE"
+PROFILE_VARIABLE = "GADEP_PROFILE"
+
+# The tracer of the running tool (None: nothing is traced)
+tracer = None
+
+# --------------------------------------------------------------------
+# Returns the peak memory (resident set size) of this process in MB, or None if it can't be read
+# --------------------------------------------------------------------
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux gives the peak in KB, macOS in bytes
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+    # Windows (ArcGIS Pro): psutil ships with the ArcGIS Pro Python environment
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss) / 1024 ** 2
+
+# --------------------------------------------------------------------
+# A timed stage of a tool run.
+# rows is set by the stage's code (e.g. the number of rows a cursor loop read); the rest is filled in when it ends.
+# --------------------------------------------------------------------
+class Stage:
+    __slots__ = ("name", "depth", "rows", "start", "seconds", "cpuSeconds", "peakMemory")
+
+    def __init__(self, name, depth = 0):
+        self.name = name
+        self.depth = depth
+        self.rows = None
+        self.start = 0.0
+        self.seconds = 0.0
+        self.cpuSeconds = 0.0
+        self.peakMemory = None
+
+    @property
+    def rowsPerSecond(self):
+        if not self.rows or self.seconds <= 0:
+            return None
+        return self.rows / self.seconds
+
+    def record(self):
+        return {"stage": self.name, "depth": self.depth, "start": round(self.start, 6), "seconds": round(self.seconds, 6),
+                "cpuSeconds": round(self.cpuSeconds, 6), "rows": self.rows, "rowsPerSecond": self.rowsPerSecond,
+                "peakMemoryMB": self.peakMemory}
+
+# --------------------------------------------------------------------
+# Collects the stages and counters of a tool run
+# --------------------------------------------------------------------
+class Tracer:
+    def __init__(self, message = print, tracePath = None, profilePath = None):
+        self.message = message
+        self.tracePath = tracePath
+        self.profilePath = profilePath
+        self.chrome = tracePath is not None and os.path.splitext(tracePath)[1].lower() == ".json"
+        self.stages = []
+        self.counters = {}
+        self.depth = 0
+        self.origin = time.perf_counter()
+        self.cpuOrigin = time.process_time()
+        self.traceFile = None
+        self.profiler = None
+
+    def start(self):
+        if self.tracePath and not self.chrome:
+            os.makedirs(os.path.dirname(os.path.abspath(self.tracePath)), exist_ok = True)
+            self.traceFile = open(self.tracePath, "w")
+        if self.profilePath:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        current = Stage(name, self.depth)
+        self.depth += 1
+        cpuStart = time.process_time()
+        current.start = time.perf_counter() - self.origin
+        try:
+            yield current
+        finally:
+            current.seconds = time.perf_counter() - self.origin - current.start
+            current.cpuSeconds = time.process_time() - cpuStart
+            current.peakMemory = peak_memory_mb()
+            self.depth -= 1
+            self.stages.append(current)
+            if self.traceFile is not None:
+                self.traceFile.write(json.dumps(dict(current.record(), type = "stage")) + "\n")
+                self.traceFile.flush()
+
+    def count(self, name, amount = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    # --------------------------------------------------------------------
+    # Stops the profiler, writes the trace file and prints the summary of the run
+    # --------------------------------------------------------------------
+    def finish(self):
+        seconds = time.perf_counter() - self.origin
+        cpuSeconds = time.process_time() - self.cpuOrigin
+        peakMemory = peak_memory_mb()
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(os.path.dirname(os.path.abspath(self.profilePath)), exist_ok = True)
+            self.profiler.dump_stats(self.profilePath)
+
+        run = {"seconds": round(seconds, 6), "cpuSeconds": round(cpuSeconds, 6), "peakMemoryMB": peakMemory}
+        if self.traceFile is not None:
+            for name, value in self.counters.items():
+                self.traceFile.write(json.dumps({"type": "counter", "name": name, "value": value}) + "\n")
+            self.traceFile.write(json.dumps(dict(run, type = "run")) + "\n")
+            self.traceFile.close()
+        elif self.chrome:
+            write_chrome_trace(self.tracePath, self.stages, self.counters, seconds)
+
+        # The stages are printed in the order they started, indented under the stage they ran in
+        self.message("Timings ({:.3f} s, {:.3f} s CPU{}):".format(
+            seconds, cpuSeconds, "" if peakMemory is None else ", peak memory {:,.0f} MB".format(peakMemory)))
+        for current in sorted(self.stages, key = lambda item: item.start):
+            self.message("{}{}".format("  " * (current.depth + 1), stage_summary(current)))
+        for name, value in self.counters.items():
+            self.message("  {}: {:,}".format(name, value))
+        if self.tracePath:
+            self.message("Trace written to '{}'.".format(self.tracePath))
+        if self.profilePath:
+            self.message("Profile written to '{}'.".format(self.profilePath))
+
+# --------------------------------------------------------------------
+# Returns the summary line of a stage (e.g. "Read rows: 1.204 s (1.150 s CPU), 120,000 rows, 99,668 rows/s")
+# --------------------------------------------------------------------
+def stage_summary(current):
+    text = "{}: {:.3f} s ({:.3f} s CPU)".format(current.name, current.seconds, current.cpuSeconds)
+    if current.rows is not None:
+        text += ", {:,} rows".format(current.rows)
+    if current.rowsPerSecond is not None:
+        text += ", {:,.0f} rows/s".format(current.rowsPerSecond)
+    return text
+
+# --------------------------------------------------------------------
+# Writes the stages (complete events) and counters (counter events) of a run to a Chrome trace file
+# --------------------------------------------------------------------
+def write_chrome_trace(path, stages, counters, seconds):
+    processID = os.getpid()
+    events = []
+    for current in stages:
+        record = current.record()
+        events.append({"name": current.name, "cat": "stage", "ph": "X", "pid": processID, "tid": 0,
+                       "ts": current.start * 1e6, "dur": current.seconds * 1e6,
+                       "args": {key: record[key] for key in ("rows", "rowsPerSecond", "cpuSeconds", "peakMemoryMB")}})
+    for name, value in counters.items():
+        events.append({"name": name, "cat": "counter", "ph": "C", "pid": processID, "tid": 0, "ts": seconds * 1e6,
+                       "args": {"value": value}})
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+    with open(path, "w") as traceFile:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, traceFile)
+
+# ********************************************************************
+# Tracing
+# ********************************************************************
+# --------------------------------------------------------------------
+# Traces a tool run (see above). tracePath and profilePath default to the GADEP_TRACE and GADEP_PROFILE
+# environment variables. A run inside another traced run is part of it.
+# --------------------------------------------------------------------
+@contextlib.contextmanager
+def tracing(message = print, tracePath = None, profilePath = None):
+    global tracer
+    if tracer is not None:
+        yield tracer
+        return
+
+    tracer = Tracer(message, tracePath or os.environ.get(TRACE_VARIABLE) or None,
+                    profilePath or os.environ.get(PROFILE_VARIABLE) or None)
+    tracer.start()
+    try:
+        yield tracer
+    finally:
+        finishing = tracer
+        tracer = None
+        finishing.finish()
+
+# --------------------------------------------------------------------
+# Times a stage of the traced run. Yields the Stage, whose rows the stage's code can set.
+# --------------------------------------------------------------------
+@contextlib.contextmanager
+def stage(name):
+    if tracer is None:
+        yield Stage(name)
+        return
+    with tracer.stage(name) as current:
+        yield current
+
+# --------------------------------------------------------------------
+# Adds amount to a counter of the traced run (e.g. "PGA grid cache hit")
+# --------------------------------------------------------------------
+def count_event(name, amount = 1):
+    if tracer is not None:
+        tracer.count(name, amount)
@@ -0,0 +1,205 @@
+# NumPy lets us hold a whole column of IM values in one array
+import numpy as np
+# The fragility functions and damage state calculations
+from FragilityEngine import load_fragility_curves, simulate_scenarios
+# The scenario side tables
+from Scenarios import read_scenario_table, scenario_values
+# The lookup tables of the TABLE and MEMO evaluation modes
+from FragilityTables import EXACT, FragilityTables
+# The asset fingerprints of incremental runs
+from Fingerprints import asset_fingerprints, fragility_versions, previous_results, read_fingerprints
+# The storage backends (every worker process opens its own)
+from Backends import open_backend, rows_equal
+
+# ********************************************************************
+# Layer Simulation
+# ********************************************************************
+# The Disaster Impact tool reads every asset layer and calculates the damage states of its rows in "tasks".
+# A task is one layer, or one object ID range of a large layer, and is described by a dictionary with:
+#   table         - the layer's table (a catalog path when the task runs in a worker process)
+#   readFields    - the fields read from the table: OID@, Frag_no, (Diameter), (PGA columns), (Damage, EP)
+#   hasDiameter   - whether the Diameter field is read
+#   where         - where clause selecting the task's object ID range (None = every row)
+#   objectIDs     - sorted object IDs of the rows the layer exposes in the task's range (None = every row read). A worker
+#                   reads the catalog path of the layer, which has no selection or definition query, so it only keeps
+#                   these rows.
+#   scenarioTable - path of the layer's scenario side table, or None if the IM values come from the PGA columns
+#   scenarioNames - the chosen scenario names
+#   runKey        - hash of the run settings (see Fingerprints.py), or None to skip the fingerprints
+#   fingerprints  - path of the layer's fingerprint table (rows whose fingerprint hasn't changed keep their last results),
+#                   or None to calculate every row
+#   resultFields  - number of result fields (Damage, EP) at the end of readFields. When they are read, a row only keeps
+#                   its last results if the fields still hold them.
+# Tasks can run one after another in the main process, or in a pool of worker processes. Every worker opens its own
+# backend and builds its fragility curves and lookup tables once; the results are sent back to the main process, which is the only
+# one that writes.
+
+# Layers with more rows than this are split into object ID ranges of this many rows
+CHUNK_ROWS = 50000
+
+# Backend, fragility curves, fragility record versions and lookup tables of a worker process
+# (set up once per worker by init_worker)
+workerBackend = None
+workerCurves = None
+workerVersions = None
+workerTables = None
+
+# --------------------------------------------------------------------
+# Worker process initializer. The fragility database is sent once per worker and parsed there,
+# and the worker opens its own connection to the workspace.
+# --------------------------------------------------------------------
+def init_worker(workspace, fdDict, evaluation = EXACT):
+    global workerBackend, workerCurves, workerVersions, workerTables
+    workerBackend = open_backend(workspace)
+    workerCurves = load_fragility_curves(fdDict)
+    workerVersions = fragility_versions(fdDict)
+    workerTables = evaluation_tables(evaluation)
+
+# --------------------------------------------------------------------
+# Returns the FragilityTables object of an evaluation mode (None for exact evaluation)
+# --------------------------------------------------------------------
+def evaluation_tables(evaluation):
+    return None if evaluation == EXACT else FragilityTables(evaluation)
+
+# --------------------------------------------------------------------
+# Returns the tasks of one layer.
+# The layer is only split when there is more than one worker to share the chunks with.
+# layer is the map layer the table (its catalog path) belongs to; the object IDs of the chunks are read from the layer,
+# so the tasks keep its selection and definition query.
+# --------------------------------------------------------------------
+def layer_tasks(backend, table, readFields, hasDiameter, scenarioTable, scenarioNames, chunkRows = None,
+                runKey = None, fingerprints = None, layer = None, resultFields = 0):
+    task = {
+        "table": table,
+        "readFields": readFields,
+        "hasDiameter": hasDiameter,
+        "where": None,
+        "objectIDs": None,
+        "scenarioTable": scenarioTable,
+        "scenarioNames": scenarioNames,
+        "runKey": runKey,
+        "fingerprints": fingerprints,
+        "resultFields": resultFields,
+    }
+    if chunkRows is None:
+        return [task]
+
+    # Split the sorted object IDs the layer exposes into ranges of chunkRows rows
+    objectIDs = np.sort(np.fromiter((row[0] for row in backend.read_rows(table if layer is None else layer, ["OID@"])),
+                                    dtype = np.int64))
+    if objectIDs.shape[0] <= chunkRows:
+        return [dict(task, objectIDs = objectIDs)]
+
+    objectIDField = backend.object_id_field(table)
+    tasks = []
+    for start in range(0, objectIDs.shape[0], chunkRows):
+        chunk = objectIDs[start:start + chunkRows]
+        tasks.append(dict(task, where = "{0} >= {1} AND {0} <= {2}".format(objectIDField, chunk[0], chunk[-1]),
+                          objectIDs = chunk))
+    return tasks
+
+# --------------------------------------------------------------------
+# Reads the rows of a task and calculates their damage states.
+# backend, curves, versions and tables are None inside a worker process, which uses its own.
+# tables is also None in the main process when the curves are evaluated exactly.
+# Returns a dictionary with:
+#   objectIDs - object IDs of the rows
+#   fragNos   - fragility numbers of the rows
+#   D         - pipe diameters of the rows (None if the layer has no Diameter field)
+#   IM        - (rows x scenarios) IM values
+#   damage    - list (one per row) of lists (one per scenario) of damage states
+#   ep        - (rows x scenarios) EP values
+#   fingerprints - fingerprints of the rows (None if the run isn't incremental)
+#   recomputed   - boolean array, True for the rows that were calculated (False for rows that kept their last results)
+# --------------------------------------------------------------------
+def simulate_task(task, backend = None, curves = None, versions = None, tables = None):
+    inWorker = backend is None
+    backend = workerBackend if inWorker else backend
+    curves = workerCurves if inWorker else curves
+    versions = workerVersions if inWorker else versions
+    tables = workerTables if inWorker else tables
+
+    objectIDs = []
+    fragNos = []
+    IMs = []
+    diameters = []
+    storedResults = []
+    hasDiameter = task["hasDiameter"]
+    firstPGAColumn = 3 if hasDiameter else 2
+    resultFields = task.get("resultFields", 0)
+    lastPGAColumn = len(task["readFields"]) - resultFields
+
+    # Rows the layer doesn't expose (outside its selection or definition query) are skipped
+    keep = None if task.get("objectIDs") is None else set(task["objectIDs"].tolist())
+    for row in backend.read_rows(task["table"], task["readFields"], task["where"]):
+        if keep is not None and row[0] not in keep:
+            continue
+        objectIDs.append(row[0])
+        fragNos.append(str(row[1]))
+        if hasDiameter:
+            diameters.append(row[2])
+        IMs.append(row[firstPGAColumn:lastPGAColumn])
+        if resultFields:
+            storedResults.append(row[lastPGAColumn:])
+
+    # IM is a (rows x scenarios) matrix of IM values
+    if task["scenarioTable"] is None:
+        IM = np.array(IMs, dtype = float).reshape(len(objectIDs), len(task["scenarioNames"]))
+    else:
+        IM = scenario_values(read_scenario_table(task["scenarioTable"]), objectIDs, task["scenarioNames"])
+
+    D = np.array(diameters, dtype = float) if hasDiameter else None
+
+    if task["runKey"] is None:
+        damage, ep, _ = simulate_scenarios(curves, fragNos, IM, D, tables)
+        return {"objectIDs": objectIDs, "fragNos": fragNos, "D": D, "IM": IM, "damage": damage, "ep": ep,
+                "fingerprints": None, "recomputed": np.ones(len(objectIDs), dtype = bool)}
+
+    # Incremental run: rows whose fingerprint is the same as in the last run keep their last results,
+    # and only the other rows are calculated
+    fingerprints = asset_fingerprints(task["runKey"], versions, fragNos, IM, D)
+    unchanged, damage, ep = previous_results(read_fingerprints(task["fingerprints"], task["runKey"]),
+                                             objectIDs, fingerprints, len(task["scenarioNames"]))
+
+    # Rows whose result fields don't hold their last results (e.g. emptied, or edited by hand) are calculated again.
+    # Rows without a result (no IM value or unknown fragility number) are never written, so they aren't checked.
+    if resultFields:
+        for position in np.flatnonzero(unchanged):
+            if damage[position][0] is None or np.isnan(IM[position, 0]):
+                continue
+            lastEP = None if np.isnan(ep[position, 0]) else float(ep[position, 0])
+            if not rows_equal(storedResults[position], (damage[position][0], lastEP)):
+                unchanged[position] = False
+
+    recomputed = ~unchanged
+    if recomputed.any():
+        positions = np.flatnonzero(recomputed)
+        newDamage, ep[positions], _ = simulate_scenarios(curves, [fragNos[position] for position in positions], IM[positions],
+                                                         None if D is None else D[positions], tables)
+        for position, states in zip(positions, newDamage):
+            damage[position] = states
+
+    return {"objectIDs": objectIDs, "fragNos": fragNos, "D": D, "IM": IM, "damage": damage, "ep": ep,
+            "fingerprints": fingerprints, "recomputed": recomputed}
+
+# --------------------------------------------------------------------
+# Combines the results of the tasks of one layer, sorted by object ID so the rows are always in the same order
+# no matter how the layer was split (the Monte Carlo results depend on the row order)
+# --------------------------------------------------------------------
+def combine_results(results):
+    objectIDs = [objectID for result in results for objectID in result["objectIDs"]]
+    order = np.argsort(np.array(objectIDs, dtype = np.int64), kind = "stable")
+
+    fragNos = [fragNo for result in results for fragNo in result["fragNos"]]
+    damage = [states for result in results for states in result["damage"]]
+    hasDiameter = results[0]["D"] is not None
+    return {
+        "objectIDs": [objectIDs[position] for position in order],
+        "fragNos": [fragNos[position] for position in order],
+        "D": np.concatenate([result["D"] for result in results])[order] if hasDiameter else None,
+        "IM": np.concatenate([result["IM"] for result in results])[order],
+        "damage": [damage[position] for position in order],
+        "ep": np.concatenate([result["ep"] for result in results])[order],
+        "fingerprints": None if results[0]["fingerprints"] is None else np.concatenate([result["fingerprints"] for result in results])[order],
+        "recomputed": np.concatenate([result["recomputed"] for result in results])[order],
+    }
@@ -1,64 +1,60 @@
-import shutil
-import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
-import os           # os library lets us work with directories
-import zipfile
-import shutil
+# Where the feature layer is read from and the new layers are written to (arcpy, or a GeoPackage/SQLite database)
+from Backends import ArcpyBackend
+# Stage timers of a traced run
+from Instrumentation import stage, tracing
+
 # ********************************************************************
-# Helper Functions
+# Data Separation
 # ********************************************************************
 # --------------------------------------------------------------------
-# Prints a message in ArcGIS Pro
+# Creates a new feature layer for every unique value of a field, containing only the features with that value.
+# Parameters:
+#   backend      - storage backend (see Backends.py)
+#   featureLayer - the feature layer that will be filtered
+#   flField      - the field belonging to the feauture layer
+#   output       - the output directory (or GeoPackage, with the SQLite backend)
+#   layerName    - name of the feature layer; the new layers are written to {output}\{layerName}
 # --------------------------------------------------------------------
-def message(message):
-    arcpy.AddMessage(message)
+def separate_layer(backend, featureLayer, flField, output, layerName):
+    # Message printed out in ArcGIS Pro to let the user know what is being exported and where
+    backend.message("The values in the '{}' field will be exported as a shapefile to '{}'"
+        .format(flField, output))
+
+    # --------------------------------------------------------------------
+    # Partitioned copy
+    # --------------------------------------------------------------------
+    # The feature layer is read once: every row is routed to the new feature layer of its value in the chosen field,
+    # which is created the first time the value shows up. This replaces one filtered copy (a full pass over the table)
+    # per unique value.
+    # Example: if the output directory is your Downloads folder, the layers are created in
+    # \Downloads\{feature layer name}
+    with stage("Partition") as partitionStage:
+        counts = backend.partition(featureLayer, flField, output, layerName)
+        partitionStage.rows = sum(counts.values())
+
+    # Success message
+    backend.message("All feature layers created successfully! {} rows copied to {} layers.".format(sum(counts.values()), len(counts)))
 
 # ********************************************************************
 # Main Program
 # ********************************************************************
 # --------------------------------------------------------------------
-# Initializing variables
-# --------------------------------------------------------------------
-featureLayer = arcpy.GetParameter(0)        # The feature layer that will be filtered
-flField = arcpy.GetParameterAsText(1)       # The field belonging to the feauture layer 
-output = arcpy.GetParameterAsText(2)        # The output directory
-
-# Message printed out in ArcGIS Pro to let the user know what is being exported and where
-message("The values in the '{}' field will be exported as a shapefile to '{}'"
-    .format(flField, output))
-
+# Runs the tool in ArcGIS Pro
 # --------------------------------------------------------------------
-# Loop through table
-# --------------------------------------------------------------------
-# da SearchCursor function will loop through the feature layer's attribute table, and 
-# depending on the field chosen, will create a new feature layer containing only the values 
-# belonging to said field
-with arcpy.da.SearchCursor(featureLayer, flField) as cursor:
-    # Since more than likely we will have duplicate value in the chosen field, we'll 
-    # store the unique values in a list
-    flFieldValues = []
-
-    # Create a new folder in the output directory
-    # Example: if the output directory is your Downloads folder, a new folder
-    # will be created there: \Downloads\{feature layer name}
-    outputFolder = os.path.join(output, featureLayer.name)
-    if not os.path.exists(outputFolder):
-        os.makedirs(outputFolder)
-        # Folder created successfully message
-        message("'{}' directory succesfully created!".format(outputFolder))
+def main():
+    import arcpy        # Arcpy package lets us work with ArcGIS Pro tools with Python
 
-    # Loop through the attribute table
-    for row in cursor:
-        # If the current value DOES NOT exist in the unique value list, then:
-        if not row[0] in flFieldValues:
-            # (1) append the current value to it
-            flFieldValues.append(row[0])
-            # (2) Create a 'where' clause that will be used as an SQL expression to filter the feature layer's attribute table
-            whereClause = "{} = \'{}\'".format(flField, row[0])
+    # --------------------------------------------------------------------
+    # Initializing variables
+    # --------------------------------------------------------------------
+    featureLayer = arcpy.GetParameter(0)        # The feature layer that will be filtered
+    flField = arcpy.GetParameterAsText(1)       # The field belonging to the feauture layer 
+    output = arcpy.GetParameterAsText(2)        # The output directory
 
-            # Use the Select_analysis tool to create the new filtered feature layer and output it to the output directory selected by the user
-            arcpy.Select_analysis(featureLayer, os.path.join(outputFolder, row[0]), whereClause)
+    separate_layer(ArcpyBackend(), featureLayer, flField, output, featureLayer.name)
 
-            # Update message
-            message("{} feature layer created!".format(row[0]))
-# Success message
-message("All feature layers created successfully!")
\ No newline at end of file
+# The tool only runs when the script is started (by ArcGIS Pro or Python), not when it's imported
+if __name__ == "__main__":
+    # The timings of the run are printed when it ends (see Instrumentation.py)
+    with tracing(ArcpyBackend().message):
+        main()
@@ -0,0 +1,39 @@
+import multiprocessing
+import os           # Import os package to work with directories
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# ********************************************************************
+# Process Pools
+# ********************************************************************
+# --------------------------------------------------------------------
+# Returns the number of worker processes to use.
+# A workers value of 0 or None means one worker per CPU core.
+# --------------------------------------------------------------------
+def worker_count(workers = None):
+    if not workers or workers < 1:
+        return os.cpu_count() or 1
+    return int(workers)
+
+# --------------------------------------------------------------------
+# Creates a pool of worker processes.
+# Inside ArcGIS Pro, sys.executable is ArcGISPro.exe instead of Python, so the workers would start another
+# copy of ArcGIS Pro. In that case we point multiprocessing to the python.exe of the ArcGIS Pro Python environment.
+# Functions run by the workers must live in a module (not in a script tool), since the workers import them.
+# --------------------------------------------------------------------
+def process_pool(workers = None, initializer = None, initargs = ()):
+    if not os.path.basename(sys.executable).lower().startswith("python"):
+        pythonPath = os.path.join(sys.exec_prefix, "python.exe" if os.name == "nt" else "bin/python")
+        if os.path.exists(pythonPath):
+            multiprocessing.set_executable(pythonPath)
+
+    return ProcessPoolExecutor(max_workers = worker_count(workers),
+                               mp_context = multiprocessing.get_context("spawn"),
+                               initializer = initializer, initargs = initargs)
+
+# --------------------------------------------------------------------
+# Splits range(total) into (start, stop) chunks of at most chunkSize items
+# --------------------------------------------------------------------
+def chunk_ranges(total, chunkSize):
+    chunkSize = max(1, int(chunkSize))
+    return [(start, min(start + chunkSize, total)) for start in range(0, total, chunkSize)]
@@ -1,235 +1,405 @@
-from cmath import acos
-import arcpy
-import pandas
 import os
-import math
+import itertools
+# NumPy lets us work with whole columns of coordinates at once
+import numpy as np
+# The nearest PGA station lookup lives in the GroundMotion module (in this same folder)
+from GroundMotion import StationIndex, load_pga_grid
+# The scenario registry and the scenario side tables live in the Scenarios module (in this same folder)
+from Scenarios import load_scenarios, scenario_fields, scenarios_by_source, scenario_table_path, write_scenario_table
+# Where the features are read from and the PGA values are written to (arcpy, or a GeoPackage/SQLite database)
+from Backends import ArcpyBackend
+# The fingerprints of the Disaster Impact tool's incremental runs
+from Fingerprints import remove_fingerprints
+# Stage timers of a traced run
+from Instrumentation import stage, tracing
 
 # ********************************************************************
-# Helper Functions
+# Preparation Functions
 # ********************************************************************
 # --------------------------------------------------------------------
-# Prints a message in ArcGIS Pro
+# Returns the fields the Disaster Impact tool needs, given the scenarios of the scenario registry
 # --------------------------------------------------------------------
-def message(message):
-    arcpy.AddMessage(message)
+def preparation_fields(scenarios):
+    # Create a dictionary containing the fields that need to be added.
+    # This dictionary is composed of a key, value pair where:
+    # key: field name
+    # value(s): (array containing the attributes for the fields)
+    # Dictionary structure/index:
+    # [Key]           [0]         [1]
+    # [Field name] = (Field type, Field alias)
+    # The PGA fields (M81_PGA, M84_PGA, M87_PGA, M90_PGA by default) come from the scenarios in the
+    # scenario registry ("PGA Values\Scenarios.json") that have an attribute table field.
+    fieldsDict = {field: ("DOUBLE", field) for field in scenario_fields(scenarios).values()}
+    fieldsDict.update({
+        "Frag_no":("TEXT", "Frag_no"), 
+        "EP": ("DOUBLE", "EP"),
+        "Hazard":("TEXT", "Hazard"),
+        "Damage":("TEXT", "Damage"),
+        "IM":("TEXT", "IM"),
+        "IM_unit":("TEXT", "IM_unit"),
+        "EQ_MAG":("TEXT", "EQ_MAG")
+    })
+    return fieldsDict
 
 # --------------------------------------------------------------------
-# Finds the distance between two different coordinates (latitude and longitude in decimal degrees)
-# Reference: https://www.youtube.com/watch?v=bzSnw-Iz6O8
+# Loads every PGA source file of the scenarios once, with a spatial index of its stations.
+# Returns a list of (registry positions of the source's scenarios, their columns, PGA grid, StationIndex) tuples.
 # --------------------------------------------------------------------
-def distance(pgaLat, pgaLong, objectLat, objectLong):
-    return 6371 * math.acos(math.cos(math.radians(90-pgaLat))*
-    math.cos(math.radians(90-objectLat))+
-    math.sin(math.radians(90-pgaLat))*
-    math.sin(math.radians(90-objectLat))*
-    math.cos(math.radians(pgaLong-objectLong)))/1.609
+def load_pga_sources(scenarios, pgasPath, message = print):
+    # Every PGA source file (e.g. "BridgePGAs.xlsx") is only loaded, indexed and searched once,
+    # no matter how many scenarios it holds.
+    sources = []
+    for source, sourceScenarios in scenarios_by_source(scenarios).items():
+        # The source file is converted once into a memory-mapped grid (e.g. "BridgePGAs.pgagrid" next to it)
+        # that is converted again only when the source file changes.
+        pgaGrid = load_pga_grid(os.path.join(pgasPath, source), message = message)
+
+        # Load the coordinates of every PGA station into a spatial index (KD-tree) once.
+        # Finding the nearest station of a feature then no longer means calculating the distance to every station.
+        stationIndex = StationIndex(pgaGrid.lat, pgaGrid.long)
+
+        columns = [scenarios.index(scenario) for scenario in sourceScenarios]
+        sources.append((columns, [scenario["column"] for scenario in sourceScenarios], pgaGrid, stationIndex))
+    return sources
 
 # --------------------------------------------------------------------
-# Xlookup Excel function python replication
-# Reference: https://pythoninoffice.com/replicate-excel-vlookup-hlookup-xlookup-in-python/
+# Returns the matrix of the PGA values of every scenario in the registry where:
+# row: feature (same order as lats and longs)
+# column: scenario (same order as the registry)
+# Features without coordinates keep NaN values. sources comes from load_pga_sources.
 # --------------------------------------------------------------------
-def xlookup(lookup_value, lookup_array, return_array, if_not_found:str = ''):
-    match_value = return_array.loc[lookup_array == lookup_value]
-    if match_value.empty:
-        return f'"{lookup_value}" not found!' if if_not_found == '' else if_not_found
-    else:
-        return match_value.tolist()[0]
-# ********************************************************************
-# Main Program
-# ********************************************************************
+def scenario_pgas(sources, scenarioCount, lats, longs):
+    scenarioPGAs = np.full((len(lats), scenarioCount), np.nan)
+    for columns, gridColumns, pgaGrid, stationIndex in sources:
+        # nearestPositions holds the row position (in the source file) of the nearest station to each feature.
+        # Features without coordinates get a position of -1.
+        nearestPositions, _ = stationIndex.nearest(lats, longs)
+        found = nearestPositions >= 0
+
+        # Gather the PGA values of every feature's nearest station for all of the source's scenarios in one step
+        scenarioPGAs[np.ix_(found, columns)] = pgaGrid.gather(nearestPositions[found], gridColumns)
+    return scenarioPGAs
+
 # --------------------------------------------------------------------
-# Setting directories
+# Calculates the PGA values of every feature of a table that has LONG_CALC and LAT_CALC coordinates.
+# The PGA values of every scenario are stored in the table's scenario side table
+# ("Projects\GADEP\Scenarios\{feature name}.npz"), and the scenarios with a field are also written to the table.
 # --------------------------------------------------------------------
-# Get the current directory of the script; it should look something like the following:
-# {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Scripts
-scriptsPath = os.getcwd()
+def assign_pga(backend, inputFeature, featureName, projectPath, pgasPath, scenarios = None):
+    if scenarios is None:
+        scenarios = load_scenarios(pgasPath)
 
-infrastructuresPath = os.path.join(os.path.dirname(scriptsPath), "Projects", "GADEP", "Infrastructures.gdb")
-pgasPath = os.path.join(os.path.dirname(scriptsPath), "PGA Values")
+    # Read the coordinates of every feature first so the nearest stations can be found in one bulk query
+    with stage("Read coordinates") as readStage:
+        objectIDs = []
+        longs = []
+        lats = []
+        for row in backend.read_rows(inputFeature, ["OID@", "LONG_CALC", "LAT_CALC"]):
+            objectIDs.append(row[0])
+            longs.append(row[1])
+            lats.append(row[2])
+        lats = np.array(lats, dtype = float)
+        longs = np.array(longs, dtype = float)
+        readStage.rows = len(objectIDs)
+
+    # Matrix of the PGA values of every scenario in the registry (see scenario_pgas)
+    scenarioNames = [scenario["name"] for scenario in scenarios]
+    with stage("Load PGA grids"):
+        sources = load_pga_sources(scenarios, pgasPath, backend.message)
+    with stage("Nearest PGA stations") as nearestStage:
+        scenarioPGAs = scenario_pgas(sources, len(scenarios), lats, longs)
+        nearestStage.rows = len(objectIDs)
+
+    # Store the PGA values of every scenario in the layer's scenario side table
+    # ("Projects\GADEP\Scenarios\{feature name}.npz"), keyed by object ID
+    write_scenario_table(scenario_table_path(projectPath, featureName), objectIDs, scenarioNames, scenarioPGAs)
+    backend.message("PGA values of {} scenarios stored in the scenario side table!".format(len(scenarioNames)))
+
+    # The scenarios with an attribute table field (M81_PGA, M84_PGA, M87_PGA, M90_PGA by default)
+    # are also written to the attribute table.
+    fieldScenarios = [index for index, scenario in enumerate(scenarios) if scenario.get("field")]
+    pgaFields = [scenarios[index]["field"] for index in fieldScenarios]
+
+    # The results are collected first and written in one pass by the backend's result writer. This dictionary
+    # is composed of a key, value pair where:
+    # key: Object ID of the feature
+    # value: PGA values of the scenarios with a field (NaN values are written as nulls)
+    # Features without coordinates are skipped.
+    results = {}
+    for featureRow, objectID in enumerate(objectIDs):
+        featurePGAs = scenarioPGAs[featureRow, fieldScenarios]
+        if featurePGAs.size == 0 or np.isnan(featurePGAs).all():
+            continue
+        results[objectID] = tuple(None if np.isnan(pga) else float(pga) for pga in featurePGAs)
+
+    if pgaFields:
+        with stage("Write PGA values") as writeStage, backend.result_writer() as resultWriter:
+            written, unchanged = resultWriter.write(inputFeature, pgaFields, results)
+            writeStage.rows = len(results)
+        backend.message("PGA values of {} features updated, {} unchanged.".format(written, unchanged))
 
 # --------------------------------------------------------------------
-# Initialize paramter variables
+# Number of features read, clipped and written per step of prepare_features
 # --------------------------------------------------------------------
-# The first paramter will be a feature layer
-inputFeature = arcpy.GetParameter(0)
-# The second paramter is a boolean asking the user whether or not the PGA values in the input feature will be calculated
-calculatePGA = arcpy.GetParameter(1)
-# The third paramter is a boolean asking the user whether or not the resulting feature layer will be clipped
-clip = arcpy.GetParameter(2)
-# The fourth paramter will be the clip features 
-clipFeatures = arcpy.GetParameter(3)
-
+PREPARATION_CHUNK_ROWS = 10000
+
+# The dimension of the intersection of a feature with the clip features (1: points, 2: lines, 4: polygons)
+CLIP_DIMENSIONS = {"Point": 1, "Multipoint": 1, "Polyline": 2, "Polygon": 4}
+
 # --------------------------------------------------------------------
-# Create local copy of the input feature in the Infrastructures.gdb
-# --------------------------------------------------------------------
-# Set the new name of the feature layer.
-# An error will be thrown if the feature layer's name contains blanks, so we need to get rid of them first
-
-# Store the feature layer name
-featureName = inputFeature.name
-# If it contains a blank, change the case of the sring to title case (it looks better), and get rid of the blanks
-if " " in featureName:
-    featureName = featureName.title().replace(" ", "")
-
-# Copy the features of the input feature to the Infrastructures.gdb
-arcpy.CopyFeatures_management(inputFeature, os.path.join(infrastructuresPath, featureName))
-
-# Overwrite inputFeature to be the new, copied version
-inputFeature = os.path.join(infrastructuresPath, featureName)
-
-# Get the geometry/shape type of the input feature
-ifType = arcpy.Describe(inputFeature)
-
-# Print copy success message in ArcGIS Pro
-message("{} successfully copied to {}!".format(ifType.name, ifType.path))
-
-# --------------------------------------------------------------------
-# Add latitude and longitude points according to shapetype
-# --------------------------------------------------------------------
-# If the input feature is a point feature, its geometry property will need to be set to "POINT".
-# For all other shapetypes such as polygons and polylines, the "INSIDE" property will be set.
-if ifType.shapeType == "Point":
-    geometryPropertyX = "POINT_X"
-    geometryPropertyY = "POINT_Y"
-else:
-    geometryPropertyX = "INSIDE_X"
-    geometryPropertyY = "INSIDE_Y"
-
-# Create array of array of the new fields and their geometry properties.
-# Two new fields will be created and added to the input feature:
-# LONG_CALC - stands for "longitude calculated" and will contain the calculated longitude values in decimal degrees
-# LAT_CALC - stands for "latitude calculated" and will contain the calculated latitude values in decimal degrees
-geometryProperties = [["LONG_CALC", geometryPropertyX], ["LAT_CALC", geometryPropertyY]]
-
-# Perform the calculation 
-arcpy.CalculateGeometryAttributes_management(inputFeature, geometryProperties, coordinate_format="DD")
-
-# Print coordinate fields added success message in ArcGIS Pro
-message("Latitude and longitude fields and coordinates successfully added!")
-
-# --------------------------------------------------------------------
-# Add necessary fields to input feature
-# --------------------------------------------------------------------
-# Create a dictionary containing the fields that need to be added.
-# This dictionary is composed of a key, value pair where:
-# key: field name
-# value(s): (array containing the attributes for the fields)
-# Dictionary structure/index:
-# [Key]           [0]         [1]
-# [Field name] = (Field type, Field alias)
-fieldsDict = {
-    "M81_PGA": ("DOUBLE", "M81_PGA"),
-    "M84_PGA": ("DOUBLE", "M84_PGA"),
-    "M87_PGA": ("DOUBLE", "M87_PGA"),
-    "M90_PGA": ("DOUBLE", "M90_PGA"),
-    "Frag_no":("TEXT", "Frag_no"), 
-    "EP": ("DOUBLE", "EP"),
-    "Hazard":("TEXT", "Hazard"),
-    "Damage":("TEXT", "Damage"),
-    "IM":("TEXT", "IM"),
-    "IM_unit":("TEXT", "IM_unit"),
-    "EQ_MAG":("TEXT", "EQ_MAG")
-}
-
-# Iterate through the dictionary and add the fields to the input table
-for field, fieldAttributes in fieldsDict.items():
-    arcpy.AddField_management(inputFeature, field, fieldAttributes[0], field_alias=fieldAttributes[1])
-    # Print a success message for each field added in ArcGIS Pro
-    message("Added '{}' field!".format(field))
-
-# --------------------------------------------------------------------
-# Calculate PGA values
-# --------------------------------------------------------------------
-# If the second parameter is false, print a message in ArcGIS Pro
-if calculatePGA == False:
-    message("Calculating PGA values skipped!")
-else:
-    # Get the path of the file containing the PGA values.
-    # This file is called "BridgePGAs.xlsx"
-    filePath = os.path.join(pgasPath, "BridgePGAs.xlsx")
-
-    # Create object containing the file's data
-    file = pandas.read_excel(filePath, sheet_name=0)
-
-    # Array containing the fields that will be read and updated
-    # Index:
-    # [0, 1]          LONG_CALC, LAT_CALC
-    # [2, 3, 4, 5]    M81_PGA, M84_PGA, M87_PGA, M90_PGA 
-    pgaFields = [
-        "LONG_CALC", "LAT_CALC", \
-        "M81_PGA", "M84_PGA", "M87_PGA", "M90_PGA" 
-    ]
-
-    # Calulating PGA values message
-    message("Calculating PGA values...")
-    # Use the UpdateCursor function to iterate and update through every row in the given feature layer table
-    with arcpy.da.UpdateCursor(inputFeature, pgaFields) as cursor:
-        
-        # row is the nth row in the table
-        # cursor is the iterator
+# Reads the clip features once, projected to the spatial reference of the features that will be clipped.
+# Returns (clip geometries, array of their extents as XMin, YMin, XMax, YMax rows).
+# --------------------------------------------------------------------
+def clip_index(arcpy, clipFeatures, spatialReference):
+    geometries = []
+    with arcpy.da.SearchCursor(clipFeatures, ["SHAPE@"], spatial_reference = spatialReference) as cursor:
         for row in cursor:
-            
-            # Create dictionary to hold distances calculated from coordinates in row to all points in the Excel file
-            # This dictionary is composed of a key, value pair where:
-            # key: Object ID from Excel file
-            # value: Distance calculated from current row to object ID coordinates (in miles)
-            # Dictionary structure/index:
-            # [Key]          
-            # [Object ID] = Distance in miles
-            distances = {}
-            # Store longitude from current row
-            long = row[0]
-            # Store latitude from current row
-            lat = row[1]
-            
-            # Loop through the entire Excel file to calculate the distance from the current 
-            # row's coordinates to all the coordinates in the Excel file
-            for index in file.index:
-                # Store calculations in dictionary 
-                distances[file["OBJECTID"][index]] = distance(lat, long, file["LATITUDE"][index], file["LONGITUDE"][index])
-
-            # Return the shortest distance in a tuple where the structure is:
-            # (Distance value, Object ID key)
-            shortestDistance = min(zip(distances.values(), distances.keys()))
-
-            # Update M81_PGA column
-            row[2] = xlookup(shortestDistance[1],file["OBJECTID"],file["M81_PGA"])
-            # Update M84_PGA column
-            row[3] = xlookup(shortestDistance[1],file["OBJECTID"],file["M84_PGA"])
-            # Update M87_PGA column
-            row[4] = xlookup(shortestDistance[1],file["OBJECTID"],file["M87_PGA"])
-            # Update M90_PGA column
-            row[5] = xlookup(shortestDistance[1],file["OBJECTID"],file["M90_PGA"])
-
-            # Update the row
-            cursor.updateRow(row)
-    # Print a message in ArcGIS Pro
-    message("PGA values successfully added!")
-
-# --------------------------------------------------------------------
-# Clip features
-# --------------------------------------------------------------------
-# If the third parameter is false, print a message in ArcGIS Pro
-if clip == False:
-    message("Clipping features skipped!")
-else:
-    # Clipping features message
-    message("Clipping features...")
-    # New, temporary name for the clipped feature
-    clippedInputFeature = os.path.join(infrastructuresPath, featureName + "Clipped")
-
-    # Perform pairwise clip analysis to clip the input features given the clip features, and output the 
-    # clipped feature layer to the "Infrastructures.gdb".
-    # ArcGIS Pro does not allow two feature layers of the same type with the same name in the same geodatabase, thus
-    # why we added "Clipped" to the end of the clipped feature layer.
-    arcpy.PairwiseClip_analysis(inputFeature, clipFeatures, clippedInputFeature)
-
-    # Delete the original input feature from the "Infrastructures.gdb".
-    # We are deleting it because we don't want to have the original and the clipped version in the same place.
-    arcpy.Delete_management(inputFeature)
-
-    # We don't want to have the word "Clipped" at the end of the newly clipped feature layer, so we'll rename it.
-    arcpy.Rename_management(clippedInputFeature, os.path.join(infrastructuresPath, featureName))
-
-    # Success message
-    message("{} clipped!".format(featureName))
\ No newline at end of file
+            if row[0] is not None:
+                geometries.append(row[0])
+    extents = np.array([[geometry.extent.XMin, geometry.extent.YMin, geometry.extent.XMax, geometry.extent.YMax]
+                        for geometry in geometries], dtype = float).reshape(-1, 4)
+    return geometries, extents
+
+# --------------------------------------------------------------------
+# Clips a shape with the clip features of clip_index.
+# Returns the shape itself when a clip feature contains it, its intersection with the clip features it overlaps,
+# or None when nothing of it is left.
+# --------------------------------------------------------------------
+def clip_shape(shape, geometries, extents, dimension):
+    # Only the clip features whose extent overlaps the shape's extent can overlap the shape
+    extent = shape.extent
+    candidates = np.flatnonzero((extents[:, 0] <= extent.XMax) & (extents[:, 2] >= extent.XMin) &
+                                (extents[:, 1] <= extent.YMax) & (extents[:, 3] >= extent.YMin))
+    if candidates.size == 0:
+        return None
+
+    # Most features lie completely inside one clip feature and are kept as they are
+    for candidate in candidates:
+        if geometries[candidate].contains(shape):
+            return shape
+
+    clipGeometry = geometries[candidates[0]]
+    for candidate in candidates[1:]:
+        clipGeometry = clipGeometry.union(geometries[candidate])
+    clipped = shape.intersect(clipGeometry, dimension)
+    if clipped is None or clipped.pointCount == 0:
+        return None
+    return clipped
+
+# --------------------------------------------------------------------
+# Copies the input features to the output feature class in one pass: every feature is read once, gets its inside
+# point (LONG_CALC and LAT_CALC), is clipped with the clip features (None: no clipping), gets the PGA values of the
+# scenarios (None: no PGA values) and is written once.
+# The PGA values of every scenario are stored in the scenario side table of the output, keyed by its object IDs.
+# The object IDs change when the output is written again, so the old side tables of the output are always removed.
+# Features without geometry are kept (with empty coordinates and PGA values) as the copy kept them, unless the
+# features are clipped, as the clip left them out.
+# Returns the number of features written.
+# --------------------------------------------------------------------
+def prepare_features(backend, inputFeature, outputFeature, fieldsDict, clipFeatures = None, scenarios = None,
+                     projectPath = None, pgasPath = None):
+    arcpy = backend.arcpy
+    describe = arcpy.Describe(inputFeature)
+    shapeType = describe.shapeType
+    spatialReference = describe.spatialReference
+
+    # The coordinates are calculated in decimal degrees of the geographic coordinate system of the input feature
+    geographic = spatialReference.GCS if spatialReference.type == "Projected" else None
+
+    # The input feature can't be replaced while it's read, so a copy of it is first written next to it
+    outputPath, outputName = os.path.split(outputFeature)
+    replaceInput = os.path.normcase(os.path.abspath(describe.catalogPath)) == os.path.normcase(os.path.abspath(outputFeature))
+    writtenFeature = os.path.join(outputPath, outputName + "Prepared") if replaceInput else outputFeature
+    if arcpy.Exists(writtenFeature):
+        arcpy.Delete_management(writtenFeature)
+    arcpy.CreateFeatureclass_management(outputPath, os.path.basename(writtenFeature), shapeType, inputFeature,
+                                        "SAME_AS_TEMPLATE", "SAME_AS_TEMPLATE", spatialReference)
+
+    # The coordinate fields and the fields the Disaster Impact tool needs are added in one operation
+    preparationFields = {"LONG_CALC": ("DOUBLE", "LONG_CALC"), "LAT_CALC": ("DOUBLE", "LAT_CALC")}
+    preparationFields.update(fieldsDict)
+    for field in backend.add_fields(writtenFeature, preparationFields):
+        backend.message("Added '{}' field!".format(field))
+
+    # The scenarios with an attribute table field (M81_PGA, M84_PGA, M87_PGA, M90_PGA by default)
+    # are also written to the attribute table.
+    calculatePGA = scenarios is not None
+    fieldScenarios = [index for index, scenario in enumerate(scenarios) if scenario.get("field")] if calculatePGA else []
+    pgaFields = [scenarios[index]["field"] for index in fieldScenarios]
+    with stage("Load PGA grids"):
+        sources = load_pga_sources(scenarios, pgasPath, backend.message) if calculatePGA else []
+
+    # Every other field of the input feature is copied as it is
+    calculatedFields = {field.upper() for field in ["LONG_CALC", "LAT_CALC"] + pgaFields}
+    inputFields = {field.name.upper() for field in arcpy.ListFields(inputFeature)}
+    copyFields = [field.name for field in arcpy.ListFields(writtenFeature)
+                  if field.editable and field.type not in ("OID", "Geometry", "GlobalID")
+                  and field.name.upper() in inputFields and field.name.upper() not in calculatedFields]
+
+    if clipFeatures is not None:
+        with stage("Read clip features") as clipStage:
+            geometries, extents = clip_index(arcpy, clipFeatures, spatialReference)
+            dimension = CLIP_DIMENSIONS.get(shapeType, 4)
+            clipStage.rows = len(geometries)
+
+    objectIDs = []
+    featurePGAs = []
+    written = 0
+    emptyShapes = 0
+    # One stage for the whole pass: the features are read, clipped and written a chunk at a time
+    with stage("Read, clip and write features") as featureStage:
+        with arcpy.da.SearchCursor(inputFeature, ["SHAPE@"] + copyFields) as rows, \
+             arcpy.da.InsertCursor(writtenFeature, ["SHAPE@"] + copyFields + ["LONG_CALC", "LAT_CALC"] + pgaFields) as cursor:
+            while True:
+                chunk = list(itertools.islice(rows, PREPARATION_CHUNK_ROWS))
+                if not chunk:
+                    break
+
+                # The inside point is calculated before the feature is clipped, as it was by the copy that was clipped later
+                shapes = []
+                longs = []
+                lats = []
+                for row in chunk:
+                    shape = row[0]
+                    if shape is None:
+                        shapes.append(None)
+                        longs.append(np.nan)
+                        lats.append(np.nan)
+                        continue
+                    point = arcpy.PointGeometry(shape.firstPoint if shapeType == "Point" else shape.labelPoint, spatialReference)
+                    if geographic is not None:
+                        point = point.projectAs(geographic)
+                    longs.append(point.firstPoint.X)
+                    lats.append(point.firstPoint.Y)
+                    shapes.append(shape if clipFeatures is None else clip_shape(shape, geometries, extents, dimension))
+
+                # The PGA values of the chunk's features come from the spatial index of every PGA source file
+                scenarioPGAs = scenario_pgas(sources, len(scenarios), np.array(lats), np.array(longs)) if calculatePGA else None
+
+                for featureRow, (row, shape) in enumerate(zip(chunk, shapes)):
+                    if row[0] is None:
+                        emptyShapes += 1
+                    # Features outside of the clip features (and clipped features without geometry) are left out
+                    if shape is None and (row[0] is not None or clipFeatures is not None):
+                        continue
+                    pgas = [] if scenarioPGAs is None else scenarioPGAs[featureRow, fieldScenarios]
+                    coordinates = [longs[featureRow], lats[featureRow]]
+                    objectID = cursor.insertRow([shape] + list(row[1:]) +
+                                                [None if np.isnan(value) else float(value) for value in coordinates] +
+                                                [None if np.isnan(pga) else float(pga) for pga in pgas])
+                    written += 1
+                    if calculatePGA:
+                        objectIDs.append(objectID)
+                        featurePGAs.append(scenarioPGAs[featureRow])
+        featureStage.rows = written
+
+    if emptyShapes:
+        backend.message("{} features without geometry {}!".format(
+            emptyShapes, "left out by the clip" if clipFeatures is not None else "copied without coordinates or PGA values"))
+
+    if replaceInput:
+        arcpy.Delete_management(outputFeature)
+        arcpy.Rename_management(writtenFeature, outputFeature)
+
+    # The side tables of the old output are keyed by its object IDs, which the new output doesn't keep
+    if projectPath is not None:
+        for results in (False, True):
+            path = scenario_table_path(projectPath, outputName, results)
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Store the PGA values of every scenario in the layer's scenario side table
+    # ("Projects\GADEP\Scenarios\{feature name}.npz"), keyed by object ID
+    if calculatePGA:
+        scenarioNames = [scenario["name"] for scenario in scenarios]
+        write_scenario_table(scenario_table_path(projectPath, outputName), objectIDs, scenarioNames,
+                             np.array(featurePGAs, dtype = float).reshape(-1, len(scenarios)))
+        backend.message("PGA values of {} scenarios stored in the scenario side table!".format(len(scenarioNames)))
+    return written
+
+# ********************************************************************
+# Main Program
+# ********************************************************************
+# --------------------------------------------------------------------
+# Runs the tool in ArcGIS Pro
+# --------------------------------------------------------------------
+def main():
+    import arcpy
+    backend = ArcpyBackend()
+    message = backend.message
+
+    # --------------------------------------------------------------------
+    # Setting directories
+    # --------------------------------------------------------------------
+    # Get the current directory of the script; it should look something like the following:
+    # {YOUR LOCAL DRIVE}\{OTHER FOLDERS}\GADEP\Scripts
+    scriptsPath = os.getcwd()
+
+    projectPath = os.path.join(os.path.dirname(scriptsPath), "Projects", "GADEP")
+    infrastructuresPath = os.path.join(projectPath, "Infrastructures.gdb")
+    pgasPath = os.path.join(os.path.dirname(scriptsPath), "PGA Values")
+
+    # --------------------------------------------------------------------
+    # Initialize paramter variables
+    # --------------------------------------------------------------------
+    # The first paramter will be a feature layer
+    inputFeature = arcpy.GetParameter(0)
+    # The second paramter is a boolean asking the user whether or not the PGA values in the input feature will be calculated
+    calculatePGA = arcpy.GetParameter(1)
+    # The third paramter is a boolean asking the user whether or not the resulting feature layer will be clipped
+    clip = arcpy.GetParameter(2)
+    # The fourth paramter will be the clip features 
+    clipFeatures = arcpy.GetParameter(3)
+
+    # --------------------------------------------------------------------
+    # Create the prepared copy of the input feature in the Infrastructures.gdb
+    # --------------------------------------------------------------------
+    # Set the new name of the feature layer.
+    # An error will be thrown if the feature layer's name contains blanks, so we need to get rid of them first
+
+    # Store the feature layer name
+    featureName = inputFeature.name
+    # If it contains a blank, change the case of the sring to title case (it looks better), and get rid of the blanks
+    if " " in featureName:
+        featureName = featureName.title().replace(" ", "")
+    outputFeature = os.path.join(infrastructuresPath, featureName)
+
+    # Create a dictionary containing the fields that need to be added (see preparation_fields)
+    scenarios = load_scenarios(pgasPath)
+    fieldsDict = preparation_fields(scenarios)
+
+    # If the third parameter is false, print a message in ArcGIS Pro
+    if clip == False:
+        clipFeatures = None
+        message("Clipping features skipped!")
+    else:
+        message("Clipping features...")
+    # If the second parameter is false, print a message in ArcGIS Pro
+    if calculatePGA == False:
+        message("Calculating PGA values skipped!")
+    else:
+        message("Calculating PGA values...")
+
+    # The input features are read once. Every feature gets its latitude and longitude (LONG_CALC and LAT_CALC, in
+    # decimal degrees, calculated before clipping so the clipped features keep the PGA values of the whole feature),
+    # is clipped with the clip features, gets its PGA values and is written once to the "Infrastructures.gdb".
+    # The object IDs the scenario side table is keyed by are the object IDs of the final feature class.
+    written = prepare_features(backend, inputFeature, outputFeature, fieldsDict, clipFeatures,
+                               scenarios if calculatePGA else None, projectPath, pgasPath)
+
+    # The new copy has empty result fields, so the next Disaster Impact run has to calculate every row again
+    remove_fingerprints(projectPath, featureName)
+
+    # Print success messages in ArcGIS Pro
+    message("{} features successfully copied to {}!".format(written, infrastructuresPath))
+    message("Latitude and longitude fields and coordinates successfully added!")
+    if clip != False:
+        message("{} clipped!".format(featureName))
+    if calculatePGA != False:
+        message("PGA values successfully added!")
+
+# The tool only runs when the script is started (by ArcGIS Pro or Python), not when it's imported
+if __name__ == "__main__":
+    # The timings of the run are printed when it ends (see Instrumentation.py)
+    with tracing(ArcpyBackend().message):
+        main()
@@ -0,0 +1,750 @@
+import csv          # Route tables are written as CSV files by the command line interface
+import heapq        # Priority queue of the k nearest facilities search
+import json         # The network's metadata file is JSON
+import os           # Import os package to work with directories
+import re
+import shutil
+# NumPy holds the whole road network in a few flat arrays
+import numpy as np
+# scipy's Dijkstra runs in compiled code over the CSR adjacency
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+# The KD-tree of nearest points on the earth (see GroundMotion.py)
+from GroundMotion import EARTH_RADIUS_KM, KM_PER_MILE, StationIndex, chord_to_miles, unit_sphere_coordinates
+# Stage timers and cache counters of a traced run
+from Instrumentation import count_event, stage
+
+# ********************************************************************
+# Road Network
+# ********************************************************************
+# The Disaster Route Analysis tool used to build a network dataset layer and a ClosestFacility solver on every run,
+# which needs a Network Analyst license and takes ~30 seconds for a handful of routes. Instead, the edges of the
+# network dataset (e.g. TransportationNetwork.gdb\OregonNetwork) can be exported once into a folder of .npy files
+# (e.g. "Projects\GADEP\OregonNetwork.network") holding the network as a CSR (compressed sparse row) adjacency:
+#   nodeLat, nodeLong         - float64 coordinates of the junctions (decimal degrees)
+#   indptr                    - int64, the arcs leaving junction n are indptr[n]:indptr[n + 1]
+#   indices                   - int32 junction each arc leads to
+#   minutes                   - float64 travel time of each arc
+#   arcEdges                  - int32 edge (row position in edgeIDs) each arc belongs to
+#   arcReversed               - bool, True for arcs that travel against the digitized direction of their edge
+#   edgeIDs                   - int64 object IDs of the edges
+#   edgeVertexPtr             - int64, the vertices of edge e are edgeVertexPtr[e]:edgeVertexPtr[e + 1]
+#   vertexLat, vertexLong     - float64 coordinates of the edge vertices, in digitized order
+#   network.json              - the network version, the edge sources and the counts
+# The .npy files are opened memory-mapped, so loading the network doesn't read it until it's used.
+#
+# Junctions are the end points of the edges (the "end point" connectivity of a network dataset): end points
+# closer than NODE_DECIMALS decimal degrees are the same junction, so the junction feature class isn't read.
+# Every edge becomes one arc per direction it can be traveled in (see ONEWAY_FORWARD and ONEWAY_BACKWARD).
+#
+# Routes are solved with Dijkstra's algorithm on that adjacency. Bridges (or any other point barriers) close the
+# edges nearest to them, by giving their arcs an infinite travel time ("edge masks"), so the network itself never changes.
+
+# Bump this number whenever the layout of the exported network changes so old networks get exported again
+NETWORK_VERSION = 1
+
+# End points rounded to this many decimals (~0.1 m) are the same junction
+NODE_DECIMALS = 6
+
+# Incidents, facilities and barriers farther than this from the network are not located
+# (the default search tolerance of Network Analyst is 5000 meters)
+SEARCH_TOLERANCE_MILES = 5000 / 1000 / KM_PER_MILE
+
+# Fields holding the travel time of an edge in minutes, the speed limit, the direction of one way roads, and the
+# road class (OSM's "highway" tag), in order of preference. Field names are compared without case.
+MINUTES_FIELDS = ("Minutes", "TravelTime", "Travel_Time", "DriveTime", "Drive_Time")
+SPEED_FIELDS = ("maxspeed", "SpeedLimit", "Speed_Limit", "Speed")
+ONEWAY_FIELDS = ("oneway", "Oneway", "One_Way")
+CLASS_FIELDS = ("highway", "fclass", "RoadClass")
+
+# Values of the one way field: roads open only in their digitized direction, or only against it
+# (OSM uses yes/-1, Esri street data FT/TF); any other value is a two way road
+ONEWAY_FORWARD = ("yes", "true", "1", "ft", "f")
+ONEWAY_BACKWARD = ("-1", "tf", "t", "reverse")
+
+# Speed of a road (km/h) by road class when it has no speed limit, and of every other road
+CLASS_SPEEDS_KMH = {
+    "motorway": 100, "trunk": 90, "primary": 80, "secondary": 70, "tertiary": 60,
+    "unclassified": 50, "residential": 40, "service": 25, "living_street": 15, "track": 20,
+}
+DEFAULT_SPEED_KMH = 50
+
+# Road classes vehicles can't travel on (the "Vehicle" travel mode); their edges are not exported
+NON_VEHICLE_CLASSES = ("footway", "cycleway", "path", "pedestrian", "steps", "bridleway", "corridor", "elevator")
+
+# The edge segments are indexed in pieces of at most this length (km), so a point is only compared with the segments near it
+SEGMENT_PIECE_KM = 0.1
+
+# Distances of the closest facility searches are computed for this many (incidents x junctions) at a time
+SEARCH_BATCH_VALUES = 20000000
+
+# Closest facility searches (see closest_facilities and reverse_closest_facilities):
+# INCIDENT - one search from every incident; best with many facilities
+# FACILITY - a single reverse search from every facility at once; best with few facilities (e.g. shelters, hospitals)
+# AUTO     - FACILITY if there are fewer facilities than incidents, otherwise INCIDENT
+INCIDENT = "INCIDENT"
+FACILITY = "FACILITY"
+AUTO = "AUTO"
+SEARCHES = (AUTO, INCIDENT, FACILITY)
+
+# --------------------------------------------------------------------
+# Finds the nearest segment (the straight line between two consecutive vertices of an edge) of many points at once.
+# The segments are split into pieces of at most SEGMENT_PIECE_KM and the midpoints of the pieces go in a KD-tree. For every
+# point, the nearest piece midpoint gives an upper bound of the distance to the nearest segment; every piece whose
+# midpoint is within that bound plus half a piece is then measured exactly, by projecting the point onto the piece's
+# segment. So long segments, and roads crossing each other (e.g. at an overpass), are matched by their distance to the
+# point, not by the distance to their midpoint.
+# Distances are measured on the unit sphere (see GroundMotion.py); over a segment, the straight line and the earth's
+# surface differ by less than a millimeter.
+# --------------------------------------------------------------------
+class SegmentIndex:
+    __slots__ = ("tree", "starts", "ends", "pieceSegments", "radius")
+
+    def __init__(self, lat, long, segments):
+        self.starts = unit_sphere_coordinates(lat[segments], long[segments])
+        self.ends = unit_sphere_coordinates(lat[segments + 1], long[segments + 1])
+        lengths = np.linalg.norm(self.ends - self.starts, axis = 1)
+
+        # Every segment is split into pieces of the same length
+        pieceCounts = np.maximum(np.ceil(lengths / (SEGMENT_PIECE_KM / EARTH_RADIUS_KM)), 1).astype(np.int64)
+        self.pieceSegments = np.repeat(np.arange(segments.shape[0]), pieceCounts)
+        pieceNumbers = np.arange(self.pieceSegments.shape[0]) - np.repeat(np.cumsum(pieceCounts) - pieceCounts, pieceCounts)
+        fractions = (pieceNumbers + 0.5) / pieceCounts[self.pieceSegments]
+        midpoints = self.starts[self.pieceSegments] + fractions[:, None] * (self.ends - self.starts)[self.pieceSegments]
+        self.tree = cKDTree(midpoints)
+        # No point of a piece is farther than this from the piece's midpoint
+        self.radius = float((lengths / pieceCounts).max()) / 2 if segments.shape[0] else 0.0
+
+    # --------------------------------------------------------------------
+    # Returns, for every coordinate:
+    #   segments  - the position of the nearest segment (-1 if the coordinate is missing)
+    #   distances - the distance to that segment in miles (NaN if the coordinate is missing)
+    # --------------------------------------------------------------------
+    def nearest(self, lat, long):
+        points = unit_sphere_coordinates(lat, long)
+        valid = np.all(np.isfinite(points), axis = 1)
+        segments = np.full(points.shape[0], -1, dtype = np.intp)
+        distances = np.full(points.shape[0], np.nan)
+        if not valid.any() or self.pieceSegments.shape[0] == 0:
+            return segments, distances
+
+        validPoints = points[valid]
+        bounds, _ = self.tree.query(validPoints)
+        candidates = self.tree.query_ball_point(validPoints, bounds * (1 + 1e-9) + self.radius + 1e-12)
+        candidateCounts = np.array([len(pieces) for pieces in candidates], dtype = np.intp)
+        candidatePoints = np.repeat(np.arange(validPoints.shape[0]), candidateCounts)
+        candidateSegments = self.pieceSegments[np.concatenate([np.asarray(pieces, dtype = np.intp) for pieces in candidates])]
+
+        # Distance from every point to the nearest point of every candidate segment
+        starts = self.starts[candidateSegments]
+        directions = self.ends[candidateSegments] - starts
+        offsets = validPoints[candidatePoints] - starts
+        squaredLengths = np.maximum((directions * directions).sum(axis = 1), np.finfo(float).tiny)
+        along = np.clip((offsets * directions).sum(axis = 1) / squaredLengths, 0, 1)
+        chords = np.linalg.norm(offsets - along[:, None] * directions, axis = 1)
+
+        # The closest candidate of every point (the candidates are sorted by point, then by distance)
+        order = np.lexsort((chords, candidatePoints))
+        first = order[np.concatenate([[True], candidatePoints[order][1:] != candidatePoints[order][:-1]])]
+        segments[valid] = candidateSegments[first]
+        distances[valid] = chord_to_miles(chords[first])
+        return segments, distances
+
+# --------------------------------------------------------------------
+# An exported road network (see above). Junctions are also called nodes.
+# --------------------------------------------------------------------
+class RoadNetwork:
+    __slots__ = ("nodeLat", "nodeLong", "indptr", "indices", "minutes", "arcEdges", "arcReversed",
+                 "edgeIDs", "edgeVertexPtr", "vertexLat", "vertexLong", "nodeIndex", "segmentIndex")
+
+    def __init__(self, arrays):
+        for name in self.__slots__[:-2]:
+            setattr(self, name, arrays[name])
+        # The KD-trees of the junctions and the edge segments are only built when something is located on the network
+        self.nodeIndex = None
+        self.segmentIndex = None
+
+    @property
+    def nodeCount(self):
+        return self.nodeLat.shape[0]
+
+    @property
+    def arcCount(self):
+        return self.indices.shape[0]
+
+    # --------------------------------------------------------------------
+    # Returns the network as a (junctions x junctions) sparse matrix of travel times.
+    # Closed arcs (a boolean array, one per arc) get an infinite travel time, which Dijkstra never travels.
+    # minutes replaces the travel times of the arcs (e.g. with penalties).
+    # --------------------------------------------------------------------
+    def matrix(self, closedArcs = None, minutes = None):
+        data = np.array(self.minutes if minutes is None else minutes, dtype = float)
+        if closedArcs is not None:
+            data[closedArcs] = np.inf
+        return csr_matrix((data, np.asarray(self.indices), np.asarray(self.indptr)), shape = (self.nodeCount, self.nodeCount))
+
+    # --------------------------------------------------------------------
+    # Returns, for every coordinate, the nearest junction (-1 if it's farther than tolerance miles, or has no coordinates)
+    # --------------------------------------------------------------------
+    def snap(self, lat, long, tolerance = SEARCH_TOLERANCE_MILES):
+        if self.nodeIndex is None:
+            self.nodeIndex = StationIndex(self.nodeLat, self.nodeLong)
+        nodes, distances = self.nodeIndex.nearest(lat, long)
+        nodes[~(distances <= tolerance)] = -1
+        return nodes
+
+    # --------------------------------------------------------------------
+    # Returns, for every coordinate, the nearest edge (-1 if it's farther than tolerance miles).
+    # Edges are located by the distance to their segments (see SegmentIndex), measured from the coordinate to the
+    # nearest point of the segment.
+    # --------------------------------------------------------------------
+    def nearest_edges(self, lat, long, tolerance = SEARCH_TOLERANCE_MILES):
+        if self.segmentIndex is None:
+            vertexEdges = np.searchsorted(self.edgeVertexPtr, np.arange(self.vertexLat.shape[0]), side = "right") - 1
+            segments = np.flatnonzero(vertexEdges[1:] == vertexEdges[:-1])
+            self.segmentIndex = (SegmentIndex(np.asarray(self.vertexLat), np.asarray(self.vertexLong), segments),
+                                 vertexEdges[segments])
+        index, segmentEdges = self.segmentIndex
+        segments, distances = index.nearest(lat, long)
+        return np.where(distances <= tolerance, segmentEdges[np.maximum(segments, 0)], -1)
+
+    # --------------------------------------------------------------------
+    # Returns the boolean array (one per arc) of the arcs of the given edges
+    # --------------------------------------------------------------------
+    def edge_arcs(self, edges):
+        edges = np.asarray(edges)
+        return np.isin(self.arcEdges, edges[edges >= 0])
+
+    # --------------------------------------------------------------------
+    # Returns the arcs closed by point barriers (e.g. damaged bridges): every arc of the edge nearest to a barrier
+    # --------------------------------------------------------------------
+    def barrier_arcs(self, lat, long, tolerance = SEARCH_TOLERANCE_MILES):
+        return self.edge_arcs(self.nearest_edges(lat, long, tolerance))
+
+    # --------------------------------------------------------------------
+    # Returns the travel times of the arcs with the arcs of the given edges multiplied by a factor
+    # (e.g. the penalty of a damaged bridge; inf closes the arcs). When several factors fall on one edge, the highest counts.
+    # --------------------------------------------------------------------
+    def scaled_minutes(self, edges, factors):
+        edges = np.asarray(edges, dtype = np.int64)
+        factors = np.asarray(factors, dtype = float)
+        located = edges >= 0
+        edgeFactors = np.ones(self.edgeIDs.shape[0])
+        np.maximum.at(edgeFactors, edges[located], factors[located])
+        arcFactors = edgeFactors[np.asarray(self.arcEdges)]
+        return np.where(np.isinf(arcFactors), np.inf, np.asarray(self.minutes, dtype = float) * arcFactors)
+
+    # --------------------------------------------------------------------
+    # Returns the cheapest open arc from junction start to junction end
+    # --------------------------------------------------------------------
+    def arc_between(self, start, end, minutes = None):
+        minutes = self.minutes if minutes is None else minutes
+        arcs = np.arange(self.indptr[start], self.indptr[start + 1])
+        arcs = arcs[np.asarray(self.indices[arcs]) == end]
+        return int(arcs[np.argmin(np.asarray(minutes)[arcs])])
+
+    # --------------------------------------------------------------------
+    # Returns the (vertices x 2) longitudes and latitudes of a path (a list of junctions), following the edge geometries
+    # --------------------------------------------------------------------
+    def path_coordinates(self, path, minutes = None):
+        path = [int(node) for node in path]
+        pieces = [np.array([[self.nodeLong[path[0]], self.nodeLat[path[0]]]])]
+        for start, end in zip(path[:-1], path[1:]):
+            arc = self.arc_between(start, end, minutes)
+            edge = self.arcEdges[arc]
+            vertices = slice(self.edgeVertexPtr[edge], self.edgeVertexPtr[edge + 1])
+            piece = np.column_stack((self.vertexLong[vertices], self.vertexLat[vertices]))
+            pieces.append((piece[::-1] if self.arcReversed[arc] else piece)[1:])
+        return np.concatenate(pieces)
+
+# ********************************************************************
+# Export
+# ********************************************************************
+# --------------------------------------------------------------------
+# Returns the first field of a table matching one of the candidate names (without case), or None
+# --------------------------------------------------------------------
+def find_field(fields, candidates):
+    byName = {field.lower(): field for field in fields}
+    for candidate in candidates:
+        if candidate.lower() in byName:
+            return byName[candidate.lower()]
+    return None
+
+# --------------------------------------------------------------------
+# Reads a speed limit (e.g. 45, "45", "45 mph", "70 km/h") in km/h. Returns NaN if there is no number.
+# --------------------------------------------------------------------
+def speed_kmh(value):
+    match = re.match(r"\s*([0-9]+(?:\.[0-9]+)?)", str(value)) if value is not None else None
+    if match is None:
+        return np.nan
+    speed = float(match.group(1))
+    return speed * KM_PER_MILE if "mph" in str(value).lower() else speed
+
+# --------------------------------------------------------------------
+# Returns the great-circle distances (km) between consecutive coordinates
+# --------------------------------------------------------------------
+def segment_lengths(lat, long):
+    lat = np.radians(lat)
+    long = np.radians(long)
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(long) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+# --------------------------------------------------------------------
+# Reads the edges of one or more edge sources.
+# Returns a dictionary with one entry per edge: the object IDs, vertices, parts, travel times (NaN if the source
+# has no travel time field), speeds (km/h) and whether the edge is open forward and backward.
+# --------------------------------------------------------------------
+def read_edges(backend, edgeTables):
+    edgeIDs, vertices, vertexParts, partEdges = [], [], [], []
+    minutes, speeds, forward, backward = [], [], [], []
+
+    for table in edgeTables:
+        fields = backend.list_fields(table)
+        minutesField = find_field(fields, MINUTES_FIELDS)
+        speedField = find_field(fields, SPEED_FIELDS)
+        onewayField = find_field(fields, ONEWAY_FIELDS)
+        classField = find_field(fields, CLASS_FIELDS)
+        readFields = ["OID@"] + [field for field in (minutesField, speedField, onewayField, classField) if field is not None]
+        column = {field: position + 1 for position, field in enumerate(readFields)}
+
+        for row in backend.read_lines(table, readFields):
+            parts = [part for part in row[0] if part.shape[0] > 1]
+            roadClass = str(row[column[classField]]).lower() if classField is not None else ""
+            if not parts or roadClass in NON_VEHICLE_CLASSES:
+                continue
+
+            for part in parts:
+                vertices.append(part)
+                vertexParts.append(np.full(part.shape[0], len(partEdges), dtype = np.int64))
+                partEdges.append(len(edgeIDs))
+            edgeIDs.append(row[1])
+
+            value = row[column[minutesField]] if minutesField is not None else None
+            minutes.append(float(value) if isinstance(value, (int, float)) and value >= 0 else np.nan)
+            speed = speed_kmh(row[column[speedField]]) if speedField is not None else np.nan
+            if not speed > 0:
+                speed = CLASS_SPEEDS_KMH.get(roadClass.replace("_link", ""), DEFAULT_SPEED_KMH)
+            speeds.append(speed)
+
+            oneway = str(row[column[onewayField]]).strip().lower() if onewayField is not None else ""
+            forward.append(oneway not in ONEWAY_BACKWARD)
+            backward.append(oneway not in ONEWAY_FORWARD)
+
+    if not edgeIDs:
+        raise ValueError("The edge sources have no edges")
+
+    return {
+        "edgeIDs": np.array(edgeIDs, dtype = np.int64),
+        "vertices": np.concatenate(vertices),
+        # Part of every vertex, and edge of every part
+        "vertexParts": np.concatenate(vertexParts),
+        "partEdges": np.array(partEdges, dtype = np.int64),
+        "minutes": np.array(minutes, dtype = float),
+        "speeds": np.array(speeds, dtype = float),
+        "forward": np.array(forward, dtype = bool),
+        "backward": np.array(backward, dtype = bool),
+    }
+
+# --------------------------------------------------------------------
+# Builds the network arrays (see above) from the edges returned by read_edges
+# --------------------------------------------------------------------
+def build_network(edges):
+    vertices = edges["vertices"]
+    vertexEdges = edges["partEdges"][edges["vertexParts"]]
+    edgeCount = edges["edgeIDs"].shape[0]
+
+    # Length of every edge: the segments between consecutive vertices of the same part
+    lengths = segment_lengths(vertices[:, 1], vertices[:, 0])
+    samePart = edges["vertexParts"][1:] == edges["vertexParts"][:-1]
+    lengthKm = np.bincount(vertexEdges[1:][samePart], weights = lengths[samePart], minlength = edgeCount)
+
+    # Travel time: the edge's travel time field, or its length at its speed
+    minutes = np.where(np.isnan(edges["minutes"]), lengthKm / edges["speeds"] * 60, edges["minutes"])
+
+    # The first vertex of an edge is its start point and the last vertex its end point
+    edgeVertexPtr = np.concatenate([[0], np.cumsum(np.bincount(vertexEdges, minlength = edgeCount))]).astype(np.int64)
+    endPoints = np.concatenate([vertices[edgeVertexPtr[:-1]], vertices[edgeVertexPtr[1:] - 1]])
+    nodes, endNodes = np.unique(np.round(endPoints, NODE_DECIMALS), axis = 0, return_inverse = True)
+    endNodes = endNodes.ravel()
+    startNodes, endNodes = endNodes[:edgeCount], endNodes[edgeCount:]
+
+    # One arc per direction an edge can be traveled in; edges that start and end at the same junction lead nowhere
+    allEdges = np.arange(edgeCount)
+    useful = startNodes != endNodes
+    forward = allEdges[edges["forward"] & useful]
+    backward = allEdges[edges["backward"] & useful]
+    arcStarts = np.concatenate([startNodes[forward], endNodes[backward]])
+    arcEnds = np.concatenate([endNodes[forward], startNodes[backward]])
+    arcEdges = np.concatenate([forward, backward])
+    arcReversed = np.concatenate([np.zeros(forward.shape[0], dtype = bool), np.ones(backward.shape[0], dtype = bool)])
+
+    # Sort the arcs by the junction they leave from (CSR order)
+    order = np.argsort(arcStarts, kind = "stable")
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(arcStarts, minlength = nodes.shape[0]))]).astype(np.int64)
+
+    return {
+        "nodeLat": nodes[:, 1].astype(np.float64),
+        "nodeLong": nodes[:, 0].astype(np.float64),
+        "indptr": indptr,
+        "indices": arcEnds[order].astype(np.int32),
+        "minutes": minutes[arcEdges[order]].astype(np.float64),
+        "arcEdges": arcEdges[order].astype(np.int32),
+        "arcReversed": arcReversed[order],
+        "edgeIDs": edges["edgeIDs"],
+        "edgeVertexPtr": edgeVertexPtr,
+        "vertexLat": vertices[:, 1].astype(np.float64),
+        "vertexLong": vertices[:, 0].astype(np.float64),
+    }
+
+# --------------------------------------------------------------------
+# Exports the edge sources of a network to a network folder. Returns the path of the network folder.
+# Parameters:
+#   backend    - storage backend the edge sources are read with (see Backends.py)
+#   edgeTables - list of edge feature classes/tables (e.g. the edge sources of OregonNetworkDataset)
+# --------------------------------------------------------------------
+def export_network(backend, edgeTables, networkPath):
+    with stage("Read edges") as readStage:
+        edges = read_edges(backend, edgeTables)
+        readStage.rows = int(edges["edgeIDs"].shape[0])
+    with stage("Build network"):
+        arrays = build_network(edges)
+
+    # Write to a temporary folder first so a failed export never leaves a broken network behind
+    temporaryPath = networkPath + ".tmp"
+    shutil.rmtree(temporaryPath, ignore_errors = True)
+    os.makedirs(temporaryPath)
+    for name, values in arrays.items():
+        np.save(os.path.join(temporaryPath, name + ".npy"), values)
+
+    metadata = {
+        "version": NETWORK_VERSION,
+        "sources": [backend.table_name(table) for table in edgeTables],
+        "nodes": int(arrays["nodeLat"].shape[0]),
+        "arcs": int(arrays["indices"].shape[0]),
+        "edges": int(arrays["edgeIDs"].shape[0]),
+    }
+    with open(os.path.join(temporaryPath, "network.json"), "w") as metadataFile:
+        json.dump(metadata, metadataFile, indent = 2)
+
+    shutil.rmtree(networkPath, ignore_errors = True)
+    os.replace(temporaryPath, networkPath)
+    return networkPath
+
+# --------------------------------------------------------------------
+# Reads a network folder's metadata. Returns None if the folder doesn't exist, can't be read,
+# or was exported by a different NETWORK_VERSION.
+# --------------------------------------------------------------------
+def read_network_metadata(networkPath):
+    try:
+        with open(os.path.join(networkPath, "network.json")) as metadataFile:
+            metadata = json.load(metadataFile)
+    except (OSError, ValueError):
+        return None
+    return metadata if metadata.get("version") == NETWORK_VERSION else None
+
+# --------------------------------------------------------------------
+# Returns the RoadNetwork of a network folder, with every array memory-mapped
+# --------------------------------------------------------------------
+def load_network(networkPath):
+    if read_network_metadata(networkPath) is None:
+        raise ValueError("'{}' is not an exported road network (or was exported by an older version)".format(networkPath))
+    return RoadNetwork({name: np.load(os.path.join(networkPath, name + ".npy"), mmap_mode = "r")
+                        for name in RoadNetwork.__slots__[:-2]})
+
+# ********************************************************************
+# Closest Facilities
+# ********************************************************************
+# Routes are returned as a dictionary of arrays with one entry per route:
+#   incidents  - row position of the route's incident (in the incident arrays given to the solver)
+#   facilities - row position of the route's facility
+#   ranks      - 1 for the closest facility of the incident, 2 for the next one, ...
+#   minutes    - travel time of the route
+#   paths      - list of junction arrays, from the incident to the facility
+# Incidents that can't reach any facility (or aren't located on the network) get no route.
+
+# --------------------------------------------------------------------
+# Returns the junctions of the shortest path from source to target, given Dijkstra's predecessors of a search from source
+# --------------------------------------------------------------------
+def walk_path(predecessors, source, target):
+    path = [int(target)]
+    while path[-1] != source:
+        path.append(int(predecessors[path[-1]]))
+    return np.array(path[::-1], dtype = np.int64)
+
+# --------------------------------------------------------------------
+# Finds the count closest facilities of every incident with one Dijkstra search per distinct incident junction
+# (searches run in batches in compiled code).
+# Parameters:
+#   network        - RoadNetwork
+#   incidentNodes  - junction of every incident (see RoadNetwork.snap; -1 = not located)
+#   facilityNodes  - junction of every facility
+#   count          - number of facilities to find for every incident
+#   closedArcs     - optional boolean array of closed arcs (see RoadNetwork.barrier_arcs)
+#   cutoff         - optional longest travel time (minutes) of a route
+#   minutes        - optional travel times of the arcs replacing the network's (see RoadNetwork.scaled_minutes)
+# --------------------------------------------------------------------
+def closest_facilities(network, incidentNodes, facilityNodes, count = 1, closedArcs = None, cutoff = None, minutes = None):
+    incidentNodes = np.asarray(incidentNodes, dtype = np.int64)
+    facilityNodes = np.asarray(facilityNodes, dtype = np.int64)
+    graph = network.matrix(closedArcs, minutes)
+    limit = np.inf if cutoff is None else float(cutoff)
+
+    facilities = np.flatnonzero(facilityNodes >= 0)
+    sources = np.unique(incidentNodes[incidentNodes >= 0])
+    routes = {"incidents": [], "facilities": [], "ranks": [], "minutes": [], "paths": []}
+    if facilities.shape[0] == 0:
+        return finish_routes(routes)
+
+    batchSize = max(1, SEARCH_BATCH_VALUES // max(network.nodeCount, 1))
+    for start in range(0, sources.shape[0], batchSize):
+        batch = sources[start:start + batchSize]
+        distances, predecessors = dijkstra(graph, indices = batch, return_predecessors = True, limit = limit)
+        facilityMinutes = distances[:, facilityNodes[facilities]]
+
+        for row, source in enumerate(batch.tolist()):
+            order = np.argsort(facilityMinutes[row], kind = "stable")[:count]
+            order = order[np.isfinite(facilityMinutes[row, order])]
+            paths = [walk_path(predecessors[row], source, facilityNodes[facilities[position]]) for position in order]
+            for incident in np.flatnonzero(incidentNodes == source).tolist():
+                for rank, (position, path) in enumerate(zip(order.tolist(), paths), 1):
+                    routes["incidents"].append(incident)
+                    routes["facilities"].append(int(facilities[position]))
+                    routes["ranks"].append(rank)
+                    routes["minutes"].append(float(facilityMinutes[row, position]))
+                    routes["paths"].append(path)
+    return finish_routes(routes)
+
+# --------------------------------------------------------------------
+# Finds the count closest facilities of every incident with a single search from every facility at once, traveling the
+# arcs backwards: the search reaches every junction from its closest facility first, so one search answers every incident.
+# With count = 1 the search runs in compiled code (a multi-source Dijkstra). With a larger count every junction keeps
+# the labels (travel time, facility, previous label) of its count closest facilities (see nearest_labels).
+# The parameters are the same as closest_facilities.
+# --------------------------------------------------------------------
+def reverse_closest_facilities(network, incidentNodes, facilityNodes, count = 1, closedArcs = None, cutoff = None, minutes = None):
+    incidentNodes = np.asarray(incidentNodes, dtype = np.int64)
+    facilityNodes = np.asarray(facilityNodes, dtype = np.int64)
+    limit = np.inf if cutoff is None else float(cutoff)
+
+    facilities = np.flatnonzero(facilityNodes >= 0)
+    incidents = np.flatnonzero(incidentNodes >= 0)
+    routes = {"incidents": [], "facilities": [], "ranks": [], "minutes": [], "paths": []}
+    if facilities.shape[0] == 0 or incidents.shape[0] == 0:
+        return finish_routes(routes)
+    reverse = network.matrix(closedArcs, minutes).T.tocsr()
+
+    if count > 1:
+        labels = nearest_labels(reverse, facilityNodes[facilities], np.unique(incidentNodes[incidents]), count, limit)
+        for incident in incidents.tolist():
+            for rank, (labelMinutes, facility, path) in enumerate(labels.get(int(incidentNodes[incident]), []), 1):
+                routes["incidents"].append(incident)
+                routes["facilities"].append(int(facilities[facility]))
+                routes["ranks"].append(rank)
+                routes["minutes"].append(labelMinutes)
+                routes["paths"].append(path)
+        return finish_routes(routes)
+
+    # The first facility on every junction is the one its routes go to
+    sourceNodes, firstFacilities = np.unique(facilityNodes[facilities], return_index = True)
+    distances, predecessors, sources = dijkstra(reverse, indices = sourceNodes, min_only = True,
+                                                return_predecessors = True, limit = limit)
+    paths = {}
+    for incident in incidents.tolist():
+        node = int(incidentNodes[incident])
+        if not np.isfinite(distances[node]):
+            continue
+        source = int(sources[node])
+        # The predecessors of a backward search lead from the incident towards the facility
+        if node not in paths:
+            paths[node] = walk_path(predecessors, source, node)[::-1]
+        routes["incidents"].append(incident)
+        routes["facilities"].append(int(facilities[firstFacilities[np.searchsorted(sourceNodes, source)]]))
+        routes["ranks"].append(1)
+        routes["minutes"].append(float(distances[node]))
+        routes["paths"].append(paths[node])
+    return finish_routes(routes)
+
+# --------------------------------------------------------------------
+# k nearest labels search: finds the count closest facilities of the target junctions with one search over the
+# reversed network. Every facility starts a label at its junction; labels are taken from the queue in order of travel
+# time, and a junction accepts at most count labels, each from a different facility. The search stops once every
+# target junction has count labels (or nothing is left within limit minutes).
+# Parameters:
+#   reverse       - the reversed network matrix (arcs into every junction)
+#   sourceNodes   - junction of every facility (positions in this array are the facility numbers returned)
+#   targets       - junctions whose labels are wanted
+# Returns a dictionary of target junction -> list of (minutes, facility number, path from the target to the facility)
+# --------------------------------------------------------------------
+def nearest_labels(reverse, sourceNodes, targets, count, limit = np.inf):
+    indptr = reverse.indptr.tolist()
+    indices = reverse.indices.tolist()
+    arcMinutes = reverse.data.tolist()
+    targets = set(int(target) for target in targets)
+    remaining = len(targets)
+
+    # Accepted labels: junction, facility, travel time and previous label of every label, and the labels of every junction
+    labelNodes, labelFacilities, labelMinutes, labelParents = [], [], [], []
+    nodeLabels = {}
+    queue = [(0.0, int(node), facility, -1) for facility, node in enumerate(sourceNodes.tolist())]
+    heapq.heapify(queue)
+
+    while queue and remaining:
+        minutes, node, facility, parent = heapq.heappop(queue)
+        accepted = nodeLabels.setdefault(node, [])
+        if len(accepted) >= count or any(labelFacilities[label] == facility for label in accepted):
+            continue
+        accepted.append(len(labelNodes))
+        labelNodes.append(node)
+        labelFacilities.append(facility)
+        labelMinutes.append(minutes)
+        labelParents.append(parent)
+        if len(accepted) == count and node in targets:
+            remaining -= 1
+
+        label = len(labelNodes) - 1
+        for arc in range(indptr[node], indptr[node + 1]):
+            nextMinutes = minutes + arcMinutes[arc]
+            nextNode = indices[arc]
+            if nextMinutes <= limit and len(nodeLabels.get(nextNode, ())) < count:
+                heapq.heappush(queue, (nextMinutes, nextNode, facility, label))
+
+    results = {}
+    for target in targets:
+        results[target] = []
+        for label in nodeLabels.get(target, []):
+            # Following the previous labels leads from the target to the facility
+            path = [target]
+            parent = labelParents[label]
+            while parent >= 0:
+                path.append(labelNodes[parent])
+                parent = labelParents[parent]
+            results[target].append((labelMinutes[label], labelFacilities[label], np.array(path, dtype = np.int64)))
+    return results
+
+# --------------------------------------------------------------------
+# Converts the lists of a routes dictionary to arrays, sorted by incident and rank
+# --------------------------------------------------------------------
+def finish_routes(routes):
+    order = np.lexsort((np.array(routes["ranks"], dtype = np.int64), np.array(routes["incidents"], dtype = np.int64)))
+    return {
+        "incidents": np.array(routes["incidents"], dtype = np.int64)[order],
+        "facilities": np.array(routes["facilities"], dtype = np.int64)[order],
+        "ranks": np.array(routes["ranks"], dtype = np.int64)[order],
+        "minutes": np.array(routes["minutes"], dtype = float)[order],
+        "paths": [routes["paths"][position] for position in order.tolist()],
+    }
+
+# ********************************************************************
+# Route Output
+# ********************************************************************
+# --------------------------------------------------------------------
+# Reads the object IDs and coordinates of a point table (incidents, facilities or barriers).
+# Returns (objectIDs, lat, long) arrays.
+# --------------------------------------------------------------------
+def read_locations(backend, table, where = None):
+    rows = list(backend.read_points(table, ["OID@"], where))
+    objectIDs = np.array([row[2] for row in rows], dtype = np.int64)
+    long = np.array([np.nan if row[0] is None else row[0] for row in rows], dtype = float)
+    lat = np.array([np.nan if row[1] is None else row[1] for row in rows], dtype = float)
+    return objectIDs, lat, long
+
+# --------------------------------------------------------------------
+# Returns the rows of a route table: (IncidentOID, FacilityOID, FacilityRank, Total_Minutes, (vertices x 2) coordinates).
+# closedArcs and minutes must be the ones the routes were solved with, so the geometries follow the same arcs.
+# --------------------------------------------------------------------
+def route_rows(network, routes, incidentIDs, facilityIDs, closedArcs = None, minutes = None):
+    minutes = np.array(network.minutes if minutes is None else minutes)
+    if closedArcs is not None:
+        minutes[closedArcs] = np.inf
+    for position in range(routes["incidents"].shape[0]):
+        yield (int(incidentIDs[routes["incidents"][position]]), int(facilityIDs[routes["facilities"][position]]),
+               int(routes["ranks"][position]), float(routes["minutes"][position]),
+               network.path_coordinates(routes["paths"][position], minutes))
+
+# --------------------------------------------------------------------
+# Writes route rows to a CSV file, with the route geometries as WKT (well-known text) line strings
+# --------------------------------------------------------------------
+def write_route_table(path, rows):
+    with open(path, "w", newline = "") as routeFile:
+        writer = csv.writer(routeFile)
+        writer.writerow(["IncidentOID", "FacilityOID", "FacilityRank", "Total_Minutes", "WKT"])
+        for incidentID, facilityID, rank, minutes, coordinates in rows:
+            if coordinates.shape[0] == 1:
+                coordinates = np.repeat(coordinates, 2, axis = 0)
+            wkt = "LINESTRING ({})".format(", ".join("{!r} {!r}".format(long, lat) for long, lat in coordinates.tolist()))
+            writer.writerow([incidentID, facilityID, rank, round(minutes, 4), wkt])
+
+# ********************************************************************
+# Route Analysis
+# ********************************************************************
+# --------------------------------------------------------------------
+# Returns the RoadNetwork of a network folder, exporting the edge sources first if the folder doesn't hold
+# a network yet (or refresh is True)
+# --------------------------------------------------------------------
+def open_network(backend, networkPath, edgeTables, refresh = False):
+    if refresh or read_network_metadata(networkPath) is None:
+        backend.message("Exporting the road network to '{}'...".format(networkPath))
+        count_event("Road network cache miss")
+        export_network(backend, edgeTables, networkPath)
+    else:
+        count_event("Road network cache hit")
+    return load_network(networkPath)
+
+# --------------------------------------------------------------------
+# Finds the closest facilities of the incidents, avoiding the edges of the barriers.
+# Returns the route rows (see route_rows).
+# Parameters:
+#   backend    - storage backend the incidents, facilities and barriers are read with (see Backends.py)
+#   network    - RoadNetwork
+#   incidents, facilities - point tables (or, with arcpy, any feature class: the centroids are used)
+#   barriers   - optional point table of barriers (e.g. the damaged bridges)
+#   barrierFactors - optional dictionary {object ID: travel time factor} of the barriers (see BridgeBarriers.barrier_factors):
+#                    inf closes the edge of a barrier, other factors multiply its travel time. Without it (and for
+#                    barriers missing from it) every barrier closes its edge.
+#   count      - number of facilities to find for every incident
+#   incidentsWhere, facilitiesWhere, barriersWhere - optional where clauses filtering the tables
+#   search     - INCIDENT, FACILITY or AUTO (see SEARCHES)
+# --------------------------------------------------------------------
+def solve_routes(backend, network, incidents, facilities, barriers = None, count = 1,
+                 incidentsWhere = None, facilitiesWhere = None, barriersWhere = None, search = AUTO, barrierFactors = None):
+    with stage("Locate incidents and facilities") as locateStage:
+        incidentIDs, incidentLat, incidentLong = read_locations(backend, incidents, incidentsWhere)
+        facilityIDs, facilityLat, facilityLong = read_locations(backend, facilities, facilitiesWhere)
+        incidentNodes = network.snap(incidentLat, incidentLong)
+        facilityNodes = network.snap(facilityLat, facilityLong)
+        locateStage.rows = int(incidentIDs.shape[0] + facilityIDs.shape[0])
+
+    closedArcs = None
+    minutes = None
+    with stage("Barriers") as barrierStage:
+        if barriers is not None and barrierFactors is not None:
+            barrierIDs, barrierLat, barrierLong = read_locations(backend, barriers, barriersWhere)
+            factors = np.array([barrierFactors.get(objectID, np.inf) for objectID in barrierIDs.tolist()], dtype = float)
+            minutes = network.scaled_minutes(network.nearest_edges(barrierLat, barrierLong), factors)
+            closedArcs = np.isinf(minutes)
+            barrierStage.rows = int(barrierLat.shape[0])
+            backend.message("{} barriers close {} arcs of the network and slow down {} arcs.".format(
+                barrierLat.shape[0], int(closedArcs.sum()), int((minutes > np.asarray(network.minutes)).sum() - closedArcs.sum())))
+        elif barriers is not None:
+            _, barrierLat, barrierLong = read_locations(backend, barriers, barriersWhere)
+            closedArcs = network.barrier_arcs(barrierLat, barrierLong)
+            barrierStage.rows = int(barrierLat.shape[0])
+            backend.message("{} barriers close {} arcs of the network.".format(barrierLat.shape[0], int(closedArcs.sum())))
+
+    for name, nodes in (("incidents", incidentNodes), ("facilities", facilityNodes)):
+        if (nodes < 0).any():
+            backend.message("{} {} could not be located on the network.".format(int((nodes < 0).sum()), name))
+
+    if search == AUTO:
+        search = FACILITY if facilityIDs.shape[0] < incidentIDs.shape[0] else INCIDENT
+    with stage("Solve routes ({} search)".format(search)) as solveStage:
+        if search == FACILITY:
+            routes = reverse_closest_facilities(network, incidentNodes, facilityNodes, count, closedArcs, minutes = minutes)
+        else:
+            routes = closest_facilities(network, incidentNodes, facilityNodes, count, closedArcs, minutes = minutes)
+        solveStage.rows = int(incidentIDs.shape[0])
+    with stage("Route geometries") as geometryStage:
+        rows = list(route_rows(network, routes, incidentIDs, facilityIDs, closedArcs, minutes))
+        geometryStage.rows = len(rows)
+    return rows
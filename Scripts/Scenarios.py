@@ -0,0 +1,159 @@
+import json         # The scenario registry is a JSON file
+import os           # Import os package to work with directories
+# NumPy lets us store the scenario values as compact arrays
+import numpy as np
+
+# ********************************************************************
+# Scenario Registry
+# ********************************************************************
+# A scenario is one ground-motion event (e.g. a CSZ magnitude 9.0 earthquake, a crustal event or a ShakeMap grid).
+# The registry ("PGA Values\Scenarios.json") lists every scenario the tools know about:
+#   {
+#       "scenarios": [
+#           {"name": "9.0", "source": "BridgePGAs.xlsx", "column": "M90_PGA", "field": "M90_PGA"},
+#           ...
+#       ]
+#   }
+# where:
+#   name   - the name used to pick the scenario (e.g. the earthquake magnitude parameter)
+#   source - the PGA source file in the "PGA Values" folder (.xlsx, .csv or .tif, see GroundMotion.py)
+#   column - the scenario's column (or band) in the source file
+#   field  - (optional) attribute table field that also receives the scenario's PGA values
+
+# File name of the registry inside the "PGA Values" folder
+REGISTRY_FILE_NAME = "Scenarios.json"
+
+# The scenarios used when there is no registry file: the four CSZ magnitudes from OHELP (https://ohelp.oregonstate.edu/)
+DEFAULT_SCENARIOS = [
+    {"name": "8.1", "source": "BridgePGAs.xlsx", "column": "M81_PGA", "field": "M81_PGA"},
+    {"name": "8.4", "source": "BridgePGAs.xlsx", "column": "M84_PGA", "field": "M84_PGA"},
+    {"name": "8.7", "source": "BridgePGAs.xlsx", "column": "M87_PGA", "field": "M87_PGA"},
+    {"name": "9.0", "source": "BridgePGAs.xlsx", "column": "M90_PGA", "field": "M90_PGA"},
+]
+
+# --------------------------------------------------------------------
+# Returns the list of scenarios in the registry of the "PGA Values" folder
+# --------------------------------------------------------------------
+def load_scenarios(pgasPath):
+    registryPath = os.path.join(pgasPath, REGISTRY_FILE_NAME)
+    if not os.path.exists(registryPath):
+        return [dict(scenario) for scenario in DEFAULT_SCENARIOS]
+    with open(registryPath) as registryFile:
+        return json.load(registryFile)["scenarios"]
+
+# --------------------------------------------------------------------
+# Returns the dictionary of scenario name -> attribute table field (only scenarios with a field)
+# --------------------------------------------------------------------
+def scenario_fields(scenarios):
+    return {scenario["name"]: scenario["field"] for scenario in scenarios if scenario.get("field")}
+
+# --------------------------------------------------------------------
+# Picks scenarios from the registry.
+# selection is a string of scenario names separated by semicolons (e.g. "8.1;9.0"), or "ALL" for every scenario.
+# Returns the chosen scenarios in the order they were given.
+# --------------------------------------------------------------------
+def select_scenarios(scenarios, selection):
+    byName = {scenario["name"]: scenario for scenario in scenarios}
+    names = [name.strip().strip("'\"") for name in str(selection).split(";") if name.strip()]
+    if len(names) == 1 and names[0].upper() == "ALL":
+        return list(scenarios)
+
+    missing = [name for name in names if name not in byName]
+    if missing:
+        raise ValueError("Unknown scenario(s): {}".format(", ".join(missing)))
+    return [byName[name] for name in names]
+
+# --------------------------------------------------------------------
+# Groups scenarios by their source file so every source file is only read once.
+# Returns a dictionary of source file -> list of scenarios
+# --------------------------------------------------------------------
+def scenarios_by_source(scenarios):
+    sources = {}
+    for scenario in scenarios:
+        sources.setdefault(scenario["source"], []).append(scenario)
+    return sources
+
+# ********************************************************************
+# Scenario Side Tables
+# ********************************************************************
+# Instead of adding one attribute table field per scenario, the IM values of every scenario are kept in a side table
+# next to the project ("Projects\GADEP\Scenarios\{layer name}.npz") with the arrays:
+#   objectIDs - int64 object IDs of the assets
+#   scenarios - scenario names
+#   values    - float32 (assets x scenarios) IM values
+# The results of a multi-scenario Disaster Impact run are kept the same way ("{layer name}_results.npz") with:
+#   objectIDs - int64 object IDs of the assets
+#   scenarios - scenario names
+#   damage    - (assets x scenarios) damage states ("" if the asset's fragility number is unknown)
+#   ep        - float32 (assets x scenarios) EP values
+
+# --------------------------------------------------------------------
+# Returns the path of a layer's scenario side table (or results side table)
+# --------------------------------------------------------------------
+def scenario_table_path(projectPath, layerName, results = False):
+    return os.path.join(projectPath, "Scenarios", layerName + ("_results" if results else "") + ".npz")
+
+# --------------------------------------------------------------------
+# Writes a side table. Every keyword argument becomes one array in the file.
+# --------------------------------------------------------------------
+def write_side_table(path, **arrays):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    # Write to a temporary file first so a failed write never leaves a broken table behind
+    temporaryPath = path + ".tmp.npz"
+    np.savez(temporaryPath, **arrays)
+    os.replace(temporaryPath, path)
+
+# --------------------------------------------------------------------
+# Writes the IM values of every scenario for every asset of a layer
+# --------------------------------------------------------------------
+def write_scenario_table(path, objectIDs, scenarioNames, values):
+    write_side_table(path,
+                     objectIDs = np.asarray(objectIDs, dtype = np.int64),
+                     scenarios = np.array(scenarioNames, dtype = str),
+                     values = np.asarray(values, dtype = np.float32))
+
+# --------------------------------------------------------------------
+# Reads a scenario side table.
+# Returns (objectIDs, scenario names, values), or None if the table doesn't exist.
+# --------------------------------------------------------------------
+def read_scenario_table(path):
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle = False) as table:
+        return table["objectIDs"], table["scenarios"].tolist(), table["values"]
+
+# --------------------------------------------------------------------
+# Returns a (rows x scenarios) matrix of the IM values of the given object IDs and scenario names,
+# taken from a scenario side table. Object IDs missing from the table get NaN.
+# Returns None if the table doesn't have every one of the scenarios.
+# --------------------------------------------------------------------
+def scenario_values(table, objectIDs, scenarioNames):
+    tableObjectIDs, tableScenarios, tableValues = table
+    if any(name not in tableScenarios for name in scenarioNames):
+        return None
+
+    columns = [tableScenarios.index(name) for name in scenarioNames]
+    objectIDs = np.asarray(objectIDs, dtype = np.int64)
+
+    matrix = np.full((objectIDs.shape[0], len(columns)), np.nan)
+    if tableObjectIDs.shape[0] == 0:
+        return matrix
+
+    # Find the table row of every object ID with a binary search over the sorted object IDs
+    order = np.argsort(tableObjectIDs, kind = "stable")
+    sortedObjectIDs = tableObjectIDs[order]
+    found = np.minimum(np.searchsorted(sortedObjectIDs, objectIDs), sortedObjectIDs.shape[0] - 1)
+    matched = sortedObjectIDs[found] == objectIDs
+
+    matrix[matched] = tableValues[order[found[matched]]][:, columns]
+    return matrix
+
+# --------------------------------------------------------------------
+# Writes the results of a multi-scenario Disaster Impact run
+# --------------------------------------------------------------------
+def write_results_table(path, objectIDs, scenarioNames, damage, ep):
+    write_side_table(path,
+                     objectIDs = np.asarray(objectIDs, dtype = np.int64),
+                     scenarios = np.array(scenarioNames, dtype = str),
+                     damage = np.array([["" if state is None else state for state in row] for row in damage], dtype = str),
+                     ep = np.asarray(ep, dtype = np.float32))
@@ -0,0 +1,63 @@
+# Where the tables are changed (arcpy, or a GeoPackage/SQLite database)
+from Backends import SQLiteBackend, open_backend
+# Process pools
+from Parallel import process_pool, worker_count
+# Stage timers of a traced run
+from Instrumentation import stage
+
+# ********************************************************************
+# Schema Migration
+# ********************************************************************
+# Brings the schema of many tables up to date in one step: the wanted fields are compared with the fields every table
+# already has, and only the missing ones are added, all of them with one call per table (see Backends.add_fields).
+# Tables that already have every field aren't touched (no schema lock is taken), so running the migration again is
+# almost free. Tables are independent of each other, so with more than one worker the tables of a geodatabase are
+# migrated in parallel; the tables of a GeoPackage/SQLite database are migrated one after another, since a database
+# file only has one writer at a time.
+
+# Backend of a worker process (set up once per worker by init_worker)
+workerBackend = None
+
+# --------------------------------------------------------------------
+# Worker process initializer. Every worker opens the workspace itself.
+# --------------------------------------------------------------------
+def init_worker(workspace):
+    global workerBackend
+    workerBackend = open_backend(workspace)
+
+# --------------------------------------------------------------------
+# Adds the missing fields to one table. task is a (table, fieldsDict) tuple.
+# backend is None inside a worker process, which uses its own.
+# Returns (table, names of the added fields)
+# --------------------------------------------------------------------
+def migrate_table(task, backend = None):
+    backend = workerBackend if backend is None else backend
+    table, fieldsDict = task
+    return table, backend.add_fields(table, fieldsDict)
+
+# --------------------------------------------------------------------
+# Adds the fields of fieldsDict ({field name: (field type, field alias)}) that are missing from every table.
+# Parameters:
+#   backend  - storage backend (see Backends.py)
+#   tables   - the tables (or layers) to migrate
+#   fieldsDict - the fields every table should have
+#   workers  - worker processes (1 = no worker processes, 0 = one per CPU core)
+# Returns a dictionary {table name: names of the added fields}
+# --------------------------------------------------------------------
+def migrate_schema(backend, tables, fieldsDict, workers = 1):
+    tables = list(tables)
+    parallel = worker_count(workers) > 1 and len(tables) > 1 and not isinstance(backend, SQLiteBackend)
+    with stage("Migrate schema") as migrateStage:
+        migrateStage.rows = len(tables)
+        if parallel:
+            # The workers open the tables through their catalog paths
+            tasks = [(backend.table_path(table), fieldsDict) for table in tables]
+            with process_pool(min(worker_count(workers), len(tasks)), init_worker, (backend.workspace,)) as pool:
+                results = list(pool.map(migrate_table, tasks))
+        else:
+            results = [migrate_table((table, fieldsDict), backend) for table in tables]
+
+    added = {}
+    for table, (_, fields) in zip(tables, results):
+        added[backend.table_name(table)] = fields
+    return added
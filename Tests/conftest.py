@@ -0,0 +1,60 @@
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pytest
+
+# The tools import their helper modules by name, the way ArcGIS Pro runs them from the Scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Scripts"))
+
+from Backends import SQLiteBackend
+from Benchmark import synthetic_assets, synthetic_fragility_database
+from DisasterImpact import fdFields
+from FragilityCache import cache_path, write_cache
+
+# Number of synthetic assets of the test layer
+ASSET_ROWS = 500
+
+# ********************************************************************
+# Test Data
+# ********************************************************************
+# --------------------------------------------------------------------
+# SQLite backend that keeps its messages (e.g. the rows calculated and skipped by an incremental run)
+# --------------------------------------------------------------------
+class RecordingBackend(SQLiteBackend):
+    def __init__(self, path):
+        super().__init__(path)
+        self.messages = []
+
+    def message(self, text):
+        self.messages.append(text)
+
+# --------------------------------------------------------------------
+# A Disaster Impact project on the SQLite backend, made of the benchmark's synthetic data:
+#   projectPath - project folder holding the local copy of the fragility database
+#   pgasPath    - folder without a scenario registry, so the default scenarios (M81_PGA to M90_PGA) are used
+#   database    - SQLite database with an "Assets" table (M90_PGA and M81_PGA columns, empty result fields)
+#   fdDict      - the fragility database dictionary
+#   assets      - the synthetic assets (see Benchmark.synthetic_assets)
+# --------------------------------------------------------------------
+@pytest.fixture
+def project(tmp_path):
+    fdDict, mix = synthetic_fragility_database()
+    projectPath = str(tmp_path / "GADEP")
+    os.makedirs(projectPath)
+    write_cache(cache_path(projectPath), fdFields, [(fragNo,) + tuple(record) for fragNo, record in fdDict.items()], None)
+
+    assets = synthetic_assets(np.random.default_rng(1), ASSET_ROWS, mix)
+    database = str(tmp_path / "Assets.sqlite")
+    connection = sqlite3.connect(database)
+    connection.execute("CREATE TABLE Assets (OBJECTID INTEGER PRIMARY KEY, Frag_no TEXT, Diameter REAL, M90_PGA REAL, "
+                       "M81_PGA REAL, Damage TEXT, EP REAL, Hazard TEXT, IM TEXT, IM_unit TEXT, EQ_MAG TEXT)")
+    connection.executemany("INSERT INTO Assets (OBJECTID, Frag_no, Diameter, M90_PGA, M81_PGA) VALUES (?, ?, ?, ?, ?)",
+                           [(objectID + 1, fragNo, None if np.isnan(diameter) else diameter, IM, IM * 0.8)
+                            for objectID, (fragNo, diameter, IM) in
+                            enumerate(zip(assets["fragNos"], assets["D"].tolist(), assets["IM"].tolist()))])
+    connection.commit()
+    connection.close()
+
+    return {"projectPath": projectPath, "pgasPath": str(tmp_path), "database": database, "fdDict": fdDict, "assets": assets}
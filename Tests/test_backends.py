@@ -0,0 +1,166 @@
+import os
+
+import pytest
+
+from conftest import RecordingBackend
+import Backends
+from Backends import SQLiteResultWriter, folder_workspace
+
+# Values of the partition field; None and numbers become tables too
+HIGHWAYS = ["motorway", "primary", "residential", "service", None, 5]
+
+# The result fields of the Disaster Impact tool
+RESULT_FIELDS = ["Damage", "EP", "EQ_MAG"]
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Creates a database with a "Roads" table to partition by its highway field
+# --------------------------------------------------------------------
+def roads_database(path, rowCount = 120):
+    backend = RecordingBackend(path)
+    backend.connection.execute("CREATE TABLE Roads (OBJECTID INTEGER PRIMARY KEY, highway, name TEXT, length REAL)")
+    backend.connection.executemany("INSERT INTO Roads (highway, name, length) VALUES (?, ?, ?)",
+                                   [(HIGHWAYS[row * 7 % len(HIGHWAYS)], "Road {}".format(row), row * 0.25) for row in range(rowCount)])
+    backend.connection.commit()
+    return backend
+
+# --------------------------------------------------------------------
+# Returns the rows of a table, sorted
+# --------------------------------------------------------------------
+def table_rows(backend, table):
+    return sorted(backend.connection.execute("SELECT * FROM {}".format(Backends.quote_identifier(table))).fetchall(),
+                  key = lambda row: row[0])
+
+# --------------------------------------------------------------------
+# Returns Disaster Impact results for the odd object IDs up to rowCount: {object ID: (Damage, EP, EQ_MAG)}
+# --------------------------------------------------------------------
+def disaster_results(rowCount, em = "9.0"):
+    return {objectID: (["None", "Slight", "Moderate"][objectID % 3], objectID / 997.0, em) for objectID in range(1, rowCount + 1, 2)}
+
+# --------------------------------------------------------------------
+# Writes every row of the results with its own UPDATE, as the baseline's UpdateCursor loop did
+# --------------------------------------------------------------------
+def baseline_update(connection, table, fields, results):
+    for objectID, values in results.items():
+        connection.execute("UPDATE {} SET {} WHERE OBJECTID = ?".format(table, ", ".join("{} = ?".format(field) for field in fields)),
+                           tuple(values) + (objectID,))
+    connection.commit()
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# The one pass partition writes the same tables as one select per value (the baseline), also when the table is read
+# a few rows at a time
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("batchRows", [Backends.PARTITION_BATCH_ROWS, 7])
+def test_partition_matches_selects(tmp_path, monkeypatch, batchRows):
+    monkeypatch.setattr(Backends, "PARTITION_BATCH_ROWS", batchRows)
+    backend = roads_database(str(tmp_path / "Roads.sqlite"))
+    partitions = str(tmp_path / "Partitions.sqlite")
+    selects = str(tmp_path / "Selects.sqlite")
+
+    counts = backend.partition("Roads", "highway", partitions, "Roads")
+    for value in HIGHWAYS:
+        where = "highway IS NULL" if value is None else "highway = {!r}".format(value)
+        backend.select("Roads", "{}|{}".format(selects, value), where)
+    assert counts == {value: sum(1 for row in range(120) if HIGHWAYS[row * 7 % len(HIGHWAYS)] == value) for value in HIGHWAYS}
+    backend.close()
+
+    partitionBackend = RecordingBackend(partitions)
+    selectBackend = RecordingBackend(selects)
+    for value in HIGHWAYS:
+        assert table_rows(partitionBackend, str(value)) == table_rows(selectBackend, str(value))
+    partitionBackend.close()
+    selectBackend.close()
+
+# --------------------------------------------------------------------
+# A value named like the partitioned table (in the same database) or a metadata table is refused before any table
+# is replaced. In another database, a value named like the partitioned table is fine.
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("value", ["Roads", "ROADS", "sqlite_sequence", "gpkg_contents"])
+def test_partition_never_replaces_the_table(tmp_path, value):
+    database = str(tmp_path / "Roads.sqlite")
+    backend = roads_database(database)
+    backend.connection.execute("CREATE TABLE Other (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+    backend.connection.execute("UPDATE Roads SET highway = ? WHERE OBJECTID = 3", (value,))
+    backend.connection.commit()
+    rows = table_rows(backend, "Roads")
+
+    with pytest.raises(ValueError):
+        backend.partition("Roads", "highway", database, "Roads")
+    assert table_rows(backend, "Roads") == rows
+    assert backend.list_fields("primary") == []
+
+    otherDatabase = str(tmp_path / "Partitions.sqlite")
+    if value.lower() == "roads":
+        assert backend.partition("Roads", "highway", otherDatabase, "Roads")[value] == 1
+    else:
+        with pytest.raises(ValueError):
+            backend.partition("Roads", "highway", otherDatabase, "Roads")
+    backend.close()
+
+# --------------------------------------------------------------------
+# Folders hold shapefiles; geodatabases and GeoPackages hold the tables themselves
+# --------------------------------------------------------------------
+def test_folder_workspace():
+    assert folder_workspace(os.path.join("C:", "Data", "Roads"))
+    assert folder_workspace(os.path.join("C:", "Data.v2", "Roads"))
+    assert not folder_workspace(os.path.join("C:", "Data", "Infrastructures.gdb"))
+    assert not folder_workspace(os.path.join("C:", "Data", "Infrastructures.gdb", "Roads"))
+    assert not folder_workspace(os.path.join("C:", "Data", "Roads.gpkg"))
+
+# --------------------------------------------------------------------
+# The backend's result writer leaves the table as the baseline's row by row update does, and only writes the rows
+# whose values changed. Results of rows the table doesn't have are left out.
+# --------------------------------------------------------------------
+def test_table_writer_skips_unchanged_rows(tmp_path):
+    backend = RecordingBackend(str(tmp_path / "Results.sqlite"))
+    for table in ("Assets", "Baseline"):
+        backend.connection.execute("CREATE TABLE {} (OBJECTID INTEGER PRIMARY KEY, Damage TEXT, EP REAL, EQ_MAG TEXT)".format(table))
+        backend.connection.executemany("INSERT INTO {} (OBJECTID) VALUES (?)".format(table), [(row,) for row in range(1, 41)])
+    backend.connection.commit()
+    results = disaster_results(40)
+    results[99] = ("Complete", 0.5, "9.0")
+    try:
+        with backend.result_writer() as resultWriter:
+            assert resultWriter.write("Assets", RESULT_FIELDS, results) == (20, 0)
+            baseline_update(backend.connection, "Baseline", RESULT_FIELDS, results)
+            assert table_rows(backend, "Assets") == table_rows(backend, "Baseline")
+            assert resultWriter.write("Assets", RESULT_FIELDS, results) == (0, 20)
+
+            # An EP value that only differs by rounding is unchanged; another damage state or magnitude is not
+            changed = dict(results)
+            changed[1] = (results[1][0], results[1][1] * (1 + 1e-12), results[1][2])
+            changed[3] = ("Extensive",) + results[3][1:]
+            changed[5] = results[5][:2] + ("8.1",)
+            assert resultWriter.write("Assets", RESULT_FIELDS, changed) == (2, 18)
+            baseline_update(backend.connection, "Baseline", RESULT_FIELDS, changed)
+            assert table_rows(backend, "Assets") == [(1,) + results[1]] + table_rows(backend, "Baseline")[1:]
+    finally:
+        backend.close()
+
+# --------------------------------------------------------------------
+# The sidecar result writer keeps the results of every layer in a table keyed by OBJECTID: new rows and rows that
+# changed are written, the others are skipped, and fields the table doesn't have yet are added
+# --------------------------------------------------------------------
+def test_sidecar_writer_skips_unchanged_rows(tmp_path):
+    path = str(tmp_path / "Results.sqlite")
+    results = disaster_results(40)
+    with SQLiteResultWriter(path) as resultWriter:
+        assert resultWriter.write("Bridges", RESULT_FIELDS[:2], {objectID: values[:2] for objectID, values in results.items()}) == (20, 0)
+        assert resultWriter.write("Bridges", RESULT_FIELDS, results) == (20, 0)
+        assert resultWriter.write("Bridges", RESULT_FIELDS, results) == (0, 20)
+
+        more = disaster_results(50, "8.1")
+        assert resultWriter.write("Bridges", RESULT_FIELDS, more) == (25, 0)
+        assert resultWriter.write("Pipes", RESULT_FIELDS, results) == (20, 0)
+
+    backend = RecordingBackend(path)
+    try:
+        assert table_rows(backend, "Bridges") == [(objectID,) + values for objectID, values in sorted(more.items())]
+        assert table_rows(backend, "Pipes") == [(objectID,) + values for objectID, values in sorted(results.items())]
+    finally:
+        backend.close()
@@ -0,0 +1,81 @@
+import json
+
+import Benchmark
+from Benchmark import RESULTS_VERSION, STAGES, find_regressions, main, read_results, run_benchmarks, write_results
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Returns results with the given {stage: seconds}
+# --------------------------------------------------------------------
+def timings(**seconds):
+    return {"version": RESULTS_VERSION, "stages": {stage: {"seconds": value} for stage, value in seconds.items()}}
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# Every stage runs at every scale and reports the rows it processed. The two routing searches find a facility for
+# the same incidents.
+# --------------------------------------------------------------------
+def test_run_benchmarks_times_every_stage(tmp_path):
+    messages = []
+    results = run_benchmarks(str(tmp_path), scales = [200, 300], repeats = 1, seed = 3, message = messages.append)
+
+    assert results["version"] == RESULTS_VERSION and results["seed"] == 3 and results["scales"] == [200, 300]
+    assert list(results["stages"]) == ["{}@{}".format(stage, scale) for scale in (200, 300) for stage in STAGES]
+    for scale in (200, 300):
+        for stage in ("damage_states", "simulate_layer", "pga_assignment", "extract_memory", "extract_stream"):
+            assert results["stages"]["{}@{}".format(stage, scale)]["rows"] == scale
+        routes = results["stages"]["routing_incident@{}".format(scale)]["rows"]
+        assert 0 < routes <= Benchmark.INCIDENT_COUNT
+        assert results["stages"]["routing_facility@{}".format(scale)]["rows"] == routes
+    for timing in results["stages"].values():
+        assert timing["seconds"] > 0 and timing["cpuSeconds"] >= 0
+    assert len(messages) == 2 + 2 * len(STAGES)
+
+# --------------------------------------------------------------------
+# Only stages that got slower than the baseline by more than the threshold are regressions; stages the baseline
+# doesn't have (or has no time for) are not compared
+# --------------------------------------------------------------------
+def test_find_regressions():
+    baseline = timings(**{"partition@1000": 1.0, "routing@1000": 2.0, "export@1000": 0})
+    results = timings(**{"partition@1000": 1.3, "routing@1000": 2.2, "export@1000": 5.0, "new@1000": 9.0})
+    assert find_regressions(results, baseline) == [("partition@1000", 1.0, 1.3, 1.3)]
+    assert find_regressions(results, baseline, 0.05) == [("partition@1000", 1.0, 1.3, 1.3), ("routing@1000", 2.0, 2.2, 1.1)]
+    assert find_regressions(results, {}) == []
+
+# --------------------------------------------------------------------
+# A results file is read back as it was written, unless it's missing, broken or of another RESULTS_VERSION
+# --------------------------------------------------------------------
+def test_results_file_round_trip(tmp_path):
+    path = str(tmp_path / "Benchmarks" / "Baseline.json")
+    assert read_results(path) is None
+    write_results(path, timings(partition = 1.5))
+    assert read_results(path) == timings(partition = 1.5)
+
+    with open(path, "w") as resultsFile:
+        json.dump(dict(timings(partition = 1.5), version = RESULTS_VERSION + 1), resultsFile)
+    assert read_results(path) is None
+    with open(path, "w") as resultsFile:
+        resultsFile.write("{")
+    assert read_results(path) is None
+
+# --------------------------------------------------------------------
+# The command line run writes its results and its baseline, and counts the stages slower than the baseline
+# --------------------------------------------------------------------
+def test_main_compares_with_baseline(tmp_path):
+    output = str(tmp_path / "Results.json")
+    baseline = str(tmp_path / "Baseline.json")
+    arguments = ["--scales", "200", "--stages", "simulate_layer", "partition", "--repeats", "1",
+                 "--folder", str(tmp_path / "Data"), "--baseline", baseline]
+
+    assert main(arguments + ["--output", output, "--update-baseline"]) == 0
+    assert read_results(output) == read_results(baseline)
+    assert list(read_results(baseline)["stages"]) == ["simulate_layer@200", "partition@200"]
+
+    # Every stage is slower than a baseline that took no time at all
+    write_results(baseline, timings(**{"simulate_layer@200": 1e-9, "partition@200": 1e-9}))
+    assert main(arguments) == 2
+    assert main(arguments + ["--threshold", "1e12"]) == 0
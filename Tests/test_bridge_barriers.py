@@ -0,0 +1,65 @@
+import numpy as np
+
+from conftest import RecordingBackend
+from BridgeBarriers import CLOSURE_PROBABILITY, PENALTY_FACTORS, barrier_factors, state_probabilities, threshold_factors
+from DisasterImpact import run_disaster_impact
+
+# The bridges the Disaster Route Analysis tool closes (the baseline): every damaged bridge
+DAMAGED_BRIDGES = "Damage = 'Slight' Or Damage = 'Moderate' Or Damage = 'Extensive' Or Damage = 'Complete'"
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Runs the Disaster Impact tool on the "Assets" table (standing in for the bridges) for the 9.0 scenario.
+# Returns the backend and the object IDs of the rows.
+# --------------------------------------------------------------------
+def simulated_bridges(project):
+    backend = RecordingBackend(project["database"])
+    run_disaster_impact(backend, ["Assets"], "9.0", project["projectPath"], project["pgasPath"], offline = True)
+    objectIDs = np.array([row[0] for row in backend.read_rows("Assets", ["OID@"], orderBy = ["OBJECTID"])], dtype = np.int64)
+    return backend, objectIDs
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# Without Monte Carlo results, the state probabilities are estimated from the damage state and its EP: every bridge's
+# probabilities are between 0 and 1 and sum to 1, and the bridges without damage (or results) are undamaged
+# --------------------------------------------------------------------
+def test_estimated_state_probabilities_sum_to_one(project):
+    backend, objectIDs = simulated_bridges(project)
+    try:
+        probabilities = state_probabilities(backend, project["projectPath"], "Assets", objectIDs, ["9.0"])
+        damaged = {row[0] for row in backend.read_rows("Assets", ["OID@"], DAMAGED_BRIDGES)}
+    finally:
+        backend.close()
+
+    assert probabilities.shape[:2] == (objectIDs.shape[0], 1)
+    assert (probabilities >= 0).all() and (probabilities <= 1).all()
+    np.testing.assert_allclose(probabilities.sum(axis = 2), 1.0, rtol = 0, atol = 1e-12)
+    undamaged = ~np.isin(objectIDs, list(damaged))
+    np.testing.assert_array_equal(probabilities[undamaged, 0, 0], 1.0)
+    # A damaged bridge may end one level lower, but never in two levels that aren't next to each other
+    assert ((probabilities[:, 0] > 0).sum(axis = 1) <= 2).all()
+
+# --------------------------------------------------------------------
+# The default threshold closes the bridges the Damage filter of the Disaster Route Analysis tool closes, and slows
+# down the others by their expected penalty
+# --------------------------------------------------------------------
+def test_default_threshold_closes_damaged_bridges(project):
+    backend, objectIDs = simulated_bridges(project)
+    try:
+        probabilities = state_probabilities(backend, project["projectPath"], "Assets", objectIDs, ["9.0"])
+        damaged = {row[0] for row in backend.read_rows("Assets", ["OID@"], DAMAGED_BRIDGES)}
+        factors = barrier_factors(backend, project["projectPath"], "Assets", "9.0", CLOSURE_PROBABILITY)
+    finally:
+        backend.close()
+
+    assert 0 < len(damaged) < objectIDs.shape[0]
+    closed = np.isinf(threshold_factors(probabilities, [CLOSURE_PROBABILITY])[:, 0])
+    assert set(objectIDs[closed].tolist()) == damaged
+    assert {objectID for objectID, factor in factors.items() if np.isinf(factor)} == damaged
+
+    # The open bridges all end undamaged, so they get the penalty factor of no damage
+    assert {factor for factor in factors.values() if np.isfinite(factor)} == {PENALTY_FACTORS[0]}
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import DamageSimulation
+from DamageSimulation import monte_carlo
+from FragilityEngine import load_fragility_curves
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# With the same seed, the realizations are the same with or without worker processes: every chunk has its own seed,
+# whichever process samples it. The IM values are sampled too, so the workers evaluate their own copy of the curves.
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("sigma", [0.0, 0.4])
+def test_monte_carlo_is_independent_of_workers(project, monkeypatch, sigma):
+    # A few hundred samples per chunk, so the realizations are split into several chunks
+    monkeypatch.setattr(DamageSimulation, "CHUNK_SAMPLES", 20 * len(project["assets"]["IM"]))
+    fdDict = project["fdDict"]
+    curves = load_fragility_curves(fdDict)
+    assets = project["assets"]
+
+    def simulate(workers):
+        return monte_carlo(fdDict, curves, assets["fragNos"], assets["IM"], assets["D"], realizations = 90, seed = 7,
+                           sigma = sigma, rho = 0.3, workers = workers, keepLevels = True)
+
+    serial = simulate(1)
+    for workers in (2, 3):
+        parallel = simulate(workers)
+        np.testing.assert_array_equal(parallel["stateProbabilities"], serial["stateProbabilities"])
+        np.testing.assert_array_equal(parallel["realizationCounts"], serial["realizationCounts"])
+        np.testing.assert_array_equal(parallel["realizationLevels"], serial["realizationLevels"])
+        assert parallel["adjustedAssets"] == serial["adjustedAssets"]
+
+    # Another seed gives other realizations
+    other = monte_carlo(fdDict, curves, assets["fragNos"], assets["IM"], assets["D"], realizations = 90, seed = 8,
+                        sigma = sigma, rho = 0.3, workers = 1, keepLevels = True)
+    assert not np.array_equal(other["realizationLevels"], serial["realizationLevels"])
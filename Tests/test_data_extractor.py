@@ -0,0 +1,82 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import RecordingBackend
+import DataExtractor
+from DataExtractor import MEMORY, STREAM, extract_data
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Creates a database with an "Input" table and a "Joined" table joined on (County, Code).
+# Some join field values are empty (None), some input rows have no join table row and some already hold their values.
+# The join table has one row per key, so both modes pick the same row.
+# --------------------------------------------------------------------
+def join_database(path, rowCount = 400):
+    random = np.random.default_rng(2)
+    counties = ["Benton", "Clackamas", "Lane", "Linn", "Marion", None]
+    codes = [1, 2, 3, 4, 5, 6, 7, None]
+    keys = [(county, code) for county in counties for code in codes]
+
+    backend = RecordingBackend(path)
+    connection = backend.connection
+    connection.execute("CREATE TABLE Input (OBJECTID INTEGER PRIMARY KEY, County TEXT, Code INTEGER, Owner TEXT, Year INTEGER)")
+    connection.execute("CREATE TABLE Joined (OBJECTID INTEGER PRIMARY KEY, County TEXT, Code INTEGER, Owner TEXT, Year INTEGER)")
+
+    # Every other key is in the join table, in a random order
+    joinKeys = [keys[position] for position in random.permutation(len(keys)) if position % 2 == 0]
+    joinRows = [(county, code, "Owner{}".format(number), 1950 + number) for number, (county, code) in enumerate(joinKeys)]
+    connection.executemany("INSERT INTO Joined (County, Code, Owner, Year) VALUES (?, ?, ?, ?)", joinRows)
+
+    inputRows = []
+    for position in random.integers(0, len(keys), rowCount).tolist():
+        county, code = keys[position]
+        inputRows.append((county, code, None, None))
+    connection.executemany("INSERT INTO Input (County, Code, Owner, Year) VALUES (?, ?, ?, ?)", inputRows)
+    # Some rows already hold the values of their join table row
+    connection.execute("UPDATE Input SET Owner = (SELECT Owner FROM Joined WHERE Joined.County IS Input.County AND Joined.Code IS Input.Code), "
+                       "Year = (SELECT Year FROM Joined WHERE Joined.County IS Input.County AND Joined.Code IS Input.Code) "
+                       "WHERE OBJECTID % 5 = 0")
+    connection.commit()
+    backend.close()
+
+# --------------------------------------------------------------------
+# Joins a copy of the database in one mode. Returns the (written, unchanged) rows and the rows of the input table.
+# --------------------------------------------------------------------
+def join(database, copy, mode):
+    shutil.copy(database, copy)
+    backend = RecordingBackend(copy)
+    try:
+        counts = extract_data(backend, "Input", "County;Code", "Joined", ["County", "Code"], ["Owner", "Year"], mode)
+        rows = list(backend.read_rows("Input", ["OID@", "County", "Code", "Owner", "Year"], orderBy = ["OBJECTID"]))
+    finally:
+        backend.close()
+    return counts, rows
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# Both join modes write the same values to the same rows, including the rows with empty join field values.
+# The streaming join is also read a few rows at a time so the chunks are merged too.
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("chunkRows", [DataExtractor.JOIN_CHUNK_ROWS, 7])
+def test_stream_join_matches_memory_join(tmp_path, monkeypatch, chunkRows):
+    monkeypatch.setattr(DataExtractor, "JOIN_CHUNK_ROWS", chunkRows)
+    database = str(tmp_path / "Join.sqlite")
+    join_database(database)
+
+    memoryCounts, memoryRows = join(database, str(tmp_path / "Memory.sqlite"), MEMORY)
+    streamCounts, streamRows = join(database, str(tmp_path / "Stream.sqlite"), STREAM)
+    assert streamRows == memoryRows
+    assert streamCounts == memoryCounts
+
+    # Input rows with empty join field values got the values of the join table row with the same empty values
+    joined = {(county, code): (owner, year) for _, county, code, owner, year in memoryRows if owner is not None}
+    assert any(None in key for key in joined)
+
+    # A second run finds every row already joined
+    assert join(str(tmp_path / "Stream.sqlite"), str(tmp_path / "Again.sqlite"), STREAM)[0][0] == 0
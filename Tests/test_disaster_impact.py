@@ -0,0 +1,245 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import ASSET_ROWS, RecordingBackend
+from Backends import ResultWriter
+import DisasterImpact
+from DisasterImpact import fdFields, run_disaster_impact
+from FragilityCache import cache_path, write_cache
+from FragilityEngine import load_fragility_curves, simulate_layer
+from FragilityTables import TABLE_MAX_ERROR
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Runs the Disaster Impact tool on the "Assets" table for the 9.0 scenario (M90_PGA).
+# Returns the backend's messages.
+# --------------------------------------------------------------------
+def run(project, backendClass = RecordingBackend, database = None, **settings):
+    backend = backendClass(database or project["database"])
+    try:
+        run_disaster_impact(backend, ["Assets"], "9.0", project["projectPath"], project["pgasPath"], offline = True, **settings)
+    finally:
+        backend.close()
+    return backend.messages
+
+# --------------------------------------------------------------------
+# Returns the (Damage, EP) results of every row, ordered by object ID
+# --------------------------------------------------------------------
+def results(project, database = None):
+    backend = RecordingBackend(database or project["database"])
+    try:
+        rows = list(backend.read_rows("Assets", ["Damage", "EP"], orderBy = ["OBJECTID"]))
+    finally:
+        backend.close()
+    return [row[0] for row in rows], np.array([np.nan if row[1] is None else row[1] for row in rows])
+
+# --------------------------------------------------------------------
+# Returns the exact (Damage, EP) results of the rows' current M90_PGA values
+# --------------------------------------------------------------------
+def exact_results(project):
+    backend = RecordingBackend(project["database"])
+    try:
+        rows = list(backend.read_rows("Assets", ["Frag_no", "Diameter", "M90_PGA"], orderBy = ["OBJECTID"]))
+    finally:
+        backend.close()
+    D = np.array([np.nan if row[1] is None else row[1] for row in rows])
+    damage, ep, _ = simulate_layer(load_fragility_curves(project["fdDict"]), [row[0] for row in rows], [row[2] for row in rows], D)
+    return damage, ep
+
+# --------------------------------------------------------------------
+# Returns the (calculated, skipped) number of rows of an incremental run's message
+# --------------------------------------------------------------------
+def incremental_rows(messages):
+    for text in messages:
+        if "rows calculated" in text:
+            words = text.split()
+            return int(words[1]), int(words[4])
+    raise AssertionError("No incremental run message in {}".format(messages))
+
+# --------------------------------------------------------------------
+# Result writer that fails, like a write stopped by a schema lock
+# --------------------------------------------------------------------
+class FailingWriter(ResultWriter):
+    def write(self, table, fields, results):
+        raise RuntimeError("Cannot acquire a schema lock")
+
+# --------------------------------------------------------------------
+# SQLite backend whose result writer fails
+# --------------------------------------------------------------------
+class FailingBackend(RecordingBackend):
+    def result_writer(self):
+        return FailingWriter()
+
+# --------------------------------------------------------------------
+# Adds a "Copy" table with the rows of the "Assets" table, as a second layer of a run
+# --------------------------------------------------------------------
+def copy_layer(database):
+    backend = RecordingBackend(database)
+    connection = backend.connection
+    schema = connection.execute("SELECT sql FROM sqlite_master WHERE name = 'Assets'").fetchone()[0]
+    connection.execute(schema.replace("Assets", "Copy", 1))
+    connection.execute("INSERT INTO Copy SELECT * FROM Assets")
+    connection.commit()
+    backend.close()
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# Every evaluation mode writes the exact results (within TABLE_MAX_ERROR for the lookup tables) to the attribute table
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("evaluation", ["EXACT", "TABLE", "MEMO"])
+def test_evaluation_modes_agree(project, evaluation):
+    run(project, evaluation = evaluation, incremental = False)
+    damage, ep = results(project)
+    expectedDamage, expectedEP = exact_results(project)
+
+    np.testing.assert_allclose(ep, expectedEP, rtol = 0, atol = TABLE_MAX_ERROR if evaluation == "TABLE" else 1e-12, equal_nan = True)
+    # Rows whose fragility number isn't in the fragility database keep empty results
+    for state, expectedState, expectedValue in zip(damage, expectedDamage, expectedEP.tolist()):
+        if evaluation == "TABLE" and abs(expectedValue - 0.5) <= TABLE_MAX_ERROR:
+            continue
+        assert state == expectedState
+
+# --------------------------------------------------------------------
+# An incremental run with another evaluation mode calculates every row again
+# --------------------------------------------------------------------
+def test_incremental_run_after_mode_switch(project):
+    run(project, evaluation = "TABLE")
+    assert incremental_rows(run(project, evaluation = "TABLE")) == (0, ASSET_ROWS)
+
+    # The lookup table results can't be kept by an exact run
+    assert incremental_rows(run(project, evaluation = "EXACT")) == (ASSET_ROWS, 0)
+    damage, ep = results(project)
+    expectedDamage, expectedEP = exact_results(project)
+    assert damage == expectedDamage
+    np.testing.assert_allclose(ep, expectedEP, rtol = 1e-9, atol = 1e-12, equal_nan = True)
+
+    assert incremental_rows(run(project, evaluation = "EXACT")) == (0, ASSET_ROWS)
+
+# --------------------------------------------------------------------
+# Worker processes simulating the tasks of two layers, split into object ID ranges, write the same results as the
+# serial run
+# --------------------------------------------------------------------
+def test_parallel_run_matches_serial_run(project, tmp_path, monkeypatch):
+    monkeypatch.setattr(DisasterImpact, "CHUNK_ROWS", 120)
+    copy_layer(project["database"])
+    databases = {}
+    messages = {}
+    for workers in (1, 3):
+        databases[workers] = str(tmp_path / "Workers{}.sqlite".format(workers))
+        shutil.copy(project["database"], databases[workers])
+        backend = RecordingBackend(databases[workers])
+        try:
+            run_disaster_impact(backend, ["Assets", "Copy"], "9.0", project["projectPath"], project["pgasPath"],
+                                offline = True, workers = workers, incremental = False)
+        finally:
+            backend.close()
+        messages[workers] = backend.messages
+
+    # Each layer of 500 rows is split into 5 tasks
+    assert any("in 10 task(s)" in text for text in messages[3])
+    fields = ["OID@", "Damage", "EP", "Hazard", "IM", "IM_unit", "EQ_MAG"]
+    for layer in ("Assets", "Copy"):
+        serial, parallel = (RecordingBackend(databases[workers]) for workers in (1, 3))
+        try:
+            serialRows = list(serial.read_rows(layer, fields, orderBy = ["OBJECTID"]))
+            assert list(parallel.read_rows(layer, fields, orderBy = ["OBJECTID"])) == serialRows
+        finally:
+            serial.close()
+            parallel.close()
+        assert sum(1 for row in serialRows if row[1] is not None) > ASSET_ROWS // 2
+
+# --------------------------------------------------------------------
+# When the results can't be written, the next incremental run calculates the changed rows again
+# --------------------------------------------------------------------
+def test_incremental_run_after_failed_write(project):
+    run(project)
+
+    # Change the IM values of some rows and fail to write their new results
+    backend = RecordingBackend(project["database"])
+    backend.connection.execute("UPDATE Assets SET M90_PGA = M90_PGA * 1.5 WHERE OBJECTID <= 50")
+    backend.connection.commit()
+    backend.close()
+    with pytest.raises(RuntimeError):
+        run(project, FailingBackend)
+
+    # The failed run kept none of its fingerprints, so the changed rows are calculated again
+    assert incremental_rows(run(project)) == (50, ASSET_ROWS - 50)
+    damage, ep = results(project)
+    expectedDamage, expectedEP = exact_results(project)
+    assert damage == expectedDamage
+    np.testing.assert_allclose(ep, expectedEP, rtol = 1e-9, atol = 1e-12, equal_nan = True)
+
+# --------------------------------------------------------------------
+# A layer with the same name in another workspace (e.g. a fresh copy of the database) doesn't get the results of the
+# first one: every row of it is calculated and written
+# --------------------------------------------------------------------
+def test_incremental_run_in_another_workspace(project, tmp_path):
+    fresh = str(tmp_path / "Fresh.sqlite")
+    shutil.copy(project["database"], fresh)
+    run(project)
+    assert incremental_rows(run(project, database = fresh)) == (ASSET_ROWS, 0)
+    damage, ep = results(project, fresh)
+    expectedDamage, expectedEP = exact_results(project)
+    assert damage == expectedDamage
+    np.testing.assert_allclose(ep, expectedEP, rtol = 1e-9, atol = 1e-12, equal_nan = True)
+
+    # The fingerprint table only holds the last run, so the first workspace is calculated again, but its rows already
+    # hold their results and none is written
+    messages = run(project)
+    assert incremental_rows(messages) == (ASSET_ROWS, 0)
+    assert any("SUCCESSFUL! 0 rows updated" in text for text in messages)
+
+# --------------------------------------------------------------------
+# Rows whose result fields no longer hold the last results are calculated again
+# --------------------------------------------------------------------
+def test_incremental_run_after_results_are_emptied(project):
+    run(project)
+    backend = RecordingBackend(project["database"])
+    backend.connection.execute("UPDATE Assets SET Damage = NULL, EP = NULL WHERE OBJECTID <= 40")
+    backend.connection.commit()
+    backend.close()
+
+    # Rows with an unknown fragility number never get results, so they are still skipped
+    unknown = sum(1 for fragNo in project["assets"]["fragNos"][:40] if fragNo not in project["fdDict"])
+    assert incremental_rows(run(project)) == (40 - unknown, ASSET_ROWS - 40 + unknown)
+    damage, ep = results(project)
+    expectedDamage, expectedEP = exact_results(project)
+    assert damage == expectedDamage
+    np.testing.assert_allclose(ep, expectedEP, rtol = 1e-9, atol = 1e-12, equal_nan = True)
+
+# --------------------------------------------------------------------
+# Polynomial curves use every asset's own pipe diameter (the Diameter field; 1 when it's empty)
+# --------------------------------------------------------------------
+def test_pipe_diameter_field_is_used(project):
+    run(project, incremental = False)
+    _, ep = results(project)
+    assets = project["assets"]
+    polynomial = np.array([fragNo == "PO1" for fragNo in assets["fragNos"]])
+    D = np.where(np.isnan(assets["D"]), 1.0, assets["D"])
+    assert len(set(D[polynomial].tolist())) > 1
+    np.testing.assert_allclose(ep[polynomial], 0.6 * assets["IM"][polynomial] ** 1.2 * D[polynomial] ** 0.1, rtol = 1e-12)
+
+# --------------------------------------------------------------------
+# A fragility record that can't be used is reported, along with the number of rows that use it
+# --------------------------------------------------------------------
+def test_rejected_fragility_numbers_are_reported(project):
+    fdDict = dict(project["fdDict"])
+    record = list(fdDict["PO1"])
+    record[17] = "__import__('os').getcwd()"
+    fdDict["BAD"] = tuple(record)
+    write_cache(cache_path(project["projectPath"]), fdFields, [(fragNo,) + tuple(record) for fragNo, record in fdDict.items()], None)
+    backend = RecordingBackend(project["database"])
+    backend.connection.execute("UPDATE Assets SET Frag_no = 'BAD' WHERE OBJECTID <= 25")
+    backend.connection.commit()
+    backend.close()
+
+    warnings = [text for text in run(project) if text.startswith("WARNING")]
+    assert len(warnings) == 2
+    assert "BAD" in warnings[0]
+    assert "25 rows" in warnings[1]
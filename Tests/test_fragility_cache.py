@@ -0,0 +1,69 @@
+import pytest
+
+import FragilityCache
+from DisasterImpact import fdFields
+from FragilityCache import cache_path, load_fragility_database, rows_to_dictionary
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Stands in for the hosted fragility database: counts the reads of its rows and reports its edit date
+# --------------------------------------------------------------------
+class FakeService:
+    def __init__(self, rows, lastEditDate):
+        self.rows = rows
+        self.lastEditDate = lastEditDate
+        self.reads = 0
+
+    def read(self):
+        self.reads += 1
+        return list(self.rows)
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# The cached dictionary is the one read from the service (the baseline), and the service is only read again when
+# the cache is missing, out of date, written by another cache version, or a refresh is asked for
+# --------------------------------------------------------------------
+def test_cache_is_read_again_only_when_invalid(project, tmp_path, monkeypatch):
+    rows = [(fragNo,) + tuple(record) for fragNo, record in project["fdDict"].items()]
+    service = FakeService(rows, 1000)
+    monkeypatch.setattr(FragilityCache, "service_last_edit_date", lambda serviceUrl: service.lastEditDate)
+    path = cache_path(str(tmp_path))
+    messages = []
+
+    def load(**settings):
+        return load_fragility_database("https://service", fdFields, path, service.read, message = messages.append, **settings)
+
+    # No cache yet, then an up to date one
+    baseline = rows_to_dictionary(rows)
+    assert load() == baseline and service.reads == 1
+    assert load() == baseline and service.reads == 1
+    assert load(offline = True) == baseline and service.reads == 1
+
+    # The service can't be reached: the cache is used
+    service.lastEditDate = None
+    assert load() == baseline and service.reads == 1
+
+    # The service was edited after the cache was written
+    service.rows = rows[1:] + [("NEW",) + tuple(rows[0][1:])]
+    service.lastEditDate = 2000
+    edited = rows_to_dictionary(service.rows)
+    assert load() == edited and service.reads == 2
+    assert load() == edited and service.reads == 2
+
+    # A refresh, and a cache written by another version of the module
+    assert load(refresh = True) == edited and service.reads == 3
+    monkeypatch.setattr(FragilityCache, "CACHE_VERSION", FragilityCache.CACHE_VERSION + 1)
+    assert load(offline = False) == edited and service.reads == 4
+    assert load() == edited and service.reads == 4
+
+# --------------------------------------------------------------------
+# Offline mode never reads the service, so it needs a cache
+# --------------------------------------------------------------------
+def test_offline_mode_needs_a_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(FragilityCache, "service_last_edit_date", lambda serviceUrl: pytest.fail("The service was contacted"))
+    with pytest.raises(RuntimeError):
+        load_fragility_database("https://service", fdFields, cache_path(str(tmp_path)), lambda: [], offline = True)
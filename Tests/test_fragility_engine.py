@@ -0,0 +1,175 @@
+import math
+from math import exp, log
+
+import numpy as np
+import pytest
+from scipy import interpolate
+from scipy.stats import lognorm
+
+from FragilityEngine import compile_polynomial, damage_states, load_fragility_curves, return_state, simulate_layer, simulate_scenarios
+from FragilityTables import MEMO, TABLE, TABLE_MAX_ERROR, FragilityTables
+
+# ********************************************************************
+# Baseline
+# ********************************************************************
+# The per-row code the vectorized engine replaced (DisasterImpact.py before the fragility engine), kept here as the
+# reference: every damage state of one asset is calculated with a scalar call and returned as a string.
+# --------------------------------------------------------------------
+# Fragility function evaluator (discrete, lognormal, normal and polynomial distributions; D defaults to 1)
+# --------------------------------------------------------------------
+def baseline_fragility_function(fragDist, IM, med, std, poly, IMDesc):
+    if fragDist == "Discrete":
+        x = [float(num) for num in med.split()]
+        y = [float(num) for num in std.split()]
+        if IM < x[0]:
+            IM = x[0]
+        return str(interpolate.interp1d(x, y, fill_value = "extrapolate")(IM))
+    elif fragDist == "Lognormal":
+        return str(lognorm.cdf(IM, float(std), scale = exp(log(float(med)))))
+    elif fragDist == "Normal":
+        return str((1 + math.erf((IM - float(med)) / math.sqrt(2) / float(std))) / 2)
+    elif fragDist == "Polynomial":
+        return str(eval(str(poly).replace(IMDesc, str(IM)).replace("D", "(1)").replace("^", "**")))
+
+# --------------------------------------------------------------------
+# Dictionary of damage state -> EP (string) of one asset
+# --------------------------------------------------------------------
+def baseline_damage_states(fdDict, fragNo, numberOfStates, IM):
+    record = fdDict[fragNo]
+    damageStates = {}
+    for nameIndex, medIndex, stdIndex in ((5, 6, 7), (8, 9, 10), (11, 12, 13), (14, 15, 16), (18, 19, 20))[:int(numberOfStates)]:
+        damageStates[record[nameIndex]] = baseline_fragility_function(record[3], IM, record[medIndex], record[stdIndex],
+                                                                      record[17], record[1])
+    return damageStates
+
+# --------------------------------------------------------------------
+# The (state, EP) of the lowest EP that is >= 0.5, or ("None", EP of the first state)
+# --------------------------------------------------------------------
+def baseline_return_state(dict):
+    for a, b in sorted(dict.items(), key = lambda x: x[1]):
+        if float(b) >= 0.5:
+            return (a, b)
+    lowState = list(dict.keys())[0]
+    return ("None", dict.get(lowState))
+
+# --------------------------------------------------------------------
+# Checks a damage state and EP against the baseline's. When several states have the same EP (e.g. every state
+# at 1.0), the baseline's pick depends on the last bit of the EP values, so any of the tied states is accepted.
+# --------------------------------------------------------------------
+def assert_same_state(state, ep, expectedStates):
+    expectedState, expectedEP = baseline_return_state(expectedStates)
+    assert ep == pytest.approx(float(expectedEP), rel = 1e-9, abs = 1e-12)
+    if state != expectedState:
+        assert "None" not in (state, expectedState)
+        assert float(expectedStates[state]) == pytest.approx(float(expectedEP), rel = 1e-9, abs = 1e-12)
+
+# --------------------------------------------------------------------
+# IM values of the synthetic assets, plus the edge cases: 0, below the first discrete breakpoint, past the last one
+# --------------------------------------------------------------------
+def edge_IMs(project):
+    return np.concatenate([project["assets"]["IM"], [0.0, 0.05, 1.5, 4.0]])
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# The single asset helpers give the baseline's EP values and damage state for every curve and IM value
+# --------------------------------------------------------------------
+def test_damage_states_match_baseline(project):
+    fdDict = project["fdDict"]
+    curves = load_fragility_curves(fdDict)
+    for fragNo, curve in curves.items():
+        for IM in edge_IMs(project).tolist():
+            expected = baseline_damage_states(fdDict, fragNo, fdDict[fragNo][4], IM)
+            states = damage_states(curves, fragNo, len(curve.stateNames), IM)
+            assert list(states) == list(expected)
+            np.testing.assert_allclose(list(states.values()), [float(value) for value in expected.values()],
+                                       rtol = 1e-9, atol = 1e-12)
+            assert_same_state(*return_state(states), expected)
+
+# --------------------------------------------------------------------
+# The whole layer, grouped by fragility number, gives the baseline's results row by row
+# --------------------------------------------------------------------
+def test_simulate_layer_matches_baseline(project):
+    fdDict = project["fdDict"]
+    curves = load_fragility_curves(fdDict)
+    fragNos = project["assets"]["fragNos"]
+    IM = project["assets"]["IM"]
+    damage, ep, epMatrix = simulate_layer(curves, fragNos, IM)
+
+    for position, (fragNo, rowIM) in enumerate(zip(fragNos, IM.tolist())):
+        # Fragility numbers that aren't in the fragility database get no results
+        if fragNo not in fdDict:
+            assert damage[position] is None
+            assert np.isnan(ep[position])
+            assert np.isnan(epMatrix[position]).all()
+            continue
+        expected = baseline_damage_states(fdDict, fragNo, fdDict[fragNo][4], rowIM)
+        assert_same_state(damage[position], ep[position], expected)
+        np.testing.assert_allclose(epMatrix[position, :len(expected)], [float(value) for value in expected.values()],
+                                   rtol = 1e-9, atol = 1e-12)
+
+# --------------------------------------------------------------------
+# The lookup tables and the memo give the exact EP values within TABLE_MAX_ERROR, for several scenarios and pipe diameters
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("mode", [TABLE, MEMO])
+def test_evaluation_modes_match_exact(project, mode):
+    curves = load_fragility_curves(project["fdDict"])
+    assets = project["assets"]
+    IM = np.column_stack([assets["IM"], assets["IM"] * 0.8])
+    damage, ep, epMatrix = simulate_scenarios(curves, assets["fragNos"], IM, assets["D"])
+    modeDamage, modeEP, modeMatrix = simulate_scenarios(curves, assets["fragNos"], IM, assets["D"], FragilityTables(mode))
+
+    np.testing.assert_allclose(modeMatrix, epMatrix, rtol = 0, atol = TABLE_MAX_ERROR, equal_nan = True)
+    np.testing.assert_allclose(modeEP, ep, rtol = 0, atol = TABLE_MAX_ERROR, equal_nan = True)
+    # The damage states can only differ where an EP value is within the error of 0.5
+    nearHalf = (np.abs(epMatrix - 0.5) <= TABLE_MAX_ERROR).any(axis = 2)
+    different = np.array(modeDamage, dtype = object) != np.array(damage, dtype = object)
+    assert not (different & ~nearHalf).any()
+
+# --------------------------------------------------------------------
+# The polynomial whitelist only lets arithmetic, log, exp, numbers, the IM description and D through
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("polynomial", [
+    "PGA * x",                                  # unknown name
+    "__import__('os').system('echo')",          # call of a function that isn't allowed, attribute access
+    "PGA.real",                                 # attribute access
+    "np.log(PGA)",                              # attribute access in a call
+    "abs(PGA)",                                 # call of a function that isn't allowed
+    "log(PGA, base = 10)",                      # keyword arguments
+    "exp(PGA, 2)",                              # wrong number of arguments
+    "PGA[0]",                                   # subscript
+    "(lambda: PGA)()",                          # lambda
+    "PGA if D else 1",                          # conditional expression
+    "'PGA'",                                    # string
+    "0.5 * PGA +",                              # syntax error
+])
+def test_polynomial_whitelist_rejects(polynomial):
+    with pytest.raises(ValueError):
+        compile_polynomial(polynomial, "PGA")
+
+# --------------------------------------------------------------------
+# A compiled polynomial gives the same values as the baseline's eval, with every asset's own pipe diameter
+# --------------------------------------------------------------------
+def test_polynomial_uses_every_pipe_diameter():
+    polynomial = "0.00187 * PGV ^ 2 * log(D) + exp(-PGV) / D - 2 ^ 0.5"
+    IM = np.array([0.1, 0.5, 2.0, 10.0])
+    D = np.array([4.0, 6.0, 12.0, 24.0])
+    expected = [eval(polynomial.replace("PGV", "({})".format(rowIM)).replace("D", "({})".format(rowD))
+                     .replace("^", "**").replace("log", "math.log").replace("exp", "math.exp"))
+                for rowIM, rowD in zip(IM.tolist(), D.tolist())]
+    np.testing.assert_allclose(compile_polynomial(polynomial, "PGV")(IM, D), expected, rtol = 1e-12)
+
+# --------------------------------------------------------------------
+# Records that can't be parsed are left out and reported with the reason
+# --------------------------------------------------------------------
+def test_rejected_records_are_reported(project):
+    fdDict = dict(project["fdDict"])
+    record = list(fdDict["PO1"])
+    record[17] = "__import__('os').getcwd()"
+    fdDict["BAD"] = tuple(record)
+    rejected = {}
+    curves = load_fragility_curves(fdDict, rejected)
+    assert "BAD" not in curves
+    assert list(rejected) == ["BAD"]
+    assert set(curves) == set(project["fdDict"])
@@ -0,0 +1,154 @@
+import math
+import os
+
+import numpy as np
+import pandas
+import pytest
+
+import GroundMotion
+from GroundMotion import PGAGrid, StationIndex, grid_path, load_pga_grid, table_columns
+from PreparationForDisasterImpact import scenario_pgas
+
+# The scenario columns of the PGA source file (BridgePGAs.xlsx)
+PGA_COLUMNS = ["M81_PGA", "M84_PGA", "M87_PGA", "M90_PGA"]
+
+# ********************************************************************
+# Baseline
+# ********************************************************************
+# The per-row code the bulk lookups replaced (PreparationForDisasterImpact.py before the KD-tree), kept here as the
+# reference.
+# --------------------------------------------------------------------
+# Distance in miles between two coordinates (spherical law of cosines)
+# --------------------------------------------------------------------
+def baseline_distance(pgaLat, pgaLong, objectLat, objectLong):
+    return 6371 * math.acos(min(1.0, math.cos(math.radians(90 - pgaLat)) * math.cos(math.radians(90 - objectLat)) +
+                                math.sin(math.radians(90 - pgaLat)) * math.sin(math.radians(90 - objectLat)) *
+                                math.cos(math.radians(pgaLong - objectLong)))) / 1.609
+
+# --------------------------------------------------------------------
+# Returns the first value of return_array where lookup_array equals lookup_value (Excel's XLOOKUP)
+# --------------------------------------------------------------------
+def baseline_xlookup(lookup_value, lookup_array, return_array):
+    match_value = return_array.loc[lookup_array == lookup_value]
+    return match_value.tolist()[0]
+
+# --------------------------------------------------------------------
+# Returns the PGA values of the station nearest to a feature: the station with the shortest distance (the smallest
+# OBJECTID on a tie), looked up by its OBJECTID in every scenario column
+# --------------------------------------------------------------------
+def baseline_pgas(file, lat, long):
+    distances = {}
+    for index in range(len(file)):
+        distances[file["OBJECTID"][index]] = baseline_distance(lat, long, file["LATITUDE"][index], file["LONGITUDE"][index])
+    shortestDistance = min(zip(distances.values(), distances.keys()))
+    return [baseline_xlookup(shortestDistance[1], file["OBJECTID"], file[column]) for column in PGA_COLUMNS]
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Randomly placed stations and features over the project area (decimal degrees)
+# --------------------------------------------------------------------
+def coordinates(random, count):
+    return random.uniform(41.9, 46.3, count), random.uniform(-124.6, -121.5, count)
+
+# --------------------------------------------------------------------
+# A PGA source file (as pandas reads it) with shuffled OBJECTIDs. The PGA values are float32 numbers, as the
+# converted grids store them.
+# --------------------------------------------------------------------
+def pga_table(random, count):
+    lat, long = coordinates(random, count)
+    table = pandas.DataFrame({"OBJECTID": random.permutation(count) * 3 + 1, "LATITUDE": lat, "LONGITUDE": long})
+    for column in PGA_COLUMNS:
+        table[column] = random.uniform(0.05, 1.5, count).astype(np.float32).astype(float)
+    return table
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# The KD-tree finds the station the baseline's loop over every station finds, at the same distance.
+# Features without coordinates get no station.
+# --------------------------------------------------------------------
+def test_nearest_station_matches_baseline():
+    random = np.random.default_rng(6)
+    stationLat, stationLong = coordinates(random, 400)
+    featureLat, featureLong = coordinates(random, 200)
+    featureLat[[3, 17]] = np.nan
+    featureLong[17] = np.nan
+
+    positions, distances = StationIndex(stationLat, stationLong).nearest(featureLat, featureLong)
+    assert positions[3] == positions[17] == -1
+    assert np.isnan(distances[[3, 17]]).all()
+
+    for feature in np.flatnonzero(positions >= 0).tolist():
+        stationDistances = [baseline_distance(lat, long, featureLat[feature], featureLong[feature])
+                            for lat, long in zip(stationLat.tolist(), stationLong.tolist())]
+        # The law of cosines loses precision near 0, so the distances agree within 0.0001 miles (16 cm)
+        nearest = min(stationDistances)
+        assert distances[feature] == pytest.approx(nearest, rel = 1e-9, abs = 1e-4)
+        # Stations at the same distance (within rounding) are as good as the baseline's pick
+        assert stationDistances[positions[feature]] <= nearest + 1e-4
+
+# --------------------------------------------------------------------
+# Gathering the PGA values of the nearest stations from the grid gives the baseline's value of every scenario
+# column, in the order of the scenarios in the registry. Features without coordinates keep NaN values.
+# --------------------------------------------------------------------
+def test_scenario_pgas_match_baseline_lookup():
+    random = np.random.default_rng(7)
+    file = pga_table(random, 300)
+    featureLat, featureLong = coordinates(random, 150)
+    featureLat[[0, 42]] = np.nan
+
+    # The registry lists the scenarios in another order than the source file's columns
+    pgaGrid = PGAGrid(*table_columns(file))
+    gridColumns = PGA_COLUMNS[::-1]
+    sources = [(list(range(len(gridColumns))), gridColumns, pgaGrid, StationIndex(pgaGrid.lat, pgaGrid.long))]
+    scenarioPGAs = scenario_pgas(sources, len(gridColumns), featureLat, featureLong)
+
+    assert scenarioPGAs.shape == (150, 4)
+    assert np.isnan(scenarioPGAs[[0, 42]]).all()
+    for feature in range(150):
+        if feature in (0, 42):
+            continue
+        expected = baseline_pgas(file, featureLat[feature], featureLong[feature])[::-1]
+        assert scenarioPGAs[feature].tolist() == expected
+
+# --------------------------------------------------------------------
+# A source file is converted to a memory-mapped grid holding the values pandas reads from it (the baseline), as
+# float32 PGA values. The grid is used as it is until the source file changes or the grid version does.
+# --------------------------------------------------------------------
+def test_pga_grid_is_converted_again_only_when_invalid(tmp_path, monkeypatch):
+    random = np.random.default_rng(8)
+    sourcePath = str(tmp_path / "BridgePGAs.csv")
+    pga_table(random, 50).to_csv(sourcePath, index = False)
+    messages = []
+
+    def load():
+        messages.clear()
+        pgaGrid = load_pga_grid(sourcePath, message = messages.append)
+        baseline = pandas.read_csv(sourcePath)
+        np.testing.assert_array_equal(pgaGrid.lat, baseline["LATITUDE"].to_numpy())
+        np.testing.assert_array_equal(pgaGrid.long, baseline["LONGITUDE"].to_numpy())
+        assert pgaGrid.scenarios == tuple(PGA_COLUMNS)
+        for column in PGA_COLUMNS:
+            assert isinstance(pgaGrid.values[column], np.memmap)
+            np.testing.assert_array_equal(pgaGrid.values[column], baseline[column].to_numpy(dtype = np.float32))
+        return any(text.startswith("Converting") for text in messages)
+
+    # No grid yet, then an up to date one
+    assert load()
+    assert os.path.isdir(grid_path(sourcePath))
+    assert not load()
+
+    # The source file changed
+    pga_table(random, 60).to_csv(sourcePath, index = False)
+    stat = os.stat(sourcePath)
+    os.utime(sourcePath, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+    assert load()
+    assert not load()
+
+    # A grid converted by another version of the module
+    monkeypatch.setattr(GroundMotion, "GRID_VERSION", GroundMotion.GRID_VERSION + 1)
+    assert load()
+    assert not load()
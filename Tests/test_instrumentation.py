@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+from conftest import RecordingBackend
+import Instrumentation
+from DisasterImpact import run_disaster_impact
+from Instrumentation import count_event, stage, tracing
+
+# The result fields of the Disaster Impact tool
+RESULT_FIELDS = "Damage, EP, Hazard, IM, IM_unit, EQ_MAG"
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Runs the Disaster Impact tool on empty result fields. Returns the results and the messages of the run.
+# --------------------------------------------------------------------
+def disaster_impact(project):
+    backend = RecordingBackend(project["database"])
+    try:
+        backend.connection.execute("UPDATE Assets SET Damage = NULL, EP = NULL, Hazard = NULL, IM = NULL, IM_unit = NULL, EQ_MAG = NULL")
+        backend.connection.commit()
+        run_disaster_impact(backend, ["Assets"], "9.0", project["projectPath"], project["pgasPath"], offline = True,
+                            incremental = False)
+        return backend.connection.execute("SELECT OBJECTID, {} FROM Assets ORDER BY OBJECTID".format(RESULT_FIELDS)).fetchall(), backend.messages
+    finally:
+        backend.close()
+
+# --------------------------------------------------------------------
+# Returns the stage names of a trace file (Chrome trace format or JSON lines)
+# --------------------------------------------------------------------
+def traced_stages(path):
+    with open(path) as traceFile:
+        if path.endswith(".json"):
+            return [event["name"] for event in json.load(traceFile)["traceEvents"] if event["ph"] == "X"]
+        return [record["stage"] for record in map(json.loads, traceFile) if record["type"] == "stage"]
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# A traced run writes the results of an untraced run (the baseline), and reports and writes its stages
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("traceName", ["Trace.json", "Trace.jsonl"])
+def test_traced_run_matches_untraced_run(project, tmp_path, traceName):
+    baseline, baselineMessages = disaster_impact(project)
+    assert not any(text.startswith("Timings") for text in baselineMessages)
+
+    messages = []
+    tracePath = str(tmp_path / "Traces" / traceName)
+    with tracing(messages.append, tracePath):
+        results, _ = disaster_impact(project)
+    assert results == baseline
+    assert Instrumentation.tracer is None
+
+    stages = traced_stages(tracePath)
+    assert "Fragility database" in stages and "Read and simulate" in stages
+    assert messages[0].startswith("Timings")
+    assert any(text.strip().startswith("Read and simulate:") for text in messages)
+    assert messages[-1] == "Trace written to '{}'.".format(tracePath)
+
+# --------------------------------------------------------------------
+# Stages keep their depth and rows, counters add up, and a run inside another run is part of it. Outside of a run,
+# nothing is recorded.
+# --------------------------------------------------------------------
+def test_stages_and_counters(tmp_path, monkeypatch):
+    with stage("Untraced") as untraced:
+        untraced.rows = 5
+    count_event("Untraced")
+
+    profilePath = str(tmp_path / "Run.prof")
+    monkeypatch.setenv(Instrumentation.PROFILE_VARIABLE, profilePath)
+    tracePath = str(tmp_path / "Trace.jsonl")
+    messages = []
+    with tracing(messages.append, tracePath) as tracer:
+        with stage("Outer"):
+            with stage("Inner") as inner:
+                inner.rows = 1000
+            count_event("PGA grid cache hit")
+        with tracing(messages.append) as innerTracer:
+            assert innerTracer is tracer
+            count_event("PGA grid cache hit", 2)
+            count_event("PGA grid cache miss")
+
+    assert [(current.name, current.depth, current.rows) for current in tracer.stages] == [("Inner", 1, 1000), ("Outer", 0, None)]
+    assert tracer.counters == {"PGA grid cache hit": 3, "PGA grid cache miss": 1}
+    assert os.path.getsize(profilePath) > 0
+
+    with open(tracePath) as traceFile:
+        records = [json.loads(line) for line in traceFile]
+    assert [record["type"] for record in records] == ["stage", "stage", "counter", "counter", "run"]
+    assert records[0]["rows"] == 1000 and records[0]["rowsPerSecond"] > 0
+    assert "  PGA grid cache hit: 3" in messages
+    assert messages[-1] == "Profile written to '{}'.".format(profilePath)
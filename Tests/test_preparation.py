@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+
+from conftest import RecordingBackend
+from PreparationForDisasterImpact import assign_pga, clip_shape
+from Scenarios import read_scenario_table, scenario_table_path
+from test_ground_motion import PGA_COLUMNS, baseline_pgas, coordinates, pga_table
+
+# The scenarios of the PGA source file: the four magnitudes with a field, and one kept in the side table only
+SCENARIOS = [{"name": column, "source": "BridgePGAs.csv", "column": column, "field": column} for column in PGA_COLUMNS] + \
+            [{"name": "Side", "source": "BridgePGAs.csv", "column": "M87_PGA"}]
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Stands in for a geometry (arcpy.Polygon) with a rectangle: its extent, and what contains, union and intersect need
+# --------------------------------------------------------------------
+class Box:
+    def __init__(self, xMin, yMin, xMax, yMax):
+        self.XMin, self.YMin, self.XMax, self.YMax = xMin, yMin, xMax, yMax
+        self.pointCount = 0 if xMin >= xMax or yMin >= yMax else 4
+
+    @property
+    def extent(self):
+        return self
+
+    def contains(self, other):
+        return self.XMin <= other.XMin and self.YMin <= other.YMin and self.XMax >= other.XMax and self.YMax >= other.YMax
+
+    # Only boxes next to each other (as the clip features are below) have a box as their union
+    def union(self, other):
+        return Box(min(self.XMin, other.XMin), min(self.YMin, other.YMin), max(self.XMax, other.XMax), max(self.YMax, other.YMax))
+
+    def intersect(self, other, dimension):
+        return Box(max(self.XMin, other.XMin), max(self.YMin, other.YMin), min(self.XMax, other.XMax), min(self.YMax, other.YMax))
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# Every feature gets the PGA values of the baseline's nearest station (in its fields and its scenario side table);
+# features without coordinates get none
+# --------------------------------------------------------------------
+def test_assign_pga_matches_baseline_lookup(tmp_path):
+    random = np.random.default_rng(9)
+    file = pga_table(random, 250)
+    file.to_csv(str(tmp_path / "BridgePGAs.csv"), index = False)
+    with open(str(tmp_path / "Scenarios.json"), "w") as registryFile:
+        json.dump({"scenarios": SCENARIOS}, registryFile)
+
+    featureLat, featureLong = coordinates(random, 80)
+    featureLat[5] = np.nan
+    backend = RecordingBackend(str(tmp_path / "Features.sqlite"))
+    backend.connection.execute("CREATE TABLE Bridges (OBJECTID INTEGER PRIMARY KEY, LONG_CALC REAL, LAT_CALC REAL, {})".format(
+        ", ".join(column + " REAL" for column in PGA_COLUMNS)))
+    backend.connection.executemany("INSERT INTO Bridges (OBJECTID, LONG_CALC, LAT_CALC) VALUES (?, ?, ?)",
+                                   [(row * 2 + 1, long, None if np.isnan(lat) else lat)
+                                    for row, (lat, long) in enumerate(zip(featureLat.tolist(), featureLong.tolist()))])
+    backend.connection.commit()
+    try:
+        assign_pga(backend, "Bridges", "Bridges", str(tmp_path), str(tmp_path))
+        rows = backend.connection.execute("SELECT OBJECTID, {} FROM Bridges ORDER BY OBJECTID".format(", ".join(PGA_COLUMNS))).fetchall()
+    finally:
+        backend.close()
+
+    objectIDs, scenarioNames, values = read_scenario_table(scenario_table_path(str(tmp_path), "Bridges"))
+    assert objectIDs.tolist() == [row[0] for row in rows]
+    assert scenarioNames == [scenario["name"] for scenario in SCENARIOS]
+    for feature, row in enumerate(rows):
+        if feature == 5:
+            assert row[1:] == (None,) * len(PGA_COLUMNS)
+            assert np.isnan(values[feature]).all()
+            continue
+        expected = baseline_pgas(file, featureLat[feature], featureLong[feature])
+        assert list(row[1:]) == expected
+        assert values[feature].tolist() == expected + [expected[2]]
+
+# --------------------------------------------------------------------
+# A feature inside a clip feature is kept as it is, a feature outside of every clip feature is left out, and a
+# feature over the edge is cut by the clip features it overlaps
+# --------------------------------------------------------------------
+def test_clip_shape_keeps_inside_cuts_edges():
+    geometries = [Box(0, 0, 10, 10), Box(10, 0, 20, 10), Box(40, 40, 50, 50)]
+    extents = np.array([[box.XMin, box.YMin, box.XMax, box.YMax] for box in geometries], dtype = float)
+
+    inside = Box(2, 2, 4, 4)
+    assert clip_shape(inside, geometries, extents, 4) is inside
+    assert clip_shape(Box(25, 25, 30, 30), geometries, extents, 4) is None
+
+    clipped = clip_shape(Box(5, 5, 15, 15), geometries, extents, 4)
+    assert (clipped.XMin, clipped.YMin, clipped.XMax, clipped.YMax) == (5, 5, 15, 10)
+    clipped = clip_shape(Box(15, -5, 30, 5), geometries, extents, 4)
+    assert (clipped.XMin, clipped.YMin, clipped.XMax, clipped.YMax) == (15, 0, 20, 5)
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from conftest import RecordingBackend
+from Benchmark import generate_data
+from GroundMotion import chord_to_miles, unit_sphere_coordinates
+from RoadNetwork import SegmentIndex, closest_facilities, export_network, load_network, reverse_closest_facilities
+
+# Number of points every segment is sampled at by the brute force search
+SAMPLES = 2000
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Exports the benchmark's synthetic road grid (about 3000 roads, 100 incidents, 10 facilities).
+# Returns (network, data).
+# --------------------------------------------------------------------
+def synthetic_network(folder):
+    data = generate_data(folder, 3000, seed = 4)
+    backend = RecordingBackend(data["databasePath"])
+    try:
+        export_network(backend, ["Roads"], data["networkPath"])
+    finally:
+        backend.close()
+    return load_network(data["networkPath"]), data
+
+# --------------------------------------------------------------------
+# Checks that every route follows open arcs from its incident's junction to its facility's junction,
+# and that its travel time is the sum of the travel times of its arcs
+# --------------------------------------------------------------------
+def assert_routes_follow_network(network, routes, incidentNodes, facilityNodes, minutes):
+    for incident, facility, routeMinutes, path in zip(routes["incidents"].tolist(), routes["facilities"].tolist(),
+                                                      routes["minutes"].tolist(), routes["paths"]):
+        assert path[0] == incidentNodes[incident] and path[-1] == facilityNodes[facility]
+        pathMinutes = sum(minutes[network.arc_between(start, end, minutes)] for start, end in zip(path[:-1], path[1:]))
+        assert pathMinutes == pytest.approx(routeMinutes, rel = 1e-9, abs = 1e-9)
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# The nearest segment of every point is the one a brute force search finds: every segment is sampled densely and
+# the sample nearest to the point gives its distance. Long segments (several kilometers) and short ones are mixed,
+# so a point can be close to the middle of a long segment while a short segment's midpoint is closer.
+# --------------------------------------------------------------------
+def test_nearest_segment_matches_brute_force():
+    random = np.random.default_rng(3)
+    segmentCount = 60
+    starts = np.column_stack([random.uniform(45.0, 45.2, segmentCount), random.uniform(-123.2, -123.0, segmentCount)])
+    lengths = np.where(random.random(segmentCount) < 0.3, 0.05, 0.002)
+    angles = random.uniform(0, 2 * np.pi, segmentCount)
+    ends = starts + lengths[:, None] * np.column_stack([np.sin(angles), np.cos(angles)])
+
+    # Every segment is its own two-vertex line
+    lat = np.column_stack([starts[:, 0], ends[:, 0]]).ravel()
+    long = np.column_stack([starts[:, 1], ends[:, 1]]).ravel()
+    index = SegmentIndex(lat, long, np.arange(0, 2 * segmentCount, 2))
+
+    pointLat = np.append(random.uniform(45.0, 45.2, 300), np.nan)
+    pointLong = np.append(random.uniform(-123.2, -123.0, 300), -123.1)
+    segments, distances = index.nearest(pointLat, pointLong)
+    assert segments[-1] == -1 and np.isnan(distances[-1])
+
+    # Like the index, the segments are measured as straight lines between their vertices on the unit sphere
+    startPoints = unit_sphere_coordinates(starts[:, 0], starts[:, 1])
+    endPoints = unit_sphere_coordinates(ends[:, 0], ends[:, 1])
+    fractions = np.linspace(0, 1, SAMPLES)[None, :, None]
+    samples = startPoints[:, None] + fractions * (endPoints - startPoints)[:, None]
+    points = unit_sphere_coordinates(pointLat[:-1], pointLong[:-1])
+    bruteDistances = np.array([chord_to_miles(np.linalg.norm(samples - point, axis = 2).min(axis = 1)) for point in points])
+
+    # The samples are a few meters apart, so the brute force distances are at most that much too long
+    sampleError = 0.05 * 69 / SAMPLES
+    nearest = bruteDistances.min(axis = 1)
+    np.testing.assert_array_less(distances[:-1], nearest + 1e-9)
+    np.testing.assert_array_less(nearest, distances[:-1] + sampleError)
+    assert (bruteDistances[np.arange(points.shape[0]), segments[:-1]] <= nearest + sampleError).all()
+
+# --------------------------------------------------------------------
+# One reverse search from every facility (k nearest labels for k > 1) finds the same closest facilities as one search
+# per incident, on the synthetic road grid with the bridges and a tenth of the arcs closed, within a cutoff. With penalties
+# on every arc too, so the travel times aren't tied on the grid.
+# --------------------------------------------------------------------
+@pytest.mark.parametrize("count", [1, 3])
+@pytest.mark.parametrize("penalties", [False, True])
+def test_reverse_search_matches_incident_search(tmp_path, count, penalties):
+    network, data = synthetic_network(str(tmp_path))
+    random = np.random.default_rng(5)
+    closedArcs = network.barrier_arcs(*data["bridges"]) | (random.random(network.arcCount) < 0.1)
+    minutes = np.asarray(network.minutes) * (random.uniform(1, 3, network.arcCount) if penalties else 1)
+    incidentNodes = network.snap(*data["incidents"])
+    facilityNodes = network.snap(*data["facilities"])
+    # Two facilities on the same junction, and a facility that isn't on the network
+    facilityNodes[1] = facilityNodes[0]
+    facilityNodes[2] = -1
+
+    # The first five incidents are cut off by closing every arc into and out of their junctions
+    arcStarts = np.repeat(np.arange(network.nodeCount), np.diff(network.indptr))
+    closedArcs |= np.isin(arcStarts, incidentNodes[:5]) | np.isin(network.indices, incidentNodes[:5])
+
+    # With a cutoff of the median travel time to the closest facility, many incidents reach fewer than count facilities
+    cutoff = np.median(closest_facilities(network, incidentNodes, facilityNodes, 1, closedArcs, minutes = minutes)["minutes"])
+    forward = closest_facilities(network, incidentNodes, facilityNodes, count, closedArcs, cutoff, minutes)
+    reverse = reverse_closest_facilities(network, incidentNodes, facilityNodes, count, closedArcs, cutoff, minutes)
+
+    np.testing.assert_array_equal(reverse["incidents"], forward["incidents"])
+    np.testing.assert_array_equal(reverse["ranks"], forward["ranks"])
+    np.testing.assert_allclose(reverse["minutes"], forward["minutes"], rtol = 1e-9)
+    routeCounts = np.bincount(forward["incidents"], minlength = len(incidentNodes))
+    assert (routeCounts[:5] == 0).all()
+    assert (routeCounts[5:] > 0).sum() >= 40 and (routeCounts[5:] < count).sum() >= 40
+
+    # Facilities on the same junction are tied, so either one is right; any other facility must be the same
+    sameJunction = facilityNodes[reverse["facilities"]] == facilityNodes[forward["facilities"]]
+    assert sameJunction.all()
+    closedMinutes = np.where(closedArcs, np.inf, minutes)
+    assert_routes_follow_network(network, reverse, incidentNodes, facilityNodes, closedMinutes)
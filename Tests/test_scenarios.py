@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import RecordingBackend
+from DisasterImpact import run_disaster_impact
+from Scenarios import (load_scenarios, read_scenario_table, scenario_fields, scenario_table_path, scenario_values,
+                       select_scenarios, write_scenario_table)
+
+# The magnitudes and PGA columns the Disaster Impact tool knew before the scenario registry (the baseline)
+BASELINE_MAG_DICT = {'8.1': 'M81_PGA', '8.4': 'M84_PGA', '8.7': 'M87_PGA', '9.0': 'M90_PGA'}
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Rounds the M90_PGA values of the "Assets" table to float32 numbers, as the scenario side tables store them,
+# and copies the table without its M90_PGA column to a "Copy" table.
+# Returns the object IDs and M90_PGA values of the rows.
+# --------------------------------------------------------------------
+def copy_without_pga(database):
+    backend = RecordingBackend(database)
+    connection = backend.connection
+    rows = connection.execute("SELECT OBJECTID, M90_PGA FROM Assets ORDER BY OBJECTID").fetchall()
+    objectIDs = np.array([row[0] for row in rows], dtype = np.int64)
+    pgas = np.array([row[1] for row in rows], dtype = np.float32).astype(float)
+    connection.executemany("UPDATE Assets SET M90_PGA = ? WHERE OBJECTID = ?", zip(pgas.tolist(), objectIDs.tolist()))
+    schema = connection.execute("SELECT sql FROM sqlite_master WHERE name = 'Assets'").fetchone()[0]
+    connection.execute(schema.replace("Assets", "Copy", 1).replace("M90_PGA REAL, ", ""))
+    connection.execute("INSERT INTO Copy (OBJECTID, Frag_no, Diameter, M81_PGA) SELECT OBJECTID, Frag_no, Diameter, M81_PGA FROM Assets")
+    connection.commit()
+    backend.close()
+    return objectIDs, pgas
+
+# --------------------------------------------------------------------
+# Returns the (OBJECTID, Damage, EP) rows of a table
+# --------------------------------------------------------------------
+def results(database, table):
+    backend = RecordingBackend(database)
+    try:
+        return backend.connection.execute("SELECT OBJECTID, Damage, EP FROM {} ORDER BY OBJECTID".format(table)).fetchall()
+    finally:
+        backend.close()
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# Without a registry file, the scenarios are the baseline's magnitudes and PGA columns. A registry file replaces them.
+# --------------------------------------------------------------------
+def test_registry_defaults_to_baseline_magnitudes(tmp_path):
+    scenarios = load_scenarios(str(tmp_path))
+    assert scenario_fields(scenarios) == BASELINE_MAG_DICT
+    assert [scenario["name"] for scenario in select_scenarios(scenarios, "9.0;'8.1'")] == ["9.0", "8.1"]
+    assert select_scenarios(scenarios, "ALL") == scenarios
+    with pytest.raises(ValueError):
+        select_scenarios(scenarios, "9.0;9.5")
+
+    registry = [{"name": "9.0", "source": "BridgePGAs.xlsx", "column": "M90_PGA", "field": "M90_PGA"},
+                {"name": "Crustal", "source": "Crustal.tif", "column": "Crustal_1"}]
+    with open(str(tmp_path / "Scenarios.json"), "w") as registryFile:
+        json.dump({"scenarios": registry}, registryFile)
+    assert load_scenarios(str(tmp_path)) == registry
+    assert scenario_fields(registry) == {"9.0": "M90_PGA"}
+
+# --------------------------------------------------------------------
+# A side table gives back the values of the object IDs it was written with; other object IDs get NaN
+# --------------------------------------------------------------------
+def test_scenario_table_round_trip(tmp_path):
+    path = scenario_table_path(str(tmp_path), "Bridges")
+    assert read_scenario_table(path) is None
+    values = np.array([[0.1, 0.2], [0.3, 0.4], [0.5, 0.6]])
+    write_scenario_table(path, [30, 10, 20], ["8.1", "Crustal"], values)
+
+    table = read_scenario_table(path)
+    assert table[1] == ["8.1", "Crustal"]
+    matrix = scenario_values(table, [20, 40, 30, 10], ["Crustal", "8.1"])
+    np.testing.assert_array_equal(matrix[[0, 2, 3]], values[[2, 0, 1]][:, ::-1].astype(np.float32))
+    assert np.isnan(matrix[1]).all()
+    assert scenario_values(table, [10], ["9.0"]) is None
+
+# --------------------------------------------------------------------
+# A layer without the PGA column of the scenario gets the results of the baseline, which read the attribute table,
+# from its scenario side table. Without a side table, the run stops.
+# --------------------------------------------------------------------
+def test_side_table_run_matches_attribute_table_run(project):
+    objectIDs, pgas = copy_without_pga(project["database"])
+
+    def run(table):
+        backend = RecordingBackend(project["database"])
+        try:
+            run_disaster_impact(backend, [table], "9.0", project["projectPath"], project["pgasPath"], offline = True,
+                                incremental = False)
+        finally:
+            backend.close()
+
+    with pytest.raises(ValueError):
+        run("Copy")
+
+    write_scenario_table(scenario_table_path(project["projectPath"], "Copy"), objectIDs, ["9.0"], pgas[:, np.newaxis])
+    run("Copy")
+    run("Assets")
+    baseline = results(project["database"], "Assets")
+    assert any(row[1] is not None for row in baseline)
+    assert results(project["database"], "Copy") == baseline
@@ -0,0 +1,48 @@
+from conftest import RecordingBackend
+from AddFields import add_fields
+
+# The fields of the tool's value table: {field name: (field type, field alias)}
+FIELDS = {"Damage": ("TEXT", "Damage"), "EP": ("DOUBLE", "EP"), "Frag_no": ("TEXT", "Frag_no"), "Year": ("LONG", "Year")}
+
+# ********************************************************************
+# Helper Functions
+# ********************************************************************
+# --------------------------------------------------------------------
+# Returns the (name, type) of every column of a table
+# --------------------------------------------------------------------
+def columns(backend, table):
+    return [(row[1], row[2]) for row in backend.connection.execute('PRAGMA table_info("{}")'.format(table))]
+
+# ********************************************************************
+# Tests
+# ********************************************************************
+# --------------------------------------------------------------------
+# Every table gets the fields it's missing, in the order of the value table, and keeps the ones it has (without case).
+# Running the tool again changes nothing.
+# --------------------------------------------------------------------
+def test_add_fields_adds_only_missing_fields(tmp_path):
+    backend = RecordingBackend(str(tmp_path / "Tables.sqlite"))
+    backend.connection.execute("CREATE TABLE Bridges (OBJECTID INTEGER PRIMARY KEY, FRAG_NO TEXT, Name TEXT)")
+    backend.connection.execute("CREATE TABLE Pipes (OBJECTID INTEGER PRIMARY KEY)")
+    backend.connection.execute("CREATE TABLE Tanks (OBJECTID INTEGER PRIMARY KEY, damage TEXT, ep REAL, Frag_no TEXT, year INTEGER)")
+    backend.connection.execute("INSERT INTO Bridges (FRAG_NO, Name) VALUES ('LN1', 'Bridge 1')")
+    backend.connection.commit()
+    try:
+        add_fields(backend, ["Bridges", "Pipes", "Tanks"], FIELDS, workers = 2)
+        assert columns(backend, "Bridges") == [("OBJECTID", "INTEGER"), ("FRAG_NO", "TEXT"), ("Name", "TEXT"),
+                                               ("Damage", "TEXT"), ("EP", "REAL"), ("Year", "INTEGER")]
+        assert columns(backend, "Pipes") == [("OBJECTID", "INTEGER"), ("Damage", "TEXT"), ("EP", "REAL"),
+                                             ("Frag_no", "TEXT"), ("Year", "INTEGER")]
+        assert columns(backend, "Tanks") == [("OBJECTID", "INTEGER"), ("damage", "TEXT"), ("ep", "REAL"),
+                                             ("Frag_no", "TEXT"), ("year", "INTEGER")]
+        assert backend.connection.execute("SELECT FRAG_NO, Name, Damage FROM Bridges").fetchall() == [("LN1", "Bridge 1", None)]
+        assert "Tanks already had 4 of the fields." in backend.messages
+        assert sum(1 for text in backend.messages if text.startswith("Added")) == 3 + 4
+
+        backend.messages = []
+        schema = [columns(backend, table) for table in ("Bridges", "Pipes", "Tanks")]
+        add_fields(backend, ["Bridges", "Pipes", "Tanks"], FIELDS)
+        assert [columns(backend, table) for table in ("Bridges", "Pipes", "Tanks")] == schema
+        assert not any(text.startswith("Added") for text in backend.messages)
+    finally:
+        backend.close()